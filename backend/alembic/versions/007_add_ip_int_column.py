@@ -0,0 +1,34 @@
+"""Add stored integer ip_int column to ip_addresses
+
+Revision ID: 007
+Revises: 006
+Create Date: 2025-02-10 10:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Add ip_int as a STORED generated column so every write path (ORM and raw SQL)
+    # keeps it in sync; adding a stored column rebuilds the table and backfills existing rows
+    op.execute(
+        "ALTER TABLE ip_addresses "
+        "ADD COLUMN ip_int INT UNSIGNED AS (INET_ATON(ip_address)) STORED NOT NULL AFTER ip_address"
+    )
+
+    # Composite index for per-subnet listing/allocation ordered by address
+    op.create_index('ix_ip_addresses_subnet_status_ip_int', 'ip_addresses', ['subnet_id', 'status', 'ip_int'])
+    # Global ordering and CIDR range scans across subnets
+    op.create_index('ix_ip_addresses_ip_int', 'ip_addresses', ['ip_int'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ip_addresses_ip_int', 'ip_addresses')
+    op.drop_index('ix_ip_addresses_subnet_status_ip_int', 'ip_addresses')
+    op.drop_column('ip_addresses', 'ip_int')
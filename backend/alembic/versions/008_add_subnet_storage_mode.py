@@ -0,0 +1,29 @@
+"""Add storage_mode to subnets for sparse IP materialization
+
+Revision ID: 008
+Revises: 007
+Create Date: 2025-02-12 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # dense: every host address is stored as a row (existing behaviour)
+    # sparse: only allocated/reserved/conflict addresses are stored, available ones are derived from the CIDR
+    op.add_column(
+        'subnets',
+        sa.Column('storage_mode', sa.Enum('dense', 'sparse', name='subnetstoragemode'),
+                  nullable=False, server_default='dense')
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('subnets', 'storage_mode')
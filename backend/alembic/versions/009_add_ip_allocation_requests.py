@@ -0,0 +1,36 @@
+"""Add ip_allocation_requests table for idempotent batch allocation
+
+Revision ID: 009
+Revises: 008
+Create Date: 2025-02-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # One row per idempotency key; the stored response is committed together with the allocation
+    op.create_table('ip_allocation_requests',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=100), nullable=False),
+        sa.Column('request_hash', sa.String(length=64), nullable=False),
+        sa.Column('response', mysql.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ip_allocation_requests_key', 'ip_allocation_requests', ['idempotency_key'], unique=True)
+    op.create_index('ix_ip_allocation_requests_created_at', 'ip_allocation_requests', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ip_allocation_requests_created_at', 'ip_allocation_requests')
+    op.drop_index('ix_ip_allocation_requests_key', 'ip_allocation_requests')
+    op.drop_table('ip_allocation_requests')
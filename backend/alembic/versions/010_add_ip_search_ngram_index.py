@@ -0,0 +1,29 @@
+"""Add ngram FULLTEXT index for IP record free-text search
+
+Revision ID: 010
+Revises: 009
+Create Date: 2025-02-24 10:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = "user_name, assigned_to, mac_address, device_type, location, description"
+
+
+def upgrade() -> None:
+    # Stopwords are bound to a FULLTEXT index when it is created; with the default list
+    # every ngram containing "a" or "i" is dropped, which breaks MAC fragment search.
+    op.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+    op.execute(
+        f"CREATE FULLTEXT INDEX ix_ip_addresses_search_ngram ON ip_addresses({SEARCH_COLUMNS}) WITH PARSER ngram"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ip_addresses_search_ngram', 'ip_addresses')
@@ -0,0 +1,91 @@
+"""Add subnet_ip_counters summary table maintained by triggers on ip_addresses
+
+Revision ID: 011
+Revises: 010
+Create Date: 2025-03-03 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+# Each subnet's counts are spread over COUNTER_SLOTS rows (slot = CONNECTION_ID() MOD COUNTER_SLOTS)
+# so that concurrent allocations in one subnet do not all wait on the same counter row lock.
+# The slot depends on the connection, not the row, so a transaction touching many addresses
+# (batch, bulk, generate) locks a single counter row per subnet and cannot deadlock with
+# another such transaction by locking slots in a different order.
+# Must match subnet_counters.COUNTER_SLOTS.
+COUNTER_SLOTS = 8
+
+STATUSES = ('available', 'allocated', 'reserved', 'conflict')
+
+
+def _delta_values(row: str, sign: str) -> str:
+    flags = ", ".join(f"{sign}({row}.status <=> '{status}')" for status in STATUSES)
+    return f"({row}.subnet_id, CONNECTION_ID() MOD {COUNTER_SLOTS}, {sign}1, {flags})"
+
+
+UPSERT_HEAD = (
+    "INSERT INTO subnet_ip_counters "
+    "(subnet_id, slot, total_count, available_count, allocated_count, reserved_count, conflict_count) VALUES "
+)
+UPSERT_TAIL = (
+    " ON DUPLICATE KEY UPDATE total_count = total_count + VALUES(total_count), "
+    + ", ".join(f"{status}_count = {status}_count + VALUES({status}_count)" for status in STATUSES)
+)
+
+
+def upgrade() -> None:
+    op.create_table('subnet_ip_counters',
+        sa.Column('subnet_id', sa.Integer(), nullable=False),
+        sa.Column('slot', sa.SmallInteger(), nullable=False),
+        sa.Column('total_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('available_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('allocated_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('reserved_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('conflict_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['subnet_id'], ['subnets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('subnet_id', 'slot')
+    )
+
+    # Every write path (ORM, raw SQL, bulk statements) goes through these triggers in the
+    # writer's own transaction. Deltas are upserted, so a slot row may go negative after the
+    # reconciler has folded a subnet into slot 0; only the per-subnet sum is meaningful.
+    # FK cascades from subnets do not fire triggers, but they also remove the counter rows.
+    op.execute(
+        "CREATE TRIGGER trg_ip_addresses_counters_insert AFTER INSERT ON ip_addresses FOR EACH ROW "
+        + UPSERT_HEAD + _delta_values("NEW", "") + UPSERT_TAIL
+    )
+    op.execute(
+        "CREATE TRIGGER trg_ip_addresses_counters_delete AFTER DELETE ON ip_addresses FOR EACH ROW "
+        + UPSERT_HEAD + _delta_values("OLD", "-") + UPSERT_TAIL
+    )
+    op.execute(
+        "CREATE TRIGGER trg_ip_addresses_counters_update AFTER UPDATE ON ip_addresses FOR EACH ROW "
+        "BEGIN "
+        "IF NOT (OLD.status <=> NEW.status) OR OLD.subnet_id <> NEW.subnet_id THEN "
+        + UPSERT_HEAD + _delta_values("OLD", "-") + ", " + _delta_values("NEW", "") + UPSERT_TAIL + "; "
+        "END IF; "
+        "END"
+    )
+
+    # Backfill existing rows into slot 0
+    op.execute(
+        "INSERT INTO subnet_ip_counters "
+        "(subnet_id, slot, total_count, available_count, allocated_count, reserved_count, conflict_count) "
+        "SELECT subnet_id, 0, COUNT(*), "
+        + ", ".join(f"SUM(status <=> '{status}')" for status in STATUSES)
+        + " FROM ip_addresses GROUP BY subnet_id"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_ip_addresses_counters_update")
+    op.execute("DROP TRIGGER IF EXISTS trg_ip_addresses_counters_delete")
+    op.execute("DROP TRIGGER IF EXISTS trg_ip_addresses_counters_insert")
+    op.drop_table('subnet_ip_counters')
@@ -0,0 +1,98 @@
+"""Add IP usage events and subnet utilization history rollups
+
+Revision ID: 012
+Revises: 011
+Create Date: 2025-03-10 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+# subnet_id 0 in subnet_utilization_history is the series for all subnets combined.
+ALL_SUBNETS = 0
+
+
+def _event_insert(row: str, event_type: str) -> str:
+    return (
+        "INSERT INTO ip_usage_events (subnet_id, ip_address_id, event_type, occurred_at) "
+        f"VALUES ({row}.subnet_id, {row}.id, '{event_type}', NOW())"
+    )
+
+
+def upgrade() -> None:
+    # Staging log written by triggers and consumed (rolled up, then deleted) by utilization_history
+    op.create_table('ip_usage_events',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('subnet_id', sa.Integer(), nullable=False),
+        sa.Column('ip_address_id', sa.Integer(), nullable=False),
+        sa.Column('event_type', sa.Enum('allocate', 'release', name='ipusageevent'), nullable=False),
+        sa.Column('occurred_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # Append-only rollups; no FK so that history outlives deleted subnets
+    op.create_table('subnet_utilization_history',
+        sa.Column('subnet_id', sa.Integer(), nullable=False),
+        sa.Column('resolution', sa.Enum('minute', 'hour', 'day', name='historyresolution'), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('allocations', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('releases', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_count', sa.Integer(), nullable=True),
+        sa.Column('allocated_count', sa.Integer(), nullable=True),
+        sa.Column('peak_allocated', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('subnet_id', 'resolution', 'bucket_start')
+    )
+    op.create_index('idx_utilization_history_retention', 'subnet_utilization_history',
+                    ['resolution', 'bucket_start'])
+
+    # Only transitions into and out of 'allocated' are recorded
+    op.execute(
+        "CREATE TRIGGER trg_ip_addresses_usage_insert AFTER INSERT ON ip_addresses FOR EACH ROW "
+        "BEGIN "
+        "IF NEW.status <=> 'allocated' THEN " + _event_insert("NEW", "allocate") + "; END IF; "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER trg_ip_addresses_usage_delete AFTER DELETE ON ip_addresses FOR EACH ROW "
+        "BEGIN "
+        "IF OLD.status <=> 'allocated' THEN " + _event_insert("OLD", "release") + "; END IF; "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER trg_ip_addresses_usage_update AFTER UPDATE ON ip_addresses FOR EACH ROW "
+        "BEGIN "
+        "IF NEW.status <=> 'allocated' AND NOT (OLD.status <=> 'allocated') THEN "
+        + _event_insert("NEW", "allocate") + "; "
+        "ELSEIF OLD.status <=> 'allocated' AND NOT (NEW.status <=> 'allocated') THEN "
+        + _event_insert("OLD", "release") + "; "
+        "END IF; "
+        "END"
+    )
+
+    # Backfill daily allocations from the addresses that are still allocated, so existing
+    # trend charts keep their data (releases before this migration are not recoverable)
+    op.execute(
+        "INSERT INTO subnet_utilization_history (subnet_id, resolution, bucket_start, allocations) "
+        "SELECT subnet_id, 'day', DATE(allocated_at), COUNT(*) FROM ip_addresses "
+        "WHERE status = 'allocated' AND allocated_at IS NOT NULL GROUP BY subnet_id, DATE(allocated_at)"
+    )
+    op.execute(
+        "INSERT INTO subnet_utilization_history (subnet_id, resolution, bucket_start, allocations) "
+        f"SELECT {ALL_SUBNETS}, 'day', DATE(allocated_at), COUNT(*) FROM ip_addresses "
+        "WHERE status = 'allocated' AND allocated_at IS NOT NULL GROUP BY DATE(allocated_at)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_ip_addresses_usage_update")
+    op.execute("DROP TRIGGER IF EXISTS trg_ip_addresses_usage_delete")
+    op.execute("DROP TRIGGER IF EXISTS trg_ip_addresses_usage_insert")
+    op.drop_index('idx_utilization_history_retention', table_name='subnet_utilization_history')
+    op.drop_table('subnet_utilization_history')
+    op.drop_table('ip_usage_events')
@@ -0,0 +1,25 @@
+"""Add users.credential_version used as the token version
+
+Revision ID: 013
+Revises: 012
+Create Date: 2025-03-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Incremented on password change/reset only. Tokens carry it as "ver", so a transparent
+    # rehash of the same password (bcrypt cost change) no longer invalidates other sessions.
+    op.add_column('users', sa.Column('credential_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'credential_version')
@@ -0,0 +1,52 @@
+"""Add subnet_index_generation bumped by triggers when subnet networks change
+
+Revision ID: 014
+Revises: 013
+Create Date: 2025-03-24 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+_BUMP = (
+    "INSERT INTO subnet_index_generation (id, generation) VALUES (1, 1) "
+    "ON DUPLICATE KEY UPDATE generation = generation + 1"
+)
+
+
+def upgrade() -> None:
+    # Single-row generation counter read by app.core.subnet_trie with a primary key lookup
+    # to detect subnet writes made by other processes (replaces COUNT/MAX over subnets)
+    op.create_table('subnet_index_generation',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('generation', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO subnet_index_generation (id, generation) VALUES (1, 0)")
+
+    # Only id and network are indexed, so other column updates do not bump the generation
+    op.execute(
+        "CREATE TRIGGER trg_subnets_index_insert AFTER INSERT ON subnets FOR EACH ROW " + _BUMP
+    )
+    op.execute(
+        "CREATE TRIGGER trg_subnets_index_delete AFTER DELETE ON subnets FOR EACH ROW " + _BUMP
+    )
+    op.execute(
+        "CREATE TRIGGER trg_subnets_index_update AFTER UPDATE ON subnets FOR EACH ROW "
+        "BEGIN "
+        "IF NOT (OLD.network <=> NEW.network) THEN " + _BUMP + "; END IF; "
+        "END"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_subnets_index_update")
+    op.execute("DROP TRIGGER IF EXISTS trg_subnets_index_delete")
+    op.execute("DROP TRIGGER IF EXISTS trg_subnets_index_insert")
+    op.drop_table('subnet_index_generation')
@@ -4,8 +4,30 @@ API扩展模块 - 添加前端需要的缺失API端点
 from fastapi import HTTPException, Depends, Header
 from typing import List, Optional
 import pymysql
+import ipaddress
 import logging
 
+from db_executor import db_bound
+from ip_generation import (
+    sync_subnet_ips, get_storage_mode, host_int_range, resolve_network,
+    materialize_ip, materialize_unstored, sparse_virtual_counts, sparse_search_page
+)
+from ip_allocation import (
+    claim_next_ip, mark_allocated, AllocationContentionError, load_subnet_bitmap, reconcile_bitmaps,
+    allocate_batch, request_fingerprint, begin_idempotent_request, finish_idempotent_request,
+    IdempotencyKeyReuseError, ALLOCATION_FIELDS, BATCH_ALLOCATION_MAX
+)
+from ip_bulk_operations import bulk_ip_operation
+from app.core.ip_bitmap import ip_bitmaps
+from app.core.ip_prefix import parse_ip_query, range_condition
+from app.core.subnet_trie import subnet_index, trie_from_cursor, parse_network
+from app.core.search_index import IP_SEARCH_FULLTEXT, build_boolean_query, match_condition, relevance_expression
+from app.core.pagination import encode_cursor, decode_cursor, normalize_count_mode, estimate_row_count
+from app.core.security import get_password_hash
+from app.core.principal_cache import invalidate_principal
+from app.core.live_updates import publish_ip_changes
+from subnet_counters import subnet_counts, total_counts
+
 logger = logging.getLogger(__name__)
 
 def add_missing_endpoints(app, get_db_connection):
@@ -13,7 +35,8 @@ def add_missing_endpoints(app, get_db_connection):
     
     # 部门管理API端点
     @app.get("/api/departments/")
-    async def get_departments_fallback(skip: int = 0, limit: int = 50, search: str = None):
+    @db_bound
+    def get_departments_fallback(skip: int = 0, limit: int = 50, search: str = None):
         """获取部门列表 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -62,7 +85,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.get("/api/departments/statistics")
-    async def get_department_statistics_fallback():
+    @db_bound
+    def get_department_statistics_fallback():
         """获取部门统计信息 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -80,7 +104,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.get("/api/departments/options")
-    async def get_department_options_fallback():
+    @db_bound
+    def get_department_options_fallback():
         """获取部门选项列表 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -103,7 +128,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.get("/api/departments/{department_id}")
-    async def get_department_fallback(department_id: int):
+    @db_bound
+    def get_department_fallback(department_id: int):
         """获取部门详情 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -128,7 +154,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.post("/api/departments/")
-    async def create_department_fallback(data: dict):
+    @db_bound
+    def create_department_fallback(data: dict):
         """创建部门 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -181,7 +208,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.put("/api/departments/{department_id}")
-    async def update_department_fallback(department_id: int, data: dict):
+    @db_bound
+    def update_department_fallback(department_id: int, data: dict):
         """更新部门 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -251,7 +279,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.delete("/api/departments/{department_id}")
-    async def delete_department_fallback(department_id: int):
+    @db_bound
+    def delete_department_fallback(department_id: int):
         """删除部门 - 备用端点"""
         connection = get_db_connection()
         try:
@@ -279,29 +308,64 @@ def add_missing_endpoints(app, get_db_connection):
     
     # 网段相关API端点
     @app.get("/api/subnets")
-    async def get_subnets_api(skip: int = 0, limit: int = 50):
-        """获取网段列表 - /api 路径"""
+    @db_bound
+    def get_subnets_api(skip: int = 0, limit: int = 50, cursor: Optional[str] = None, count: str = "exact"):
+        """
+        获取网段列表 - /api 路径
+        
+        传入上一页返回的 next_cursor 时按 (created_at, id) 游标分页；count 可选 exact/estimate/none
+        """
+        try:
+            count_mode = normalize_count_mode(count)
+            position = decode_cursor(cursor, ("created_at", "id")) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
         connection = get_db_connection()
         try:
             with connection.cursor() as cursor:
                 # 获取总数
-                cursor.execute("SELECT COUNT(*) as total FROM subnets")
-                total_result = cursor.fetchone()
-                total = total_result['total']
+                if count_mode == "exact":
+                    cursor.execute("SELECT COUNT(*) as total FROM subnets")
+                    total = cursor.fetchone()['total']
+                elif count_mode == "estimate":
+                    total = estimate_row_count(cursor, "FROM subnets", [])
+                else:
+                    total = None
                 
-                # 获取分页数据，包含IP统计信息
-                cursor.execute("""
-                    SELECT 
-                        s.*,
-                        COUNT(CASE WHEN ip.status = 'allocated' THEN 1 END) as allocated_count,
-                        COUNT(CASE WHEN ip.status = 'available' THEN 1 END) as available_count
-                    FROM subnets s
-                    LEFT JOIN ip_addresses ip ON s.id = ip.subnet_id
-                    GROUP BY s.id
-                    ORDER BY s.created_at DESC
+                # 先在网段表上完成分页，再只读取当前页网段的计数器
+                if position:
+                    page_where_clause = "WHERE created_at < %s OR (created_at = %s AND id < %s)"
+                    page_params = [position['created_at'], position['created_at'], position['id']]
+                    offset = 0
+                else:
+                    page_where_clause = ""
+                    page_params = []
+                    offset = skip
+                
+                cursor.execute(f"""
+                    SELECT * FROM subnets
+                    {page_where_clause}
+                    ORDER BY created_at DESC, id DESC
                     LIMIT %s OFFSET %s
-                """, (limit, skip))
+                """, page_params + [limit + 1, offset])
                 results = cursor.fetchall()
+                has_more = len(results) > limit
+                results = results[:limit]
+                counts = subnet_counts(cursor, [row['id'] for row in results])
+                for row in results:
+                    row_counts = counts.get(row['id'], {})
+                    row['allocated_count'] = row_counts.get('allocated_count', 0)
+                    row['available_count'] = row_counts.get('available_count', 0)
+                next_cursor = encode_cursor({
+                    "created_at": results[-1]['created_at'],
+                    "id": results[-1]['id']
+                }) if has_more else None
+                
+                # 稀疏网段未存储的地址计入可用数
+                virtual = sparse_virtual_counts(
+                    cursor, [row['id'] for row in results if row.get('storage_mode') == 'sparse']
+                )
                 
                 subnets = []
                 for row in results:
@@ -322,9 +386,10 @@ def add_missing_endpoints(app, get_db_connection):
                         "description": row['description'],
                         "vlan_id": row['vlan_id'],
                         "location": row['location'],
+                        "storage_mode": row.get('storage_mode') or 'dense',
                         "created_at": str(row['created_at']),
                         "allocated_count": int(row['allocated_count'] or 0),
-                        "available_count": int(row['available_count'] or 0),
+                        "available_count": int(row['available_count'] or 0) + virtual.get(row['id'], 0),
                         "ip_count": total_ips
                     }
                     subnets.append(subnet_data)
@@ -333,15 +398,20 @@ def add_missing_endpoints(app, get_db_connection):
                     "subnets": subnets,
                     "total": total,
                     "page": skip // limit + 1,
-                    "size": limit
+                    "size": limit,
+                    "next_cursor": next_cursor,
+                    "has_more": has_more
                 }
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to fetch subnets: {str(e)}")
         finally:
             connection.close()
     
     @app.get("/api/subnets/search")
-    async def search_subnets_api(q: Optional[str] = None, vlan_id: Optional[int] = None):
+    @db_bound
+    def search_subnets_api(q: Optional[str] = None, vlan_id: Optional[int] = None):
         """搜索网段"""
         connection = get_db_connection()
         try:
@@ -379,13 +449,71 @@ def add_missing_endpoints(app, get_db_connection):
         finally:
             connection.close()
     
+    @app.get("/api/subnets/lookup")
+    @db_bound
+    def lookup_subnet_by_ip_api(ip: str):
+        """查询IP地址所属网段（最长前缀匹配），matches 为包含该IP的全部网段，最具体的在前"""
+        try:
+            ip = str(ipaddress.IPv4Address(ip.strip()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的IP地址: {ip}")
+        
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                match_ids = [entry.id for entry in trie_from_cursor(cursor).matches(ip)]
+                rows = {}
+                if match_ids:
+                    cursor.execute(f"""
+                        SELECT id, network, netmask, gateway, description, vlan_id, location, storage_mode
+                        FROM subnets WHERE id IN ({', '.join(['%s'] * len(match_ids))})
+                    """, match_ids)
+                    rows = {row['id']: row for row in cursor.fetchall()}
+                matches = [rows[subnet_id] for subnet_id in match_ids if subnet_id in rows]
+                return {
+                    "ip": ip,
+                    "subnet": matches[0] if matches else None,
+                    "matches": matches
+                }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to lookup subnet: {str(e)}")
+        finally:
+            connection.close()
+    
+    @app.get("/api/subnets/free-space")
+    @db_bound
+    def get_subnet_free_space_api(network: str, min_prefixlen: Optional[int] = None, limit: int = 100):
+        """查询网段范围内未被任何网段占用的CIDR块（用于规划新网段）"""
+        parsed = parse_network(network)
+        if parsed is None:
+            raise HTTPException(status_code=400, detail="无效的网段格式，请使用CIDR格式如192.168.1.0/24")
+        if min_prefixlen is not None and not 0 <= min_prefixlen <= 32:
+            raise HTTPException(status_code=400, detail="min_prefixlen 必须在 0-32 之间")
+        limit = max(1, min(limit, 1000))
+        
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                blocks = trie_from_cursor(cursor).free_blocks(parsed, min_prefixlen, limit)
+                return {
+                    "network": str(parsed),
+                    "free_blocks": [str(block) for block in blocks],
+                    "free_addresses": sum(block.num_addresses for block in blocks)
+                }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to compute free space: {str(e)}")
+        finally:
+            connection.close()
+    
     @app.get("/api/subnets/{subnet_id}")
-    async def get_subnet_api(subnet_id: int):
+    @db_bound
+    def get_subnet_api(subnet_id: int):
         """获取单个网段详情 - /api 路径"""
-        return await get_subnet_internal(subnet_id, get_db_connection)
+        return get_subnet_internal(subnet_id, get_db_connection)
     
     @app.put("/api/subnets/{subnet_id}")
-    async def update_subnet_api(subnet_id: int, data: dict):
+    @db_bound
+    def update_subnet_api(subnet_id: int, data: dict):
         """更新网段"""
         connection = get_db_connection()
         try:
@@ -402,6 +530,17 @@ def add_missing_endpoints(app, get_db_connection):
                 if not update_fields:
                     raise HTTPException(status_code=400, detail="No fields to update")
                 
+                if 'network' in data:
+                    new_network = parse_network(data['network'])
+                    if new_network is None:
+                        raise HTTPException(status_code=400, detail="无效的网段格式，请使用CIDR格式如192.168.1.0/24")
+                    overlapping = trie_from_cursor(cursor).overlapping(new_network, exclude_id=subnet_id)
+                    if overlapping:
+                        raise HTTPException(
+                            status_code=409,
+                            detail=f"网段与现有网段重叠: {', '.join(str(entry.network) for entry in overlapping)}"
+                        )
+                
                 update_values.append(subnet_id)
                 sql = f"UPDATE subnets SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
                 
@@ -411,8 +550,14 @@ def add_missing_endpoints(app, get_db_connection):
                 if cursor.rowcount == 0:
                     raise HTTPException(status_code=404, detail="Subnet not found")
                 
-                # 返回更新后的网段信息
-                return await get_subnet_internal(subnet_id, get_db_connection)
+                # 网段范围可能变化，位图和前缀树在下次使用时重建
+                ip_bitmaps.invalidate(subnet_id)
+                if 'network' in data:
+                    subnet_index.invalidate()
+                publish_ip_changes([subnet_id])
+                
+                # 返回更新后的网段信息（复用当前连接，不再从池中另取一个）
+                return _fetch_subnet(cursor, subnet_id)
         except HTTPException:
             raise
         except Exception as e:
@@ -421,7 +566,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.delete("/api/subnets/{subnet_id}")
-    async def delete_subnet_api(subnet_id: int):
+    @db_bound
+    def delete_subnet_api(subnet_id: int):
         """删除网段"""
         connection = get_db_connection()
         try:
@@ -439,6 +585,9 @@ def add_missing_endpoints(app, get_db_connection):
                 if cursor.rowcount == 0:
                     raise HTTPException(status_code=404, detail="Subnet not found")
                 
+                ip_bitmaps.invalidate(subnet_id)
+                subnet_index.invalidate()
+                publish_ip_changes([subnet_id])
                 return {"message": "Subnet deleted successfully"}
         except HTTPException:
             raise
@@ -448,12 +597,11 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.post("/api/subnets/{subnet_id}/sync-ips")
-    async def sync_subnet_ips_api(subnet_id: int):
+    @db_bound
+    def sync_subnet_ips_api(subnet_id: int):
         """同步网段的IP地址列表 - 根据CIDR重新生成正确的IP地址范围"""
         connection = get_db_connection()
         try:
-            import ipaddress
-            
             with connection.cursor() as cursor:
                 # 检查网段是否存在
                 cursor.execute("SELECT network FROM subnets WHERE id = %s", (subnet_id,))
@@ -463,54 +611,11 @@ def add_missing_endpoints(app, get_db_connection):
                 
                 network = subnet_result['network']
                 
-                # 解析网段
+                # 集合化同步：批量删除越界的可用地址，分块补齐缺失地址
                 try:
-                    net = ipaddress.ip_network(network, strict=False)
-                except ValueError:
-                    raise HTTPException(status_code=400, detail=f"无效的网段格式: {network}")
-                
-                # 获取当前网段中的所有IP地址
-                cursor.execute(
-                    "SELECT ip_address, status FROM ip_addresses WHERE subnet_id = %s",
-                    (subnet_id,)
-                )
-                existing_ips = cursor.fetchall()
-                existing_ip_dict = {ip['ip_address']: ip['status'] for ip in existing_ips}
-                
-                # 生成网段中应该存在的所有IP地址
-                expected_ips = {str(ip) for ip in net.hosts()}
-                
-                # 找出需要添加和删除的IP地址
-                existing_ip_set = set(existing_ip_dict.keys())
-                ips_to_add = expected_ips - existing_ip_set
-                ips_to_remove = existing_ip_set - expected_ips
-                
-                stats = {
-                    'added': 0,
-                    'removed': 0,
-                    'kept': len(existing_ip_set & expected_ips)
-                }
-                
-                # 删除不再属于网段的IP地址（只删除未分配的）
-                if ips_to_remove:
-                    for ip_to_remove in ips_to_remove:
-                        if existing_ip_dict[ip_to_remove] == 'available':
-                            cursor.execute(
-                                "DELETE FROM ip_addresses WHERE subnet_id = %s AND ip_address = %s",
-                                (subnet_id, ip_to_remove)
-                            )
-                            stats['removed'] += 1
-                
-                # 添加新的IP地址
-                if ips_to_add:
-                    for ip_str in ips_to_add:
-                        cursor.execute(
-                            "INSERT INTO ip_addresses (ip_address, subnet_id, status) VALUES (%s, %s, 'available')",
-                            (ip_str, subnet_id)
-                        )
-                    stats['added'] = len(ips_to_add)
-                
-                connection.commit()
+                    stats = sync_subnet_ips(connection, subnet_id, network)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
                 
                 return {
                     "message": "IP地址同步完成",
@@ -528,15 +633,33 @@ def add_missing_endpoints(app, get_db_connection):
     
     # IP地址相关API端点
     @app.get("/api/ips")
-    async def get_ips_api(skip: int = 0, limit: int = 50, subnet_id: Optional[int] = None):
+    @db_bound
+    def get_ips_api(skip: int = 0, limit: int = 50, subnet_id: Optional[int] = None):
         """获取IP地址列表"""
-        return await list_ip_addresses_internal(skip, limit, subnet_id, get_db_connection)
+        return list_ip_addresses_internal(skip, limit, subnet_id, get_db_connection)
     
     @app.get("/api/ips/search")
-    async def search_ips_api(skip: int = 0, limit: int = 50, query: Optional[str] = None, 
+    @db_bound
+    def search_ips_api(skip: int = 0, limit: int = 50, query: Optional[str] = None, 
                             status: Optional[str] = None, subnet_id: Optional[int] = None,
-                            assigned_to: Optional[str] = None, authorization: str = Header(None)):
-        """搜索IP地址"""
+                            assigned_to: Optional[str] = None, authorization: str = Header(None),
+                            cursor: Optional[str] = None, count: str = "exact", order: Optional[str] = None):
+        """
+        搜索IP地址
+        
+        支持两种分页方式：skip/limit 偏移分页，以及传入上一页返回的 next_cursor 进行游标分页。
+        count 可选 exact/estimate/none，无限滚动场景可使用 none 或 estimate 跳过精确计数。
+        文本查询走全文索引，order 可选 relevance（默认，按相关度排序，仅支持偏移分页）/ ip（按地址排序）。
+        指定稀疏网段且条件可能匹配可用地址时，结果与 /api/ips 一致地包含未存储地址的 available 虚拟记录（id 为 None）。
+        """
+        if order not in (None, "relevance", "ip"):
+            raise HTTPException(status_code=400, detail="order 参数必须是 relevance 或 ip")
+        try:
+            count_mode = normalize_count_mode(count)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        cursor_token = cursor
+        
         # 获取当前用户角色
         user_role = None
         if authorization and authorization.startswith("Bearer "):
@@ -551,6 +674,10 @@ def add_missing_endpoints(app, get_db_connection):
             with connection.cursor() as cursor:
                 where_conditions = []
                 params = []
+                # 全文检索的相关度排序表达式，非文本查询时为 None
+                relevance_sql = None
+                relevance_params = []
+                ip_ranges = None
                 
                 # 处理assigned_to参数（精确匹配）
                 if assigned_to:
@@ -563,37 +690,13 @@ def add_missing_endpoints(app, get_db_connection):
                     
 
                     
-                    # 检查是否是完整的IP地址格式
-                    ip_pattern = r'^(\d{1,3}\.){3}\d{1,3}$'
-                    # 检查是否是C类网段格式（如 192.168.1 或 192.168.1.0）
-                    ip_c_subnet_pattern = r'^(\d{1,3}\.){2}\d{1,3}(\.0)?$'
-                    # 检查是否是B类网段格式（如 192.168）
-                    ip_b_subnet_pattern = r'^(\d{1,3}\.){1}\d{1,3}$'
-                    
-                    if re.match(ip_pattern, query):
-                        # 完整IP地址：只进行精确匹配
-
-                        where_conditions.append("ip_address = %s")
-                        params.append(query)
-                    elif re.match(ip_c_subnet_pattern, query):
-                        # C类网段搜索（如 192.168.1 或 192.168.1.0）：精确网段匹配
-
-                        # 标准化查询：只有当查询以.0结尾且不是x.x.0格式时才移除.0
-                        # 例如：192.168.1.0 -> 192.168.1，但 192.168.0 保持不变
-                        if query.endswith('.0') and query.count('.') == 3:
-                            normalized_query = query[:-2]  # 移除末尾的.0
-                        else:
-                            normalized_query = query
-                        # 使用精确的网段匹配，确保只匹配该网段
-                        # 使用正则表达式确保精确匹配，避免 192.168.1 匹配到 192.168.10
-                        regex_pattern = f"^{re.escape(normalized_query)}\\.[0-9]+$"
-                        where_conditions.append("ip_address REGEXP %s")
-                        params.append(regex_pattern)
-                    elif re.match(ip_b_subnet_pattern, query):
-                        # B类网段搜索（如 192.168）：匹配整个B类网段
-
-                        where_conditions.append("ip_address LIKE %s")
-                        params.append(f"{query}.%")
+                    # IP地址、八位组前缀（192.168.1）、CIDR、通配符和区间查询：
+                    # 转换为 ip_int 上的连续区间，走索引范围扫描
+                    ip_ranges = parse_ip_query(query)
+                    if ip_ranges:
+                        range_sql, range_params = range_condition(ip_ranges)
+                        where_conditions.append(range_sql)
+                        params.extend(range_params)
                     else:
                         # 检查是否包含中文字符（用户名通常是中文）
                         chinese_pattern = r'[\u4e00-\u9fff]'
@@ -603,7 +706,14 @@ def add_missing_endpoints(app, get_db_connection):
                         ip_part_pattern = r'^\d{1,3}(\.\d{1,3})?$'
                         is_ip_part = bool(re.match(ip_part_pattern, query))
                         
-                        if has_chinese:
+                        boolean_query = build_boolean_query(query) if IP_SEARCH_FULLTEXT and not is_ip_part else None
+                        if boolean_query:
+                            # 全文索引（ngram 分词）：各字段任一命中即可，按相关度和完全匹配加权排序
+                            match_sql, match_params = match_condition(boolean_query)
+                            where_conditions.append(match_sql)
+                            params.extend(match_params)
+                            relevance_sql, relevance_params = relevance_expression(boolean_query, query)
+                        elif has_chinese:
                             # 中文查询：主要在用户相关字段中搜索
                             where_conditions.append("""(
                                 user_name = %s OR 
@@ -641,9 +751,9 @@ def add_missing_endpoints(app, get_db_connection):
                 
                 # 只读用户网段限制：只允许查询192.168.10.0/23网段
                 if user_role == "readonly":
-                    # 192.168.10.0/23 包含 192.168.10.0-192.168.11.255
-                    subnet_restriction = "(ip_address LIKE %s OR ip_address LIKE %s)"
-                    subnet_params = ['192.168.10.%', '192.168.11.%']
+                    # 192.168.10.0/23 包含 192.168.10.0-192.168.11.255，按整数范围过滤
+                    subnet_restriction = "ip_int BETWEEN %s AND %s"
+                    subnet_params = [3232238080, 3232238591]
                     
                     if where_conditions:
                         where_clause = f"({base_where_clause}) AND {subnet_restriction}"
@@ -656,106 +766,104 @@ def add_missing_endpoints(app, get_db_connection):
                     where_clause = base_where_clause
                     final_params = params
                 
-                # 首先获取总数
-                count_sql = f"SELECT COUNT(*) as total FROM ip_addresses WHERE {where_clause}"
-                cursor.execute(count_sql, final_params)
-                total_count = cursor.fetchone()['total']
+                # 稀疏网段只存储占用的地址：没有文本/使用人条件、状态为空或 available 时，
+                # 结果还包括未存储的可用地址，按CIDR整数区间生成
+                if (subnet_id and not assigned_to and (not query or ip_ranges)
+                        and status in (None, "", "available")
+                        and get_storage_mode(cursor, subnet_id) == 'sparse'):
+                    results, total_count, has_more, next_cursor = _search_sparse_subnet_ips(
+                        connection, cursor, subnet_id, ip_ranges, status or None,
+                        readonly=user_role == "readonly", skip=skip, limit=limit, cursor_token=cursor_token
+                    )
+                    return {
+                        "data": [_search_result_row(row) for row in results],
+                        "total": total_count if count_mode != "none" else None,
+                        "skip": skip,
+                        "limit": limit,
+                        "next_cursor": next_cursor,
+                        "has_more": has_more
+                    }
                 
-                # 然后获取分页数据，优化排序逻辑
-                if query and not re.match(ip_pattern, query):
-                    # 对于非IP地址查询，使用相关性排序
-                    chinese_pattern = r'[\u4e00-\u9fff]'
-                    has_chinese = bool(re.search(chinese_pattern, query))
-                    
-                    if has_chinese:
-                        # 中文查询：使用简单的排序，避免参数重复问题
-                        data_sql = f"""
-                            SELECT * FROM ip_addresses 
-                            WHERE {where_clause} 
-                            ORDER BY INET_ATON(ip_address)
-                            LIMIT %s OFFSET %s
-                        """
-                        sort_params = final_params + [limit, skip]
-
-                        cursor.execute(data_sql, sort_params)
-                    else:
-                        # 英文/数字查询：使用简单的排序，避免参数重复问题
-                        data_sql = f"""
-                            SELECT * FROM ip_addresses 
-                            WHERE {where_clause} 
-                            ORDER BY INET_ATON(ip_address)
-                            LIMIT %s OFFSET %s
-                        """
-                        sort_params = final_params + [limit, skip]
-
-                        cursor.execute(data_sql, sort_params)
+                # 游标分页：在索引 ip_int 上定位，代价与页深无关
+                page_where_clause = where_clause
+                page_params = list(final_params)
+                rank_by_relevance = relevance_sql is not None and order != "ip" and not cursor_token
+                if cursor_token:
+                    keyset_sql, keyset_params = _ip_keyset_condition(cursor_token)
+                    page_where_clause = f"({where_clause}) AND {keyset_sql}"
+                    page_params += keyset_params
+                    offset = 0
                 else:
-                    # IP地址查询或无查询条件，使用默认排序
-                    cursor.execute(f"""
-                        SELECT * FROM ip_addresses 
-                        WHERE {where_clause} 
-                        ORDER BY INET_ATON(ip_address) 
-                        LIMIT %s OFFSET %s
-                    """, final_params + [limit, skip])
+                    offset = skip
+                
+                # 总数统计：exact 精确统计 / estimate 执行计划估算 / none 不统计
+                if count_mode == "exact":
+                    cursor.execute(f"SELECT COUNT(*) as total FROM ip_addresses WHERE {where_clause}", final_params)
+                    total_count = cursor.fetchone()['total']
+                elif count_mode == "estimate":
+                    total_count = estimate_row_count(cursor, f"FROM ip_addresses WHERE {where_clause}", final_params)
+                else:
+                    total_count = None
+                
+                # 多取一条用于判断是否还有下一页
+                if rank_by_relevance:
+                    order_sql = f"{relevance_sql} DESC, ip_int, id"
+                    order_params = relevance_params
+                else:
+                    order_sql = "ip_int, id"
+                    order_params = []
+                cursor.execute(f"""
+                    SELECT * FROM ip_addresses 
+                    WHERE {page_where_clause} 
+                    ORDER BY {order_sql} 
+                    LIMIT %s OFFSET %s
+                """, page_params + order_params + [limit + 1, offset])
                 results = cursor.fetchall()
+                has_more = len(results) > limit
+                results = results[:limit]
+                # 相关度排序不是按 ip_int 的顺序，无法生成游标，继续使用 skip 翻页
+                next_cursor = _ip_next_cursor(results) if has_more and not rank_by_relevance else None
                 
-                data = [
-                    {
-                        "id": row['id'],
-                        "ip_address": row['ip_address'],
-                        "subnet_id": row['subnet_id'],
-                        "status": row['status'],
-                        "user_name": row['user_name'],
-                        "mac_address": row['mac_address'],
-                        "device_type": row['device_type'],
-                        "location": row['location'],
-                        "assigned_to": row['assigned_to'],
-                        "description": row['description'],
-                        "allocated_at": str(row['allocated_at']) if row['allocated_at'] else None,
-                        "created_at": str(row['created_at'])
-                    } for row in results
-                ]
+                data = [_search_result_row(row) for row in results]
                 
                 return {
                     "data": data,
                     "total": total_count,
                     "skip": skip,
-                    "limit": limit
+                    "limit": limit,
+                    "next_cursor": next_cursor,
+                    "has_more": has_more
                 }
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to search IP addresses: {str(e)}")
         finally:
             connection.close()
     
     @app.get("/api/ips/statistics")
-    async def get_ip_statistics_api(subnet_id: Optional[int] = None):
+    @db_bound
+    def get_ip_statistics_api(subnet_id: Optional[int] = None):
         """获取IP统计信息"""
         connection = get_db_connection()
         try:
             with connection.cursor() as cursor:
-                where_clause = "WHERE subnet_id = %s" if subnet_id else ""
-                params = [subnet_id] if subnet_id else []
+                counts = total_counts(cursor, subnet_id or None)
                 
-                cursor.execute(f"""
-                    SELECT 
-                        COUNT(*) as total_ips,
-                        SUM(CASE WHEN status = 'allocated' THEN 1 ELSE 0 END) as allocated_ips,
-                        SUM(CASE WHEN status = 'available' THEN 1 ELSE 0 END) as available_ips,
-                        SUM(CASE WHEN status = 'reserved' THEN 1 ELSE 0 END) as reserved_ips,
-                        SUM(CASE WHEN status = 'conflict' THEN 1 ELSE 0 END) as conflict_ips
-                    FROM ip_addresses {where_clause}
-                """, params)
-                result = cursor.fetchone()
+                # 稀疏网段：可用数 = CIDR主机数 - 已存记录数，未存储部分补入总数和可用数
+                virtual_available = sum(sparse_virtual_counts(
+                    cursor, [subnet_id] if subnet_id else None
+                ).values())
                 
-                total = result['total_ips'] or 0
-                allocated = result['allocated_ips'] or 0
+                total = counts['total_count'] + virtual_available
+                allocated = counts['allocated_count']
                 
                 return {
                     "total_ips": total,
                     "allocated_ips": allocated,
-                    "available_ips": result['available_ips'] or 0,
-                    "reserved_ips": result['reserved_ips'] or 0,
-                    "conflict_ips": result['conflict_ips'] or 0,
+                    "available_ips": counts['available_count'] + virtual_available,
+                    "reserved_ips": counts['reserved_count'],
+                    "conflict_ips": counts['conflict_count'],
                     "utilization_rate": round((allocated / total * 100) if total > 0 else 0, 2)
                 }
         except Exception as e:
@@ -763,6 +871,52 @@ def add_missing_endpoints(app, get_db_connection):
         finally:
             connection.close()
     
+    @app.get("/api/ips/bitmap/status")
+    async def get_ip_bitmap_status_api():
+        """网段空闲地址位图状态"""
+        return ip_bitmaps.status()
+    
+    @app.get("/api/ips/bitmap/free-ranges")
+    @db_bound
+    def get_ip_free_ranges_api(subnet_id: int, limit: int = 20):
+        """按位图列出网段内的连续空闲地址段"""
+        connection = get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                ranges = ip_bitmaps.free_ranges(subnet_id, limit, lambda: load_subnet_bitmap(cursor, subnet_id))
+            if ranges is None:
+                raise HTTPException(status_code=404, detail="网段不存在或超出位图容量")
+            return [
+                {
+                    "start_ip": str(ipaddress.IPv4Address(start)),
+                    "end_ip": str(ipaddress.IPv4Address(end)),
+                    "count": end - start + 1
+                } for start, end in ranges
+            ]
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"获取空闲地址段失败: {str(e)}")
+        finally:
+            connection.close()
+    
+    @app.post("/api/ips/bitmap/reconcile")
+    @db_bound
+    def reconcile_ip_bitmaps_api(subnet_id: Optional[int] = None, fix: bool = True):
+        """将网段位图与数据库对账，fix=true 时以数据库为准修正"""
+        connection = get_db_connection()
+        try:
+            reports = reconcile_bitmaps(connection, subnet_id, fix)
+            return {
+                "checked": len(reports),
+                "inconsistent": sum(1 for report in reports if not report["consistent"]),
+                "reports": reports
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"位图对账失败: {str(e)}")
+        finally:
+            connection.close()
+    
     @app.get("/api/ips/search-history")
     async def get_search_history_api(limit: int = 20):
         """获取搜索历史（模拟数据）"""
@@ -775,21 +929,31 @@ def add_missing_endpoints(app, get_db_connection):
     
     # IP分配相关端点
     @app.post("/api/ips/allocate")
-    async def allocate_ip_api(data: dict):
+    @db_bound
+    def allocate_ip_api(data: dict):
         """分配IP地址"""
         connection = get_db_connection()
         try:
-            with connection.cursor() as cursor:
+            # 事务未提交（回滚、异常）时，从位图取出的地址恢复为空闲
+            with ip_bitmaps.transaction() as bitmap_tx, connection.cursor() as cursor:
                 # 验证必填字段
                 subnet_id = data.get('subnet_id')
                 if not subnet_id:
                     raise HTTPException(status_code=400, detail="网段ID不能为空")
                 
                 # 检查网段是否存在
-                cursor.execute("SELECT id FROM subnets WHERE id = %s", (subnet_id,))
-                if not cursor.fetchone():
+                cursor.execute("SELECT id, network, storage_mode FROM subnets WHERE id = %s", (subnet_id,))
+                subnet = cursor.fetchone()
+                if not subnet:
                     raise HTTPException(status_code=404, detail="网段不存在")
                 
+                sparse = subnet.get('storage_mode') == 'sparse'
+                if sparse:
+                    try:
+                        first, last = host_int_range(resolve_network(connection, subnet_id, subnet['network']))
+                    except ValueError as e:
+                        raise HTTPException(status_code=400, detail=str(e))
+                
                 # 如果指定了首选IP，尝试分配
                 preferred_ip = data.get('preferred_ip')
                 if preferred_ip:
@@ -799,6 +963,17 @@ def add_missing_endpoints(app, get_db_connection):
                     """, (preferred_ip, subnet_id))
                     ip_record = cursor.fetchone()
                     
+                    if not ip_record and sparse:
+                        # 稀疏网段：网段范围内未存储的地址即为可用，按需写入
+                        try:
+                            preferred_int = int(ipaddress.IPv4Address(preferred_ip))
+                        except ValueError:
+                            raise HTTPException(status_code=400, detail=f"无效的IP地址: {preferred_ip}")
+                        if first <= preferred_int <= last:
+                            ip_record = materialize_ip(cursor, subnet_id, preferred_int)
+                            if ip_record and ip_record['subnet_id'] != subnet_id:
+                                raise HTTPException(status_code=409, detail=f"IP地址 {preferred_ip} 已属于其他网段")
+                    
                     if not ip_record:
                         raise HTTPException(status_code=404, detail=f"IP地址 {preferred_ip} 不存在")
                     
@@ -806,51 +981,32 @@ def add_missing_endpoints(app, get_db_connection):
                         raise HTTPException(status_code=409, detail=f"IP地址 {preferred_ip} 不可用，当前状态: {ip_record['status']}")
                     
                     ip_id = ip_record['id']
+                    # 条件更新，读取之后被其他请求抢先分配时受影响行数为0
+                    if not mark_allocated(cursor, ip_id, data):
+                        connection.rollback()
+                        raise HTTPException(status_code=409, detail=f"IP地址 {preferred_ip} 已被其他请求分配")
                 else:
-                    # 自动分配可用IP
-                    cursor.execute("""
-                        SELECT id, ip_address FROM ip_addresses 
-                        WHERE subnet_id = %s AND status = 'available' 
-                        ORDER BY INET_ATON(ip_address) 
-                        LIMIT 1
-                    """, (subnet_id,))
-                    ip_record = cursor.fetchone()
+                    # 自动分配：原子认领网段中最小的可用地址
+                    try:
+                        ip_id = claim_next_ip(
+                            cursor, subnet_id, data, sparse_range=(first, last) if sparse else None
+                        )
+                    except AllocationContentionError as e:
+                        connection.rollback()
+                        raise HTTPException(status_code=409, detail=str(e))
                     
-                    if not ip_record:
+                    if not ip_id:
+                        connection.rollback()
                         raise HTTPException(status_code=404, detail="网段中没有可用的IP地址")
-                    
-                    ip_id = ip_record['id']
-                    preferred_ip = ip_record['ip_address']
-                
-                # 更新IP地址状态
-                cursor.execute("""
-                    UPDATE ip_addresses SET 
-                        status = 'allocated',
-                        mac_address = %s,
-                        user_name = %s,
-                        device_type = %s,
-                        location = %s,
-                        assigned_to = %s,
-                        description = %s,
-                        allocated_at = NOW(),
-                        allocated_by = 1,
-                        updated_at = NOW()
-                    WHERE id = %s
-                """, (
-                    data.get('mac_address'),
-                    data.get('user_name'),  # 改为user_name
-                    data.get('device_type'),
-                    data.get('location'),
-                    data.get('assigned_to'),
-                    data.get('description'),
-                    ip_id
-                ))
                 
                 connection.commit()
+                bitmap_tx.commit()
                 
                 # 返回更新后的IP信息
                 cursor.execute("SELECT * FROM ip_addresses WHERE id = %s", (ip_id,))
                 result = cursor.fetchone()
+                ip_bitmaps.apply_status(result['subnet_id'], result['ip_int'], result['status'])
+                publish_ip_changes([result['subnet_id']], [(result['subnet_id'], result['ip_address'])])
                 
                 return {
                     "id": result['id'],
@@ -877,8 +1033,142 @@ def add_missing_endpoints(app, get_db_connection):
         finally:
             connection.close()
     
+    @app.post("/api/ips/allocate/batch")
+    @db_bound
+    def allocate_ip_batch_api(data: dict, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+        """
+        批量分配IP地址，所有地址在同一事务中认领
+        
+        请求字段:
+        - subnet_id 或 subnet_ids: 候选网段（按顺序尝试）
+        - count: 分配数量；items: 每个地址的附加字段（mac_address、user_name、device_type 等），
+          与 count 同时提供时长度必须一致；顶层的同名字段作为所有地址的默认值
+        - contiguous: 是否要求整块连续地址（默认否，优先最佳适配的连续块，不足时拼凑）
+        - allow_partial: 地址不足时是否提交已认领的部分（默认否，整批回滚）
+        - idempotency_key 或请求头 Idempotency-Key: 重试时返回首次提交的结果
+        """
+        key = idempotency_key or data.get('idempotency_key')
+        subnet_ids = data.get('subnet_ids') or ([data['subnet_id']] if data.get('subnet_id') else [])
+        items = data.get('items') or []
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise HTTPException(status_code=400, detail="items 必须是对象数组")
+        count = data.get('count') or len(items)
+        contiguous = bool(data.get('contiguous', False))
+        allow_partial = bool(data.get('allow_partial', False))
+        
+        if not subnet_ids:
+            raise HTTPException(status_code=400, detail="网段ID不能为空")
+        try:
+            subnet_ids = list(dict.fromkeys(int(sid) for sid in subnet_ids))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="无效的网段ID")
+        if not isinstance(count, int) or isinstance(count, bool) or count <= 0:
+            raise HTTPException(status_code=400, detail="分配数量必须为正整数")
+        if count > BATCH_ALLOCATION_MAX:
+            raise HTTPException(status_code=400, detail=f"单次最多分配 {BATCH_ALLOCATION_MAX} 个地址")
+        if items and len(items) != count:
+            raise HTTPException(status_code=400, detail="items 数量与 count 不一致")
+        if key and len(key) > 100:
+            raise HTTPException(status_code=400, detail="幂等键长度不能超过100")
+        
+        defaults = {field: data.get(field) for field in ALLOCATION_FIELDS}
+        item_data = [
+            {**defaults, **{field: item[field] for field in ALLOCATION_FIELDS if field in item}}
+            for item in (items or [{}] * count)
+        ]
+        
+        connection = get_db_connection()
+        try:
+            # 事务未提交（回滚、异常）时，从位图取出的地址恢复为空闲
+            with ip_bitmaps.transaction() as bitmap_tx, connection.cursor() as cursor:
+                if key:
+                    fingerprint = request_fingerprint({
+                        "subnet_ids": subnet_ids, "items": item_data,
+                        "contiguous": contiguous, "allow_partial": allow_partial
+                    })
+                    try:
+                        previous = begin_idempotent_request(cursor, key, fingerprint)
+                    except IdempotencyKeyReuseError as e:
+                        connection.rollback()
+                        raise HTTPException(status_code=422, detail=str(e))
+                    if previous is not None:
+                        connection.rollback()
+                        return {**previous, "replayed": True}
+                
+                cursor.execute(
+                    f"SELECT id, network, netmask, storage_mode FROM subnets WHERE id IN ({', '.join(['%s'] * len(subnet_ids))})",
+                    subnet_ids
+                )
+                found = {row['id']: row for row in cursor.fetchall()}
+                missing = [sid for sid in subnet_ids if sid not in found]
+                if missing:
+                    raise HTTPException(status_code=404, detail=f"网段不存在: {missing}")
+                
+                try:
+                    ip_ids = allocate_batch(cursor, [found[sid] for sid in subnet_ids], item_data, contiguous=contiguous)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                
+                if not ip_ids or (len(ip_ids) < count and not allow_partial):
+                    connection.rollback()
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"{'没有足够的连续' if contiguous else '没有足够的'}可用IP地址：请求 {count} 个，可分配 {len(ip_ids)} 个"
+                    )
+                
+                cursor.execute(
+                    f"SELECT * FROM ip_addresses WHERE id IN ({', '.join(['%s'] * len(ip_ids))})", ip_ids
+                )
+                rows = {row['id']: row for row in cursor.fetchall()}
+                allocated = [
+                    {
+                        "id": rows[ip_id]['id'],
+                        "ip_address": rows[ip_id]['ip_address'],
+                        "subnet_id": rows[ip_id]['subnet_id'],
+                        "status": rows[ip_id]['status'],
+                        "user_name": rows[ip_id]['user_name'],
+                        "mac_address": rows[ip_id]['mac_address'],
+                        "device_type": rows[ip_id]['device_type'],
+                        "location": rows[ip_id]['location'],
+                        "assigned_to": rows[ip_id]['assigned_to'],
+                        "description": rows[ip_id]['description'],
+                        "allocated_at": str(rows[ip_id]['allocated_at']) if rows[ip_id]['allocated_at'] else None,
+                        "allocated_by": rows[ip_id]['allocated_by']
+                    } for ip_id in ip_ids
+                ]
+                ip_ints = [rows[ip_id]['ip_int'] for ip_id in ip_ids]
+                response = {
+                    "requested": count,
+                    "allocated_count": len(allocated),
+                    "contiguous": ip_ints == list(range(ip_ints[0], ip_ints[0] + len(ip_ints))),
+                    "items": allocated,
+                    "failed": [
+                        {"index": index, "error": "可用IP地址不足"} for index in range(len(allocated), count)
+                    ],
+                    "idempotency_key": key,
+                    "replayed": False
+                }
+                if key:
+                    finish_idempotent_request(cursor, key, response)
+                connection.commit()
+                bitmap_tx.commit()
+                
+                for row in rows.values():
+                    ip_bitmaps.apply_status(row['subnet_id'], row['ip_int'], row['status'])
+                publish_ip_changes(subnet_ids, [(row['subnet_id'], row['ip_address']) for row in rows.values()])
+                return response
+                
+        except HTTPException:
+            raise
+        except Exception as e:
+            connection.rollback()
+            raise HTTPException(status_code=500, detail=f"批量分配IP地址失败: {str(e)}")
+        finally:
+            connection.close()
+    
     @app.post("/api/ips/reserve")
-    async def reserve_ip_api(data: dict):
+    @db_bound
+    def reserve_ip_api(data: dict):
         """保留IP地址"""
         connection = get_db_connection()
         try:
@@ -891,9 +1181,9 @@ def add_missing_endpoints(app, get_db_connection):
                 if not reason:
                     raise HTTPException(status_code=400, detail="保留原因不能为空")
                 
-                # 查找IP记录
+                # 查找IP记录（稀疏网段中未存储的可用地址按需写入）
                 cursor.execute("SELECT id, status FROM ip_addresses WHERE ip_address = %s", (ip_address,))
-                ip_record = cursor.fetchone()
+                ip_record = cursor.fetchone() or materialize_unstored(cursor, [ip_address]).get(ip_address)
                 
                 if not ip_record:
                     raise HTTPException(status_code=404, detail=f"IP地址 {ip_address} 不存在")
@@ -910,14 +1200,19 @@ def add_missing_endpoints(app, get_db_connection):
                         allocated_at = NOW(),
                         allocated_by = 1,
                         updated_at = NOW()
-                    WHERE id = %s
+                    WHERE id = %s AND status = 'available'
                 """, (reason, f"保留 - {reason}", ip_record['id']))
+                if cursor.rowcount != 1:
+                    connection.rollback()
+                    raise HTTPException(status_code=409, detail=f"IP地址 {ip_address} 已被其他请求占用")
                 
                 connection.commit()
                 
                 # 返回更新后的IP信息
                 cursor.execute("SELECT * FROM ip_addresses WHERE id = %s", (ip_record['id'],))
                 result = cursor.fetchone()
+                ip_bitmaps.apply_status(result['subnet_id'], result['ip_int'], result['status'])
+                publish_ip_changes([result['subnet_id']], [(result['subnet_id'], result['ip_address'])])
                 
                 return {
                     "id": result['id'],
@@ -945,7 +1240,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.post("/api/ips/release")
-    async def release_ip_api(data: dict):
+    @db_bound
+    def release_ip_api(data: dict):
         """释放IP地址"""
         connection = get_db_connection()
         try:
@@ -957,7 +1253,9 @@ def add_missing_endpoints(app, get_db_connection):
                     raise HTTPException(status_code=400, detail="IP地址不能为空")
                 
                 # 查找IP记录
-                cursor.execute("SELECT id, status FROM ip_addresses WHERE ip_address = %s", (ip_address,))
+                cursor.execute(
+                    "SELECT id, subnet_id, ip_int, status FROM ip_addresses WHERE ip_address = %s", (ip_address,)
+                )
                 ip_record = cursor.fetchone()
                 
                 if not ip_record:
@@ -966,6 +1264,35 @@ def add_missing_endpoints(app, get_db_connection):
                 if ip_record['status'] not in ['allocated', 'reserved']:
                     raise HTTPException(status_code=400, detail=f"IP地址 {ip_address} 无法释放，当前状态: {ip_record['status']}")
                 
+                if get_storage_mode(cursor, ip_record['subnet_id']) == 'sparse':
+                    # 稀疏网段不存储可用地址：释放即删除记录，返回未存储的可用地址
+                    cursor.execute(
+                        "DELETE FROM ip_addresses WHERE id = %s AND status IN ('allocated', 'reserved')",
+                        (ip_record['id'],)
+                    )
+                    if cursor.rowcount != 1:
+                        connection.rollback()
+                        raise HTTPException(status_code=409, detail=f"IP地址 {ip_address} 已被其他请求修改")
+                    connection.commit()
+                    ip_bitmaps.apply_status(ip_record['subnet_id'], ip_record['ip_int'], None)
+                    publish_ip_changes([ip_record['subnet_id']], [(ip_record['subnet_id'], ip_address)])
+                    return {
+                        "id": None,
+                        "ip_address": ip_address,
+                        "subnet_id": ip_record['subnet_id'],
+                        "status": "available",
+                        "user_name": None,
+                        "mac_address": None,
+                        "device_type": None,
+                        "location": None,
+                        "assigned_to": None,
+                        "description": None,
+                        "allocated_at": None,
+                        "allocated_by": None,
+                        "created_at": None,
+                        "updated_at": None
+                    }
+                
                 # 更新IP状态为可用
                 cursor.execute("""
                     UPDATE ip_addresses SET 
@@ -987,6 +1314,8 @@ def add_missing_endpoints(app, get_db_connection):
                 # 返回更新后的IP信息
                 cursor.execute("SELECT * FROM ip_addresses WHERE id = %s", (ip_record['id'],))
                 result = cursor.fetchone()
+                ip_bitmaps.apply_status(result['subnet_id'], result['ip_int'], result['status'])
+                publish_ip_changes([result['subnet_id']], [(result['subnet_id'], result['ip_address'])])
                 
                 return {
                     "id": result['id'],
@@ -1014,7 +1343,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.post("/api/ips/bulk-operation")
-    async def bulk_ip_operation_api(data: dict):
+    @db_bound
+    def bulk_ip_operation_api(data: dict):
         """批量IP地址操作"""
         connection = get_db_connection()
         try:
@@ -1029,68 +1359,15 @@ def add_missing_endpoints(app, get_db_connection):
                 if operation not in ['reserve', 'release', 'delete']:
                     raise HTTPException(status_code=400, detail="无效的操作类型")
                 
-                success_ips = []
-                failed_ips = []
-                
-                for ip_address in ip_addresses:
-                    try:
-                        # 查找IP记录
-                        cursor.execute("SELECT id, status FROM ip_addresses WHERE ip_address = %s", (ip_address,))
-                        ip_record = cursor.fetchone()
-                        
-                        if not ip_record:
-                            failed_ips.append({"ip": ip_address, "error": "IP地址不存在"})
-                            continue
-                        
-                        if operation == 'reserve':
-                            if ip_record['status'] != 'available':
-                                failed_ips.append({"ip": ip_address, "error": f"IP不可用，当前状态: {ip_record['status']}"})
-                                continue
-                            
-                            cursor.execute("""
-                                UPDATE ip_addresses SET 
-                                    status = 'reserved',
-                                    description = %s,
-                                    assigned_to = %s,
-                                    allocated_at = NOW(),
-                                    allocated_by = 1,
-                                    updated_at = NOW()
-                                WHERE id = %s
-                            """, (reason, f"批量保留 - {reason}", ip_record['id']))
-                            
-                        elif operation == 'release':
-                            if ip_record['status'] not in ['allocated', 'reserved']:
-                                failed_ips.append({"ip": ip_address, "error": f"IP无法释放，当前状态: {ip_record['status']}"})
-                                continue
-                            
-                            cursor.execute("""
-                                UPDATE ip_addresses SET 
-                                    status = 'available',
-                                    mac_address = NULL,
-                                    user_name = NULL,
-                                    device_type = NULL,
-                                    location = NULL,
-                                    assigned_to = NULL,
-                                    description = %s,
-                                    allocated_at = NULL,
-                                    allocated_by = NULL,
-                                    updated_at = NOW()
-                                WHERE id = %s
-                            """, (reason, ip_record['id']))
-                            
-                        elif operation == 'delete':
-                            if ip_record['status'] == 'allocated':
-                                failed_ips.append({"ip": ip_address, "error": "IP已分配，无法删除。请先释放该IP地址"})
-                                continue
-                            
-                            cursor.execute("DELETE FROM ip_addresses WHERE id = %s", (ip_record['id'],))
-                        
-                        success_ips.append(ip_address)
-                        
-                    except Exception as e:
-                        failed_ips.append({"ip": ip_address, "error": str(e)})
+                # 集合化执行：每块一次加锁查询 + 一条带状态条件的批量语句
+                result = bulk_ip_operation(cursor, ip_addresses, operation, reason)
+                success_ips = result['success_ips']
+                failed_ips = result['failed_ips']
                 
                 connection.commit()
+                for subnet_id, ip_int, new_status in result['bitmap_changes']:
+                    ip_bitmaps.apply_status(subnet_id, ip_int, new_status)
+                publish_ip_changes(ip_addresses=result['changed_ips'])
                 
                 return {
                     "success_count": len(success_ips),
@@ -1109,7 +1386,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.delete("/api/ips/delete")
-    async def delete_ip_api(data: dict):
+    @db_bound
+    def delete_ip_api(data: dict):
         """删除IP地址"""
         connection = get_db_connection()
         try:
@@ -1121,7 +1399,7 @@ def add_missing_endpoints(app, get_db_connection):
                     raise HTTPException(status_code=400, detail="IP地址不能为空")
                 
                 # 查找IP记录
-                cursor.execute("SELECT id, status FROM ip_addresses WHERE ip_address = %s", (ip_address,))
+                cursor.execute("SELECT id, subnet_id, ip_int, status FROM ip_addresses WHERE ip_address = %s", (ip_address,))
                 ip_record = cursor.fetchone()
                 
                 if not ip_record:
@@ -1137,6 +1415,8 @@ def add_missing_endpoints(app, get_db_connection):
                 
                 if cursor.rowcount == 0:
                     raise HTTPException(status_code=500, detail=f"删除IP地址 {ip_address} 失败")
+                ip_bitmaps.apply_status(ip_record['subnet_id'], ip_record['ip_int'], None)
+                publish_ip_changes([ip_record['subnet_id']], [(ip_record['subnet_id'], ip_address)])
                 
                 return {
                     "ip_address": ip_address,
@@ -1153,14 +1433,15 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
 
     @app.put("/api/ips/{ip_address}")
-    async def update_ip_api(ip_address: str, data: dict):
+    @db_bound
+    def update_ip_api(ip_address: str, data: dict):
         """更新IP地址信息"""
         connection = get_db_connection()
         try:
             with connection.cursor() as cursor:
-                # 首先验证IP地址是否存在
-                cursor.execute("SELECT id FROM ip_addresses WHERE ip_address = %s", (ip_address,))
-                ip_record = cursor.fetchone()
+                # 首先验证IP地址是否存在（稀疏网段中未存储的可用地址按需写入）
+                cursor.execute("SELECT id, subnet_id FROM ip_addresses WHERE ip_address = %s", (ip_address,))
+                ip_record = cursor.fetchone() or materialize_unstored(cursor, [ip_address]).get(ip_address)
                 
                 if not ip_record:
                     raise HTTPException(status_code=404, detail=f"IP地址 {ip_address} 不存在")
@@ -1204,6 +1485,7 @@ def add_missing_endpoints(app, get_db_connection):
                 
                 if cursor.rowcount == 0:
                     raise HTTPException(status_code=404, detail=f"IP地址 {ip_address} 更新失败")
+                publish_ip_changes([ip_record['subnet_id']], [(ip_record['subnet_id'], ip_address)])
                 
                 # 记录审计日志
                 try:
@@ -1233,7 +1515,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
 
     @app.get("/api/ips/{ip_address}/history")
-    async def get_ip_history_api(ip_address: str):
+    @db_bound
+    def get_ip_history_api(ip_address: str):
         """获取IP地址历史记录"""
         connection = get_db_connection()
         try:
@@ -1279,7 +1562,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.post("/api/ips/advanced-search")
-    async def advanced_search_ips_api(data: dict):
+    @db_bound
+    def advanced_search_ips_api(data: dict):
         """高级搜索IP地址"""
         connection = get_db_connection()
         try:
@@ -1289,7 +1573,14 @@ def add_missing_endpoints(app, get_db_connection):
                 params = []
                 
                 # 基本搜索
-                if data.get('query'):
+                ip_ranges = parse_ip_query(data.get('query'))
+                # 只有地址相关条件时，稀疏网段的未存储地址也可能匹配
+                address_only = not data.get('query') or bool(ip_ranges)
+                if ip_ranges:
+                    range_sql, range_params = range_condition(ip_ranges)
+                    where_conditions.append(range_sql)
+                    params.extend(range_params)
+                elif data.get('query'):
                     where_conditions.append("(ip_address LIKE %s OR user_name LIKE %s OR assigned_to LIKE %s)")
                     query_param = f"%{data['query']}%"
                     params.extend([query_param, query_param, query_param])
@@ -1331,33 +1622,84 @@ def add_missing_endpoints(app, get_db_connection):
                 
                 # IP范围过滤
                 if data.get('ip_range_start') and data.get('ip_range_end'):
-                    where_conditions.append("INET_ATON(ip_address) BETWEEN INET_ATON(%s) AND INET_ATON(%s)")
-                    params.extend([data['ip_range_start'], data['ip_range_end']])
+                    import ipaddress
+                    try:
+                        range_start = int(ipaddress.IPv4Address(data['ip_range_start']))
+                        range_end = int(ipaddress.IPv4Address(data['ip_range_end']))
+                    except ValueError:
+                        raise HTTPException(status_code=400, detail="无效的IP范围")
+                    # 使用整数列进行范围扫描，可以走 ip_int 索引
+                    where_conditions.append("ip_int BETWEEN %s AND %s")
+                    params.extend([range_start, range_end])
+                    ip_ranges = [
+                        (max(start, range_start), min(end, range_end))
+                        for start, end in (ip_ranges or [(range_start, range_end)])
+                    ]
                 
                 where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
                 
-                # 分页参数
+                # 分页参数：提供 cursor 时使用游标分页，忽略 skip
                 skip = data.get('skip', 0)
                 limit = data.get('limit', 50)
+                try:
+                    count_mode = normalize_count_mode(data.get('count'))
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                
+                sparse_listing = (
+                    data.get('subnet_id') and address_only
+                    and data.get('status') in (None, "", "available")
+                    and not any(data.get(key) for key in ('device_type', 'location', 'assigned_to', 'mac_address', 'user_name'))
+                    and get_storage_mode(cursor, data['subnet_id']) == 'sparse'
+                )
                 
-                # 获取总数
-                count_query = f"SELECT COUNT(*) as total FROM ip_addresses WHERE {where_clause}"
-                cursor.execute(count_query, params)
-                total = cursor.fetchone()['total']
-                
-                # 获取数据
-                data_query = f"""
-                    SELECT * FROM ip_addresses 
-                    WHERE {where_clause} 
-                    ORDER BY INET_ATON(ip_address) 
-                    LIMIT %s OFFSET %s
-                """
-                cursor.execute(data_query, params + [limit, skip])
-                results = cursor.fetchall()
+                if sparse_listing:
+                    # 稀疏网段：合并未存储地址的 available 虚拟记录
+                    results, total, has_more, next_cursor = _search_sparse_subnet_ips(
+                        connection, cursor, data['subnet_id'], ip_ranges, data.get('status') or None,
+                        readonly=False, skip=skip, limit=limit, cursor_token=data.get('cursor')
+                    )
+                    if data.get('cursor'):
+                        skip = 0
+                    if count_mode == "none":
+                        total = None
+                else:
+                    page_where_clause = where_clause
+                    page_params = list(params)
+                    if data.get('cursor'):
+                        keyset_sql, keyset_params = _ip_keyset_condition(data['cursor'])
+                        page_where_clause = f"({where_clause}) AND {keyset_sql}"
+                        page_params += keyset_params
+                        skip = 0
+                    
+                    # 获取总数
+                    if count_mode == "exact":
+                        cursor.execute(f"SELECT COUNT(*) as total FROM ip_addresses WHERE {where_clause}", params)
+                        total = cursor.fetchone()['total']
+                    elif count_mode == "estimate":
+                        total = estimate_row_count(cursor, f"FROM ip_addresses WHERE {where_clause}", params)
+                    else:
+                        total = None
+                    
+                    # 获取数据（多取一条判断是否有下一页）
+                    data_query = f"""
+                        SELECT * FROM ip_addresses 
+                        WHERE {page_where_clause} 
+                        ORDER BY ip_int, id 
+                        LIMIT %s OFFSET %s
+                    """
+                    cursor.execute(data_query, page_params + [limit + 1, skip])
+                    results = cursor.fetchall()
+                    has_more = len(results) > limit
+                    results = results[:limit]
+                    next_cursor = _ip_next_cursor(results) if has_more else None
                 
                 # 计算分页信息
                 page = (skip // limit) + 1 if limit > 0 else 1
-                total_pages = (total + limit - 1) // limit if limit > 0 else 1
+                if total is None:
+                    total_pages = None
+                else:
+                    total_pages = (total + limit - 1) // limit if limit > 0 else 1
                 
                 items = [
                     {
@@ -1373,8 +1715,8 @@ def add_missing_endpoints(app, get_db_connection):
                         "description": row['description'],
                         "allocated_at": str(row['allocated_at']) if row['allocated_at'] else None,
                         "allocated_by": row['allocated_by'],
-                        "created_at": str(row['created_at']),
-                        "updated_at": str(row['updated_at'])
+                        "created_at": str(row['created_at']) if row['created_at'] else None,
+                        "updated_at": str(row['updated_at']) if row['updated_at'] else None
                     } for row in results
                 ]
                 
@@ -1383,9 +1725,13 @@ def add_missing_endpoints(app, get_db_connection):
                     "total": total,
                     "page": page,
                     "page_size": limit,
-                    "total_pages": total_pages
+                    "total_pages": total_pages,
+                    "next_cursor": next_cursor,
+                    "has_more": has_more
                 }
                 
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"高级搜索失败: {str(e)}")
         finally:
@@ -1393,7 +1739,8 @@ def add_missing_endpoints(app, get_db_connection):
     
     # 标签相关API端点
     @app.get("/api/tags/")
-    async def get_tags_api(limit: int = 1000):
+    @db_bound
+    def get_tags_api(limit: int = 1000):
         """获取标签列表"""
         connection = get_db_connection()
         try:
@@ -1417,7 +1764,8 @@ def add_missing_endpoints(app, get_db_connection):
     
     # 自定义字段相关API端点
     @app.get("/api/custom-fields/")
-    async def get_custom_fields_api(entity_type: Optional[str] = None):
+    @db_bound
+    def get_custom_fields_api(entity_type: Optional[str] = None):
         """获取自定义字段列表"""
         connection = get_db_connection()
         try:
@@ -1446,7 +1794,8 @@ def add_missing_endpoints(app, get_db_connection):
     
     # 用户管理相关API端点
     @app.get("/api/users/")
-    async def get_users_api(skip: int = 0, limit: int = 20, active_only: bool = False):
+    @db_bound
+    def get_users_api(skip: int = 0, limit: int = 20, active_only: bool = False):
         """获取用户列表"""
         connection = get_db_connection()
         try:
@@ -1490,7 +1839,8 @@ def add_missing_endpoints(app, get_db_connection):
 
     # 网段验证端点
     @app.post("/api/subnets/validate")
-    async def validate_subnet_api(data: dict):
+    @db_bound
+    def validate_subnet_api(data: dict):
         """验证网段格式和重叠检测"""
         connection = get_db_connection()
         try:
@@ -1514,19 +1864,19 @@ def add_missing_endpoints(app, get_db_connection):
                 }
             
             with connection.cursor() as cursor:
-                # 简化的重叠检查 - 只检查网段地址是否已存在
-                if exclude_id:
-                    cursor.execute("""
-                        SELECT id, network, description FROM subnets 
-                        WHERE id != %s AND network = %s
-                    """, (exclude_id, network))
-                else:
-                    cursor.execute("""
+                # 重叠检查：网段前缀树给出包含、相同和被包含的网段，只查询命中的记录
+                overlapping_ids = [
+                    entry.id for entry in trie_from_cursor(cursor).overlapping(
+                        network, exclude_id=int(exclude_id) if exclude_id else None
+                    )
+                ]
+                overlapping_subnets = []
+                if overlapping_ids:
+                    cursor.execute(f"""
                         SELECT id, network, description FROM subnets 
-                        WHERE network = %s
-                    """, (network,))
-                
-                overlapping_subnets = cursor.fetchall()
+                        WHERE id IN ({', '.join(['%s'] * len(overlapping_ids))})
+                    """, overlapping_ids)
+                    overlapping_subnets = cursor.fetchall()
                 
                 if overlapping_subnets:
                     return {
@@ -1557,7 +1907,8 @@ def add_missing_endpoints(app, get_db_connection):
     # 用户管理API端点
     @app.get("/api/users")
     @app.get("/api/users/")
-    async def get_users_api(skip: int = 0, limit: int = 20, active_only: bool = False):
+    @db_bound
+    def get_users_api(skip: int = 0, limit: int = 20, active_only: bool = False):
         """获取用户列表"""
         connection = get_db_connection()
         try:
@@ -1603,7 +1954,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.get("/api/users/statistics")
-    async def get_user_statistics_api():
+    @db_bound
+    def get_user_statistics_api():
         """获取用户统计信息"""
         connection = get_db_connection()
         try:
@@ -1674,7 +2026,8 @@ def add_missing_endpoints(app, get_db_connection):
         }
     
     @app.get("/api/users/{user_id}")
-    async def get_user_api(user_id: int):
+    @db_bound
+    def get_user_api(user_id: int):
         """获取用户详情"""
         connection = get_db_connection()
         try:
@@ -1707,19 +2060,23 @@ def add_missing_endpoints(app, get_db_connection):
     
     @app.post("/api/users")
     @app.post("/api/users/")
-    async def create_user_api(data: dict):
+    @db_bound
+    def create_user_api(data: dict):
         """创建新用户"""
+        username = data.get('username')
+        password = data.get('password')
+        email = data.get('email')
+        role = data.get('role', 'user')
+        
+        if not username or not password:
+            raise HTTPException(status_code=400, detail="用户名和密码不能为空")
+        
+        # 在获取数据库连接之前完成哈希计算（密码哈希线程池），不占用连接
+        password_hash = get_password_hash(password)
+        
         connection = get_db_connection()
         try:
             with connection.cursor() as cursor:
-                username = data.get('username')
-                password = data.get('password')
-                email = data.get('email')
-                role = data.get('role', 'user')
-                
-                if not username or not password:
-                    raise HTTPException(status_code=400, detail="用户名和密码不能为空")
-                
                 # 检查用户名是否已存在
                 cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
                 if cursor.fetchone():
@@ -1731,11 +2088,7 @@ def add_missing_endpoints(app, get_db_connection):
                     if cursor.fetchone():
                         raise HTTPException(status_code=400, detail="邮箱地址已存在")
                 
-                # 创建用户（使用bcrypt哈希）
-                from passlib.context import CryptContext
-                pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-                password_hash = pwd_context.hash(password)
-                
+                # 创建用户
                 cursor.execute("""
                     INSERT INTO users (username, password_hash, email, role, theme, is_active, created_at)
                     VALUES (%s, %s, %s, %s, 'light', TRUE, NOW())
@@ -1769,7 +2122,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.put("/api/users/{user_id}")
-    async def update_user_api(user_id: int, data: dict):
+    @db_bound
+    def update_user_api(user_id: int, data: dict):
         """更新用户信息"""
         connection = get_db_connection()
         try:
@@ -1806,6 +2160,7 @@ def add_missing_endpoints(app, get_db_connection):
                 
                 cursor.execute(sql, update_values)
                 connection.commit()
+                invalidate_principal(user_id)
                 
                 # 返回更新后的用户信息
                 cursor.execute("""
@@ -1833,7 +2188,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.delete("/api/users/{user_id}")
-    async def delete_user_api(user_id: int):
+    @db_bound
+    def delete_user_api(user_id: int):
         """删除用户"""
         connection = get_db_connection()
         try:
@@ -1907,6 +2263,12 @@ def add_missing_endpoints(app, get_db_connection):
                     message = "用户删除成功"
                 
                 connection.commit()
+                invalidate_principal(user_id)
+                if audit_count == 0 or is_already_deleted:
+                    # 级联删除了地址和网段，全部位图和网段前缀树在下次使用时重建
+                    ip_bitmaps.invalidate()
+                    subnet_index.invalidate()
+                    publish_ip_changes(resync=True)
                 
                 return {"message": message}
         except HTTPException:
@@ -1918,35 +2280,36 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.put("/api/users/{user_id}/password")
-    async def reset_user_password_api(user_id: int, data: dict):
+    @db_bound
+    def reset_user_password_api(user_id: int, data: dict):
         """重置用户密码"""
+        new_password = data.get('new_password')
+        
+        if not new_password:
+            raise HTTPException(status_code=400, detail="新密码不能为空")
+        
+        if len(new_password) < 8:
+            raise HTTPException(status_code=400, detail="密码长度至少8位")
+        
+        # 在获取数据库连接之前完成哈希计算（密码哈希线程池），不占用连接
+        password_hash = get_password_hash(new_password)
+        
         connection = get_db_connection()
         try:
             with connection.cursor() as cursor:
-                new_password = data.get('new_password')
-                
-                if not new_password:
-                    raise HTTPException(status_code=400, detail="新密码不能为空")
-                
-                if len(new_password) < 8:
-                    raise HTTPException(status_code=400, detail="密码长度至少8位")
-                
                 # 检查用户是否存在
                 cursor.execute("SELECT id FROM users WHERE id = %s", (user_id,))
                 if not cursor.fetchone():
                     raise HTTPException(status_code=404, detail="用户不存在")
                 
-                # 更新密码（使用bcrypt哈希）
-                from passlib.context import CryptContext
-                pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-                password_hash = pwd_context.hash(new_password)
-                
+                # 更新密码
                 cursor.execute("""
-                    UPDATE users SET password_hash = %s, updated_at = NOW() 
+                    UPDATE users SET password_hash = %s, credential_version = credential_version + 1, updated_at = NOW() 
                     WHERE id = %s
                 """, (password_hash, user_id))
                 
                 connection.commit()
+                invalidate_principal(user_id)
                 
                 return {"message": "密码重置成功"}
         except HTTPException:
@@ -1958,7 +2321,8 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
     
     @app.put("/api/users/{user_id}/toggle-status")
-    async def toggle_user_status_api(user_id: int):
+    @db_bound
+    def toggle_user_status_api(user_id: int):
         """切换用户激活状态"""
         connection = get_db_connection()
         try:
@@ -1982,6 +2346,7 @@ def add_missing_endpoints(app, get_db_connection):
                 """, (new_status, user_id))
                 
                 connection.commit()
+                invalidate_principal(user_id)
                 
                 action = "激活" if new_status else "停用"
                 return {
@@ -1998,7 +2363,25 @@ def add_missing_endpoints(app, get_db_connection):
             connection.close()
 
 # 内部辅助函数
-async def list_subnets_internal(skip: int, limit: int, get_db_connection):
+def _ip_keyset_condition(cursor_token: str):
+    """根据游标构建 (ip_int, id) 定位条件"""
+    try:
+        position = decode_cursor(cursor_token, ("ip_int", "id"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return (
+        "(ip_int > %s OR (ip_int = %s AND id > %s))",
+        [position["ip_int"], position["ip_int"], position["id"]]
+    )
+
+def _ip_next_cursor(rows) -> Optional[str]:
+    """用当前页最后一条记录生成下一页游标"""
+    if not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor({"ip_int": last["ip_int"], "id": last["id"]})
+
+def list_subnets_internal(skip: int, limit: int, get_db_connection):
     """内部网段列表函数"""
     connection = get_db_connection()
     try:
@@ -2023,27 +2406,31 @@ async def list_subnets_internal(skip: int, limit: int, get_db_connection):
     finally:
         connection.close()
 
-async def get_subnet_internal(subnet_id: int, get_db_connection):
+def _fetch_subnet(cursor, subnet_id: int) -> dict:
+    """用已有游标读取网段详情，不存在时抛出404"""
+    cursor.execute("SELECT * FROM subnets WHERE id = %s", (subnet_id,))
+    result = cursor.fetchone()
+    
+    if not result:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    
+    return {
+        "id": result['id'],
+        "network": result['network'],
+        "netmask": result['netmask'],
+        "gateway": result['gateway'],
+        "description": result['description'],
+        "vlan_id": result['vlan_id'],
+        "location": result['location'],
+        "created_at": str(result['created_at'])
+    }
+
+def get_subnet_internal(subnet_id: int, get_db_connection):
     """内部获取网段函数"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            cursor.execute("SELECT * FROM subnets WHERE id = %s", (subnet_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                raise HTTPException(status_code=404, detail="Subnet not found")
-            
-            return {
-                "id": result['id'],
-                "network": result['network'],
-                "netmask": result['netmask'],
-                "gateway": result['gateway'],
-                "description": result['description'],
-                "vlan_id": result['vlan_id'],
-                "location": result['location'],
-                "created_at": str(result['created_at'])
-            }
+            return _fetch_subnet(cursor, subnet_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -2051,18 +2438,115 @@ async def get_subnet_internal(subnet_id: int, get_db_connection):
     finally:
         connection.close()
 
-async def list_ip_addresses_internal(skip: int, limit: int, subnet_id: Optional[int], get_db_connection):
+def _search_result_row(row) -> dict:
+    """IP搜索结果的单条记录"""
+    return {
+        "id": row['id'],
+        "ip_address": row['ip_address'],
+        "subnet_id": row['subnet_id'],
+        "status": row['status'],
+        "user_name": row['user_name'],
+        "mac_address": row['mac_address'],
+        "device_type": row['device_type'],
+        "location": row['location'],
+        "assigned_to": row['assigned_to'],
+        "description": row['description'],
+        "allocated_at": str(row['allocated_at']) if row['allocated_at'] else None,
+        "created_at": str(row['created_at']) if row['created_at'] else None
+    }
+
+def _search_sparse_subnet_ips(connection, cursor, subnet_id: int, ip_ranges, status: Optional[str],
+                              readonly: bool, skip: int, limit: int, cursor_token: Optional[str]):
+    """
+    稀疏网段的IP搜索：已存储记录与未存储地址的虚拟记录合并后按 ip_int 分页
+    返回 (rows, total, has_more, next_cursor)；游标只依赖 ip_int（每个地址只有一条结果）
+    """
+    ranges = list(ip_ranges or [(0, 0xFFFFFFFF)])
+    if readonly:
+        # 只读用户只能查询 192.168.10.0/23
+        ranges = [(max(start, 3232238080), min(end, 3232238591)) for start, end in ranges]
+    offset = skip
+    if cursor_token:
+        try:
+            position = decode_cursor(cursor_token, ("ip_int",))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        ranges = [(max(start, int(position["ip_int"]) + 1), end) for start, end in ranges]
+        offset = 0
+
+    rows, total = sparse_search_page(connection, cursor, subnet_id, ranges, status, offset, limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_cursor({"ip_int": rows[-1]['ip_int'], "id": rows[-1]['id'] or 0})
+    return rows, total, has_more, next_cursor
+
+def _list_sparse_subnet_ips(connection, cursor, subnet_id: int, skip: int, limit: int):
+    """
+    稀疏网段的地址列表：按CIDR整数区间分页，
+    窗口内已存储的记录原样返回，其余地址生成 available 虚拟记录（id 为 None）
+    """
+    cursor.execute("SELECT network FROM subnets WHERE id = %s", (subnet_id,))
+    first, last = host_int_range(resolve_network(connection, subnet_id, cursor.fetchone()['network']))
+    window_start = first + skip
+    window_end = min(window_start + limit - 1, last)
+    if window_start > window_end:
+        return []
+
+    cursor.execute(
+        "SELECT * FROM ip_addresses WHERE subnet_id = %s AND ip_int BETWEEN %s AND %s",
+        (subnet_id, window_start, window_end)
+    )
+    stored = {row['ip_int']: row for row in cursor.fetchall()}
+
+    items = []
+    for ip_int in range(window_start, window_end + 1):
+        row = stored.get(ip_int)
+        if row:
+            items.append({
+                "id": row['id'],
+                "ip_address": row['ip_address'],
+                "subnet_id": row['subnet_id'],
+                "status": row['status'],
+                "hostname": row.get('hostname', row.get('user_name')),
+                "mac_address": row['mac_address'],
+                "device_type": row['device_type'],
+                "location": row['location'],
+                "assigned_to": row['assigned_to'],
+                "description": row['description'],
+                "created_at": str(row['created_at'])
+            })
+        else:
+            items.append({
+                "id": None,
+                "ip_address": str(ipaddress.IPv4Address(ip_int)),
+                "subnet_id": subnet_id,
+                "status": "available",
+                "hostname": None,
+                "mac_address": None,
+                "device_type": None,
+                "location": None,
+                "assigned_to": None,
+                "description": None,
+                "created_at": None
+            })
+    return items
+
+def list_ip_addresses_internal(skip: int, limit: int, subnet_id: Optional[int], get_db_connection):
     """内部IP地址列表函数"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
+            if subnet_id and get_storage_mode(cursor, subnet_id) == 'sparse':
+                return _list_sparse_subnet_ips(connection, cursor, subnet_id, skip, limit)
             if subnet_id:
                 cursor.execute(
-                    "SELECT * FROM ip_addresses WHERE subnet_id = %s ORDER BY INET_ATON(ip_address) LIMIT %s OFFSET %s", 
+                    "SELECT * FROM ip_addresses WHERE subnet_id = %s ORDER BY ip_int LIMIT %s OFFSET %s", 
                     (subnet_id, limit, skip)
                 )
             else:
-                cursor.execute("SELECT * FROM ip_addresses ORDER BY INET_ATON(ip_address) LIMIT %s OFFSET %s", (limit, skip))
+                cursor.execute("SELECT * FROM ip_addresses ORDER BY ip_int LIMIT %s OFFSET %s", (limit, skip))
             
             results = cursor.fetchall()
             
@@ -61,12 +61,12 @@ class UserProfileResponse(BaseModel):
 
 
 @router.post("/login", response_model=LoginResponse)
-async def login(
+def login(
     request: LoginRequest,
     auth_service: AuthService = Depends(get_auth_service)
 ):
     """
-    用户登录
+    用户登录（同步处理函数在线程池中执行，密码校验由有界的哈希线程池完成，不阻塞事件循环）
     
     Args:
         request: 登录请求数据
@@ -76,7 +76,7 @@ async def login(
         LoginResponse: 登录响应，包含访问令牌、刷新令牌和用户信息
     
     Raises:
-        HTTPException: 认证失败时抛出401错误
+        HTTPException: 认证失败时抛出401错误，登录请求过多时抛出429错误
     """
     try:
         access_token, refresh_token, user_info = auth_service.login(
@@ -223,7 +223,7 @@ async def update_profile(
 
 
 @router.put("/password")
-async def change_password(
+def change_password(
     request: ChangePasswordRequest,
     current_user: User = Depends(get_current_active_user),
     auth_service: AuthService = Depends(get_auth_service)
@@ -19,7 +19,7 @@ router = APIRouter()
 
 
 @router.get("/", response_model=List[IPAddressResponse])
-async def get_ip_addresses(
+def get_ip_addresses(
     subnet_id: Optional[int] = None,
     status: Optional[str] = None,
     skip: int = 0,
@@ -46,7 +46,7 @@ async def get_ip_addresses(
 
 
 @router.post("/allocate", response_model=IPAddressResponse)
-async def allocate_ip(
+def allocate_ip(
     request: IPAllocationRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_write_permission),
@@ -103,7 +103,7 @@ async def allocate_ip(
 
 
 @router.post("/reserve", response_model=IPAddressResponse)
-async def reserve_ip(
+def reserve_ip(
     request: IPReservationRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_write_permission),
@@ -157,7 +157,7 @@ async def reserve_ip(
 
 
 @router.post("/release", response_model=IPAddressResponse)
-async def release_ip(
+def release_ip(
     request: IPReleaseRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_write_permission),
@@ -216,7 +216,7 @@ async def release_ip(
 
 
 @router.delete("/delete")
-async def delete_ip(
+def delete_ip(
     request: IPDeleteRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_write_permission),
@@ -276,7 +276,7 @@ async def delete_ip(
 
 
 @router.get("/search", response_model=List[IPAddressResponse])
-async def search_ips(
+def search_ips(
     query: Optional[str] = None,
     subnet_id: Optional[int] = None,
     status: Optional[str] = None,
@@ -311,7 +311,7 @@ async def search_ips(
 
 
 @router.post("/advanced-search")
-async def advanced_search_ips(
+def advanced_search_ips(
     search_request: IPSearchRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -334,7 +334,7 @@ async def advanced_search_ips(
 
 
 @router.get("/statistics", response_model=IPStatisticsResponse)
-async def get_ip_statistics(
+def get_ip_statistics(
     subnet_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -351,7 +351,7 @@ async def get_ip_statistics(
 
 
 @router.get("/conflicts", response_model=List[IPConflictResponse])
-async def get_ip_conflicts(
+def get_ip_conflicts(
     subnet_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -368,7 +368,7 @@ async def get_ip_conflicts(
 
 
 @router.post("/range-status", response_model=List[IPRangeStatusResponse])
-async def get_ip_range_status(
+def get_ip_range_status(
     request: IPRangeStatusRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -390,7 +390,7 @@ async def get_ip_range_status(
 
 
 @router.post("/bulk-operation", response_model=BulkIPOperationResponse)
-async def bulk_ip_operation(
+def bulk_ip_operation(
     request: BulkIPOperationRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin),
@@ -436,7 +436,7 @@ async def bulk_ip_operation(
 
 
 @router.get("/{ip_address}/history")
-async def get_ip_history(
+def get_ip_history(
     ip_address: str,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -468,7 +468,7 @@ async def get_ip_history(
 
 
 @router.get("/search-history", response_model=List[SearchHistoryResponse])
-async def get_search_history(
+def get_search_history(
     limit: int = 20,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -499,7 +499,7 @@ async def get_search_history(
 
 
 @router.get("/search-favorites", response_model=List[SearchHistoryResponse])
-async def get_search_favorites(
+def get_search_favorites(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -529,7 +529,7 @@ async def get_search_favorites(
 
 
 @router.post("/search-history", response_model=dict)
-async def save_search_history(
+def save_search_history(
     request: SearchHistoryRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -554,7 +554,7 @@ async def save_search_history(
 
 
 @router.put("/search-history/{search_id}/favorite")
-async def toggle_search_favorite(
+def toggle_search_favorite(
     search_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -578,7 +578,7 @@ async def toggle_search_favorite(
 
 
 @router.put("/search-history/{search_id}/name")
-async def update_search_name(
+def update_search_name(
     search_id: int,
     search_name: str,
     db: Session = Depends(get_db),
@@ -608,7 +608,7 @@ async def update_search_name(
 
 
 @router.delete("/search-history/{search_id}")
-async def delete_search_history(
+def delete_search_history(
     search_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -637,7 +637,7 @@ async def delete_search_history(
 
 
 @router.get("/departments")
-async def get_departments(
+def get_departments(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -1,50 +1,57 @@
 """
 监控和报告相关的API端点
 """
-from datetime import datetime, timedelta
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
 
 from app.core.deps import get_db, get_current_user
+from app.core.database import SessionLocal
+from app.core.cache_manager import cache_manager
 from app.models.user import User
-from app.models.ip_address import IPAddress
 from app.models.subnet import Subnet
+from app.models.subnet_ip_counter import SubnetIPCounter
+from app.repositories.subnet_repository import SubnetRepository
+from app.repositories.utilization_history_repository import UtilizationHistoryRepository
+from app.services.capacity_forecast_service import CapacityForecastService
 from app.schemas.monitoring import (
     DashboardSummary,
     IPUtilizationStats,
     SubnetUtilizationStats,
     AllocationTrend,
+    ExhaustionForecast,
     TopSubnet
 )
 
 router = APIRouter()
 
-@router.get("/dashboard", response_model=DashboardSummary)
-async def get_dashboard_summary(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """获取仪表盘汇总数据"""
-    
-    # IP地址统计
-    total_ips = db.query(IPAddress).count()
-    allocated_ips = db.query(IPAddress).filter(IPAddress.status == "allocated").count()
-    reserved_ips = db.query(IPAddress).filter(IPAddress.status == "reserved").count()
-    available_ips = db.query(IPAddress).filter(IPAddress.status == "available").count()
-    conflict_ips = db.query(IPAddress).filter(IPAddress.status == "conflict").count()
-    
-    utilization_rate = round((allocated_ips / total_ips * 100) if total_ips > 0 else 0, 2)
-    
-    # 网段统计
-    total_subnets = db.query(Subnet).count()
+def _load_dashboard_summary() -> dict:
+    """计算仪表盘汇总数据（使用独立会话，可由缓存后台刷新线程调用）"""
+    db = SessionLocal()
+    try:
+        # IP地址统计（一次读取网段计数器合计，不扫描地址表）
+        counts = db.query(
+            func.coalesce(func.sum(SubnetIPCounter.total_count), 0),
+            func.coalesce(func.sum(SubnetIPCounter.allocated_count), 0),
+            func.coalesce(func.sum(SubnetIPCounter.reserved_count), 0),
+            func.coalesce(func.sum(SubnetIPCounter.available_count), 0),
+            func.coalesce(func.sum(SubnetIPCounter.conflict_count), 0)
+        ).one()
+        total_ips, allocated_ips, reserved_ips, available_ips, conflict_ips = (int(value) for value in counts)
+        
+        utilization_rate = round((allocated_ips / total_ips * 100) if total_ips > 0 else 0, 2)
+        
+        # 网段统计
+        total_subnets = db.query(Subnet).count()
+    finally:
+        db.close()
     
     # 警报统计（模拟数据，因为警报功能已删除）
     unresolved_alerts = 0
     
-    return DashboardSummary(
-        ip_statistics={
+    return {
+        "ip_statistics": {
             "total_ips": total_ips,
             "allocated_ips": allocated_ips,
             "reserved_ips": reserved_ips,
@@ -52,137 +59,107 @@ async def get_dashboard_summary(
             "conflict_ips": conflict_ips,
             "utilization_rate": utilization_rate
         },
-        total_subnets=total_subnets,
-        alert_statistics={
+        "total_subnets": total_subnets,
+        "alert_statistics": {
             "unresolved_alerts": unresolved_alerts
         }
-    )
+    }
+
+@router.get("/dashboard", response_model=DashboardSummary)
+def get_dashboard_summary(
+    current_user: User = Depends(get_current_user)
+):
+    """获取仪表盘汇总数据（dashboard_stats 缓存，后台提前刷新）"""
+    return DashboardSummary(**cache_manager.get_or_set("dashboard_stats", _load_dashboard_summary))
 
 @router.get("/ip-utilization", response_model=IPUtilizationStats)
-async def get_ip_utilization_stats(
+def get_ip_utilization_stats(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """获取IP使用率统计"""
     
-    stats = db.query(
-        IPAddress.status,
-        func.count(IPAddress.id).label('count')
-    ).group_by(IPAddress.status).all()
-    
-    result = {
-        "allocated": 0,
-        "reserved": 0,
-        "available": 0,
-        "conflict": 0
-    }
+    counts = db.query(
+        func.coalesce(func.sum(SubnetIPCounter.allocated_count), 0),
+        func.coalesce(func.sum(SubnetIPCounter.reserved_count), 0),
+        func.coalesce(func.sum(SubnetIPCounter.available_count), 0),
+        func.coalesce(func.sum(SubnetIPCounter.conflict_count), 0)
+    ).one()
     
-    for stat in stats:
-        if stat.status in result:
-            result[stat.status] = stat.count
+    result = dict(zip(("allocated", "reserved", "available", "conflict"), (int(value) for value in counts)))
     
     return IPUtilizationStats(**result)
 
 @router.get("/subnet-utilization", response_model=List[SubnetUtilizationStats])
-async def get_subnet_utilization_stats(
+def get_subnet_utilization_stats(
+    response: Response,
+    vlan_id: Optional[int] = Query(None, description="按VLAN过滤"),
+    location: Optional[str] = Query(None, description="按位置过滤"),
+    tag_id: Optional[int] = Query(None, description="按标签过滤"),
+    sort_by: str = Query("utilization_rate", pattern="^(utilization_rate|allocated_ips|total_ips|network)$",
+                         description="排序字段"),
+    sort_order: str = Query("desc", pattern="^(asc|desc)$", description="排序方向"),
+    skip: int = Query(0, ge=0, description="跳过的记录数"),
+    limit: int = Query(100, ge=1, le=1000, description="返回的记录数"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取网段使用率统计"""
-    
-    subnets = db.query(Subnet).all()
-    result = []
-    
-    for subnet in subnets:
-        total_ips = db.query(IPAddress).filter(IPAddress.subnet_id == subnet.id).count()
-        allocated_ips = db.query(IPAddress).filter(
-            IPAddress.subnet_id == subnet.id,
-            IPAddress.status == "allocated"
-        ).count()
-        
-        utilization_rate = round((allocated_ips / total_ips * 100) if total_ips > 0 else 0, 2)
-        
-        result.append(SubnetUtilizationStats(
-            subnet_id=subnet.id,
-            network=subnet.network,
-            description=subnet.description,
-            total_ips=total_ips,
-            allocated_ips=allocated_ips,
-            utilization_rate=utilization_rate
-        ))
+    """获取网段使用率统计（分组聚合查询，总数在 X-Total-Count 响应头中）"""
+    subnet_repo = SubnetRepository(db)
+    rows = subnet_repo.get_utilization(
+        vlan_id=vlan_id, location=location, tag_id=tag_id,
+        sort_by=sort_by, descending=sort_order == "desc", skip=skip, limit=limit
+    )
+    response.headers["X-Total-Count"] = str(subnet_repo.count_utilization(vlan_id, location, tag_id))
     
-    return result
+    return [SubnetUtilizationStats(**row) for row in rows]
 
 @router.get("/allocation-trends", response_model=List[AllocationTrend])
-async def get_allocation_trends(
+def get_allocation_trends(
     days: int = Query(30, ge=1, le=365),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取IP分配趋势"""
-    
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days)
-    
-    # 查询指定时间范围内的分配记录
-    trends = db.query(
-        func.date(IPAddress.allocated_at).label('date'),
-        func.count(IPAddress.id).label('allocations')
-    ).filter(
-        IPAddress.allocated_at >= start_date,
-        IPAddress.allocated_at <= end_date,
-        IPAddress.status == "allocated"
-    ).group_by(
-        func.date(IPAddress.allocated_at)
-    ).order_by(
-        func.date(IPAddress.allocated_at)
-    ).all()
-    
-    # 填充缺失的日期
-    result = []
-    current_date = start_date
-    trend_dict = {trend.date: trend.allocations for trend in trends}
-    
-    while current_date <= end_date:
-        result.append(AllocationTrend(
-            date=current_date.isoformat(),
-            allocations=trend_dict.get(current_date, 0)
-        ))
-        current_date += timedelta(days=1)
-    
-    return result
+    """获取IP分配趋势（读取利用率历史的按天汇总，已释放地址的分配同样计入）"""
+    
+    series = UtilizationHistoryRepository(db).daily_series(days + 1)
+    
+    return [
+        AllocationTrend(
+            date=day['date'].isoformat(),
+            allocations=day['allocations'],
+            releases=day['releases'],
+            allocated_ips=day['allocated_count']
+        )
+        for day in series
+    ]
 
 @router.get("/top-utilized-subnets", response_model=List[TopSubnet])
-async def get_top_utilized_subnets(
+def get_top_utilized_subnets(
     limit: int = Query(10, ge=1, le=50),
+    vlan_id: Optional[int] = Query(None, description="按VLAN过滤"),
+    location: Optional[str] = Query(None, description="按位置过滤"),
+    tag_id: Optional[int] = Query(None, description="按标签过滤"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取使用率最高的网段"""
-    
-    subnets = db.query(Subnet).all()
-    subnet_stats = []
-    
-    for subnet in subnets:
-        total_ips = db.query(IPAddress).filter(IPAddress.subnet_id == subnet.id).count()
-        allocated_ips = db.query(IPAddress).filter(
-            IPAddress.subnet_id == subnet.id,
-            IPAddress.status == "allocated"
-        ).count()
-        
-        utilization_rate = round((allocated_ips / total_ips * 100) if total_ips > 0 else 0, 2)
-        
-        subnet_stats.append(TopSubnet(
-            network=subnet.network,
-            description=subnet.description,
-            vlan_id=subnet.vlan_id,
-            location=subnet.location,
-            total_ips=total_ips,
-            allocated_ips=allocated_ips,
-            utilization_rate=utilization_rate
-        ))
-    
-    # 按使用率排序并返回前N个
-    subnet_stats.sort(key=lambda x: x.utilization_rate, reverse=True)
-    return subnet_stats[:limit]
+    """获取使用率最高的网段（数据库中排序并取前N个）"""
+    rows = SubnetRepository(db).get_utilization(
+        vlan_id=vlan_id, location=location, tag_id=tag_id, limit=limit
+    )
+    return [TopSubnet(**row) for row in rows]
 
+@router.get("/exhaustion-forecast", response_model=List[ExhaustionForecast])
+def get_exhaustion_forecast(
+    within_days: Optional[int] = Query(None, ge=1, le=3650, description="只返回预计在该天数内耗尽的网段"),
+    min_confidence: float = Query(0.0, ge=0, le=1, description="最低置信度"),
+    window_days: int = Query(90, ge=7, le=365, description="拟合使用的历史天数"),
+    limit: int = Query(100, ge=1, le=10000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """网段耗尽预测，预计最早耗尽的在前"""
+    forecasts = CapacityForecastService(db).running_out(
+        within_days=within_days, min_confidence=min_confidence, window_days=window_days, limit=limit
+    )
+    return [ExhaustionForecast(**forecast) for forecast in forecasts]
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from app.core.database import get_db
@@ -11,7 +11,9 @@ from app.schemas.subnet import (
     SubnetResponse,
     SubnetListResponse,
     SubnetValidationRequest,
-    SubnetValidationResponse
+    SubnetValidationResponse,
+    SubnetLookupResponse,
+    SubnetFreeSpaceResponse
 )
 from app.core.exceptions import ValidationError, NotFoundError, ConflictError
 
@@ -19,7 +21,7 @@ router = APIRouter()
 
 
 @router.post("/", response_model=SubnetResponse, status_code=status.HTTP_201_CREATED)
-async def create_subnet(
+def create_subnet(
     subnet_data: SubnetCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
@@ -41,7 +43,7 @@ async def create_subnet(
 
 
 @router.get("/", response_model=SubnetListResponse)
-async def get_subnets(
+def get_subnets(
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(50, ge=1, le=100, description="返回的记录数"),
     db: Session = Depends(get_db),
@@ -60,7 +62,7 @@ async def get_subnets(
 
 
 @router.get("/search", response_model=SubnetListResponse)
-async def search_subnets(
+def search_subnets(
     q: str = Query(..., min_length=1, description="搜索关键词"),
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(50, ge=1, le=100, description="返回的记录数"),
@@ -80,7 +82,7 @@ async def search_subnets(
 
 
 @router.get("/vlan/{vlan_id}", response_model=List[SubnetResponse])
-async def get_subnets_by_vlan(
+def get_subnets_by_vlan(
     vlan_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -90,8 +92,44 @@ async def get_subnets_by_vlan(
     return subnet_service.get_subnets_by_vlan(vlan_id)
 
 
+@router.get("/lookup", response_model=SubnetLookupResponse)
+def lookup_subnet_by_ip(
+    ip: str = Query(..., description="IP地址"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """查询IP地址所属网段（最长前缀匹配）"""
+    try:
+        subnet_service = SubnetService(db)
+        return subnet_service.lookup_ip(ip)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+
+
+@router.get("/free-space", response_model=SubnetFreeSpaceResponse)
+def get_subnet_free_space(
+    network: str = Query(..., description="要规划的大网段，如 10.0.0.0/16"),
+    min_prefixlen: Optional[int] = Query(None, ge=0, le=32, description="只返回不小于该前缀长度的空闲块，如 24"),
+    limit: int = Query(100, ge=1, le=1000, description="返回的空闲块数"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """查询网段范围内未被任何网段占用的CIDR块"""
+    try:
+        subnet_service = SubnetService(db)
+        return subnet_service.get_free_space(network, min_prefixlen, limit)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+
+
 @router.get("/{subnet_id}", response_model=SubnetResponse)
-async def get_subnet(
+def get_subnet(
     subnet_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -108,7 +146,7 @@ async def get_subnet(
 
 
 @router.put("/{subnet_id}", response_model=SubnetResponse)
-async def update_subnet(
+def update_subnet(
     subnet_id: int,
     subnet_data: SubnetUpdate,
     db: Session = Depends(get_db),
@@ -136,7 +174,7 @@ async def update_subnet(
 
 
 @router.delete("/{subnet_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_subnet(
+def delete_subnet(
     subnet_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
@@ -158,7 +196,7 @@ async def delete_subnet(
 
 
 @router.post("/validate", response_model=SubnetValidationResponse)
-async def validate_subnet(
+def validate_subnet(
     validation_data: SubnetValidationRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -172,7 +210,7 @@ async def validate_subnet(
 
 
 @router.get("/{subnet_id}/ips")
-async def get_subnet_ips(
+def get_subnet_ips(
     subnet_id: int,
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(50, ge=1, le=100, description="返回的记录数"),
@@ -202,7 +240,7 @@ async def get_subnet_ips(
 
 
 @router.post("/{subnet_id}/sync-ips")
-async def sync_subnet_ips(
+def sync_subnet_ips(
     subnet_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -77,7 +77,7 @@ def get_user_service(db: Session = Depends(get_db)) -> UserService:
 
 
 @router.get("/", response_model=UserListResponse)
-async def get_users(
+def get_users(
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(50, ge=1, le=100, description="返回的记录数"),
     active_only: bool = Query(True, description="是否只返回活跃用户"),
@@ -111,7 +111,7 @@ async def get_users(
 
 
 @router.get("/statistics", response_model=UserStatisticsResponse)
-async def get_user_statistics(
+def get_user_statistics(
     current_user: User = Depends(require_admin),
     user_service: UserService = Depends(get_user_service)
 ):
@@ -135,7 +135,7 @@ async def get_user_statistics(
 
 
 @router.get("/{user_id}", response_model=UserResponse)
-async def get_user(
+def get_user(
     user_id: int,
     current_user: User = Depends(require_manager_or_admin),
     user_service: UserService = Depends(get_user_service)
@@ -160,7 +160,7 @@ async def get_user(
 
 
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def create_user(
+def create_user(
     request: CreateUserRequest,
     current_user: User = Depends(require_admin),
     user_service: UserService = Depends(get_user_service)
@@ -191,7 +191,7 @@ async def create_user(
 
 
 @router.put("/{user_id}", response_model=UserResponse)
-async def update_user(
+def update_user(
     user_id: int,
     request: UpdateUserRequest,
     current_user: User = Depends(require_admin),
@@ -225,7 +225,7 @@ async def update_user(
 
 
 @router.delete("/{user_id}")
-async def delete_user(
+def delete_user(
     user_id: int,
     current_user: User = Depends(require_admin),
     user_service: UserService = Depends(get_user_service)
@@ -251,7 +251,7 @@ async def delete_user(
 
 
 @router.put("/{user_id}/password")
-async def reset_user_password(
+def reset_user_password(
     user_id: int,
     request: ResetPasswordRequest,
     current_user: User = Depends(require_admin),
@@ -278,7 +278,7 @@ async def reset_user_password(
 
 
 @router.put("/{user_id}/toggle-status")
-async def toggle_user_status(
+def toggle_user_status(
     user_id: int,
     current_user: User = Depends(require_admin),
     user_service: UserService = Depends(get_user_service)
@@ -304,7 +304,7 @@ async def toggle_user_status(
 
 
 @router.get("/roles/available")
-async def get_available_roles(
+def get_available_roles(
     current_user: User = Depends(require_manager_or_admin)
 ):
     """
@@ -328,7 +328,7 @@ async def get_available_roles(
 
 
 @router.get("/themes/available")
-async def get_available_themes(
+def get_available_themes(
     current_user: User = Depends(get_current_active_user)
 ):
     """
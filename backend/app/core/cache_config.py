@@ -3,10 +3,14 @@
 定义不同数据类型的缓存策略和TTL设置
 """
 from enum import Enum
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from dataclasses import dataclass
 
 
+# 进程内缓存默认时间上限（秒）
+DEFAULT_LOCAL_TTL = 30
+
+
 class CacheStrategy(Enum):
     """缓存策略枚举"""
     WRITE_THROUGH = "write_through"      # 写入时同时更新缓存
@@ -20,9 +24,17 @@ class CacheConfig:
     """缓存配置类"""
     ttl: int                            # 过期时间（秒）
     strategy: CacheStrategy             # 缓存策略
-    serialize: str = 'json'             # 序列化方式
+    serialize: str = 'json'             # 序列化方式：json/pickle/orjson/msgpack（见 cache_serializers）
+    compression: Optional[str] = None   # 压缩方式：zlib/zstd/lz4，超过 CACHE_COMPRESS_THRESHOLD 时压缩
     auto_refresh: bool = False          # 是否自动刷新
     refresh_threshold: float = 0.8      # 刷新阈值（TTL的百分比）
+    local_ttl: Optional[int] = None     # 进程内缓存时间（秒），None 取 min(ttl, 30)，0 表示不进进程内缓存
+
+    def get_local_ttl(self) -> int:
+        """进程内（L1）缓存时间"""
+        if self.local_ttl is None:
+            return min(self.ttl, DEFAULT_LOCAL_TTL)
+        return min(self.local_ttl, self.ttl)
 
 
 # 缓存配置字典
@@ -37,17 +49,25 @@ CACHE_CONFIGS: Dict[str, CacheConfig] = {
     "user_permissions": CacheConfig(
         ttl=3600,  # 1小时
         strategy=CacheStrategy.CACHE_ASIDE,
-        auto_refresh=True
+        auto_refresh=True,
+        local_ttl=60
     ),
     "user_list": CacheConfig(
         ttl=300,   # 5分钟
         strategy=CacheStrategy.CACHE_ASIDE
     ),
+    "user_principal": CacheConfig(
+        ttl=300,   # 5分钟，变更时按用户ID主动清除
+        strategy=CacheStrategy.CACHE_ASIDE,
+        local_ttl=15
+    ),
     
     # IP地址相关缓存
     "ip_list": CacheConfig(
         ttl=180,   # 3分钟
-        strategy=CacheStrategy.CACHE_ASIDE
+        strategy=CacheStrategy.CACHE_ASIDE,
+        serialize='msgpack',
+        compression='zstd'
     ),
     "ip_detail": CacheConfig(
         ttl=600,   # 10分钟
@@ -58,17 +78,22 @@ CACHE_CONFIGS: Dict[str, CacheConfig] = {
         ttl=60,    # 1分钟
         strategy=CacheStrategy.REFRESH_AHEAD,
         auto_refresh=True,
-        refresh_threshold=0.5
+        refresh_threshold=0.5,
+        local_ttl=5
     ),
     "ip_search_results": CacheConfig(
         ttl=300,   # 5分钟
-        strategy=CacheStrategy.CACHE_ASIDE
+        strategy=CacheStrategy.CACHE_ASIDE,
+        serialize='msgpack',
+        compression='zstd'
     ),
     
     # 网段相关缓存
     "subnet_list": CacheConfig(
         ttl=600,   # 10分钟
         strategy=CacheStrategy.CACHE_ASIDE,
+        serialize='msgpack',
+        compression='zstd',
         auto_refresh=True
     ),
     "subnet_detail": CacheConfig(
@@ -79,6 +104,8 @@ CACHE_CONFIGS: Dict[str, CacheConfig] = {
     "subnet_utilization": CacheConfig(
         ttl=120,   # 2分钟
         strategy=CacheStrategy.REFRESH_AHEAD,
+        serialize='msgpack',
+        compression='zstd',
         auto_refresh=True
     ),
     
@@ -104,15 +131,20 @@ CACHE_CONFIGS: Dict[str, CacheConfig] = {
         ttl=60,    # 1分钟
         strategy=CacheStrategy.REFRESH_AHEAD,
         auto_refresh=True,
-        refresh_threshold=0.3
+        refresh_threshold=0.3,
+        local_ttl=5
     ),
     "utilization_report": CacheConfig(
         ttl=300,   # 5分钟
-        strategy=CacheStrategy.CACHE_ASIDE
+        strategy=CacheStrategy.CACHE_ASIDE,
+        serialize='msgpack',
+        compression='zstd'
     ),
     "audit_logs": CacheConfig(
         ttl=180,   # 3分钟
-        strategy=CacheStrategy.CACHE_ASIDE
+        strategy=CacheStrategy.CACHE_ASIDE,
+        serialize='msgpack',
+        compression='zstd'
     ),
     
     # 搜索相关缓存
@@ -134,21 +166,25 @@ CACHE_CONFIGS: Dict[str, CacheConfig] = {
     # 会话相关缓存
     "user_session": CacheConfig(
         ttl=1800,  # 30分钟
-        strategy=CacheStrategy.WRITE_THROUGH
+        strategy=CacheStrategy.WRITE_THROUGH,
+        local_ttl=0   # 会话注销后各进程需立即失效
     ),
     "login_attempts": CacheConfig(
         ttl=900,   # 15分钟
-        strategy=CacheStrategy.WRITE_THROUGH
+        strategy=CacheStrategy.WRITE_THROUGH,
+        local_ttl=0   # 跨进程计数
     ),
     
     # 临时数据缓存
     "temp_data": CacheConfig(
         ttl=300,   # 5分钟
-        strategy=CacheStrategy.CACHE_ASIDE
+        strategy=CacheStrategy.CACHE_ASIDE,
+        local_ttl=0
     ),
     "rate_limit": CacheConfig(
         ttl=3600,  # 1小时
-        strategy=CacheStrategy.WRITE_THROUGH
+        strategy=CacheStrategy.WRITE_THROUGH,
+        local_ttl=0   # 跨进程计数
     )
 }
 
@@ -167,6 +203,7 @@ CACHE_KEY_PREFIXES = {
     "user_profile": "user:profile",
     "user_permissions": "user:permissions",
     "user_list": "user:list",
+    "user_principal": "auth:principal:v2",  # 令牌版本改为 credential_version 后更换前缀
     "user_session": "session",
     
     # IP地址相关
@@ -0,0 +1,244 @@
+"""
+缓存版本号（generation）
+每个缓存命名空间（如 ip:list、subnet:util）在 Redis 中有一个版本计数器，缓存键内嵌当前版本：
+
+    ip:list:v3:<identifier>
+
+失效时只需 INCR 版本号（O(1)，不扫描键空间），旧版本的键不再被读到，由 TTL 自然过期；
+StaleEntryCollector 在后台线程中用 SCAN 分批清理旧版本的键，提前回收内存。
+
+失效广播（local_cache.invalidation_bus）在线时，版本号在进程内缓存 GENERATION_LOCAL_TTL 秒，
+递增后通过 pub/sub 通知其他进程，读缓存不再需要先到 Redis 取版本号。
+"""
+import os
+import threading
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .redis_client import cache_service
+from .local_cache import invalidation_bus
+
+logger = logging.getLogger(__name__)
+
+# 版本计数器键前缀，计数器不过期
+GENERATION_KEY_PREFIX = "cache:gen:"
+
+# 后台清理间隔（秒），0 表示不启动后台线程
+CACHE_GC_INTERVAL = int(os.getenv('CACHE_GC_INTERVAL', '60'))
+
+# 每次 SCAN 的槽位数和每批删除的键数
+CACHE_GC_SCAN_COUNT = int(os.getenv('CACHE_GC_SCAN_COUNT', '1000'))
+CACHE_GC_BATCH_SIZE = int(os.getenv('CACHE_GC_BATCH_SIZE', '500'))
+
+# 进程内版本号缓存时间（秒），兜底广播消息丢失的情况，0 表示每次都读 Redis
+GENERATION_LOCAL_TTL = float(os.getenv('GENERATION_LOCAL_TTL', '5'))
+
+
+def _text(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def versioned_prefix(namespace: str, generation: int) -> str:
+    """命名空间在指定版本下的键前缀"""
+    return f"{namespace}:v{generation}"
+
+
+def key_generation(namespace: str, key: str) -> Optional[int]:
+    """解析键中内嵌的版本号，不是版本化的键时返回 None"""
+    head = f"{namespace}:v"
+    if not key.startswith(head):
+        return None
+    version = key[len(head):].split(':', 1)[0]
+    return int(version) if version.isdigit() else None
+
+
+class CacheGenerations:
+    """命名空间版本计数器"""
+
+    def __init__(self, cache=cache_service, local_ttl: float = GENERATION_LOCAL_TTL):
+        self.cache = cache
+        self.local_ttl = local_ttl
+        # namespace -> (generation, expires_at)
+        self._local: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(namespace: str) -> str:
+        return f"{GENERATION_KEY_PREFIX}{namespace}"
+
+    def current(self, namespace: str) -> int:
+        """命名空间当前版本，Redis 不可用时返回 0"""
+        return self.current_many([namespace]).get(namespace, 0)
+
+    def current_many(self, namespaces: Iterable[str]) -> Dict[str, int]:
+        """一次 MGET 读取多个命名空间的当前版本"""
+        namespaces = list(namespaces)
+        if not namespaces:
+            return {}
+        use_local = self.local_ttl > 0 and invalidation_bus.listening
+        generations: Dict[str, int] = {}
+        if use_local:
+            now = time.monotonic()
+            with self._lock:
+                for namespace in namespaces:
+                    entry = self._local.get(namespace)
+                    if entry is not None and entry[1] > now:
+                        generations[namespace] = entry[0]
+            if len(generations) == len(namespaces):
+                return generations
+        missing = [namespace for namespace in namespaces if namespace not in generations]
+        try:
+            self.cache._ensure_connection()
+            if not self.cache.client:
+                return {namespace: 0 for namespace in namespaces}
+            values = self.cache.client.mget([self._key(namespace) for namespace in missing])
+        except Exception as e:
+            logger.error(f"Failed to read cache generations: {e}")
+            return {namespace: 0 for namespace in namespaces}
+        fetched = {namespace: int(value or 0) for namespace, value in zip(missing, values)}
+        if use_local:
+            self._remember(fetched)
+        generations.update(fetched)
+        return generations
+
+    def _remember(self, generations: Dict[str, int]) -> None:
+        """写入进程内版本号，只前进不后退（广播与 MGET 结果可能乱序到达）"""
+        expires_at = time.monotonic() + self.local_ttl
+        with self._lock:
+            for namespace, generation in generations.items():
+                entry = self._local.get(namespace)
+                if entry is not None and entry[0] > generation:
+                    generation = entry[0]
+                self._local[namespace] = (generation, expires_at)
+
+    def on_message(self, message: Dict[str, Any]) -> None:
+        """处理其他进程广播的版本号递增；广播连接断开时清空进程内版本号"""
+        if message.get("clear"):
+            with self._lock:
+                self._local.clear()
+            return
+        generations = message.get("generations")
+        if generations and self.local_ttl > 0:
+            self._remember({namespace: int(generation) for namespace, generation in generations.items()})
+
+    def bump(self, namespaces: Iterable[str], collect: bool = True) -> Dict[str, int]:
+        """
+        原子递增命名空间版本（一次 pipeline），返回新版本
+        collect 为 False 时不安排后台清理（版本号只参与摘要、键中不带版本前缀的命名空间）
+        """
+        namespaces = list(dict.fromkeys(namespaces))
+        if not namespaces:
+            return {}
+        try:
+            self.cache._ensure_connection()
+            if not self.cache.client:
+                return {}
+            pipeline = self.cache.client.pipeline(transaction=False)
+            for namespace in namespaces:
+                pipeline.incr(self._key(namespace))
+            generations = dict(zip(namespaces, pipeline.execute()))
+        except Exception as e:
+            logger.error(f"Failed to bump cache generations {namespaces}: {e}")
+            return {}
+        if self.local_ttl > 0:
+            self._remember(generations)
+        invalidation_bus.publish({"generations": generations})
+        if collect:
+            stale_entry_collector.mark(namespaces)
+        return generations
+
+
+cache_generations = CacheGenerations()
+invalidation_bus.subscribe(cache_generations.on_message)
+
+
+class StaleEntryCollector:
+    """
+    旧版本缓存键的后台清理
+    版本递增后命名空间被标记为待清理，后台线程按 CACHE_GC_INTERVAL 用 SCAN MATCH <namespace>:v* 遍历，
+    分批 UNLINK 版本号小于当前版本的键；SCAN 每次只处理少量槽位，不会阻塞 Redis 上的其他请求
+    """
+
+    def __init__(self, generations: CacheGenerations = None, interval: int = CACHE_GC_INTERVAL):
+        self.generations = generations
+        self.interval = interval
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"runs": 0, "scanned": 0, "deleted": 0, "last_run_seconds": 0.0}
+
+    def mark(self, namespaces: Iterable[str]) -> None:
+        """标记需要清理的命名空间，按需启动后台线程"""
+        with self._lock:
+            self._pending.update(namespaces)
+        self.start()
+
+    def start(self) -> None:
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="cache-gc", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(f"Cache GC run failed: {e}")
+
+    def collect(self, namespaces: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        清理旧版本键；namespaces 为空时清理所有已标记的命名空间
+        返回本次扫描和删除的键数
+        """
+        if namespaces is None:
+            with self._lock:
+                namespaces, self._pending = list(self._pending), set()
+        namespaces = list(namespaces)
+        generations = (self.generations or cache_generations).current_many(namespaces)
+
+        start_time = time.time()
+        scanned = deleted = 0
+        for namespace in namespaces:
+            current = generations.get(namespace, 0)
+            batch: List[str] = []
+            for key in cache_service.scan_keys(f"{namespace}:v*", CACHE_GC_SCAN_COUNT):
+                scanned += 1
+                key = _text(key)
+                version = key_generation(namespace, key)
+                if version is None or version >= current:
+                    continue
+                batch.append(key)
+                if len(batch) >= CACHE_GC_BATCH_SIZE:
+                    deleted += cache_service.delete_many(batch)
+                    batch = []
+            deleted += cache_service.delete_many(batch)
+
+        elapsed = time.time() - start_time
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["scanned"] += scanned
+            self._stats["deleted"] += deleted
+            self._stats["last_run_seconds"] = round(elapsed, 4)
+        if deleted:
+            logger.info(f"Cache GC removed {deleted} stale entries from {len(namespaces)} namespaces in {elapsed:.3f}s")
+        return {"namespaces": namespaces, "scanned": scanned, "deleted": deleted, "elapsed": elapsed}
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "running": self._thread is not None and self._thread.is_alive(),
+                "pending": sorted(self._pending),
+                **self._stats,
+            }
+
+
+stale_entry_collector = StaleEntryCollector()
@@ -1,9 +1,30 @@
 """
 缓存管理器
 提供统一的缓存操作接口和缓存失效管理
+
+缓存键内嵌命名空间版本号（见 cache_generations），按事件失效时递增版本号，不扫描键空间
+读取顺序：进程内 LRU（L1，见 local_cache）-> Redis（L2）；L2 命中后回填 L1，
+写入和删除通过 pub/sub 通知其他进程清除各自的 L1 条目
+
+防止缓存击穿与过期雪崩：
+- 未命中时合并请求：进程内同一个键只有一个请求执行数据函数（single-flight），
+  跨进程通过分布式锁只让一个进程回源，其他进程轮询等待结果
+- 提前刷新：auto_refresh 类型的条目剩余时间低于 refresh_threshold 时由后台线程重新计算，
+  REFRESH_AHEAD 类型在仍被访问期间定期刷新，并在失效后立即重算，请求不必等待冷启动
+- 概率提前过期（XFetch）：按计算耗时和剩余时间随机让单个请求提前重算，
+  没有注册后台刷新的条目也不会在同一时刻集中过期
 """
+import hashlib
+import inspect
 import logging
-from typing import Any, Optional, List, Dict, Callable
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, List, Dict, Callable, Tuple
 from datetime import datetime, timedelta
 from app.core.timezone_config import now_beijing
 import asyncio
@@ -12,19 +33,290 @@ from functools import wraps
 from .redis_client import cache_service, DistributedLock
 from .cache_config import (
     get_cache_config, get_cache_key, get_invalidation_patterns,
-    CacheStrategy, CACHE_WARMUP_TASKS
+    CacheStrategy, CACHE_WARMUP_TASKS, CACHE_KEY_PREFIXES
 )
+from .cache_generations import cache_generations, stale_entry_collector, versioned_prefix
+from .local_cache import L1_CACHE_ENABLED, local_cache, invalidation_bus
+from .cache_serializers import available_codecs
 
 logger = logging.getLogger(__name__)
 
+# 后台刷新线程数
+CACHE_REFRESH_WORKERS = int(os.getenv('CACHE_REFRESH_WORKERS', '2'))
+
+# REFRESH_AHEAD 条目的检查间隔（秒），以及多久没被访问后停止刷新
+CACHE_REFRESH_INTERVAL = int(os.getenv('CACHE_REFRESH_INTERVAL', '5'))
+CACHE_REFRESH_IDLE = int(os.getenv('CACHE_REFRESH_IDLE', '600'))
+
+# 进程内最多登记的可刷新条目数
+CACHE_REFRESH_REGISTRY_SIZE = int(os.getenv('CACHE_REFRESH_REGISTRY_SIZE', '1024'))
+
+# 回源锁的过期时间（秒）和未拿到锁时等待其他进程结果的最长时间（秒）
+CACHE_LOAD_LOCK_TIMEOUT = int(os.getenv('CACHE_LOAD_LOCK_TIMEOUT', '30'))
+CACHE_LOAD_WAIT_TIMEOUT = float(os.getenv('CACHE_LOAD_WAIT_TIMEOUT', '5'))
+CACHE_LOAD_POLL_INTERVAL = 0.05
+
+# XFetch 系数，越大越倾向提前重算，0 表示关闭概率提前过期
+CACHE_EARLY_EXPIRY_BETA = float(os.getenv('CACHE_EARLY_EXPIRY_BETA', '1.0'))
+
+# 缓存条目外层包装：{META_KEY: {"expires_at": 过期时间戳, "delta": 计算耗时}, "value": 数据}
+META_KEY = "__cache_meta__"
+
+
+def _wrap(data: Any, ttl: int, compute_time: float) -> Dict[str, Any]:
+    return {META_KEY: {"expires_at": time.time() + ttl, "delta": round(compute_time, 4)}, "value": data}
+
+
+def _unwrap(entry: Any) -> Tuple[Any, Optional[Dict[str, float]]]:
+    """拆出数据和元数据，兼容没有包装的旧条目"""
+    if isinstance(entry, dict) and META_KEY in entry:
+        return entry.get("value"), entry[META_KEY]
+    return entry, None
+
+
+def _kwargs_key(kwargs: Dict[str, Any]) -> str:
+    return repr(sorted(kwargs.items()))
+
+
+class _Flight:
+    """进程内一次进行中的回源"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class RefreshTask:
+    """可在后台重新计算的缓存条目（版本号变化后仍指向同一逻辑条目）"""
+    
+    def __init__(self, cache_type: str, identifier: str, kwargs: Dict[str, Any],
+                 loader: Callable[[], Any], ttl: Optional[int] = None):
+        self.cache_type = cache_type
+        self.identifier = identifier
+        self.kwargs = kwargs
+        self.loader = loader
+        self.ttl = ttl
+        self.expires_at = 0.0
+        self.last_access = time.time()
+
+
+class CacheRefresher:
+    """
+    后台刷新
+    刷新任务在线程池中执行，与未命中回源共用进程内 single-flight 和分布式锁：
+    同一条目已在回源或其他进程正在刷新时直接跳过
+    """
+    
+    def __init__(self, manager: "CacheManager", workers: int = CACHE_REFRESH_WORKERS,
+                 interval: int = CACHE_REFRESH_INTERVAL):
+        self.manager = manager
+        self.workers = workers
+        self.interval = interval
+        self._tasks: "OrderedDict[Tuple[str, str, str], RefreshTask]" = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"scheduled": 0, "refreshed": 0, "skipped": 0, "failed": 0}
+    
+    def register(self, cache_type: str, identifier: str, kwargs: Dict[str, Any],
+                 loader: Callable[[], Any], ttl: Optional[int] = None) -> RefreshTask:
+        """登记（或更新）可刷新条目；loader 会在后台线程中执行，不能依赖请求内的资源"""
+        key = (cache_type, identifier, _kwargs_key(kwargs))
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = RefreshTask(cache_type, identifier, kwargs, loader, ttl)
+                self._tasks[key] = task
+                while len(self._tasks) > CACHE_REFRESH_REGISTRY_SIZE:
+                    self._tasks.popitem(last=False)
+            else:
+                task.loader = loader
+                task.ttl = ttl
+                task.last_access = time.time()
+                self._tasks.move_to_end(key)
+        if get_cache_config(cache_type).strategy == CacheStrategy.REFRESH_AHEAD:
+            self.start()
+        return task
+    
+    def lookup(self, cache_type: str, identifier: str, kwargs: Dict[str, Any]) -> Optional[RefreshTask]:
+        with self._lock:
+            task = self._tasks.get((cache_type, identifier, _kwargs_key(kwargs)))
+            if task is not None:
+                task.last_access = time.time()
+            return task
+    
+    def schedule(self, task: RefreshTask) -> bool:
+        """提交后台刷新，同一条目已在队列中时不重复提交"""
+        key = (task.cache_type, task.identifier, _kwargs_key(task.kwargs))
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cache-refresh")
+            self._stats["scheduled"] += 1
+        self._executor.submit(self._run, key, task)
+        return True
+    
+    def refresh_namespaces(self, namespaces) -> int:
+        """命名空间版本号递增后，立即重算其中仍被访问的 REFRESH_AHEAD 条目"""
+        namespaces = set(namespaces)
+        if not namespaces:
+            return 0
+        idle_before = time.time() - CACHE_REFRESH_IDLE
+        with self._lock:
+            tasks = [
+                task for task in self._tasks.values()
+                if get_cache_key(task.cache_type) in namespaces and task.last_access >= idle_before
+                and get_cache_config(task.cache_type).strategy == CacheStrategy.REFRESH_AHEAD
+            ]
+        return sum(1 for task in tasks if self.schedule(task))
+    
+    def _run(self, key, task: RefreshTask) -> None:
+        try:
+            refreshed = self.manager._refresh(task)
+            with self._lock:
+                self._stats["refreshed" if refreshed else "skipped"] += 1
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            logger.error(f"Background refresh failed for {task.cache_type}:{task.identifier}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+    
+    def start(self) -> None:
+        """启动 REFRESH_AHEAD 条目的定期检查线程（幂等）"""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._sweep_forever, name="cache-refresh-sweep", daemon=True)
+            self._thread.start()
+    
+    def _sweep_forever(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Cache refresh sweep failed: {e}")
+    
+    def sweep(self) -> int:
+        """检查 REFRESH_AHEAD 条目，剩余时间低于阈值的提交刷新，长时间未访问的移出登记"""
+        now = time.time()
+        due = []
+        with self._lock:
+            for key, task in list(self._tasks.items()):
+                if task.last_access < now - CACHE_REFRESH_IDLE:
+                    del self._tasks[key]
+                    continue
+                config = get_cache_config(task.cache_type)
+                if config.strategy != CacheStrategy.REFRESH_AHEAD:
+                    continue
+                ttl = task.ttl or config.ttl
+                if task.expires_at - now <= ttl * config.refresh_threshold:
+                    due.append(task)
+        return sum(1 for task in due if self.schedule(task))
+    
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "registered": len(self._tasks),
+                "pending": len(self._pending),
+                "sweeping": self._thread is not None and self._thread.is_alive(),
+                **self._stats,
+            }
+
 
 class CacheManager:
     """缓存管理器"""
     
     def __init__(self):
         self.cache = cache_service
+        self.local = local_cache
         self._warmup_tasks = {}
-        self._refresh_tasks = {}
+        self.refresher = CacheRefresher(self)
+        # cache_type -> {"l1_hits", "l2_hits", "misses"}
+        self._tier_stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+        # 进程内进行中的回源：cache_key -> _Flight / asyncio.Future
+        self._inflight: Dict[str, _Flight] = {}
+        self._inflight_async: Dict[Tuple[int, str], "asyncio.Future"] = {}
+        self._flight_lock = threading.Lock()
+    
+    def _use_local(self, config) -> bool:
+        """该缓存类型是否使用进程内缓存；失效广播不在线时不使用，避免读到其他进程已失效的数据"""
+        if not L1_CACHE_ENABLED or config.get_local_ttl() <= 0:
+            return False
+        invalidation_bus.start()
+        return invalidation_bus.listening
+    
+    def _record(self, cache_type: str, outcome: str) -> None:
+        with self._stats_lock:
+            stats = self._tier_stats.setdefault(cache_type, {"l1_hits": 0, "l2_hits": 0, "misses": 0})
+            stats[outcome] += 1
+    
+    def _lookup(self, cache_type: str, cache_key: str, config) -> Optional[Tuple[Any, Optional[Dict[str, float]]]]:
+        """依次查 L1、L2，命中时返回 (数据, 元数据)，未命中返回 None"""
+        use_local = self._use_local(config)
+        
+        if use_local:
+            payload = self.local.get(cache_key)
+            if payload is not None:
+                self._record(cache_type, "l1_hits")
+                return _unwrap(self.cache.deserialize(payload, config.serialize))
+        
+        payload = self.cache.get_raw(cache_key)
+        if payload is not None:
+            value, meta = _unwrap(self.cache.deserialize(payload, config.serialize))
+            if value is not None:
+                logger.debug(f"Cache hit: {cache_key}")
+                self._record(cache_type, "l2_hits")
+                if use_local:
+                    self.local.set(cache_key, payload, config.get_local_ttl(), len(payload))
+                return value, meta
+        
+        logger.debug(f"Cache miss: {cache_key}")
+        self._record(cache_type, "misses")
+        return None
+    
+    def _store(self, cache_type: str, cache_key: str, config, data: Any,
+               ttl: Optional[int] = None, compute_time: float = 0.0) -> bool:
+        """序列化（按缓存类型的序列化和压缩方式）一次后写入 L2 和 L1"""
+        ttl = ttl or config.ttl
+        payload = self.cache.serialize(_wrap(data, ttl, compute_time), config.serialize, config.compression)
+        success = self.cache.set_raw(cache_key, payload, ttl)
+        
+        if success:
+            logger.debug(f"Cache set: {cache_key} (TTL: {ttl}s)")
+            if self._use_local(config):
+                # 其他进程可能持有该键的旧值
+                invalidation_bus.publish({"keys": [cache_key]})
+                self.local.set(cache_key, payload, min(config.get_local_ttl(), ttl), len(payload))
+        
+        return success
+    
+    @staticmethod
+    def _should_refresh(config, meta: Optional[Dict[str, float]], ttl: Optional[int] = None) -> bool:
+        """
+        是否需要提前重算：
+        auto_refresh 类型剩余时间低于 refresh_threshold；
+        或按 XFetch 判定提前过期（now - delta * beta * ln(rand) >= expires_at，计算越慢、越接近过期越容易触发）
+        """
+        if not meta:
+            return False
+        now = time.time()
+        expires_at = meta.get("expires_at", 0)
+        if config.auto_refresh and expires_at - now <= (ttl or config.ttl) * config.refresh_threshold:
+            return True
+        delta = meta.get("delta", 0)
+        if delta > 0 and CACHE_EARLY_EXPIRY_BETA > 0:
+            return now - delta * CACHE_EARLY_EXPIRY_BETA * math.log(1.0 - random.random()) >= expires_at
+        return False
     
     def get(self, cache_type: str, identifier: str = "", **kwargs) -> Optional[Any]:
         """
@@ -39,19 +331,19 @@ class CacheManager:
             config = get_cache_config(cache_type)
             cache_key = self._generate_cache_key(cache_type, identifier, **kwargs)
             
-            result = self.cache.get(cache_key, config.serialize)
+            hit = self._lookup(cache_type, cache_key, config)
+            if hit is None:
+                return None
             
-            if result is not None:
-                logger.debug(f"Cache hit: {cache_key}")
-                
-                # 检查是否需要提前刷新
-                if config.auto_refresh:
-                    self._check_refresh_needed(cache_key, config)
-                
-                return result
+            value, meta = hit
+            # 登记过数据函数的条目在后台提前刷新
+            task = self.refresher.lookup(cache_type, identifier, kwargs)
+            if task is not None and meta:
+                task.expires_at = meta.get("expires_at", 0)
+                if self._should_refresh(config, meta, task.ttl):
+                    self.refresher.schedule(task)
             
-            logger.debug(f"Cache miss: {cache_key}")
-            return None
+            return value
             
         except Exception as e:
             logger.error(f"Failed to get cache {cache_type}:{identifier}: {e}")
@@ -70,13 +362,7 @@ class CacheManager:
         try:
             config = get_cache_config(cache_type)
             cache_key = self._generate_cache_key(cache_type, identifier, **kwargs)
-            
-            success = self.cache.set(cache_key, data, config.ttl, config.serialize)
-            
-            if success:
-                logger.debug(f"Cache set: {cache_key} (TTL: {config.ttl}s)")
-            
-            return success
+            return self._store(cache_type, cache_key, config, data)
             
         except Exception as e:
             logger.error(f"Failed to set cache {cache_type}:{identifier}: {e}")
@@ -87,6 +373,8 @@ class CacheManager:
         try:
             cache_key = self._generate_cache_key(cache_type, identifier, **kwargs)
             success = self.cache.delete(cache_key)
+            self.local.delete(cache_key)
+            invalidation_bus.publish({"keys": [cache_key]})
             
             if success:
                 logger.debug(f"Cache deleted: {cache_key}")
@@ -104,21 +392,44 @@ class CacheManager:
         Args:
             event_type: 事件类型
             **context: 上下文信息，用于生成具体的缓存键
+        
+        整个命名空间（如 ip:list:*）失效时递增其版本号，不扫描键空间；
+        返回失效的命名空间数与直接删除的键数之和
         """
         try:
             patterns = get_invalidation_patterns(event_type)
+            namespaces = []
+            local_prefixes = []
             total_deleted = 0
             
             for pattern in patterns:
                 # 替换模式中的占位符
                 actual_pattern = self._resolve_pattern(pattern, **context)
+                namespace, rest = self._split_pattern(actual_pattern)
+                if namespace is not None and rest in ("", "*"):
+                    namespaces.append(namespace)
+                    continue
+                if namespace is not None:
+                    # 命名空间内的部分键（如 ip:detail:{ip_id}）：只在当前版本中查找
+                    current = cache_generations.current(namespace)
+                    actual_pattern = f"{versioned_prefix(namespace, current)}:{rest}"
                 deleted_count = self.cache.clear_pattern(actual_pattern)
                 total_deleted += deleted_count
+                local_prefixes.append(actual_pattern.split('*', 1)[0])
                 
                 logger.info(f"Invalidated {deleted_count} cache entries for pattern: {actual_pattern}")
             
-            logger.info(f"Total invalidated cache entries: {total_deleted}")
-            return total_deleted
+            if local_prefixes:
+                for prefix in local_prefixes:
+                    self.local.delete_prefix(prefix)
+                invalidation_bus.publish({"prefixes": local_prefixes})
+            # 版本号递增由 cache_generations 广播，旧版本的 L1 条目不会再被读到
+            bumped = cache_generations.bump(namespaces)
+            if bumped:
+                logger.info(f"Bumped cache generations for {event_type}: {bumped}")
+                # 仍在使用的 REFRESH_AHEAD 条目立即按新版本重算，后续请求不必等待冷启动
+                self.refresher.refresh_namespaces(bumped)
+            return len(bumped) + total_deleted
             
         except Exception as e:
             logger.error(f"Failed to invalidate cache for event {event_type}: {e}")
@@ -133,54 +444,256 @@ class CacheManager:
             data_func: 数据获取函数
             identifier: 标识符
             **kwargs: 额外参数
+        
+        并发未命中只有一个请求执行 data_func；auto_refresh 类型的 data_func 会登记到后台刷新，
+        在后台线程中重新执行，不能依赖请求内的资源（如请求的数据库会话）
         """
-        # 先尝试从缓存获取
-        cached_data = self.get(cache_type, identifier, **kwargs)
-        if cached_data is not None:
-            return cached_data
-        
-        # 使用分布式锁防止缓存击穿
-        lock_key = f"lock:{cache_type}:{identifier}"
-        with DistributedLock(lock_key, timeout=30):
-            # 再次检查缓存（双重检查）
-            cached_data = self.get(cache_type, identifier, **kwargs)
-            if cached_data is not None:
-                return cached_data
-            
-            # 执行数据获取函数
-            try:
-                data = data_func(**kwargs)
-                if data is not None:
-                    self.set(cache_type, data, identifier, **kwargs)
-                return data
-            except Exception as e:
-                logger.error(f"Failed to execute data function for {cache_type}: {e}")
-                raise
+        config = get_cache_config(cache_type)
+        return self._get_or_load(
+            cache_type, identifier, kwargs, lambda: data_func(**kwargs), background=config.auto_refresh
+        )
     
     async def get_or_set_async(self, cache_type: str, data_func: Callable, identifier: str = "", **kwargs) -> Any:
         """异步版本的get_or_set"""
-        # 先尝试从缓存获取
-        cached_data = self.get(cache_type, identifier, **kwargs)
-        if cached_data is not None:
-            return cached_data
-        
-        # 使用分布式锁防止缓存击穿
-        lock_key = f"lock:{cache_type}:{identifier}"
-        with DistributedLock(lock_key, timeout=30):
-            # 再次检查缓存
-            cached_data = self.get(cache_type, identifier, **kwargs)
+        config = get_cache_config(cache_type)
+        return await self._get_or_load_async(
+            cache_type, identifier, kwargs, lambda: data_func(**kwargs), background=config.auto_refresh
+        )
+    
+    def _get_cached(self, cache_type: str, identifier: str, kwargs: Dict[str, Any], config):
+        """读取缓存，返回 (cache_key, 命中结果)；缓存异常按未命中处理"""
+        try:
+            cache_key = self._generate_cache_key(cache_type, identifier, **kwargs)
+        except Exception as e:
+            logger.error(f"Failed to generate cache key {cache_type}:{identifier}: {e}")
+            return None, None
+        try:
+            return cache_key, self._lookup(cache_type, cache_key, config)
+        except Exception as e:
+            logger.error(f"Failed to get cache {cache_key}: {e}")
+            return cache_key, None
+    
+    def _peek(self, cache_key: str, config) -> Optional[Any]:
+        """只读 L2，不计入命中统计（用于回源前的双重检查和等待其他进程的结果）"""
+        payload = self.cache.get_raw(cache_key)
+        if payload is None:
+            return None
+        return _unwrap(self.cache.deserialize(payload, config.serialize))[0]
+    
+    def _get_or_load(self, cache_type: str, identifier: str, kwargs: Dict[str, Any],
+                     loader: Callable[[], Any], ttl: Optional[int] = None, background: bool = False) -> Any:
+        config = get_cache_config(cache_type)
+        task = self.refresher.register(cache_type, identifier, kwargs, loader, ttl) if background else None
+        cache_key, hit = self._get_cached(cache_type, identifier, kwargs, config)
+        if cache_key is None:
+            return loader()
+        
+        if hit is not None:
+            value, meta = hit
+            if task is not None and meta:
+                task.expires_at = meta.get("expires_at", 0)
+            if not self._should_refresh(config, meta, ttl):
+                return value
+            if task is not None:
+                self.refresher.schedule(task)
+                return value
+            # 没有后台刷新时由单个请求提前重算，其他并发请求继续使用旧值
+            refreshed = self._load(cache_type, cache_key, config, loader, ttl, refresh=True)
+            return value if refreshed is None else refreshed
+        
+        return self._load(cache_type, cache_key, config, loader, ttl)
+    
+    def _load(self, cache_type: str, cache_key: str, config, loader: Callable[[], Any],
+              ttl: Optional[int] = None, refresh: bool = False) -> Any:
+        """
+        进程内 single-flight 回源
+        refresh 为 True 时（提前刷新）如果已有请求在回源或其他进程持有锁则跳过，返回 None
+        """
+        with self._flight_lock:
+            flight = self._inflight.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[cache_key] = _Flight()
+        
+        if not leader:
+            if refresh:
+                return None
+            if flight.done.wait(CACHE_LOAD_LOCK_TIMEOUT):
+                if flight.error is not None:
+                    raise flight.error
+                if flight.result is not None:
+                    return flight.result
+            # 等待超时或领头的刷新被跳过，自行回源
+            return self._load_locked(cache_type, cache_key, config, loader, ttl)
+        
+        try:
+            flight.result = self._load_locked(cache_type, cache_key, config, loader, ttl, refresh)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.done.set()
+            with self._flight_lock:
+                self._inflight.pop(cache_key, None)
+    
+    def _load_locked(self, cache_type: str, cache_key: str, config, loader: Callable[[], Any],
+                     ttl: Optional[int] = None, refresh: bool = False) -> Any:
+        """跨进程回源：拿到分布式锁的进程执行数据函数，其他进程等待其写入结果"""
+        self.cache._ensure_connection()
+        if not self.cache.client:
+            # Redis 不可用，直接回源
+            return self._compute(cache_type, cache_key, config, loader, ttl)
+        
+        lock = DistributedLock(f"cache:{cache_key}", timeout=CACHE_LOAD_LOCK_TIMEOUT)
+        if lock.acquire():
+            try:
+                if not refresh:
+                    # 双重检查：其他进程可能刚写入
+                    cached_data = self._peek(cache_key, config)
+                    if cached_data is not None:
+                        return cached_data
+                return self._compute(cache_type, cache_key, config, loader, ttl)
+            finally:
+                lock.release()
+        
+        if refresh:
+            return None
+        
+        deadline = time.monotonic() + CACHE_LOAD_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(CACHE_LOAD_POLL_INTERVAL)
+            cached_data = self._peek(cache_key, config)
             if cached_data is not None:
                 return cached_data
-            
-            # 执行异步数据获取函数
+        logger.warning(f"Timed out waiting for {cache_key} to be loaded by another process")
+        return self._compute(cache_type, cache_key, config, loader, ttl)
+    
+    def _compute(self, cache_type: str, cache_key: str, config, loader: Callable[[], Any],
+                 ttl: Optional[int] = None) -> Any:
+        start_time = time.perf_counter()
+        try:
+            data = loader()
+        except Exception as e:
+            logger.error(f"Failed to execute data function for {cache_type}: {e}")
+            raise
+        self._store_computed(cache_type, cache_key, config, data, ttl, time.perf_counter() - start_time)
+        return data
+    
+    def _store_computed(self, cache_type: str, cache_key: str, config, data: Any,
+                        ttl: Optional[int], compute_time: float) -> None:
+        if data is None:
+            return
+        try:
+            self._store(cache_type, cache_key, config, data, ttl, compute_time)
+        except Exception as e:
+            logger.error(f"Failed to set cache {cache_key}: {e}")
+    
+    async def _get_or_load_async(self, cache_type: str, identifier: str, kwargs: Dict[str, Any],
+                                 loader: Callable[[], Any], ttl: Optional[int] = None,
+                                 background: bool = False) -> Any:
+        config = get_cache_config(cache_type)
+        task = self.refresher.register(cache_type, identifier, kwargs, loader, ttl) if background else None
+        cache_key, hit = self._get_cached(cache_type, identifier, kwargs, config)
+        if cache_key is None:
+            return await loader()
+        
+        if hit is not None:
+            value, meta = hit
+            if task is not None and meta:
+                task.expires_at = meta.get("expires_at", 0)
+            if not self._should_refresh(config, meta, ttl):
+                return value
+            if task is not None:
+                self.refresher.schedule(task)
+                return value
+            refreshed = await self._load_async(cache_type, cache_key, config, loader, ttl, refresh=True)
+            return value if refreshed is None else refreshed
+        
+        return await self._load_async(cache_type, cache_key, config, loader, ttl)
+    
+    async def _load_async(self, cache_type: str, cache_key: str, config, loader: Callable[[], Any],
+                          ttl: Optional[int] = None, refresh: bool = False) -> Any:
+        """异步版本的 _load，进程内合并使用事件循环上的 Future"""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), cache_key)
+        future = self._inflight_async.get(flight_key)
+        if future is not None:
+            if refresh:
+                return None
+            result = await asyncio.shield(future)
+            if result is not None:
+                return result
+            return await self._load_locked_async(cache_type, cache_key, config, loader, ttl)
+        
+        future = self._inflight_async[flight_key] = loop.create_future()
+        try:
+            result = await self._load_locked_async(cache_type, cache_key, config, loader, ttl, refresh)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight_async.pop(flight_key, None)
+    
+    async def _load_locked_async(self, cache_type: str, cache_key: str, config, loader: Callable[[], Any],
+                                 ttl: Optional[int] = None, refresh: bool = False) -> Any:
+        self.cache._ensure_connection()
+        if not self.cache.client:
+            return await self._compute_async(cache_type, cache_key, config, loader, ttl)
+        
+        lock = DistributedLock(f"cache:{cache_key}", timeout=CACHE_LOAD_LOCK_TIMEOUT)
+        if lock.acquire():
             try:
-                data = await data_func(**kwargs)
-                if data is not None:
-                    self.set(cache_type, data, identifier, **kwargs)
-                return data
-            except Exception as e:
-                logger.error(f"Failed to execute async data function for {cache_type}: {e}")
-                raise
+                if not refresh:
+                    cached_data = self._peek(cache_key, config)
+                    if cached_data is not None:
+                        return cached_data
+                return await self._compute_async(cache_type, cache_key, config, loader, ttl)
+            finally:
+                lock.release()
+        
+        if refresh:
+            return None
+        
+        deadline = time.monotonic() + CACHE_LOAD_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(CACHE_LOAD_POLL_INTERVAL)
+            cached_data = self._peek(cache_key, config)
+            if cached_data is not None:
+                return cached_data
+        logger.warning(f"Timed out waiting for {cache_key} to be loaded by another process")
+        return await self._compute_async(cache_type, cache_key, config, loader, ttl)
+    
+    async def _compute_async(self, cache_type: str, cache_key: str, config, loader: Callable[[], Any],
+                             ttl: Optional[int] = None) -> Any:
+        start_time = time.perf_counter()
+        try:
+            data = await loader()
+        except Exception as e:
+            logger.error(f"Failed to execute async data function for {cache_type}: {e}")
+            raise
+        self._store_computed(cache_type, cache_key, config, data, ttl, time.perf_counter() - start_time)
+        return data
+    
+    def _refresh(self, task: RefreshTask) -> bool:
+        """后台线程中重算条目（协程数据函数在独立事件循环中执行），已有回源在进行时跳过"""
+        config = get_cache_config(task.cache_type)
+        cache_key = self._generate_cache_key(task.cache_type, task.identifier, **task.kwargs)
+        
+        def run():
+            result = task.loader()
+            return asyncio.run(result) if inspect.iscoroutine(result) else result
+        
+        result = self._load(task.cache_type, cache_key, config, run, task.ttl, refresh=True)
+        if result is None:
+            return False
+        task.expires_at = time.time() + (task.ttl or config.ttl)
+        logger.debug(f"Refreshed cache key: {cache_key}")
+        return True
     
     def batch_get(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -267,6 +780,11 @@ class CacheManager:
             return {
                 'total_keys': len(all_keys),
                 'by_prefix': stats,
+                'generations': cache_generations.current_many(sorted(set(CACHE_KEY_PREFIXES.values()))),
+                'gc': stale_entry_collector.status(),
+                'tiers': self.get_tier_stats(),
+                'refresh': self.refresher.status(),
+                'serialization': available_codecs(),
                 'timestamp': now_beijing().isoformat()
             }
             
@@ -274,35 +792,84 @@ class CacheManager:
             logger.error(f"Failed to get cache stats: {e}")
             return {'error': str(e)}
     
+    def get_tier_stats(self) -> Dict[str, Any]:
+        """各级缓存命中率：L1（进程内）、L2（Redis），以及按缓存类型的明细"""
+        def ratio(hits: int, lookups: int) -> Optional[float]:
+            return round(hits / lookups, 4) if lookups else None
+        
+        with self._stats_lock:
+            by_type = {cache_type: dict(stats) for cache_type, stats in self._tier_stats.items()}
+        
+        l1_hits = sum(stats["l1_hits"] for stats in by_type.values())
+        l2_hits = sum(stats["l2_hits"] for stats in by_type.values())
+        misses = sum(stats["misses"] for stats in by_type.values())
+        for stats in by_type.values():
+            lookups = stats["l1_hits"] + stats["l2_hits"] + stats["misses"]
+            stats["l1_hit_ratio"] = ratio(stats["l1_hits"], lookups)
+            stats["hit_ratio"] = ratio(stats["l1_hits"] + stats["l2_hits"], lookups)
+        
+        return {
+            'l1': {
+                'enabled': L1_CACHE_ENABLED,
+                'hits': l1_hits,
+                'hit_ratio': ratio(l1_hits, l1_hits + l2_hits + misses),
+                **{key: value for key, value in self.local.stats().items() if key not in ('hits', 'misses', 'hit_ratio')},
+            },
+            'l2': {
+                'hits': l2_hits,
+                'misses': misses,
+                # L2 只处理 L1 未命中的请求
+                'hit_ratio': ratio(l2_hits, l2_hits + misses),
+            },
+            'invalidation_bus': invalidation_bus.stats(),
+            'by_type': by_type,
+        }
+    
     def clear_all(self, confirm: bool = False) -> int:
         """清除所有缓存（危险操作）"""
         if not confirm:
             raise ValueError("Must confirm to clear all cache")
         
         try:
-            keys = self.cache.keys("*")
-            if keys:
-                deleted = self.cache.client.delete(*keys)
-                logger.warning(f"Cleared all cache: {deleted} keys deleted")
-                return deleted
-            return 0
+            deleted = self.cache.clear_pattern("*")
+            self.local.clear()
+            cache_generations.on_message({"clear": True})
+            invalidation_bus.publish({"clear": True})
+            logger.warning(f"Cleared all cache: {deleted} keys deleted")
+            return deleted
             
         except Exception as e:
             logger.error(f"Failed to clear all cache: {e}")
             return 0
     
     def _generate_cache_key(self, cache_type: str, identifier: str = "", **kwargs) -> str:
-        """生成缓存键"""
-        base_key = get_cache_key(cache_type, identifier)
+        """生成缓存键：<命名空间>:v<版本>[:<标识符>][:<参数摘要>]"""
+        namespace = get_cache_key(cache_type)
+        base_key = versioned_prefix(namespace, cache_generations.current(namespace))
+        if identifier:
+            base_key = f"{base_key}:{identifier}"
         
-        # 如果有额外参数，添加到键中
+        # 如果有额外参数，添加到键中（使用稳定摘要，各进程生成的键一致）
         if kwargs:
             params = sorted(kwargs.items())
             param_str = "_".join([f"{k}={v}" for k, v in params])
-            return f"{base_key}:{hash(param_str)}"
+            return f"{base_key}:{hashlib.md5(param_str.encode()).hexdigest()[:16]}"
         
         return base_key
     
+    @staticmethod
+    def _split_pattern(pattern: str):
+        """
+        将失效模式拆分为 (命名空间, 剩余部分)，如 ip:list:* -> (ip:list, *)
+        不属于任何已知命名空间时返回 (None, pattern)
+        """
+        for namespace in sorted(set(CACHE_KEY_PREFIXES.values()), key=len, reverse=True):
+            if pattern == namespace:
+                return namespace, ""
+            if pattern.startswith(f"{namespace}:"):
+                return namespace, pattern[len(namespace) + 1:]
+        return None, pattern
+    
     def _resolve_pattern(self, pattern: str, **context) -> str:
         """解析缓存模式中的占位符"""
         resolved_pattern = pattern
@@ -314,25 +881,6 @@ class CacheManager:
                 resolved_pattern = resolved_pattern.replace(placeholder, str(value))
         
         return resolved_pattern
-    
-    def _check_refresh_needed(self, cache_key: str, config):
-        """检查是否需要提前刷新缓存"""
-        try:
-            ttl = self.cache.ttl(cache_key)
-            if ttl > 0:
-                remaining_ratio = ttl / config.ttl
-                if remaining_ratio <= config.refresh_threshold:
-                    # 需要刷新，添加到刷新任务队列
-                    self._schedule_refresh(cache_key, config)
-        except Exception as e:
-            logger.error(f"Failed to check refresh for {cache_key}: {e}")
-    
-    def _schedule_refresh(self, cache_key: str, config):
-        """调度缓存刷新任务"""
-        # 这里可以实现异步刷新逻辑
-        # 例如添加到任务队列或使用后台任务
-        logger.info(f"Scheduled refresh for cache key: {cache_key}")
-        # TODO: 实现实际的刷新逻辑
 
 
 # 全局缓存管理器实例
@@ -347,6 +895,9 @@ def cached(cache_type: str, identifier_func: Optional[Callable] = None, ttl: Opt
         cache_type: 缓存类型
         identifier_func: 标识符生成函数
         ttl: 自定义TTL（覆盖配置中的TTL）
+    
+    并发未命中合并为一次调用；被装饰的方法通常依赖请求内的数据库会话，不登记后台刷新，
+    临近过期时按概率由单个请求提前重算
     """
     def decorator(func):
         @wraps(func)
@@ -357,27 +908,9 @@ def cached(cache_type: str, identifier_func: Optional[Callable] = None, ttl: Opt
             else:
                 identifier = hash(str(args) + str(sorted(kwargs.items())))
             
-            # 尝试从缓存获取
-            cached_result = cache_manager.get(cache_type, str(identifier))
-            if cached_result is not None:
-                return cached_result
-            
-            # 执行函数
-            result = func(*args, **kwargs)
-            
-            # 缓存结果
-            if result is not None:
-                if ttl:
-                    # 使用自定义TTL
-                    config = get_cache_config(cache_type)
-                    original_ttl = config.ttl
-                    config.ttl = ttl
-                    cache_manager.set(cache_type, result, str(identifier))
-                    config.ttl = original_ttl  # 恢复原始TTL
-                else:
-                    cache_manager.set(cache_type, result, str(identifier))
-            
-            return result
+            return cache_manager._get_or_load(
+                cache_type, str(identifier), {}, lambda: func(*args, **kwargs), ttl=ttl
+            )
         return wrapper
     return decorator
 
@@ -393,27 +926,9 @@ def cached_async(cache_type: str, identifier_func: Optional[Callable] = None, tt
             else:
                 identifier = hash(str(args) + str(sorted(kwargs.items())))
             
-            # 尝试从缓存获取
-            cached_result = cache_manager.get(cache_type, str(identifier))
-            if cached_result is not None:
-                return cached_result
-            
-            # 执行异步函数
-            result = await func(*args, **kwargs)
-            
-            # 缓存结果
-            if result is not None:
-                if ttl:
-                    # 使用自定义TTL
-                    config = get_cache_config(cache_type)
-                    original_ttl = config.ttl
-                    config.ttl = ttl
-                    cache_manager.set(cache_type, result, str(identifier))
-                    config.ttl = original_ttl
-                else:
-                    cache_manager.set(cache_type, result, str(identifier))
-            
-            return result
+            return await cache_manager._get_or_load_async(
+                cache_type, str(identifier), {}, lambda: func(*args, **kwargs), ttl=ttl
+            )
         return wrapper
     return decorator
 
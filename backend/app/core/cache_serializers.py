@@ -0,0 +1,195 @@
+"""
+缓存序列化与压缩
+CACHE_CONFIGS 中每种缓存类型可选择序列化方式（serialize）和压缩方式（compression）：
+
+- 序列化：json、pickle（原有），orjson、msgpack（二进制，需安装对应库）
+- 压缩：zlib（标准库），zstd（zstandard）、lz4（lz4.frame），序列化结果超过
+  CACHE_COMPRESS_THRESHOLD 字节时才压缩
+
+可选库未安装时按 FALLBACKS 降级（如 msgpack -> orjson -> json、zstd -> lz4 -> zlib），不影响启动。
+二进制格式和压缩后的内容带 4 字节帧头（MAGIC + 序列化方式 + 压缩方式），读取时按帧头解码，
+与配置无关；未压缩的 json/pickle 仍按原格式存储，已有缓存条目和直接使用 CacheService 的代码不受影响。
+Redis 连接池未开启 decode_responses，读到的是原始字节。
+"""
+import json
+import os
+import pickle
+import zlib
+import logging
+from functools import lru_cache
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# 超过该大小（字节）的序列化结果才压缩
+CACHE_COMPRESS_THRESHOLD = int(os.getenv('CACHE_COMPRESS_THRESHOLD', '1024'))
+
+# 帧头：MAGIC + 序列化方式ID + 压缩方式ID；json 文本和 pickle（0x80 开头）都不会以 0x00 开头
+MAGIC = b'\x00C'
+HEADER_SIZE = len(MAGIC) + 2
+
+Payload = Union[str, bytes]
+
+
+class Serializer(NamedTuple):
+    id: int
+    dumps: Callable[[Any], Payload]
+    loads: Callable[[Payload], Any]
+
+
+class Compressor(NamedTuple):
+    id: int
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    # 与 json.dumps(default=str) 保持一致：datetime 等交给 str()，非字符串键转为字符串
+    return orjson.dumps(value, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+def _msgpack_dumps(value: Any) -> bytes:
+    return msgpack.packb(value, default=str, use_bin_type=True)
+
+
+def _msgpack_loads(payload: bytes) -> Any:
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+SERIALIZERS: Dict[str, Serializer] = {
+    'json': Serializer(1, lambda value: json.dumps(value, default=str), json.loads),
+    'pickle': Serializer(2, pickle.dumps, pickle.loads),
+}
+if orjson is not None:
+    SERIALIZERS['orjson'] = Serializer(3, _orjson_dumps, orjson.loads)
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = Serializer(4, _msgpack_dumps, _msgpack_loads)
+
+COMPRESSORS: Dict[str, Compressor] = {
+    'zlib': Compressor(1, lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = Compressor(
+        2,
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+if lz4_frame is not None:
+    COMPRESSORS['lz4'] = Compressor(3, lz4_frame.compress, lz4_frame.decompress)
+
+# 可选库未安装时的降级顺序
+FALLBACKS = {
+    'msgpack': ['orjson', 'json'],
+    'orjson': ['json'],
+    'zstd': ['lz4', 'zlib'],
+    'lz4': ['zlib'],
+}
+
+_SERIALIZERS_BY_ID = {serializer.id: serializer for serializer in SERIALIZERS.values()}
+_COMPRESSORS_BY_ID = {compressor.id: compressor for compressor in COMPRESSORS.values()}
+
+# 帧头中记录的ID（包括本进程未安装的实现），用于给出明确的错误信息
+_SERIALIZER_NAMES = {1: 'json', 2: 'pickle', 3: 'orjson', 4: 'msgpack'}
+_COMPRESSOR_NAMES = {1: 'zlib', 2: 'zstd', 3: 'lz4'}
+
+
+def _resolve(name: str, available: Dict[str, Any], kind: str) -> Optional[str]:
+    if name in available:
+        return name
+    for fallback in FALLBACKS.get(name, []):
+        if fallback in available:
+            logger.warning(f"Cache {kind} '{name}' is not installed, falling back to '{fallback}'")
+            return fallback
+    logger.warning(f"Unknown cache {kind} '{name}'")
+    return None
+
+
+def _to_bytes(payload: Payload) -> bytes:
+    return payload.encode('utf-8') if isinstance(payload, str) else payload
+
+
+class CacheCodec:
+    """一种缓存类型的序列化 + 压缩组合"""
+
+    def __init__(self, serialize: str = 'json', compression: Optional[str] = None,
+                 threshold: int = CACHE_COMPRESS_THRESHOLD):
+        self.requested = serialize
+        # 未知的序列化方式沿用原有行为：写入 str(value)，读取原样返回
+        self.serializer_name = _resolve(serialize, SERIALIZERS, 'serializer')
+        self.serializer = SERIALIZERS.get(self.serializer_name)
+        self.compression = _resolve(compression, COMPRESSORS, 'compression') if compression else None
+        self.compressor = COMPRESSORS.get(self.compression) if self.compression else None
+        self.threshold = threshold
+
+    @property
+    def name(self) -> str:
+        if self.serializer is None:
+            return 'str'
+        return f"{self.serializer_name}+{self.compression}" if self.compressor else self.serializer_name
+
+    def dumps(self, value: Any) -> Payload:
+        if self.serializer is None:
+            return str(value)
+        payload = self.serializer.dumps(value)
+        compressor = self.compressor if self.compressor and len(payload) > self.threshold else None
+        if compressor is None and self.serializer_name in ('json', 'pickle'):
+            return payload
+        body = compressor.compress(_to_bytes(payload)) if compressor else _to_bytes(payload)
+        return MAGIC + bytes((self.serializer.id, compressor.id if compressor else 0)) + body
+
+    def loads(self, payload: Payload) -> Any:
+        if isinstance(payload, bytes) and payload[:len(MAGIC)] == MAGIC:
+            return decode_frame(payload)
+        if self.serializer is None:
+            return payload
+        # 未带帧头的是 json 文本或 pickle（包括启用二进制序列化之前写入的条目）
+        if self.serializer_name == 'pickle':
+            return pickle.loads(payload)
+        return json.loads(payload)
+
+
+def decode_frame(payload: bytes) -> Any:
+    """按帧头解码"""
+    serializer_id, compressor_id = payload[len(MAGIC)], payload[len(MAGIC) + 1]
+    body = payload[HEADER_SIZE:]
+    if compressor_id:
+        compressor = _COMPRESSORS_BY_ID.get(compressor_id)
+        if compressor is None:
+            raise ValueError(f"Cache payload compressed with unavailable '{_COMPRESSOR_NAMES.get(compressor_id, compressor_id)}'")
+        body = compressor.decompress(body)
+    serializer = _SERIALIZERS_BY_ID.get(serializer_id)
+    if serializer is None:
+        raise ValueError(f"Cache payload serialized with unavailable '{_SERIALIZER_NAMES.get(serializer_id, serializer_id)}'")
+    return serializer.loads(body)
+
+
+@lru_cache(maxsize=64)
+def get_codec(serialize: str = 'json', compression: Optional[str] = None,
+              threshold: int = CACHE_COMPRESS_THRESHOLD) -> CacheCodec:
+    """获取（并复用）编解码器"""
+    return CacheCodec(serialize, compression, threshold)
+
+
+def available_codecs() -> Dict[str, list]:
+    """本进程可用的序列化和压缩方式"""
+    return {"serializers": sorted(SERIALIZERS), "compressors": sorted(COMPRESSORS)}
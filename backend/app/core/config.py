@@ -34,6 +34,12 @@ class Settings(BaseSettings):
     DEFAULT_PAGE_SIZE: int = 50
     MAX_PAGE_SIZE: int = 1000
     
+    # 新建网段的默认IP存储模式: dense（预生成全部地址）/ sparse（只存已占用地址）
+    SUBNET_STORAGE_MODE: str = "dense"
+    
+    # 密集存储模式下单个网段允许生成的最大地址数，更大的网段只能使用 sparse 模式
+    IP_GENERATION_MAX_ADDRESSES: int = 1 << 20
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
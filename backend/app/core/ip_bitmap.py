@@ -0,0 +1,514 @@
+"""
+网段空闲地址位图
+每个网段一张位图（位 = 1 表示已占用），在进程内维护，
+用于在不查询 ip_addresses 的情况下找出下一个空闲地址和连续空闲区间。
+
+位图按进程维护，不在 worker 之间共享：各进程的位图都只是加速结构，分配的正确性仍以数据库条件更新为准：
+位图给出的候选在数据库认领失败时会被标记为占用并继续尝试下一个，
+位图与数据库的偏差由 reconcile 检查并修正。
+从位图取出的地址在事务回滚时恢复为空闲（原生SQL路径见 IPBitmapRegistry.transaction，ORM 路径由会话事件处理）。
+
+占用的含义与存储模式一致：
+- dense: 只有 status = 'available' 的已存记录为空闲，缺失的地址视为占用
+- sparse: 未存储的地址和 status = 'available' 的记录为空闲
+"""
+import os
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 是否启用位图加速
+IP_BITMAP_ENABLED = os.getenv('IP_BITMAP_ENABLED', 'true').lower() == 'true'
+
+# 单个网段位图的最大位数（默认 /8，约 2MB），超过的网段回退到SQL查询
+IP_BITMAP_MAX_BITS = int(os.getenv('IP_BITMAP_MAX_BITS', str(1 << 24)))
+
+
+class SubnetBitmap:
+    """单个网段主机区间 [first, last] 的占用位图"""
+
+    # 分块大小（位），每块维护空闲计数，查找空闲位时先跳过已满的块
+    BLOCK_BITS = 4096
+    BLOCK_BYTES = BLOCK_BITS // 8
+
+    def __init__(self, subnet_id: int, first: int, last: int, sparse: bool):
+        self.subnet_id = subnet_id
+        self.first = first
+        self.last = last
+        self.sparse = sparse
+        self.size = last - first + 1
+
+        block_count = (self.size + self.BLOCK_BITS - 1) // self.BLOCK_BITS
+        # dense 默认全部占用，加载时清除 available 记录的位；sparse 默认全部空闲
+        self._bits = bytearray(b'\x00' if sparse else b'\xff') * (block_count * self.BLOCK_BYTES)
+        self._block_free = [0] * block_count
+        for index in range(block_count):
+            bits_in_block = min(self.BLOCK_BITS, self.size - index * self.BLOCK_BITS)
+            self._block_free[index] = bits_in_block if sparse else 0
+        # 区间之外的填充位永久占用
+        for offset in range(self.size, block_count * self.BLOCK_BITS):
+            self._bits[offset >> 3] |= 1 << (offset & 7)
+        self._free = self.size if sparse else 0
+        self._first_free_block = 0
+
+    @classmethod
+    def from_rows(cls, subnet_id: int, first: int, last: int, sparse: bool,
+                  ip_ints: Iterable[int]) -> "SubnetBitmap":
+        """
+        由数据库记录构建位图
+        dense 传入 available 记录的 ip_int，sparse 传入非 available 记录的 ip_int
+        """
+        bitmap = cls(subnet_id, first, last, sparse)
+        for ip_int in ip_ints:
+            if sparse:
+                bitmap.set_occupied(ip_int)
+            else:
+                bitmap.set_free(ip_int)
+        return bitmap
+
+    def contains(self, ip_int: int) -> bool:
+        return self.first <= ip_int <= self.last
+
+    @property
+    def free_count(self) -> int:
+        return self._free
+
+    def is_free(self, ip_int: int) -> bool:
+        offset = ip_int - self.first
+        return not self._bits[offset >> 3] & (1 << (offset & 7))
+
+    def set_occupied(self, ip_int: int) -> bool:
+        """标记占用，状态发生变化时返回 True"""
+        if not self.contains(ip_int):
+            return False
+        offset = ip_int - self.first
+        mask = 1 << (offset & 7)
+        if self._bits[offset >> 3] & mask:
+            return False
+        self._bits[offset >> 3] |= mask
+        self._block_free[offset // self.BLOCK_BITS] -= 1
+        self._free -= 1
+        return True
+
+    def set_free(self, ip_int: int) -> bool:
+        """标记空闲，状态发生变化时返回 True"""
+        if not self.contains(ip_int):
+            return False
+        offset = ip_int - self.first
+        mask = 1 << (offset & 7)
+        if not self._bits[offset >> 3] & mask:
+            return False
+        self._bits[offset >> 3] &= ~mask
+        block = offset // self.BLOCK_BITS
+        self._block_free[block] += 1
+        self._free += 1
+        if block < self._first_free_block:
+            self._first_free_block = block
+        return True
+
+    def _block_int(self, block: int) -> int:
+        start = block * self.BLOCK_BYTES
+        return int.from_bytes(self._bits[start:start + self.BLOCK_BYTES], 'little')
+
+    def first_free(self, start_int: Optional[int] = None) -> Optional[int]:
+        """
+        返回 >= start_int 的最小空闲地址
+        跳过空闲计数为 0 的块，块内用整数运算（~x & (x + 1)）定位最低的 0 位
+        """
+        start_offset = 0 if start_int is None else max(start_int - self.first, 0)
+        if start_offset >= self.size or self._free == 0:
+            return None
+
+        start_block = start_offset // self.BLOCK_BITS
+        if start_int is None:
+            start_block = max(start_block, self._first_free_block)
+        for block in range(start_block, len(self._block_free)):
+            if not self._block_free[block]:
+                continue
+            value = self._block_int(block)
+            if block == start_offset // self.BLOCK_BITS:
+                # 起始块内屏蔽起点之前的位
+                value |= (1 << (start_offset % self.BLOCK_BITS)) - 1
+            lowest_zero = ~value & (value + 1)
+            bit = lowest_zero.bit_length() - 1
+            if bit < self.BLOCK_BITS:
+                if start_int is None:
+                    self._first_free_block = block
+                return self.first + block * self.BLOCK_BITS + bit
+        if start_int is None:
+            self._first_free_block = len(self._block_free)
+        return None
+
+    def free_ranges(self, limit: Optional[int] = None) -> List[Tuple[int, int]]:
+        """按地址顺序返回连续空闲区间 [(start, end), ...]"""
+        ranges: List[Tuple[int, int]] = []
+        start = self.first_free()
+        while start is not None and (limit is None or len(ranges) < limit):
+            end = self._run_end(start)
+            ranges.append((start, end))
+            start = self.first_free(end + 1) if end < self.last else None
+        return ranges
+
+    def find_block(self, count: int, contiguous: bool = False) -> List[int]:
+        """
+        为批量分配挑选 count 个空闲地址（不改变位图）
+        优先最佳适配：长度不小于 count 的最短连续区间，取其开头 count 个地址；
+        没有足够长的区间时，contiguous 为 True 返回空列表，否则从最长的区间开始拼凑（空闲不足时尽量多取）
+        """
+        if count <= 0 or self._free == 0:
+            return []
+        ranges = []
+        best = None
+        for start, end in self.free_ranges():
+            length = end - start + 1
+            if length >= count and (best is None or length < best[1] - best[0] + 1):
+                best = (start, end)
+                if length == count:
+                    break
+            ranges.append((start, end))
+        if best is not None:
+            return list(range(best[0], best[0] + count))
+        if contiguous:
+            return []
+
+        picked: List[int] = []
+        for start, end in sorted(ranges, key=lambda r: r[0] - r[1]):
+            picked.extend(range(start, min(end, start + count - len(picked) - 1) + 1))
+            if len(picked) >= count:
+                break
+        return sorted(picked)
+
+    def _run_end(self, start: int) -> int:
+        """从空闲地址 start 开始的连续空闲区间的终点"""
+        offset = start - self.first
+        block = offset // self.BLOCK_BITS
+        while block < len(self._block_free):
+            value = self._block_int(block)
+            bit_in_block = offset % self.BLOCK_BITS
+            # 从 bit_in_block 开始找第一个占用位
+            occupied = value >> bit_in_block
+            if occupied:
+                run = (occupied & -occupied).bit_length() - 1
+                return self.first + offset + run - 1
+            offset = (block + 1) * self.BLOCK_BITS
+            block += 1
+        return self.last
+
+    def diff(self, other: "SubnetBitmap") -> Dict[str, Any]:
+        """与另一张同区间位图比较，返回差异统计和样例地址"""
+        only_free_here: List[int] = []
+        only_free_there: List[int] = []
+        free_here_count = 0
+        free_there_count = 0
+        for block in range(len(self._block_free)):
+            mine = self._block_int(block)
+            theirs = other._block_int(block)
+            delta = mine ^ theirs
+            if not delta:
+                continue
+            # 本位图空闲、对方占用
+            here = delta & theirs
+            there = delta & mine
+            free_here_count += bin(here).count('1')
+            free_there_count += bin(there).count('1')
+            for bits, samples in ((here, only_free_here), (there, only_free_there)):
+                while bits and len(samples) < 10:
+                    bit = (bits & -bits).bit_length() - 1
+                    samples.append(self.first + block * self.BLOCK_BITS + bit)
+                    bits &= bits - 1
+        return {
+            "free_in_memory_occupied_in_db": free_here_count,
+            "occupied_in_memory_free_in_db": free_there_count,
+            "samples_free_in_memory": only_free_here,
+            "samples_occupied_in_memory": only_free_there,
+        }
+
+
+class BitmapTransaction:
+    """一个数据库事务内从位图取出的地址，提交后调用 commit()，否则退出时恢复为空闲"""
+
+    def __init__(self):
+        self.claims: List[Tuple[int, int]] = []
+        self.committed = False
+
+    def commit(self) -> None:
+        """数据库事务已提交，取出的地址保持占用"""
+        self.committed = True
+        self.claims.clear()
+
+
+class IPBitmapRegistry:
+    """
+    进程内的网段位图注册表
+    位图按需加载（loader 由调用方提供，负责查询数据库并构建 SubnetBitmap），
+    读写在同一把锁内完成，线程池中的并发请求不会拿到同一个候选地址；
+    loader 在锁外执行（每个网段同时只有一个线程加载），加载期间的状态变化记录下来，装入时重放
+    """
+
+    def __init__(self):
+        self._bitmaps: Dict[int, SubnetBitmap] = {}
+        self._lock = threading.RLock()
+        self._load_locks: Dict[int, threading.Lock] = {}
+        # 正在加载的网段 -> 加载期间的变化 [(ip_int, occupied)]，occupied 为 None 表示记录已删除
+        self._loading: Dict[int, List[Tuple[int, Optional[bool]]]] = {}
+        self._local = threading.local()
+        self._stats = {"hits": 0, "misses": 0, "fallbacks": 0, "loads": 0, "stale_candidates": 0,
+                       "rolled_back": 0}
+
+    # ---- 加载 ----
+
+    def get(self, subnet_id: int, loader: Optional[Callable[[], Optional[SubnetBitmap]]] = None) -> Optional[SubnetBitmap]:
+        """获取网段位图，未加载且提供了 loader 时加载（数据库查询不持有注册表锁）"""
+        if not IP_BITMAP_ENABLED:
+            return None
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            if bitmap is not None or loader is None:
+                return bitmap
+            load_lock = self._load_locks.setdefault(subnet_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                bitmap = self._bitmaps.get(subnet_id)
+                if bitmap is not None:
+                    return bitmap
+                self._loading[subnet_id] = []
+            try:
+                bitmap = loader()
+            finally:
+                with self._lock:
+                    changes = self._loading.pop(subnet_id, None)
+            if bitmap is None or changes is None:
+                # 网段不可用，或加载期间被 invalidate（快照可能早于网段变更），本次回退到SQL
+                return None
+            with self._lock:
+                for ip_int, occupied in changes:
+                    self._apply(bitmap, ip_int, occupied)
+                self._bitmaps[subnet_id] = bitmap
+                self._stats["loads"] += 1
+                return bitmap
+
+    def put(self, bitmap: SubnetBitmap) -> None:
+        """写入（替换）网段位图"""
+        with self._lock:
+            self._bitmaps[bitmap.subnet_id] = bitmap
+            self._stats["loads"] += 1
+
+    def invalidate(self, subnet_id: Optional[int] = None) -> None:
+        """丢弃网段位图（网段变更、批量生成/同步后调用），下次使用时重新加载；正在进行的加载结果也会丢弃"""
+        with self._lock:
+            if subnet_id is None:
+                self._bitmaps.clear()
+                self._loading.clear()
+            else:
+                self._bitmaps.pop(subnet_id, None)
+                self._loading.pop(subnet_id, None)
+
+    def _get_checked(self, subnet_id: int, loader: Optional[Callable[[], Optional[SubnetBitmap]]],
+                     sparse: Optional[bool]) -> Optional[SubnetBitmap]:
+        """sparse 与已加载位图的存储模式不一致（网段已被转换）时丢弃后重新加载"""
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            if bitmap is not None and sparse is not None and bitmap.sparse != sparse:
+                self.invalidate(subnet_id)
+        return self.get(subnet_id, loader)
+
+    # ---- 事务跟踪 ----
+
+    @contextmanager
+    def transaction(self) -> Iterator[BitmapTransaction]:
+        """
+        跟踪本线程在 with 块内从位图取出的地址（acquire / acquire_block），
+        块内数据库事务提交后调用 commit()；未提交就退出（回滚、异常）时这些地址恢复为空闲：
+
+            with ip_bitmaps.transaction() as bitmap_tx, connection.cursor() as cursor:
+                ...
+                connection.commit()
+                bitmap_tx.commit()
+        """
+        previous = getattr(self._local, 'transaction', None)
+        tx = BitmapTransaction()
+        self._local.transaction = tx
+        try:
+            yield tx
+        finally:
+            self._local.transaction = previous
+            if not tx.committed:
+                self.rollback(tx.claims)
+
+    def _track(self, subnet_id: int, ip_ints: Iterable[int]) -> None:
+        tx = getattr(self._local, 'transaction', None)
+        if tx is not None:
+            tx.claims.extend((subnet_id, ip_int) for ip_int in ip_ints)
+
+    def _untrack(self, subnet_id: int, ip_ints: Iterable[int]) -> None:
+        tx = getattr(self._local, 'transaction', None)
+        if tx is not None:
+            dropped = {(subnet_id, ip_int) for ip_int in ip_ints}
+            tx.claims[:] = [claim for claim in tx.claims if claim not in dropped]
+
+    def rollback(self, claims: Iterable[Tuple[int, int]]) -> None:
+        """事务回滚：把取出的地址恢复为空闲"""
+        claims = list(claims)
+        if not claims:
+            return
+        with self._lock:
+            for subnet_id, ip_int in claims:
+                bitmap = self._bitmaps.get(subnet_id)
+                if bitmap is not None:
+                    bitmap.set_free(ip_int)
+            self._stats["rolled_back"] += len(claims)
+
+    # ---- 分配与状态更新 ----
+
+    def acquire(self, subnet_id: int, loader: Optional[Callable[[], Optional[SubnetBitmap]]] = None,
+                sparse: Optional[bool] = None) -> Optional[int]:
+        """
+        取出网段中最小的空闲地址并立即标记占用，返回 ip_int
+        位图不可用或已无空闲位时返回 None，调用方回退到SQL认领；
+        sparse 与已加载位图的存储模式不一致（网段已被转换）时重新加载
+        """
+        self._get_checked(subnet_id, loader, sparse)
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            if bitmap is None:
+                self._stats["fallbacks"] += 1
+                return None
+            ip_int = bitmap.first_free()
+            if ip_int is None:
+                self._stats["misses"] += 1
+                return None
+            bitmap.set_occupied(ip_int)
+            self._stats["hits"] += 1
+        self._track(subnet_id, [ip_int])
+        return ip_int
+
+    def acquire_block(self, subnet_id: int, count: int, contiguous: bool = False,
+                      loader: Optional[Callable[[], Optional[SubnetBitmap]]] = None,
+                      sparse: Optional[bool] = None) -> Optional[List[int]]:
+        """
+        批量取出空闲地址并立即标记占用（选址规则见 SubnetBitmap.find_block）
+        位图不可用时返回 None；空闲不足时返回的地址少于 count（contiguous 时为空列表）
+        """
+        self._get_checked(subnet_id, loader, sparse)
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            if bitmap is None:
+                self._stats["fallbacks"] += 1
+                return None
+            block = bitmap.find_block(count, contiguous)
+            self._stats["hits" if len(block) == count else "misses"] += 1
+            for ip_int in block:
+                bitmap.set_occupied(ip_int)
+        self._track(subnet_id, block)
+        return block
+
+    def release(self, subnet_id: int, ip_ints: Iterable[int]) -> None:
+        """把本事务取出但未使用的地址恢复为空闲（如连续块认领失败后换块）"""
+        ip_ints = list(ip_ints)
+        self._untrack(subnet_id, ip_ints)
+        for ip_int in ip_ints:
+            self.mark(subnet_id, ip_int, False)
+
+    @staticmethod
+    def _apply(bitmap: SubnetBitmap, ip_int: int, occupied: Optional[bool]) -> None:
+        if occupied is None:
+            # 记录已删除：dense 网段缺失的地址不可分配，sparse 网段则恢复为空闲
+            occupied = not bitmap.sparse
+        if occupied:
+            bitmap.set_occupied(ip_int)
+        else:
+            bitmap.set_free(ip_int)
+
+    def _update(self, subnet_id: int, ip_int: int, occupied: Optional[bool]) -> None:
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            if bitmap is not None:
+                self._apply(bitmap, ip_int, occupied)
+            elif subnet_id in self._loading:
+                self._loading[subnet_id].append((ip_int, occupied))
+
+    def mark(self, subnet_id: int, ip_int: int, occupied: bool) -> None:
+        """更新单个地址的占用状态（网段位图未加载时忽略）"""
+        self._update(subnet_id, ip_int, occupied)
+
+    def apply_status(self, subnet_id: int, ip_int: int, status: Optional[str]) -> None:
+        """
+        按数据库中的新状态更新位图
+        status 为 None 表示记录已删除：dense 网段缺失的地址不可分配，sparse 网段则恢复为空闲
+        """
+        self._update(subnet_id, ip_int, None if status is None else status != 'available')
+
+    def record_stale_candidate(self, subnet_id: Optional[int] = None, ip_int: Optional[int] = None) -> None:
+        """位图给出的候选在数据库中已被占用：保持占用位，回滚时也不恢复"""
+        if subnet_id is not None and ip_int is not None:
+            self._untrack(subnet_id, [ip_int])
+        with self._lock:
+            self._stats["stale_candidates"] += 1
+
+    # ---- 查询 ----
+
+    def free_ranges(self, subnet_id: int, limit: Optional[int] = None,
+                    loader: Optional[Callable[[], Optional[SubnetBitmap]]] = None) -> Optional[List[Tuple[int, int]]]:
+        """网段中的连续空闲区间，位图不可用时返回 None"""
+        self.get(subnet_id, loader)
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            return None if bitmap is None else bitmap.free_ranges(limit)
+
+    def peek_free(self, subnet_id: int, limit: int,
+                  loader: Optional[Callable[[], Optional[SubnetBitmap]]] = None) -> Optional[List[int]]:
+        """按顺序列出前 limit 个空闲地址（不改变位图），位图不可用时返回 None"""
+        self.get(subnet_id, loader)
+        with self._lock:
+            bitmap = self._bitmaps.get(subnet_id)
+            if bitmap is None:
+                return None
+            result: List[int] = []
+            # 前 limit 个空闲区间至少包含 limit 个地址
+            for start, end in bitmap.free_ranges(limit):
+                result.extend(range(start, min(end, start + limit - len(result) - 1) + 1))
+                if len(result) >= limit:
+                    break
+            return result
+
+    # ---- 一致性检查 ----
+
+    def reconcile(self, fresh: SubnetBitmap, fix: bool = True) -> Dict[str, Any]:
+        """
+        将内存位图与按数据库新构建的位图比较，fix 为 True 时用新位图替换
+        """
+        with self._lock:
+            current = self._bitmaps.get(fresh.subnet_id)
+            if current is None:
+                report = {"subnet_id": fresh.subnet_id, "loaded": False, "consistent": True}
+            elif (current.first, current.last, current.sparse) != (fresh.first, fresh.last, fresh.sparse):
+                # 网段区间或存储模式已变化
+                report = {"subnet_id": fresh.subnet_id, "loaded": True, "consistent": False, "layout_changed": True}
+            else:
+                report = {"subnet_id": fresh.subnet_id, "loaded": True, **current.diff(fresh)}
+                report["consistent"] = not (report["free_in_memory_occupied_in_db"]
+                                            or report["occupied_in_memory_free_in_db"])
+            if fix and not report["consistent"]:
+                self._bitmaps[fresh.subnet_id] = fresh
+            report["fixed"] = fix and not report["consistent"]
+            return report
+
+    def status(self) -> Dict[str, Any]:
+        """位图统计（当前进程）"""
+        with self._lock:
+            return {
+                "enabled": IP_BITMAP_ENABLED,
+                "scope": "process",
+                "pid": os.getpid(),
+                "subnets": len(self._bitmaps),
+                "memory_bytes": sum(len(bitmap._bits) for bitmap in self._bitmaps.values()),
+                "free_addresses": sum(bitmap.free_count for bitmap in self._bitmaps.values()),
+                **self._stats,
+            }
+
+
+ip_bitmaps = IPBitmapRegistry()
@@ -0,0 +1,127 @@
+"""
+IP地址前缀 / CIDR / 通配符查询
+将部分IP地址输入转换为 ip_int（整数地址，带索引的生成列）上的连续区间，
+代替 ip_address LIKE '192.168.%' 和 REGEXP '^192\\.168\\.1\\.[0-9]+$'，查询代价与表大小无关：
+
+- 八位组前缀：10 / 192.168 / 192.168.1 / 192.168.1.  -> 对应 /8、/16、/24 区间
+- 完整地址：192.168.1.10                          -> 单个地址；
+  以 .0 结尾的完整地址（192.168.1.0）与原有搜索一致按 C 类网段处理，等同 192.168.1
+- CIDR：192.168.0.0/22、10.1/16（缺省八位组补 0）   -> 网络地址到广播地址
+- 通配符：192.168.*.*、192.168.1.x                  -> 同八位组前缀；
+  非末尾通配（如 10.*.1.*）展开为多个区间，超过 MAX_QUERY_RANGES 时不处理
+- 区间：192.168.1.10-192.168.1.50、192.168.1.10-50
+"""
+import ipaddress
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import or_
+
+# 非末尾通配展开的区间数上限
+MAX_QUERY_RANGES = 256
+
+_IP_QUERY_CHARS = re.compile(r'^[\d.*xX/\-]+$')
+_OCTET = re.compile(r'^\d{1,3}$')
+_WILDCARDS = ('*', 'x', 'X')
+
+IPRange = Tuple[int, int]
+
+
+def _octet(value: str) -> Optional[int]:
+    if not _OCTET.match(value) or int(value) > 255:
+        return None
+    return int(value)
+
+
+def _parse_cidr(query: str) -> Optional[List[IPRange]]:
+    address, _, prefix_length = query.partition('/')
+    octets = address.rstrip('.').split('.')
+    if not 1 <= len(octets) <= 4 or not prefix_length.isdigit() or int(prefix_length) > 32:
+        return None
+    values = [_octet(octet) for octet in octets]
+    if None in values:
+        return None
+    network = ipaddress.IPv4Network(
+        (ipaddress.IPv4Address(bytes(values + [0] * (4 - len(values)))), int(prefix_length)), strict=False
+    )
+    return [(int(network.network_address), int(network.broadcast_address))]
+
+
+def _parse_dash_range(query: str) -> Optional[List[IPRange]]:
+    start, _, end = query.partition('-')
+    try:
+        start_ip = ipaddress.IPv4Address(start)
+    except ValueError:
+        return None
+    if _octet(end) is not None:
+        # 192.168.1.10-50：结束地址只写最后一个八位组
+        end = start.rsplit('.', 1)[0] + '.' + end
+    try:
+        end_ip = ipaddress.IPv4Address(end)
+    except ValueError:
+        return None
+    if end_ip < start_ip:
+        return None
+    return [(int(start_ip), int(end_ip))]
+
+
+def _parse_octets(query: str) -> Optional[List[IPRange]]:
+    octets = query.rstrip('.').split('.') if query.endswith('.') else query.split('.')
+    if not 1 <= len(octets) <= 4:
+        return None
+    values = []
+    for octet in octets:
+        if octet in _WILDCARDS:
+            values.append(None)
+            continue
+        value = _octet(octet)
+        if value is None:
+            return None
+        values.append(value)
+    # x.x.x.0 按所在 /24 网段搜索（与原 REGEXP 搜索一致）
+    if len(values) == 4 and values[3] == 0 and None not in values:
+        values.pop()
+    # 末尾的通配符和省略的八位组等价
+    while values and values[-1] is None:
+        values.pop()
+    if not values:
+        return None
+
+    # 最后一个确定的八位组之前的通配位置需要逐个展开
+    prefixes = [0]
+    for value in values:
+        candidates = range(256) if value is None else (value,)
+        if len(prefixes) * len(candidates) > MAX_QUERY_RANGES:
+            return None
+        prefixes = [prefix * 256 + candidate for prefix in prefixes for candidate in candidates]
+
+    span = 256 ** (4 - len(values))
+    return [(prefix * span, prefix * span + span - 1) for prefix in prefixes]
+
+
+def parse_ip_query(query: Optional[str]) -> Optional[List[IPRange]]:
+    """
+    将IP地址前缀/CIDR/通配符/区间查询转换为按起始地址排序的整数区间列表 [(start, end)]
+    不是IP地址查询（或无法转换）时返回 None，调用方按普通文本搜索处理
+    """
+    query = (query or '').strip()
+    if not query or not _IP_QUERY_CHARS.match(query) or not re.search(r'\d', query):
+        return None
+    if '/' in query:
+        return _parse_cidr(query)
+    if '-' in query:
+        return _parse_dash_range(query)
+    return _parse_octets(query)
+
+
+def range_condition(ranges: List[IPRange], column: str = 'ip_int') -> Tuple[str, list]:
+    """pymysql 查询条件：column BETWEEN %s AND %s [OR ...]"""
+    conditions = ' OR '.join([f'{column} BETWEEN %s AND %s'] * len(ranges))
+    params = [value for ip_range in ranges for value in ip_range]
+    return (f'({conditions})' if len(ranges) > 1 else conditions), params
+
+
+def range_filter(column, ranges: List[IPRange]):
+    """SQLAlchemy 过滤条件：column.between(start, end) [| ...]"""
+    conditions = [column.between(start, end) for start, end in ranges]
+    return conditions[0] if len(conditions) == 1 else or_(*conditions)
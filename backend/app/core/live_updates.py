@@ -0,0 +1,370 @@
+"""
+仪表盘与IP列表的实时推送（Server-Sent Events）
+分配、释放、保留、删除、批量操作和网段同步在事务提交后调用 publish_ip_changes，
+消息经 Redis pub/sub 广播到所有 worker，各 worker 的 LiveHub 再推送给本进程的 SSE 连接，
+页面不再需要轮询 /api/monitoring/* 和统计接口。
+
+- 消息只携带变化的网段ID和IP地址；LiveHub 按 LIVE_UPDATES_COALESCE_MS 合并一段时间内的变化，
+  有连接时才用一次计数器查询和一次地址查询读取当前值，推送的是变化网段的计数器当前值和变化行的当前内容，
+  重复推送、丢失中间消息都不影响结果
+- 每个连接有独立的缓冲区：客户端读取慢时同一网段/地址只保留最新值，待推送的地址超过
+  LIVE_UPDATES_MAX_PENDING_ROWS 时丢弃明细改为 resync（客户端重新加载当前页），不会无限占用内存
+- 单次变化的地址超过 LIVE_UPDATES_MAX_ROWS、没有明细（网段同步/重新生成）或订阅中断后重连时同样发送 resync
+- 计数器和合计附带 virtual_available（稀疏网段未存储的可用地址数），客户端据此直接更新统计，
+  与统计接口的口径一致（总数/可用数 = 计数器 + virtual_available），只在 resync 时重新请求
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from app.core.local_cache import CacheInvalidationBus
+
+logger = logging.getLogger(__name__)
+
+# 是否启用实时推送
+LIVE_UPDATES_ENABLED = os.getenv('LIVE_UPDATES_ENABLED', 'true').lower() == 'true'
+
+# 跨 worker 广播的 Redis 频道
+LIVE_UPDATES_CHANNEL = os.getenv('LIVE_UPDATES_CHANNEL', 'live:updates')
+
+# 合并窗口（毫秒）：窗口内的多次变化合并为一次查询和一条推送
+LIVE_UPDATES_COALESCE_MS = int(os.getenv('LIVE_UPDATES_COALESCE_MS', '250'))
+
+# 一次变化携带的地址上限，超过时只发送网段ID和 resync
+LIVE_UPDATES_MAX_ROWS = int(os.getenv('LIVE_UPDATES_MAX_ROWS', '200'))
+
+# 每个连接待推送的地址上限，超过时丢弃明细改为 resync
+LIVE_UPDATES_MAX_PENDING_ROWS = int(os.getenv('LIVE_UPDATES_MAX_PENDING_ROWS', '1000'))
+
+# 每个 worker 的最大连接数
+LIVE_UPDATES_MAX_CONNECTIONS = int(os.getenv('LIVE_UPDATES_MAX_CONNECTIONS', '200'))
+
+# 心跳间隔（秒），需小于反向代理的读超时
+LIVE_UPDATES_HEARTBEAT = int(os.getenv('LIVE_UPDATES_HEARTBEAT', '15'))
+
+COUNTER_FIELDS = ('total_count', 'available_count', 'allocated_count', 'reserved_count', 'conflict_count')
+
+IP_FIELDS = ('id', 'ip_address', 'subnet_id', 'status', 'user_name', 'mac_address', 'device_type',
+             'location', 'assigned_to', 'description', 'allocated_at', 'allocated_by', 'updated_at')
+
+_SUM_COLUMNS = ", ".join(f"COALESCE(SUM({field}), 0) AS {field}" for field in COUNTER_FIELDS)
+
+
+def _placeholders(count: int) -> str:
+    return ', '.join(['%s'] * count)
+
+
+def _as_counts(row: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    return {field: int((row or {}).get(field) or 0) for field in COUNTER_FIELDS}
+
+
+def load_changes(cursor, subnet_ids: Iterable[int], ip_subnets: Dict[str, int],
+                 virtual_counts: Optional[Callable] = None) -> Dict[str, Any]:
+    """
+    读取变化网段的计数器、全部合计和变化地址的当前行
+    virtual_counts(cursor, subnet_ids=None) 返回稀疏网段未存储的可用地址数 {subnet_id: 数量}，
+    结果记入各计数器和合计的 virtual_available
+    已删除的地址返回 {"ip_address", "subnet_id", "deleted": True}
+    """
+    subnet_ids = sorted(set(subnet_ids) | set(ip_subnets.values()))
+    counters = {}
+    if subnet_ids:
+        cursor.execute(
+            f"SELECT subnet_id, {_SUM_COLUMNS} FROM subnet_ip_counters "
+            f"WHERE subnet_id IN ({_placeholders(len(subnet_ids))}) GROUP BY subnet_id",
+            subnet_ids
+        )
+        counters = {row['subnet_id']: _as_counts(row) for row in cursor.fetchall()}
+    cursor.execute(f"SELECT {_SUM_COLUMNS} FROM subnet_ip_counters")
+    totals = _as_counts(cursor.fetchone())
+
+    virtual: Dict[int, int] = {}
+    totals["virtual_available"] = 0
+    if virtual_counts is not None:
+        totals["virtual_available"] = sum(virtual_counts(cursor).values())
+        if subnet_ids:
+            virtual = virtual_counts(cursor, subnet_ids)
+
+    ips = []
+    if ip_subnets:
+        addresses = list(ip_subnets)
+        cursor.execute(
+            f"SELECT {', '.join(IP_FIELDS)} FROM ip_addresses WHERE ip_address IN ({_placeholders(len(addresses))})",
+            addresses
+        )
+        found = {row['ip_address']: row for row in cursor.fetchall()}
+        for address in addresses:
+            row = found.get(address)
+            if row is None:
+                ips.append({"ip_address": address, "subnet_id": ip_subnets[address], "deleted": True})
+            else:
+                ips.append({field: str(row[field]) if field in ('allocated_at', 'updated_at') and row[field]
+                            else row[field] for field in IP_FIELDS})
+
+    return {
+        "counters": [
+            {"subnet_id": subnet_id, **counters.get(subnet_id, _as_counts(None)),
+             "virtual_available": virtual.get(subnet_id, 0)}
+            for subnet_id in subnet_ids
+        ],
+        "totals": totals,
+        "ips": ips,
+    }
+
+
+class LiveConnection:
+    """
+    单个 SSE 连接的合并缓冲区，只在事件循环线程中访问
+    读取慢时新数据覆盖旧数据：计数器按网段、地址按IP只保留最新值
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, subnet_id: Optional[int] = None):
+        self.loop = loop
+        self.subnet_id = subnet_id
+        self.connected_at = time.time()
+        self._counters: Dict[int, Dict[str, Any]] = {}
+        self._ips: Dict[str, Dict[str, Any]] = {}
+        self._totals: Optional[Dict[str, int]] = None
+        self._resync = False
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.overflows = 0
+
+    def offer(self, payload: Dict[str, Any]) -> None:
+        """合并一次推送（由 LiveHub 通过 call_soon_threadsafe 调用）"""
+        if self._ready.is_set():
+            self.coalesced += 1
+        if payload.get("resync"):
+            self._resync = True
+        if payload.get("totals") is not None:
+            self._totals = payload["totals"]
+        for counts in payload.get("counters", ()):
+            if self.subnet_id is None or counts["subnet_id"] == self.subnet_id:
+                self._counters[counts["subnet_id"]] = counts
+        if not self._resync:
+            for row in payload.get("ips", ()):
+                if self.subnet_id is None or row.get("subnet_id") == self.subnet_id:
+                    self._ips[row["ip_address"]] = row
+            if len(self._ips) > LIVE_UPDATES_MAX_PENDING_ROWS:
+                self.overflows += 1
+                self._resync = True
+        if self._resync:
+            self._ips.clear()
+        self._ready.set()
+
+    def _drain(self) -> Dict[str, Any]:
+        event = {
+            "counters": list(self._counters.values()),
+            "totals": self._totals,
+            "ips": list(self._ips.values()),
+            "resync": self._resync,
+        }
+        self._counters = {}
+        self._ips = {}
+        self._totals = None
+        self._resync = False
+        self._ready.clear()
+        return event
+
+    async def stream(self, on_close: Callable[['LiveConnection'], None]) -> AsyncIterator[str]:
+        """SSE 事件流：ready、update（合并后的变化）和心跳注释"""
+        try:
+            yield f"retry: 3000\nevent: ready\ndata: {json.dumps({'subnet_id': self.subnet_id})}\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(self._ready.wait(), LIVE_UPDATES_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                event = self._drain()
+                self.sent += 1
+                # 发送期间（客户端读取慢）到达的变化继续合并到缓冲区
+                yield f"event: update\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            on_close(self)
+
+
+class LiveHub:
+    """
+    每个 worker 一个：接收本进程和其他进程的变化通知，合并后查询当前值并分发给本进程的连接
+    查询在后台线程中执行，不占用事件循环
+    """
+
+    def __init__(self, coalesce_ms: int = LIVE_UPDATES_COALESCE_MS):
+        self.coalesce = coalesce_ms / 1000
+        self.bus = CacheInvalidationBus(channel=LIVE_UPDATES_CHANNEL)
+        self.bus.subscribe(self.receive)
+        self._get_connection: Optional[Callable] = None
+        self._virtual_counts: Optional[Callable] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._connections: Set[LiveConnection] = set()
+        self._subnets: Set[int] = set()
+        self._ips: Dict[str, int] = {}
+        self._resync = False
+        self._stats = {"notifications": 0, "flushes": 0, "queries": 0, "resyncs": 0, "errors": 0,
+                       "rejected": 0, "last_flush_seconds": 0.0}
+
+    def start(self, get_connection: Callable, virtual_counts: Optional[Callable] = None) -> None:
+        """
+        启动订阅和合并线程（幂等），get_connection 返回一个数据库连接，
+        virtual_counts 统计稀疏网段未存储的可用地址（见 load_changes）
+        """
+        self._get_connection = get_connection
+        self._virtual_counts = virtual_counts
+        if not LIVE_UPDATES_ENABLED:
+            return
+        self.bus.start()
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="live-updates", daemon=True)
+            self._thread.start()
+
+    def publish(self, subnet_ids: Iterable[int], ip_subnets: Optional[Dict[str, int]], resync: bool) -> None:
+        message: Dict[str, Any] = {"subnets": sorted(set(subnet_ids) | set((ip_subnets or {}).values()))}
+        if ip_subnets is None or resync or len(ip_subnets) > LIVE_UPDATES_MAX_ROWS:
+            message["resync"] = True
+        else:
+            message["ips"] = [[address, subnet_id] for address, subnet_id in ip_subnets.items()]
+        # 本进程直接处理，其他进程经 Redis 收到（总线会跳过本进程发出的消息）
+        self.receive(message)
+        self.bus.publish(message)
+
+    def receive(self, message: Dict[str, Any]) -> None:
+        """合并一条变化通知；订阅重连（clear）时其间的消息可能丢失，通知所有连接重新加载"""
+        with self._lock:
+            if not self._connections:
+                return
+            self._stats["notifications"] += 1
+            self._subnets.update(message.get("subnets", ()))
+            for address, subnet_id in message.get("ips", ()):
+                self._ips[address] = subnet_id
+            if message.get("resync") or message.get("clear"):
+                self._resync = True
+            if len(self._ips) > LIVE_UPDATES_MAX_ROWS:
+                self._ips.clear()
+                self._resync = True
+        self._wake.set()
+
+    def _take_pending(self) -> Tuple[Set[int], Dict[str, int], bool]:
+        with self._lock:
+            self._wake.clear()
+            pending = self._subnets, self._ips, self._resync
+            self._subnets, self._ips, self._resync = set(), {}, False
+            return pending
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            # 等待合并窗口结束，期间的变化一起处理
+            time.sleep(self.coalesce)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Live update flush failed: {e}")
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """立即处理待推送的变化，没有连接时只清空"""
+        subnet_ids, ip_subnets, resync = self._take_pending()
+        if not self.connection_count() or not (subnet_ids or ip_subnets or resync):
+            return None
+        start_time = time.time()
+        payload: Dict[str, Any] = {"resync": True}
+        try:
+            connection = self._get_connection()
+            try:
+                with connection.cursor() as cursor:
+                    payload = load_changes(cursor, subnet_ids, ip_subnets, self._virtual_counts)
+                connection.rollback()
+            finally:
+                connection.close()
+            payload["resync"] = resync
+            with self._lock:
+                self._stats["queries"] += 1
+        except Exception as e:
+            # 读取失败时让客户端自行重新加载
+            logger.warning(f"Live update query failed: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+        self.broadcast(payload)
+
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["resyncs"] += bool(payload["resync"])
+            self._stats["last_flush_seconds"] = round(time.time() - start_time, 3)
+        return payload
+
+    def broadcast(self, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.loop.call_soon_threadsafe(connection.offer, payload)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.disconnect(connection)
+
+    def connect(self, loop: asyncio.AbstractEventLoop, subnet_id: Optional[int] = None) -> Optional[LiveConnection]:
+        """注册一个连接，未启用或已达到连接数上限时返回 None"""
+        if not LIVE_UPDATES_ENABLED:
+            return None
+        with self._lock:
+            if len(self._connections) >= LIVE_UPDATES_MAX_CONNECTIONS:
+                self._stats["rejected"] += 1
+                return None
+            connection = LiveConnection(loop, subnet_id)
+            self._connections.add(connection)
+            return connection
+
+    def disconnect(self, connection: LiveConnection) -> None:
+        with self._lock:
+            self._connections.discard(connection)
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            connections = list(self._connections)
+            stats = dict(self._stats)
+        return {
+            "enabled": LIVE_UPDATES_ENABLED,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "coalesce_ms": int(self.coalesce * 1000),
+            "connections": len(connections),
+            "max_connections": LIVE_UPDATES_MAX_CONNECTIONS,
+            "coalesced": sum(connection.coalesced for connection in connections),
+            "overflows": sum(connection.overflows for connection in connections),
+            "bus": self.bus.stats(),
+            **stats,
+        }
+
+
+live_hub = LiveHub()
+
+
+def publish_ip_changes(subnet_ids: Iterable[int] = (), ip_addresses: Optional[Iterable[Tuple[int, str]]] = None,
+                       resync: bool = False) -> None:
+    """
+    事务提交后通知IP地址变化
+    Args:
+        subnet_ids: 计数器可能变化的网段
+        ip_addresses: 变化的 (subnet_id, ip_address)；为 None 表示网段内的地址整体变化（同步、重新生成）
+        resync: 要求客户端重新加载
+    """
+    if not LIVE_UPDATES_ENABLED:
+        return
+    try:
+        ip_subnets = None if ip_addresses is None else {address: subnet_id for subnet_id, address in ip_addresses}
+        live_hub.publish(subnet_ids, ip_subnets, resync)
+    except Exception as e:
+        # 推送失败不影响已提交的写操作
+        logger.warning(f"Failed to publish live update: {e}")
@@ -0,0 +1,232 @@
+"""
+进程内一级缓存（L1）与跨进程失效广播
+CacheManager 先查进程内 LRU，未命中再查 Redis（L2），热点小键（ip_statistics、user_permissions 等）
+命中时不再有网络往返。L1 保存序列化后的内容，每次命中重新反序列化，调用方修改返回值不会污染缓存。
+
+- LocalLRUCache：按条目数和字节数双重限制的 LRU，每个条目带过期时间（各缓存类型的 local_ttl）
+- CacheInvalidationBus：Redis pub/sub 广播失效事件（删除的键、递增的版本号），
+  所有 uvicorn worker 收到后同步清除本地条目；监听断开期间版本号不在本地缓存，
+  L1 条目最长保留 local_ttl
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# 是否启用进程内缓存
+L1_CACHE_ENABLED = os.getenv('L1_CACHE_ENABLED', 'true').lower() == 'true'
+
+# 条目数和字节数上限（字节数按序列化后的大小估算）
+L1_CACHE_MAX_ENTRIES = int(os.getenv('L1_CACHE_MAX_ENTRIES', '2048'))
+L1_CACHE_MAX_BYTES = int(os.getenv('L1_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# 单个条目超过该大小时不放入进程内缓存
+L1_CACHE_MAX_ITEM_BYTES = int(os.getenv('L1_CACHE_MAX_ITEM_BYTES', str(1024 * 1024)))
+
+# 失效广播频道
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class LocalLRUCache:
+    """线程安全的进程内 LRU 缓存"""
+
+    def __init__(self, max_entries: int = L1_CACHE_MAX_ENTRIES, max_bytes: int = L1_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at <= now:
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: float, size: int) -> bool:
+        """写入条目，ttl <= 0 或条目过大时不缓存"""
+        if ttl <= 0 or size > min(L1_CACHE_MAX_ITEM_BYTES, self.max_bytes):
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+        return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            self._stats["invalidations"] += 1
+            return True
+
+    def delete_prefix(self, prefix: str) -> int:
+        """删除以 prefix 开头的条目（进程内遍历，条目数有上限）"""
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            self._stats["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else None,
+                **self._stats,
+            }
+
+
+local_cache = LocalLRUCache()
+
+
+class CacheInvalidationBus:
+    """
+    基于 Redis pub/sub 的缓存失效广播
+    本进程发布的消息带 origin 标识，监听时跳过（本地已同步处理）
+    """
+
+    def __init__(self, channel: str = INVALIDATION_CHANNEL):
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._handlers: List[Callable[[Dict[str, Any]], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._listening = threading.Event()
+        self._stats = {"published": 0, "received": 0, "errors": 0}
+
+    @property
+    def listening(self) -> bool:
+        """订阅连接是否正常（断开期间可能漏掉其他进程的失效消息）"""
+        return self._listening.is_set()
+
+    def subscribe(self, handler: Callable[[Dict[str, Any]], None]) -> None:
+        with self._lock:
+            self._handlers.append(handler)
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        client = redis_client.get_client()
+        if client is None:
+            return
+        try:
+            client.publish(self.channel, json.dumps({**message, "origin": self.origin}))
+            self._stats["published"] += 1
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning(f"Failed to publish cache invalidation: {e}")
+
+    def start(self) -> None:
+        """启动监听线程（幂等）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._listen_forever, name="cache-invalidation-bus", daemon=True)
+            self._thread.start()
+
+    def _listen_forever(self) -> None:
+        while True:
+            pubsub = None
+            try:
+                client = redis_client.get_client()
+                if client is None:
+                    raise ConnectionError("Redis client not available")
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._listening.set()
+                for raw in pubsub.listen():
+                    self._dispatch(raw)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning(f"Cache invalidation bus disconnected: {e}")
+            finally:
+                self._listening.clear()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            # 断开期间其他进程的失效消息可能丢失，重连前清空本地条目
+            self._notify({"clear": True})
+            time.sleep(1)
+
+    def _dispatch(self, raw: Dict[str, Any]) -> None:
+        if raw.get("type") != "message":
+            return
+        data = raw.get("data")
+        try:
+            message = json.loads(data.decode() if isinstance(data, bytes) else data)
+        except (TypeError, ValueError):
+            return
+        if message.get("origin") == self.origin:
+            return
+        self._stats["received"] += 1
+        self._notify(message)
+
+    def _notify(self, message: Dict[str, Any]) -> None:
+        for handler in list(self._handlers):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"Cache invalidation handler failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"listening": self.listening, "channel": self.channel, **self._stats}
+
+
+invalidation_bus = CacheInvalidationBus()
+
+
+def _handle_key_invalidation(message: Dict[str, Any]) -> None:
+    for key in message.get("keys", []):
+        local_cache.delete(key)
+    for prefix in message.get("prefixes", []):
+        local_cache.delete_prefix(prefix)
+    if message.get("clear"):
+        local_cache.clear()
+
+
+invalidation_bus.subscribe(_handle_key_invalidation)
@@ -0,0 +1,55 @@
+"""
+游标（Keyset）分页工具
+游标对客户端不透明，内容为最后一条记录的排序键，如 (ip_int, id) 或 (created_at, id)
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+
+# 总数统计模式: exact 精确COUNT / estimate 执行计划估算 / none 不统计
+COUNT_MODES = ("exact", "estimate", "none")
+
+
+def encode_cursor(values: Dict[str, Any]) -> str:
+    """将排序键编码为不透明游标"""
+    payload = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in values.items()
+    }
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, required_keys: Iterable[str]) -> Dict[str, Any]:
+    """解码游标并校验必需的排序键，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+    if not isinstance(payload, dict) or any(key not in payload for key in required_keys):
+        raise ValueError("无效的分页游标")
+    return payload
+
+
+def normalize_count_mode(count_mode: Optional[str]) -> str:
+    """校验总数统计模式"""
+    mode = (count_mode or "exact").lower()
+    if mode not in COUNT_MODES:
+        raise ValueError(f"count 参数必须是以下之一: {', '.join(COUNT_MODES)}")
+    return mode
+
+
+def estimate_row_count(cursor, from_where_sql: str, params: list) -> int:
+    """
+    使用 EXPLAIN 估算满足条件的行数（pymysql DictCursor）
+    代价与页深无关，适合无限滚动场景下显示近似总数
+    """
+    cursor.execute(f"EXPLAIN SELECT 1 {from_where_sql}", params)
+    plan = cursor.fetchall()
+    if not plan:
+        return 0
+    return int(plan[0].get("rows") or 0)
@@ -0,0 +1,134 @@
+"""
+密码哈希执行器
+bcrypt 计算（每次数百毫秒 CPU）放到专用的有界线程池中执行：
+
+- 同时计算的数量不超过 PASSWORD_HASH_WORKERS，登录高峰不会占满数据库线程池或 CPU
+- 排队数量超过 PASSWORD_HASH_QUEUE_LIMIT 时直接拒绝（429 + Retry-After），不无限堆积请求
+- 同步调用方（修改/重置密码等线程池中的处理函数、仓储层）用 run()，异步调用方（登录）用 run_async()，
+  都不占用事件循环；登录排队期间也不占用数据库线程
+
+bcrypt 释放 GIL，多个工作线程可以并行计算。
+"""
+import asyncio
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# 同时进行的哈希计算数
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# 允许排队等待的请求数，超过时返回 429
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', str(PASSWORD_HASH_WORKERS * 8)))
+
+# 拒绝时建议客户端的重试间隔（秒）
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', '1'))
+
+
+class PasswordHasherBusy(HTTPException):
+    """密码哈希队列已满"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="登录请求过多，请稍后重试",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
+
+
+class PasswordHasher:
+    """有界的密码哈希线程池"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "rehashed": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+            "max_queued": 0,
+        }
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_limit:
+                self._stats["rejected"] += 1
+                raise PasswordHasherBusy()
+            self._in_flight += 1
+            self._stats["submitted"] += 1
+            queued = max(self._in_flight - self.workers, 0)
+            if queued > self._stats["max_queued"]:
+                self._stats["max_queued"] = queued
+
+    def _run_tracked(self, submitted_at: float, func: Callable, args: tuple) -> Any:
+        started_at = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._in_flight -= 1
+                self._stats["completed"] += 1
+                self._stats["wait_seconds"] += started_at - submitted_at
+                self._stats["run_seconds"] += finished_at - started_at
+
+    def _submit(self, func: Callable, *args):
+        self._acquire()
+        try:
+            return self._executor.submit(self._run_tracked, time.perf_counter(), func, args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+    def run(self, func: Callable, *args) -> Any:
+        """在哈希线程池中执行并等待结果（同步调用方使用）"""
+        return self._submit(func, *args).result()
+
+    async def run_async(self, func: Callable, *args) -> Any:
+        """在哈希线程池中执行，等待期间不阻塞事件循环"""
+        return await asyncio.wrap_future(self._submit(func, *args))
+
+    def record_rehash(self) -> None:
+        with self._lock:
+            self._stats["rehashed"] += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        completed = stats["completed"]
+        stats.update({
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "active": min(in_flight, self.workers),
+            "queued": max(in_flight - self.workers, 0),
+            "avg_wait_ms": round(stats["wait_seconds"] / completed * 1000, 2) if completed else None,
+            "avg_run_ms": round(stats["run_seconds"] / completed * 1000, 2) if completed else None,
+        })
+        stats["wait_seconds"] = round(stats["wait_seconds"], 4)
+        stats["run_seconds"] = round(stats["run_seconds"], 4)
+        return stats
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
@@ -3,9 +3,12 @@
 用于验证系统性能优化效果
 """
 import asyncio
+import random
+import threading
 import time
 import statistics
 import logging
+import ipaddress
 from typing import Dict, List, Any, Callable, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
@@ -13,8 +16,11 @@ from datetime import datetime, timedelta
 from app.core.timezone_config import now_beijing
 import requests
 import json
+from collections import Counter
+from sqlalchemy import event, text
 
-from .database import SessionLocal
+from .database import SessionLocal, engine
+from .search_index import build_boolean_query, match_condition, relevance_expression
 from .redis_client import cache_service
 from .query_optimizer import query_monitor
 
@@ -251,6 +257,996 @@ class PerformanceTester:
         return results
 
 
+
+class MixedTrafficBenchmark:
+    """
+    混合读写并发基准测试
+
+    用于对比数据库调用阻塞事件循环（DB_EXECUTION_MODE=inline）与
+    线程池执行（DB_EXECUTION_MODE=threadpool）两种模式下的尾延迟：
+    分别以两种模式启动后端，对同一地址各运行一次，比较各类请求的 p99。
+    """
+    
+    # 读请求：包含网段前缀搜索和仪表盘统计，用于放大事件循环阻塞的影响
+    READ_REQUESTS = [
+        ("GET", "/health"),
+        ("GET", "/api/subnets?skip=0&limit=20"),
+        ("GET", "/api/ips/search?query=192.168.1&limit=50"),
+        ("GET", "/api/monitoring/dashboard"),
+    ]
+    
+    def __init__(self, base_url: str = "http://localhost:8000", token: Optional[str] = None):
+        self.base_url = base_url
+        self.tester = PerformanceTester(base_url)
+        if token:
+            self.tester.session.headers["Authorization"] = f"Bearer {token}"
+    
+    def run(
+        self,
+        write_ip_address: str,
+        concurrent_users: int = 50,
+        requests_per_user: int = 40,
+        write_ratio: float = 0.2
+    ) -> Dict[str, Any]:
+        """
+        运行混合流量测试
+        
+        Args:
+            write_ip_address: 写请求更新描述字段的IP地址（需已存在）
+            concurrent_users: 并发用户数
+            requests_per_user: 每个用户的请求数
+            write_ratio: 写请求占比
+        """
+        samples: Dict[str, List[float]] = {}
+        errors: List[str] = []
+        lock = threading.Lock()
+        
+        def user_loop(user_id: int):
+            rng = random.Random(user_id)
+            for i in range(requests_per_user):
+                if rng.random() < write_ratio:
+                    method, path = "PUT", f"/api/ips/{write_ip_address}"
+                    payload = {"description": f"perf-bench-{user_id}-{i}"}
+                else:
+                    method, path = rng.choice(self.READ_REQUESTS)
+                    payload = None
+                
+                label = f"{method} {path.split('?')[0]}"
+                start_time = time.time()
+                try:
+                    response = self.tester.session.request(
+                        method, f"{self.base_url}{path}", json=payload, timeout=60
+                    )
+                    if response.status_code >= 400:
+                        with lock:
+                            errors.append(f"{label}: HTTP {response.status_code}")
+                except Exception as e:
+                    with lock:
+                        errors.append(f"{label}: {str(e)}")
+                elapsed = time.time() - start_time
+                with lock:
+                    samples.setdefault(label, []).append(elapsed)
+        
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=concurrent_users) as executor:
+            for future in as_completed([executor.submit(user_loop, u) for u in range(concurrent_users)]):
+                future.result()
+        total_time = time.time() - start_time
+        
+        all_samples = [t for values in samples.values() for t in values]
+        per_endpoint = {
+            label: {
+                "count": len(values),
+                "avg": statistics.mean(values),
+                "p50": self.tester._percentile(values, 50),
+                "p95": self.tester._percentile(values, 95),
+                "p99": self.tester._percentile(values, 99),
+            }
+            for label, values in samples.items()
+        }
+        
+        result = {
+            "timestamp": now_beijing().isoformat(),
+            "concurrent_users": concurrent_users,
+            "total_requests": len(all_samples),
+            "total_time": total_time,
+            "requests_per_second": len(all_samples) / total_time if total_time > 0 else 0,
+            "p50": self.tester._percentile(all_samples, 50),
+            "p95": self.tester._percentile(all_samples, 95),
+            "p99": self.tester._percentile(all_samples, 99),
+            "endpoints": per_endpoint,
+            "error_count": len(errors),
+            "errors": errors[:10]
+        }
+        
+        logger.info(f"Mixed traffic benchmark: {result['requests_per_second']:.2f} RPS, "
+                   f"p99 {result['p99'] * 1000:.1f}ms")
+        return result
+    
+    @staticmethod
+    def compare(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+        """对比两次运行（如 inline 与 threadpool）的 p99 延迟"""
+        comparison = {
+            "overall_p99_before": before["p99"],
+            "overall_p99_after": after["p99"],
+            "overall_p99_speedup": before["p99"] / after["p99"] if after["p99"] > 0 else 0,
+            "endpoints": {}
+        }
+        for label, stats in after["endpoints"].items():
+            if label in before["endpoints"]:
+                p99_before = before["endpoints"][label]["p99"]
+                comparison["endpoints"][label] = {
+                    "p99_before": p99_before,
+                    "p99_after": stats["p99"],
+                    "speedup": p99_before / stats["p99"] if stats["p99"] > 0 else 0
+                }
+        return comparison
+
+class AllocationStressTest:
+    """
+    并发自动分配压力测试
+
+    多个客户端同时对同一网段调用 /api/ips/allocate，验证：
+    - 成功响应中没有重复地址
+    - 数据库中本轮标记的已分配记录数与成功响应数一致
+    并按并发数统计每秒分配数，用于确认吞吐随客户端数增长。
+    每轮结束后释放本轮分配的地址，网段可重复使用。
+    """
+    
+    def __init__(self, base_url: str = "http://localhost:8000", token: Optional[str] = None):
+        self.base_url = base_url
+        self.tester = PerformanceTester(base_url)
+        if token:
+            self.tester.session.headers["Authorization"] = f"Bearer {token}"
+    
+    def _count_marked_in_db(self, marker: str) -> Optional[int]:
+        """统计数据库中带本轮标记的已分配记录数，数据库不可用时返回 None"""
+        db = SessionLocal()
+        try:
+            return db.execute(
+                text("SELECT COUNT(*) FROM ip_addresses WHERE status = 'allocated' AND description LIKE :marker"),
+                {"marker": f"{marker}%"}
+            ).scalar()
+        except Exception as e:
+            logger.warning(f"Skip database verification: {e}")
+            return None
+        finally:
+            db.close()
+    
+    def _run_level(self, subnet_id: int, clients: int, allocations_per_client: int) -> Dict[str, Any]:
+        """以指定并发数运行一轮"""
+        marker = f"alloc-stress-{clients}-{int(time.time() * 1000)}"
+        allocated: List[str] = []
+        latencies: List[float] = []
+        errors: List[str] = []
+        exhausted = 0
+        lock = threading.Lock()
+        
+        def client_loop(client_id: int):
+            nonlocal exhausted
+            for i in range(allocations_per_client):
+                start_time = time.time()
+                try:
+                    response = self.tester.session.post(
+                        f"{self.base_url}/api/ips/allocate",
+                        json={"subnet_id": subnet_id, "description": f"{marker}-{client_id}-{i}"},
+                        timeout=60
+                    )
+                    elapsed = time.time() - start_time
+                    with lock:
+                        latencies.append(elapsed)
+                        if response.status_code == 200:
+                            allocated.append(response.json()["ip_address"])
+                        elif response.status_code == 404:
+                            exhausted += 1
+                        else:
+                            errors.append(f"HTTP {response.status_code}: {response.text[:200]}")
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+        
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            for future in as_completed([executor.submit(client_loop, c) for c in range(clients)]):
+                future.result()
+        total_time = time.time() - start_time
+        
+        duplicates = sorted(ip for ip, count in Counter(allocated).items() if count > 1)
+        db_count = self._count_marked_in_db(marker)
+        
+        # 释放本轮分配的地址
+        for ip_address in set(allocated):
+            try:
+                self.tester.session.post(
+                    f"{self.base_url}/api/ips/release",
+                    json={"ip_address": ip_address, "reason": marker},
+                    timeout=60
+                )
+            except Exception as e:
+                logger.warning(f"Failed to release {ip_address}: {e}")
+        
+        return {
+            "clients": clients,
+            "attempts": clients * allocations_per_client,
+            "allocated": len(allocated),
+            "unique_allocated": len(set(allocated)),
+            "duplicates": duplicates,
+            "db_allocated": db_count,
+            "db_consistent": db_count is None or db_count == len(allocated),
+            "exhausted": exhausted,
+            "error_count": len(errors),
+            "errors": errors[:10],
+            "total_time": total_time,
+            "allocations_per_second": len(allocated) / total_time if total_time > 0 else 0,
+            "p50": self.tester._percentile(latencies, 50),
+            "p99": self.tester._percentile(latencies, 99),
+        }
+    
+    def run(
+        self,
+        subnet_id: int,
+        client_levels: Optional[List[int]] = None,
+        allocations_per_client: int = 20
+    ) -> Dict[str, Any]:
+        """
+        按不同并发数依次运行
+        
+        Args:
+            subnet_id: 测试网段ID，可用地址数应不少于 最大并发数 * allocations_per_client
+            client_levels: 并发客户端数列表
+            allocations_per_client: 每个客户端的分配次数
+        """
+        client_levels = client_levels or [1, 4, 16, 32]
+        levels = [self._run_level(subnet_id, clients, allocations_per_client) for clients in client_levels]
+        
+        result = {
+            "timestamp": now_beijing().isoformat(),
+            "subnet_id": subnet_id,
+            "levels": levels,
+            "duplicate_count": sum(len(level["duplicates"]) for level in levels),
+            "db_consistent": all(level["db_consistent"] for level in levels),
+        }
+        for level in levels:
+            logger.info(f"Allocation stress ({level['clients']} clients): "
+                       f"{level['allocations_per_second']:.1f} alloc/s, "
+                       f"duplicates={len(level['duplicates'])}, errors={level['error_count']}")
+        return result
+    
+    @staticmethod
+    def assert_no_duplicates(result: Dict[str, Any]) -> None:
+        """断言没有重复分配，且数据库记录数与成功响应一致"""
+        if result["duplicate_count"]:
+            duplicates = [ip for level in result["levels"] for ip in level["duplicates"]]
+            raise AssertionError(f"发现重复分配的地址: {duplicates[:20]}")
+        if not result["db_consistent"]:
+            raise AssertionError("数据库中的已分配记录数与成功响应数不一致")
+
+
+class BulkOperationBenchmark:
+    """
+    批量操作基准测试：逐个地址 SELECT + UPDATE（旧实现）与集合化批量语句对比
+
+    每种规模取网段中的一批可用地址，两种实现各执行一遍 allocate -> release
+    （不用 reserve，避免受单用户保留额度限制），
+    统计耗时和发往数据库的SQL语句数；执行完毕后地址恢复为可用状态。
+    """
+    
+    def __init__(self, user_id: int = 1):
+        self.user_id = user_id
+    
+    @staticmethod
+    def _legacy_operation(db, ip_addresses: List[str], operation: str, reason: str, user_id: int) -> int:
+        """旧实现：每个地址一次查询加一次更新，最后统一提交"""
+        success = 0
+        for ip_address in ip_addresses:
+            row = db.execute(
+                text("SELECT id, status FROM ip_addresses WHERE ip_address = :ip"), {"ip": ip_address}
+            ).first()
+            if not row:
+                continue
+            if operation == 'allocate' and row.status == 'available':
+                db.execute(text("""
+                    UPDATE ip_addresses SET status = 'allocated', description = :reason,
+                        allocated_at = NOW(), allocated_by = :user_id, updated_at = NOW()
+                    WHERE id = :id
+                """), {"reason": reason, "user_id": user_id, "id": row.id})
+            elif operation == 'release' and row.status in ('allocated', 'reserved'):
+                db.execute(text("""
+                    UPDATE ip_addresses SET status = 'available', description = :reason,
+                        allocated_at = NULL, allocated_by = NULL, updated_at = NOW()
+                    WHERE id = :id
+                """), {"reason": reason, "id": row.id})
+            else:
+                continue
+            success += 1
+        db.commit()
+        return success
+    
+    def _set_based_operation(self, db, ip_addresses: List[str], operation: str, reason: str) -> int:
+        """新实现：IPService.bulk_ip_operation"""
+        from app.services.ip_service import IPService
+        from app.schemas.ip_address import BulkIPOperationRequest
+        
+        result = IPService(db).bulk_ip_operation(
+            BulkIPOperationRequest(ip_addresses=ip_addresses, operation=operation, reason=reason),
+            self.user_id
+        )
+        return result.success_count
+    
+    @staticmethod
+    def _measure(func: Callable[[], int]) -> Dict[str, Any]:
+        """执行并统计耗时与SQL语句数"""
+        statements = 0
+        
+        def count_statement(*args, **kwargs):
+            nonlocal statements
+            statements += 1
+        
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            start_time = time.time()
+            success = func()
+            elapsed = time.time() - start_time
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+        return {"elapsed": elapsed, "statements": statements, "success": success}
+    
+    def run(self, subnet_id: int, sizes: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Args:
+            subnet_id: 测试网段ID，可用地址数应不少于最大规模
+            sizes: 每轮操作的地址数
+        """
+        sizes = sizes or [100, 500, 2000]
+        results = []
+        db = SessionLocal()
+        try:
+            for size in sizes:
+                ip_addresses = [
+                    row.ip_address for row in db.execute(
+                        text("""
+                            SELECT ip_address FROM ip_addresses
+                            WHERE subnet_id = :subnet_id AND status = 'available'
+                            ORDER BY ip_int LIMIT :size
+                        """),
+                        {"subnet_id": subnet_id, "size": size}
+                    )
+                ]
+                db.commit()
+                if len(ip_addresses) < size:
+                    logger.warning(f"Subnet {subnet_id} has only {len(ip_addresses)} available addresses, "
+                                   f"skip size {size}")
+                    continue
+                
+                marker = f"bulk-bench-{size}"
+                level = {"size": size}
+                for name, runner in (
+                    ("legacy", lambda op: self._legacy_operation(db, ip_addresses, op, marker, self.user_id)),
+                    ("set_based", lambda op: self._set_based_operation(db, ip_addresses, op, marker)),
+                ):
+                    for operation in ("allocate", "release"):
+                        level[f"{name}_{operation}"] = self._measure(lambda: runner(operation))
+                
+                for operation in ("allocate", "release"):
+                    legacy = level[f"legacy_{operation}"]["elapsed"]
+                    set_based = level[f"set_based_{operation}"]["elapsed"]
+                    level[f"{operation}_speedup"] = legacy / set_based if set_based > 0 else None
+                results.append(level)
+                logger.info(
+                    f"Bulk operation benchmark ({size} IPs): "
+                    f"release legacy {level['legacy_release']['elapsed']:.3f}s / "
+                    f"{level['legacy_release']['statements']} stmts, "
+                    f"set-based {level['set_based_release']['elapsed']:.3f}s / "
+                    f"{level['set_based_release']['statements']} stmts"
+                )
+        finally:
+            db.close()
+        
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "subnet_id": subnet_id,
+            "levels": results,
+        }
+
+
+class SearchBenchmark:
+    """
+    IP记录搜索基准测试：多字段 LIKE '%term%'（旧实现）与 ngram 全文索引对比
+
+    在独立的测试网段中按规模分批写入合成记录（中文姓名、部门、MAC），
+    对每个规模分别用两种查询执行若干次，统计 p50/p99 延迟和命中数；
+    测试结束后删除测试网段及其记录。
+    """
+    
+    SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+    GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚"
+    DEPARTMENTS = ["研发部", "财务部", "市场部", "运维部", "人事部", "行政部", "销售部", "测试部"]
+    DEVICE_TYPES = ["PC", "Laptop", "Printer", "Server", "Phone"]
+    
+    def __init__(self, network: str = "100.0.0.0/9", iterations: int = 20, insert_batch_size: int = 5000):
+        self.network = network
+        self.iterations = iterations
+        self.insert_batch_size = insert_batch_size
+    
+    def _synthetic_row(self, index: int, base_ip: int, subnet_id: int) -> Dict[str, Any]:
+        rng = random.Random(index)
+        mac = ':'.join(f"{rng.randint(0, 255):02x}" for _ in range(6))
+        return {
+            "ip_address": str(ipaddress.IPv4Address(base_ip + index + 1)),
+            "subnet_id": subnet_id,
+            "mac": mac,
+            "user_name": rng.choice(self.SURNAMES) + rng.choice(self.GIVEN_NAMES) + rng.choice(self.GIVEN_NAMES),
+            "assigned_to": rng.choice(self.DEPARTMENTS),
+            "device_type": rng.choice(self.DEVICE_TYPES),
+            "location": f"{rng.randint(1, 20)}楼",
+        }
+    
+    def _seed(self, db, subnet_id: int, base_ip: int, start: int, end: int) -> None:
+        """写入第 start..end-1 条合成记录"""
+        for batch_start in range(start, end, self.insert_batch_size):
+            rows = [
+                self._synthetic_row(index, base_ip, subnet_id)
+                for index in range(batch_start, min(batch_start + self.insert_batch_size, end))
+            ]
+            db.execute(text("""
+                INSERT INTO ip_addresses
+                    (ip_address, subnet_id, status, mac_address, user_name, assigned_to, device_type, location)
+                VALUES
+                    (:ip_address, :subnet_id, 'allocated', :mac, :user_name, :assigned_to, :device_type, :location)
+            """), rows)
+            db.commit()
+    
+    @staticmethod
+    def _like_query(term: str):
+        columns = ["ip_address", "user_name", "mac_address", "assigned_to", "device_type", "location", "description"]
+        condition = " OR ".join(f"{column} LIKE :pattern" for column in columns)
+        return (
+            text(f"SELECT id FROM ip_addresses WHERE {condition} ORDER BY ip_int LIMIT 50"),
+            {"pattern": f"%{term}%"},
+        )
+    
+    def _time_queries(self, db, term: str) -> Dict[str, Any]:
+        result = {"term": term}
+        like_statement, like_params = self._like_query(term)
+        boolean_query = build_boolean_query(term)
+        match_sql, _ = match_condition(boolean_query)
+        relevance_sql, relevance_params = relevance_expression(boolean_query, term)
+        # relevance_expression 使用 %s 占位符，直接交给底层游标执行
+        fulltext_sql = (
+            f"SELECT id FROM ip_addresses WHERE {match_sql} "
+            f"ORDER BY {relevance_sql} DESC, ip_int LIMIT 50"
+        )
+        fulltext_params = [boolean_query] + relevance_params
+        
+        for name, run_query in (
+            ("like", lambda: db.execute(like_statement, like_params).fetchall()),
+            ("fulltext", lambda: db.connection().exec_driver_sql(fulltext_sql, tuple(fulltext_params)).fetchall()),
+        ):
+            durations = []
+            hits = 0
+            for _ in range(self.iterations):
+                start_time = time.time()
+                hits = len(run_query())
+                durations.append(time.time() - start_time)
+            durations.sort()
+            result[name] = {
+                "hits": hits,
+                "p50": durations[len(durations) // 2],
+                "p99": durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+            }
+        like_p50 = result["like"]["p50"]
+        fulltext_p50 = result["fulltext"]["p50"]
+        result["speedup"] = like_p50 / fulltext_p50 if fulltext_p50 > 0 else None
+        return result
+    
+    def run(self, sizes: Optional[List[int]] = None, terms: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Args:
+            sizes: 表中合成记录数，按从小到大递增写入
+            terms: 查询词，默认覆盖中文姓名、单字姓氏、部门、MAC片段
+        """
+        sizes = sorted(sizes or [100_000, 1_000_000, 5_000_000])
+        network = ipaddress.IPv4Network(self.network)
+        if sizes[-1] > network.num_addresses - 2:
+            raise ValueError(f"测试网段 {self.network} 容纳不下 {sizes[-1]} 条记录")
+        
+        db = SessionLocal()
+        results = []
+        subnet_id = None
+        try:
+            subnet_id = db.execute(text("""
+                INSERT INTO subnets (network, netmask, description, storage_mode)
+                VALUES (:network, :netmask, 'search-benchmark', 'sparse')
+            """), {"network": str(network), "netmask": str(network.netmask)}).lastrowid
+            db.commit()
+            
+            base_ip = int(network.network_address)
+            sample = self._synthetic_row(sizes[0] // 2, base_ip, subnet_id)
+            terms = terms or [
+                sample["user_name"], sample["user_name"][0], sample["assigned_to"],
+                sample["mac"][:8], sample["mac"][:8].replace(':', '').upper(),
+            ]
+            
+            seeded = 0
+            for size in sizes:
+                self._seed(db, subnet_id, base_ip, seeded, size)
+                seeded = size
+                db.execute(text("ANALYZE TABLE ip_addresses"))
+                level = {"rows": size, "queries": [self._time_queries(db, term) for term in terms]}
+                db.commit()
+                results.append(level)
+                for query in level["queries"]:
+                    logger.info(
+                        f"Search benchmark ({size} rows, '{query['term']}'): "
+                        f"LIKE p50 {query['like']['p50'] * 1000:.1f}ms, "
+                        f"FULLTEXT p50 {query['fulltext']['p50'] * 1000:.1f}ms"
+                    )
+        finally:
+            if subnet_id is not None:
+                db.rollback()
+                # 分批删除，避免单个大事务
+                while db.execute(
+                    text("DELETE FROM ip_addresses WHERE subnet_id = :subnet_id LIMIT :batch"),
+                    {"subnet_id": subnet_id, "batch": self.insert_batch_size}
+                ).rowcount:
+                    db.commit()
+                db.execute(text("DELETE FROM subnets WHERE id = :subnet_id"), {"subnet_id": subnet_id})
+                db.commit()
+            db.close()
+        
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "network": self.network,
+            "levels": results,
+        }
+
+
+class CacheInvalidationBenchmark:
+    """
+    缓存失效基准测试：KEYS + DEL（旧实现）与版本号递增对比
+
+    每个规模先写入 N 个缓存键（另有同样数量的无关键作为背景键空间），
+    分别测量两种失效方式的耗时，以及失效期间另一线程 PING 的最大延迟（反映 Redis 被阻塞的时间）；
+    版本号方式另外统计后台 SCAN 清理旧版本键的耗时，清理不在请求路径上。
+    """
+    
+    NAMESPACE = "bench:invalidate"
+    BACKGROUND_PREFIX = "bench:background"
+    
+    def __init__(self, batch_size: int = 10000):
+        self.cache = cache_service
+        self.batch_size = batch_size
+    
+    def _populate(self, prefix: str, count: int, ttl: int = 600) -> None:
+        client = self.cache.client
+        for start in range(0, count, self.batch_size):
+            pipeline = client.pipeline(transaction=False)
+            for index in range(start, min(start + self.batch_size, count)):
+                pipeline.setex(f"{prefix}:{index}", ttl, '{"value": 1}')
+            pipeline.execute()
+    
+    def _measure(self, func: Callable[[], Any]) -> Dict[str, Any]:
+        """执行 func，同时在另一线程持续 PING，返回耗时和 PING 最大延迟"""
+        stop = threading.Event()
+        ping_latencies: List[float] = []
+        
+        def ping_loop():
+            while not stop.is_set():
+                start_time = time.time()
+                self.cache.client.ping()
+                ping_latencies.append(time.time() - start_time)
+        
+        pinger = threading.Thread(target=ping_loop, daemon=True)
+        pinger.start()
+        try:
+            start_time = time.time()
+            result = func()
+            elapsed = time.time() - start_time
+        finally:
+            stop.set()
+            pinger.join()
+        return {
+            "elapsed": elapsed,
+            "max_ping": max(ping_latencies) if ping_latencies else None,
+            "result": result,
+        }
+    
+    def _legacy_invalidate(self, pattern: str) -> int:
+        keys = self.cache.client.keys(pattern)
+        return self.cache.client.delete(*keys) if keys else 0
+    
+    def run(self, sizes: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Args:
+            sizes: 每轮缓存的键数
+        """
+        from .cache_generations import (
+            GENERATION_KEY_PREFIX, cache_generations, stale_entry_collector, versioned_prefix
+        )
+        
+        sizes = sizes or [10_000, 100_000, 1_000_000]
+        self.cache._ensure_connection()
+        results = []
+        try:
+            for size in sizes:
+                self._populate(self.BACKGROUND_PREFIX, size)
+                
+                self._populate(f"{self.NAMESPACE}:legacy", size)
+                legacy = self._measure(lambda: self._legacy_invalidate(f"{self.NAMESPACE}:legacy:*"))
+                
+                generation = cache_generations.current(self.NAMESPACE)
+                self._populate(versioned_prefix(self.NAMESPACE, generation), size)
+                bump = self._measure(lambda: cache_generations.bump([self.NAMESPACE], collect=False))
+                gc = self._measure(lambda: stale_entry_collector.collect([self.NAMESPACE]))
+                
+                level = {
+                    "keys": size,
+                    "keys_del": {"elapsed": legacy["elapsed"], "max_ping": legacy["max_ping"],
+                                 "deleted": legacy["result"]},
+                    "generation_bump": {"elapsed": bump["elapsed"], "max_ping": bump["max_ping"]},
+                    "background_gc": {"elapsed": gc["elapsed"], "max_ping": gc["max_ping"],
+                                      "deleted": gc["result"]["deleted"]},
+                }
+                results.append(level)
+                logger.info(
+                    f"Cache invalidation benchmark ({size} keys): "
+                    f"KEYS+DEL {legacy['elapsed'] * 1000:.1f}ms (max PING {legacy['max_ping'] or 0:.4f}s), "
+                    f"generation bump {bump['elapsed'] * 1000:.2f}ms, background GC {gc['elapsed']:.2f}s"
+                )
+                self.cache.clear_pattern(f"{self.BACKGROUND_PREFIX}:*")
+        finally:
+            self.cache.clear_pattern(f"{self.NAMESPACE}:*")
+            self.cache.clear_pattern(f"{self.BACKGROUND_PREFIX}:*")
+            self.cache.delete(f"{GENERATION_KEY_PREFIX}{self.NAMESPACE}")
+        
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "levels": results,
+        }
+
+
+class CacheSerializationBenchmark:
+    """
+    缓存序列化基准测试
+    用有代表性的 ip_list（分页 IP 列表）和 subnet_utilization（网段使用率列表）数据，
+    对本进程可用的每种序列化 + 压缩组合测量编码/解码耗时、序列化后大小和写入 Redis 后的 MEMORY USAGE
+    """
+    
+    KEY_PREFIX = "bench:serialize"
+    
+    def __init__(self, iterations: int = 200, seed: int = 42):
+        self.cache = cache_service
+        self.iterations = iterations
+        self.random = random.Random(seed)
+    
+    def _ip_list_payload(self, rows: int) -> Dict[str, Any]:
+        """与 OptimizedIPService.get_ip_list 返回结构一致"""
+        base_time = now_beijing().replace(tzinfo=None)
+        network = ipaddress.ip_network("10.20.0.0/16")
+        statuses = ["allocated", "available", "reserved"]
+        items = []
+        for index in range(rows):
+            status = self.random.choice(statuses)
+            allocated = status == "allocated"
+            items.append({
+                "id": index + 1,
+                "ip_address": str(network[index + 1]),
+                "subnet_id": index // 254 + 1,
+                "status": status,
+                "mac_address": ":".join(f"{self.random.randint(0, 255):02x}" for _ in range(6)) if allocated else None,
+                "user_name": f"user{self.random.randint(1, 500)}" if allocated else None,
+                "device_type": self.random.choice(["server", "workstation", "printer", "switch"]) if allocated else None,
+                "location": self.random.choice(["机房A", "机房B", "办公区3F"]) if allocated else None,
+                "assigned_to": f"部门{self.random.randint(1, 20)}" if allocated else None,
+                "description": f"benchmark host {index}" if allocated else None,
+                "allocated_at": base_time - timedelta(minutes=index) if allocated else None,
+                "allocated_by": 1 if allocated else None,
+                "created_at": base_time - timedelta(days=30, minutes=index),
+                "updated_at": base_time - timedelta(minutes=index),
+            })
+        return {"items": items, "total": rows * 20, "page": 1, "size": rows, "pages": 20}
+    
+    def _subnet_utilization_payload(self, subnets: int) -> List[Dict[str, Any]]:
+        """与 SubnetUtilizationStats 列表结构一致"""
+        payload = []
+        for index in range(subnets):
+            total = 254
+            allocated = self.random.randint(0, total)
+            payload.append({
+                "subnet_id": index + 1,
+                "network": f"10.{index // 256}.{index % 256}.0/24",
+                "description": f"VLAN {100 + index} 业务网段",
+                "total_ips": total,
+                "allocated_ips": allocated,
+                "utilization_rate": round(allocated / total * 100, 2),
+            })
+        return payload
+    
+    def _codecs(self) -> List[Any]:
+        from .cache_serializers import SERIALIZERS, COMPRESSORS, get_codec
+        
+        codecs = []
+        for serializer in SERIALIZERS:
+            codecs.append(get_codec(serializer))
+            if serializer != 'pickle':
+                codecs.extend(get_codec(serializer, compression) for compression in COMPRESSORS)
+        return codecs
+    
+    def _measure(self, codec, payload: Any, key: str) -> Dict[str, Any]:
+        encode_times = []
+        decode_times = []
+        encoded = codec.dumps(payload)
+        for _ in range(self.iterations):
+            start_time = time.perf_counter()
+            encoded = codec.dumps(payload)
+            encode_times.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            codec.loads(encoded)
+            decode_times.append(time.perf_counter() - start_time)
+        
+        memory = None
+        if self.cache.client and self.cache.set_raw(key, encoded, 300):
+            try:
+                memory = self.cache.client.memory_usage(key)
+            except Exception as e:
+                logger.warning(f"MEMORY USAGE not available: {e}")
+        
+        return {
+            "codec": codec.name,
+            "size_bytes": len(encoded),
+            "redis_memory_bytes": memory,
+            "encode_ms": round(statistics.median(encode_times) * 1000, 4),
+            "decode_ms": round(statistics.median(decode_times) * 1000, 4),
+        }
+    
+    def run(self, ip_rows: Optional[List[int]] = None, subnet_counts: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Args:
+            ip_rows: ip_list 每页行数（默认一页 50 行和导出规模 1000 行）
+            subnet_counts: subnet_utilization 网段数
+        """
+        self.cache._ensure_connection()
+        payloads = {}
+        for rows in ip_rows or [50, 1000]:
+            payloads[f"ip_list:{rows}"] = self._ip_list_payload(rows)
+        for count in subnet_counts or [100, 2000]:
+            payloads[f"subnet_utilization:{count}"] = self._subnet_utilization_payload(count)
+        
+        results = {}
+        try:
+            for name, payload in payloads.items():
+                rows = [self._measure(codec, payload, f"{self.KEY_PREFIX}:{name}:{codec.name}") for codec in self._codecs()]
+                baseline = next(row for row in rows if row["codec"] == "json")
+                for row in rows:
+                    row["size_ratio"] = round(row["size_bytes"] / baseline["size_bytes"], 3)
+                results[name] = rows
+                best = min(rows, key=lambda row: row["size_bytes"])
+                logger.info(
+                    f"Serialization benchmark {name}: json {baseline['size_bytes']}B "
+                    f"({baseline['encode_ms']}/{baseline['decode_ms']}ms), smallest {best['codec']} "
+                    f"{best['size_bytes']}B ({best['encode_ms']}/{best['decode_ms']}ms)"
+                )
+        finally:
+            self.cache.clear_pattern(f"{self.KEY_PREFIX}:*")
+        
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "iterations": self.iterations,
+            "payloads": results,
+        }
+
+
+class SubnetUtilizationQueryCount:
+    """
+    网段使用率接口的SQL语句数回归检查
+    在一个不提交的事务中写入不同数量的合成网段（及其计数器行），直接调用 v1 的
+    subnet-utilization / top-utilized-subnets 处理函数并统计语句数：
+    语句数应为常数（数据 + 总数），不随网段数增长；结束时回滚，不留下测试数据。
+    """
+    
+    # subnet-utilization：一条聚合查询 + 一条总数查询；top-utilized-subnets：一条聚合查询
+    MAX_STATEMENTS = {"subnet_utilization": 2, "top_utilized_subnets": 1}
+    
+    @staticmethod
+    def _seed(db, count: int, vlan_id: int) -> None:
+        """写入 count 个 198.18.0.0/15 内的 /32 网段，每个网段一行计数器"""
+        db.execute(
+            text("""
+                INSERT INTO subnets (network, netmask, description, vlan_id, location)
+                VALUES (:network, '255.255.255.255', 'utilization query count check', :vlan_id, 'bench')
+            """),
+            [
+                {"network": f"198.{18 + index // 65536}.{index // 256 % 256}.{index % 256}/32", "vlan_id": vlan_id}
+                for index in range(count)
+            ]
+        )
+        db.execute(text("""
+            INSERT INTO subnet_ip_counters (subnet_id, slot, total_count, available_count, allocated_count)
+            SELECT id, 0, 254, 254 - id % 255, id % 255 FROM subnets WHERE location = 'bench' AND vlan_id = :vlan_id
+        """), {"vlan_id": vlan_id})
+    
+    @staticmethod
+    def _measure(func: Callable[[], Any]) -> int:
+        statements = 0
+        
+        def count_statement(*args, **kwargs):
+            nonlocal statements
+            statements += 1
+        
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            func()
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+        return statements
+    
+    def run(self, sizes: Optional[List[int]] = None, vlan_id: int = 4094) -> Dict[str, Any]:
+        """
+        Args:
+            sizes: 合成网段数（累加写入）
+            vlan_id: 合成网段使用的VLAN，同时作为过滤条件
+        """
+        from fastapi import Response
+        from app.api.v1.endpoints.monitoring import get_subnet_utilization_stats, get_top_utilized_subnets
+        
+        sizes = sorted(sizes or [10, 300, 3000])
+        results = []
+        db = SessionLocal()
+        try:
+            seeded = 0
+            for size in sizes:
+                self._seed(db, size - seeded, vlan_id)
+                seeded = size
+                level = {"subnets": size}
+                level["subnet_utilization"] = self._measure(lambda: get_subnet_utilization_stats(
+                    response=Response(), vlan_id=vlan_id, location=None, tag_id=None,
+                    sort_by="utilization_rate", sort_order="desc", skip=0, limit=100,
+                    db=db, current_user=None
+                ))
+                level["top_utilized_subnets"] = self._measure(lambda: get_top_utilized_subnets(
+                    limit=10, vlan_id=vlan_id, location=None, tag_id=None, db=db, current_user=None
+                ))
+                results.append(level)
+                logger.info(
+                    f"Subnet utilization query count ({size} subnets): "
+                    f"subnet-utilization {level['subnet_utilization']} stmts, "
+                    f"top-utilized-subnets {level['top_utilized_subnets']} stmts"
+                )
+        finally:
+            db.rollback()
+            db.close()
+        
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "levels": results,
+        }
+    
+    @classmethod
+    def assert_constant(cls, result: Dict[str, Any]) -> None:
+        """语句数超过上限或随网段数变化时报错"""
+        for name, limit in cls.MAX_STATEMENTS.items():
+            counts = {level["subnets"]: level[name] for level in result["levels"]}
+            if len(set(counts.values())) > 1 or max(counts.values(), default=0) > limit:
+                raise AssertionError(f"{name} 的SQL语句数随网段数变化或超过 {limit}: {counts}")
+
+
+class ResponseCacheCheck:
+    """
+    响应缓存的路径与失效检查（需要 Redis）
+    在真实挂载路径上注册轮询端点和写端点，经 ResponseCacheMiddleware 访问：
+    首次 GET 为 MISS 并带 ETag，带 If-None-Match 的 GET 返回 304，写请求之后同一 ETag 不再返回 304。
+    """
+
+    READ_PATH = "/api/monitoring/dashboard"
+    WRITE_PATH = "/api/ips/allocate"
+
+    def run(self) -> Dict[str, Any]:
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from .response_cache_middleware import ResponseCacheMiddleware
+
+        app = FastAPI()
+        state = {"version": 0}
+
+        @app.get(self.READ_PATH)
+        def read():
+            return {"version": state["version"]}
+
+        @app.post(self.WRITE_PATH)
+        def write():
+            state["version"] += 1
+            return {"version": state["version"]}
+
+        app.add_middleware(ResponseCacheMiddleware, cache_enabled=True)
+        # 每次运行使用不同的认证头，不受上次运行留下的缓存影响
+        headers = {"Authorization": f"Bearer response-cache-check-{time.time()}"}
+        client = TestClient(app)
+
+        first = client.get(self.READ_PATH, headers=headers)
+        etag = first.headers.get("etag")
+        revalidated = client.get(self.READ_PATH, headers={**headers, "If-None-Match": etag or ""})
+        client.post(self.WRITE_PATH, headers=headers)
+        after_write = client.get(self.READ_PATH, headers={**headers, "If-None-Match": etag or ""})
+
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "first": {"status": first.status_code, "x_cache": first.headers.get("x-cache"), "etag": etag},
+            "revalidated": {"status": revalidated.status_code, "x_cache": revalidated.headers.get("x-cache")},
+            "after_write": {"status": after_write.status_code, "x_cache": after_write.headers.get("x-cache"),
+                            "body": after_write.json() if after_write.status_code == 200 else None},
+        }
+
+    @staticmethod
+    def assert_revalidates(result: Dict[str, Any]) -> None:
+        """真实路径必须被缓存并返回 304，写请求之后必须返回新内容"""
+        if result["first"]["status"] != 200 or not result["first"]["etag"]:
+            raise AssertionError(f"首次请求未被缓存: {result['first']}")
+        if result["revalidated"]["status"] != 304:
+            raise AssertionError(f"If-None-Match 未返回 304: {result['revalidated']}")
+        if result["after_write"]["status"] != 200 or result["after_write"]["body"] != {"version": 1}:
+            raise AssertionError(f"写请求之后仍返回旧响应: {result['after_write']}")
+
+
+class ExhaustionForecastBenchmark:
+    """
+    网段耗尽预测基准测试
+    用合成的每日净分配矩阵测量 fit_exhaustion 在不同网段数下的耗时（不访问数据库），
+    并测量一次 CapacityForecastService.forecast 对当前数据库的完整耗时（读取 + 拟合）
+    """
+    
+    def __init__(self, window_days: int = 90, iterations: int = 10, seed: int = 42):
+        self.window_days = window_days
+        self.iterations = iterations
+        self.seed = seed
+    
+    def _synthetic(self, subnets: int):
+        import numpy as np
+        
+        rng = np.random.default_rng(self.seed)
+        net = rng.poisson(1.0, (subnets, self.window_days)) - rng.poisson(0.8, (subnets, self.window_days))
+        allocated = rng.integers(0, 200, subnets).astype(np.float64)
+        capacity = np.full(subnets, 254.0)
+        return allocated, allocated + 2, capacity, net
+    
+    def run(self, sizes: Optional[List[int]] = None, include_database: bool = True) -> Dict[str, Any]:
+        """
+        Args:
+            sizes: 合成网段数
+            include_database: 是否同时测量对当前数据库的完整预测
+        """
+        from app.services.capacity_forecast_service import CapacityForecastService, fit_exhaustion
+        
+        results = []
+        for size in sizes or [1000, 10000, 50000]:
+            arrays = self._synthetic(size)
+            times = []
+            for _ in range(self.iterations):
+                start_time = time.perf_counter()
+                fit_exhaustion(*arrays)
+                times.append(time.perf_counter() - start_time)
+            level = {"subnets": size, "fit_ms": round(statistics.median(times) * 1000, 2)}
+            results.append(level)
+            logger.info(f"Exhaustion forecast benchmark ({size} subnets): fit {level['fit_ms']}ms")
+        
+        database = None
+        if include_database:
+            db = SessionLocal()
+            try:
+                start_time = time.perf_counter()
+                forecasts = CapacityForecastService(db).forecast(self.window_days)
+                database = {"subnets": len(forecasts), "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2)}
+            finally:
+                db.close()
+            logger.info(f"Exhaustion forecast on database: {database['subnets']} subnets in {database['elapsed_ms']}ms")
+        
+        return {
+            "timestamp": now_beijing().isoformat(),
+            "window_days": self.window_days,
+            "levels": results,
+            "database": database,
+        }
+
+
 class DatabasePerformanceTester:
     """数据库性能测试器"""
     
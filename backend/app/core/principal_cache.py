@@ -0,0 +1,104 @@
+"""
+认证用户（principal）缓存
+get_current_user 每个请求都要确认用户存在且未停用，命中缓存时不再查询 users 表：
+进程内（L1）最长 local_ttl 秒，其次 Redis（L2），都未命中才查数据库。
+
+缓存按用户ID存放，条目带令牌版本（security.token_version），令牌中的 ver 与之不一致时视为已失效。
+停用/启用、删除、角色变更、密码修改和重置后调用 invalidate_principal，
+删除 Redis 条目并通过失效广播清除所有进程的 L1 条目；广播不在线时不使用 L1，最迟 TTL 后生效；
+同时递增该用户的API响应缓存版本号（响应缓存中间件也按本模块校验身份）。
+缓存内容不含密码哈希。本模块不在导入时依赖 ORM 模型，原生 SQL 接口也可直接调用 invalidate_principal。
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.core.cache_manager import cache_manager
+from app.core.security import token_version
+
+logger = logging.getLogger(__name__)
+
+CACHE_TYPE = "user_principal"
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def principal_data(user) -> Dict[str, Any]:
+    """用户对象转为可缓存的字段"""
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "role": user.role.value if user.role else None,
+        "theme": user.theme.value if user.theme else None,
+        "is_active": bool(user.is_active),
+        "created_at": _isoformat(user.created_at),
+        "updated_at": _isoformat(user.updated_at),
+        "token_version": token_version(user.credential_version),
+    }
+
+
+def get_cached_principal(user_id: int) -> Optional[Dict[str, Any]]:
+    """读取缓存的用户字段，未命中返回 None"""
+    return cache_manager.get(CACHE_TYPE, str(user_id))
+
+
+def cache_principal(user) -> Dict[str, Any]:
+    """缓存用户字段（包括已停用的用户，停用状态同样不必再查库）"""
+    data = principal_data(user)
+    cache_manager.set(CACHE_TYPE, data, str(user.id))
+    return data
+
+
+def load_principal(user_id: int) -> Optional[Dict[str, Any]]:
+    """读取用户字段，未命中缓存时用独立会话查询数据库并写入缓存；用户不存在返回 None（请求会话之外使用）"""
+    principal = get_cached_principal(user_id)
+    if principal is not None:
+        return principal
+    from app.core.database import SessionLocal
+    from app.models.user import User
+    
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        return cache_principal(user) if user else None
+    finally:
+        db.close()
+
+
+def invalidate_principal(user_id: int) -> bool:
+    """用户状态、角色或密码变更后清除缓存（Redis 和所有进程的 L1），并使该用户的API响应缓存失效"""
+    logger.debug(f"Invalidating cached principal for user {user_id}")
+    deleted = cache_manager.delete(CACHE_TYPE, str(user_id))
+    # 响应缓存中间件依赖本模块，延迟导入避免循环
+    from app.core.response_cache_middleware import cache_invalidation_service
+    cache_invalidation_service.invalidate_user_cache(user_id)
+    return deleted
+
+
+def principal_to_user(db, data: Dict[str, Any]):
+    """
+    由缓存字段构造绑定到当前会话的 User 对象，不发出 SELECT
+    未缓存的字段（如 password_hash）和关联关系在访问时按需加载
+    """
+    from sqlalchemy.orm.session import make_transient_to_detached
+    from app.models.user import User, UserRole, UserTheme
+    
+    user = User(
+        id=data["id"],
+        username=data["username"],
+        email=data.get("email"),
+        role=UserRole(data["role"]) if data.get("role") else None,
+        theme=UserTheme(data["theme"]) if data.get("theme") else None,
+        is_active=data["is_active"],
+        created_at=_parse_datetime(data.get("created_at")),
+        updated_at=_parse_datetime(data.get("updated_at")),
+    )
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
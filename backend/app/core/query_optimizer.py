@@ -16,6 +16,7 @@ from app.core.timezone_config import now_beijing
 
 from .database import engine, SessionLocal
 from .redis_client import cache_service
+from .ip_prefix import parse_ip_query, range_filter
 
 logger = logging.getLogger(__name__)
 
@@ -460,7 +461,10 @@ class QueryOptimizer:
             else:
                 query = query.filter(IPAddress.status == filters["status"])
         
-        if filters.get("search"):
+        ip_ranges = parse_ip_query(filters.get("search"))
+        if ip_ranges:
+            query = query.filter(range_filter(IPAddress.ip_int, ip_ranges))
+        elif filters.get("search"):
             search_term = f"%{filters['search']}%"
             query = query.filter(
                 IPAddress.ip_address.like(search_term) |
@@ -477,11 +481,11 @@ class QueryOptimizer:
         sort_order = filters.get("order", "asc")
         
         if sort_field == "ip_address":
-            # IP地址排序使用INET_ATON函数
+            # IP地址排序使用整数列 ip_int
             if sort_order == "desc":
-                query = query.order_by(text("INET_ATON(ip_address) DESC"))
+                query = query.order_by(IPAddress.ip_int.desc())
             else:
-                query = query.order_by(text("INET_ATON(ip_address) ASC"))
+                query = query.order_by(IPAddress.ip_int.asc())
         else:
             # 其他字段正常排序
             order_column = getattr(IPAddress, sort_field, IPAddress.ip_address)
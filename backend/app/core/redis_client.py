@@ -4,8 +4,7 @@ Redis客户端配置和缓存服务
 """
 import redis
 import json
-import pickle
-from typing import Any, Optional, Union, Dict, List
+from typing import Any, Optional, Union, Dict, List, Iterator
 from datetime import datetime, timedelta
 from app.core.timezone_config import now_beijing
 import logging
@@ -14,6 +13,7 @@ import asyncio
 from contextlib import asynccontextmanager
 
 from .config import settings
+from .cache_serializers import get_codec
 
 logger = logging.getLogger(__name__)
 
@@ -100,7 +100,18 @@ class CacheService:
             redis_client.reconnect()
             self.client = redis_client.get_client()
     
-    def set(self, key: str, value: Any, ttl: int = 300, serialize: str = 'json') -> bool:
+    @staticmethod
+    def serialize(value: Any, serialize: str = 'json', compression: Optional[str] = None) -> Union[str, bytes]:
+        """序列化（并按需压缩）缓存值，见 cache_serializers"""
+        return get_codec(serialize, compression).dumps(value)
+    
+    @staticmethod
+    def deserialize(payload: Union[str, bytes], serialize: str = 'json') -> Any:
+        """反序列化缓存值，带帧头的二进制/压缩内容按帧头解码"""
+        return get_codec(serialize).loads(payload)
+    
+    def set(self, key: str, value: Any, ttl: int = 300, serialize: str = 'json',
+            compression: Optional[str] = None) -> bool:
         """
         设置缓存值
         
@@ -108,23 +119,24 @@ class CacheService:
             key: 缓存键
             value: 缓存值
             ttl: 过期时间（秒）
-            serialize: 序列化方式 ('json' 或 'pickle')
+            serialize: 序列化方式 ('json'、'pickle'、'orjson' 或 'msgpack')
+            compression: 压缩方式 ('zlib'、'zstd' 或 'lz4')，超过阈值时压缩
         """
+        try:
+            return self.set_raw(key, self.serialize(value, serialize, compression), ttl)
+        except Exception as e:
+            logger.error(f"Failed to set cache {key}: {e}")
+            return False
+    
+    def set_raw(self, key: str, payload: Union[str, bytes], ttl: int = 300) -> bool:
+        """写入已序列化的缓存值"""
         try:
             self._ensure_connection()
             if not self.client:
                 return False
             
-            # 序列化数据
-            if serialize == 'json':
-                serialized_value = json.dumps(value, default=str)
-            elif serialize == 'pickle':
-                serialized_value = pickle.dumps(value)
-            else:
-                serialized_value = str(value)
-            
             # 设置缓存
-            result = self.client.setex(key, ttl, serialized_value)
+            result = self.client.setex(key, ttl, payload)
             logger.debug(f"Cache set: {key} (TTL: {ttl}s)")
             return result
             
@@ -138,24 +150,26 @@ class CacheService:
         
         Args:
             key: 缓存键
-            serialize: 序列化方式 ('json' 或 'pickle')
+            serialize: 序列化方式 ('json'、'pickle'、'orjson' 或 'msgpack')
         """
+        try:
+            value = self.get_raw(key)
+            if value is None:
+                return None
+            return self.deserialize(value, serialize)
+                
+        except Exception as e:
+            logger.error(f"Failed to get cache {key}: {e}")
+            return None
+    
+    def get_raw(self, key: str) -> Optional[Union[str, bytes]]:
+        """读取未反序列化的缓存值"""
         try:
             self._ensure_connection()
             if not self.client:
                 return None
             
-            value = self.client.get(key)
-            if value is None:
-                return None
-            
-            # 反序列化数据
-            if serialize == 'json':
-                return json.loads(value)
-            elif serialize == 'pickle':
-                return pickle.loads(value)
-            else:
-                return value
+            return self.client.get(key)
                 
         except Exception as e:
             logger.error(f"Failed to get cache {key}: {e}")
@@ -215,26 +229,49 @@ class CacheService:
             logger.error(f"Failed to get TTL for {key}: {e}")
             return -1
     
+    def scan_keys(self, pattern: str = "*", count: int = 1000) -> Iterator[str]:
+        """
+        增量遍历匹配模式的键（SCAN），每次调用只扫描 count 个槽位，不会像 KEYS 一样长时间阻塞 Redis
+        遍历期间新增或删除的键可能被漏掉或重复返回
+        """
+        self._ensure_connection()
+        if not self.client:
+            return iter(())
+        return self.client.scan_iter(match=pattern, count=count)
+    
     def keys(self, pattern: str = "*") -> List[str]:
-        """获取匹配模式的所有键"""
+        """获取匹配模式的所有键（基于 SCAN）"""
         try:
-            self._ensure_connection()
-            if not self.client:
-                return []
-            
-            return self.client.keys(pattern)
+            return list(self.scan_keys(pattern))
             
         except Exception as e:
             logger.error(f"Failed to get keys with pattern {pattern}: {e}")
             return []
     
-    def clear_pattern(self, pattern: str) -> int:
-        """清除匹配模式的所有缓存"""
-        try:
-            keys = self.keys(pattern)
-            if keys:
-                return self.client.delete(*keys)
+    def delete_many(self, keys: List[str]) -> int:
+        """批量删除键，优先使用 UNLINK 在后台释放内存"""
+        if not keys:
             return 0
+        try:
+            return self.client.unlink(*keys)
+        except redis.ResponseError:
+            # Redis 4.0 之前不支持 UNLINK
+            return self.client.delete(*keys)
+    
+    def clear_pattern(self, pattern: str, batch_size: int = 500) -> int:
+        """
+        清除匹配模式的所有缓存（SCAN + 分批 UNLINK）
+        缓存失效优先使用版本号（见 cache_generations），这里只用于无法映射到版本号的模式
+        """
+        try:
+            deleted = 0
+            batch = []
+            for key in self.scan_keys(pattern):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += self.delete_many(batch)
+                    batch = []
+            return deleted + self.delete_many(batch)
             
         except Exception as e:
             logger.error(f"Failed to clear pattern {pattern}: {e}")
@@ -1,13 +1,28 @@
 """
 API响应缓存中间件
 提供API响应的自动缓存和缓存控制功能
+
+- 强 ETag：响应体的摘要，与缓存条目一起保存；ETag 另存一个小键，
+  带 If-None-Match 的轮询请求命中时只读这个小键并返回 304，不读取也不发送响应体
+- 响应头：Cache-Control（默认 private, max-age=0, must-revalidate，浏览器每次用 ETag 校验）
+  和 Vary: Authorization, Cookie（响应按登录身份区分）
+- 响应体按块收集后一次拼接，同一份字节同时用于发送和缓存，命中时直接发送缓存的字节，
+  不再做 JSON 解析和重新编码；超过 RESPONSE_CACHE_MAX_BYTES 的响应转为流式透传，不缓存
+- 中间件在接口鉴权之前返回缓存，因此先校验身份：携带令牌的请求要求令牌有效、用户存在且未停用、
+  令牌版本与用户一致（principal_cache，与 get_current_user 相同的判断），缓存按校验后的用户ID区分；
+  校验不通过时不读也不写缓存，直接交给接口处理。用户停用、删除、改密时 invalidate_principal
+  同时递增该用户的缓存版本号
+- 路径前缀按实际挂载点（API_PREFIX）生成，覆盖 v1 路由和页面轮询的原生端点；
+  成功的写请求（POST/PUT/PATCH/DELETE）按 WRITE_INVALIDATIONS 递增受影响前缀的版本号，
+  原生端点和 v1 路由的写操作都会使相关的缓存失效
 """
-import json
+import os
 import hashlib
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 from datetime import datetime
 from app.core.timezone_config import now_beijing
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import Response, JSONResponse
@@ -15,9 +30,134 @@ from fastapi import FastAPI
 
 from .redis_client import cache_service
 from .cache_config import get_cache_config
+from .cache_generations import cache_generations, versioned_prefix
+from .security import verify_token
+from .principal_cache import get_cached_principal, load_principal
 
 logger = logging.getLogger(__name__)
 
+CACHE_KEY_PREFIX = "api_response"
+
+# 是否启用响应缓存
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+
+# 可缓存响应体的最大字节数
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(1024 * 1024)))
+
+# 未由接口自行指定时下发的缓存控制头
+DEFAULT_CACHE_CONTROL = "private, max-age=0, must-revalidate"
+VARY_HEADERS = ["Authorization", "Cookie"]
+
+# 缓存的响应体是字节串，使用 pickle 并按大小压缩（见 cache_serializers）
+RESPONSE_CACHE_SERIALIZE = 'pickle'
+RESPONSE_CACHE_COMPRESSION = 'zstd'
+
+# 不随缓存保存的响应头（由重新构造的响应生成，或不应在用户间复用）
+_UNCACHED_HEADERS = {"content-length", "set-cookie", "x-cache", "x-cache-date", "etag"}
+
+# 路由挂载点：enhanced_main 把 v1 路由挂在 /api 下，原生端点同样以 /api 开头
+API_PREFIX = "/api"
+
+# 可缓存的路径前缀（相对挂载点），每个前缀是一个失效命名空间
+CACHEABLE_ROUTES = [
+    "/users",
+    "/subnets",
+    "/ips",
+    "/tags",
+    "/custom-fields",
+    "/monitoring/dashboard",
+    "/monitoring/statistics",
+    "/monitoring/ip-utilization",
+    "/monitoring/subnet-utilization",
+    "/monitoring/top-utilized-subnets",
+    "/v1/stats",
+    "/reports"
+]
+
+# 不缓存的路径前缀（相对挂载点）：认证、个人信息、按用户写入的搜索记录、位图状态和实时推送
+NON_CACHEABLE_ROUTES = [
+    "/auth",
+    "/users/profile",
+    "/ips/search-history",
+    "/ips/search-favorites",
+    "/ips/bitmap",
+    "/live"
+]
+
+CACHEABLE_PATHS = [f"{API_PREFIX}{route}" for route in CACHEABLE_ROUTES]
+
+NON_CACHEABLE_PATHS = [f"{API_PREFIX}{route}" for route in NON_CACHEABLE_ROUTES] + [
+    "/health",
+    "/docs",
+    "/openapi.json"
+]
+
+# 地址和网段的写操作会改变的数据：地址列表、网段列表（含使用率）、监控统计
+_IP_DATA_ROUTES = ("/ips", "/subnets", "/monitoring", "/v1/stats")
+
+# 写请求路径前缀（相对挂载点）-> 需要失效的路径前缀，按最长前缀匹配
+WRITE_INVALIDATIONS = {
+    "/ips": _IP_DATA_ROUTES,
+    "/subnets": _IP_DATA_ROUTES,
+    # enhanced_main 的原生端点 POST /api/v1/subnets、/api/v1/ip-addresses（不是 v1 路由，v1 路由挂在 /api 下）
+    "/v1/ip-addresses": _IP_DATA_ROUTES,
+    "/v1/subnets": _IP_DATA_ROUTES,
+    # 删除用户会级联删除其分配的地址和创建的网段
+    "/users": ("/users",) + _IP_DATA_ROUTES,
+    "/tags": ("/tags", "/subnets"),
+    "/custom-fields": ("/custom-fields", "/ips", "/subnets"),
+}
+
+# 会改变数据的HTTP方法
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# 不改变缓存数据的写请求（用 POST 的查询、按用户保存的搜索记录）
+NON_INVALIDATING_ROUTES = (
+    "/ips/advanced-search",
+    "/ips/search-history",
+    "/ips/search-favorites",
+    "/subnets/validate",
+)
+
+
+def write_invalidation_paths(path: str) -> List[str]:
+    """写请求需要失效的路径前缀（完整路径），不影响缓存数据时返回空列表"""
+    if not path.startswith(API_PREFIX):
+        return []
+    route = path[len(API_PREFIX):]
+    if route.startswith(NON_INVALIDATING_ROUTES):
+        return []
+    matched = [prefix for prefix in WRITE_INVALIDATIONS if route == prefix or route.startswith(prefix + "/")]
+    if not matched:
+        return []
+    return [f"{API_PREFIX}{target}" for target in WRITE_INVALIDATIONS[max(matched, key=len)]]
+
+
+def path_namespace(cacheable_path: str) -> str:
+    """路径前缀对应的缓存命名空间"""
+    return f"{CACHE_KEY_PREFIX}:{cacheable_path}"
+
+
+def user_namespace(user_id: Any) -> str:
+    """用户级版本号命名空间，递增后该用户的所有响应缓存失效"""
+    return f"{CACHE_KEY_PREFIX}:user:{user_id}"
+
+
+def compute_etag(body: bytes) -> str:
+    """强 ETag：响应体摘要"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match 比较（弱比较，忽略 W/ 前缀）"""
+    if not if_none_match or not etag:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any((candidate[2:] if candidate.startswith("W/") else candidate) == opaque for candidate in candidates)
+
 
 class ResponseCacheMiddleware(BaseHTTPMiddleware):
     """API响应缓存中间件"""
@@ -25,62 +165,91 @@ class ResponseCacheMiddleware(BaseHTTPMiddleware):
     def __init__(self, app: FastAPI, cache_enabled: bool = True):
         super().__init__(app)
         self.cache_enabled = cache_enabled
-        self.cache_key_prefix = "api_response"
+        self.cache_key_prefix = CACHE_KEY_PREFIX
         
         # 可缓存的HTTP方法
         self.cacheable_methods = {"GET"}
         
         # 可缓存的路径模式
-        self.cacheable_paths = [
-            "/api/v1/users",
-            "/api/v1/subnets",
-            "/api/v1/ips",
-            "/api/v1/tags",
-            "/api/v1/custom-fields",
-            "/api/v1/monitoring/dashboard",
-            "/api/v1/monitoring/statistics",
-            "/api/v1/reports"
-        ]
+        self.cacheable_paths = list(CACHEABLE_PATHS)
         
         # 不缓存的路径模式
-        self.non_cacheable_paths = [
-            "/api/v1/auth",
-            "/api/v1/users/profile",
-            "/health",
-            "/docs",
-            "/openapi.json"
-        ]
+        self.non_cacheable_paths = list(NON_CACHEABLE_PATHS)
         
         # 默认缓存TTL（秒）
         self.default_ttl = 60
+        
+        # 可缓存响应体的最大字节数
+        self.max_body_bytes = RESPONSE_CACHE_MAX_BYTES
     
     async def dispatch(self, request: Request, call_next):
         """处理请求和响应"""
         if not self.cache_enabled:
             return await call_next(request)
         
+        if request.method in WRITE_METHODS:
+            response = await call_next(request)
+            # 写操作已完成：递增受影响路径的版本号，之后的读取和 If-None-Match 校验不再命中旧响应
+            if response.status_code < 400:
+                paths = write_invalidation_paths(request.url.path)
+                if paths:
+                    cache_invalidation_service.invalidate_by_paths(paths)
+            return response
+        
         # 检查是否应该缓存此请求
         if not self._should_cache_request(request):
             return await call_next(request)
         
+        # 校验身份：令牌无效、用户已停用或令牌已失效时不使用缓存
+        user_id = await self._verified_user_id(request)
+        if user_id is None:
+            return await call_next(request)
+        
         # 生成缓存键
-        cache_key = self._generate_cache_key(request)
+        cache_key = self._generate_cache_key(request, user_id)
+        if_none_match = request.headers.get("if-none-match")
+        
+        # 条件请求先比对单独保存的 ETag，一致时不读取响应体
+        if if_none_match:
+            cached_etag = self._get_cached_etag(cache_key)
+            if etag_matches(if_none_match, cached_etag):
+                logger.debug(f"Cache revalidated for {request.url.path}")
+                return self._not_modified(cached_etag, {}, "HIT")
         
         # 尝试从缓存获取响应
         cached_response = self._get_cached_response(cache_key)
         if cached_response:
             logger.debug(f"Cache hit for {request.url.path}")
+            if etag_matches(if_none_match, cached_response.get("etag")):
+                return self._not_modified(cached_response["etag"], cached_response.get("headers", {}), "HIT")
             return self._create_response_from_cache(cached_response)
         
         # 执行请求
         response = await call_next(request)
         
         # 缓存响应（如果适合）
-        if self._should_cache_response(response):
-            await self._cache_response(cache_key, response)
-            logger.debug(f"Cached response for {request.url.path}")
+        if not self._should_cache_response(response):
+            return response
+        
+        body = await self._capture_body(response)
+        if body is None:
+            # 响应体过大，已转为流式透传
+            response.headers["X-Cache"] = "BYPASS"
+            return response
         
-        return response
+        headers = self._cacheable_headers(response)
+        etag = compute_etag(body)
+        self._cache_response(cache_key, response.status_code, headers, body, etag, self._get_cache_ttl(response))
+        logger.debug(f"Cached response for {request.url.path}")
+        
+        if etag_matches(if_none_match, etag):
+            return self._not_modified(etag, headers, "MISS", background=response.background)
+        return Response(
+            content=body,
+            status_code=response.status_code,
+            headers=self._with_validators(headers, etag, "MISS"),
+            background=response.background
+        )
     
     def _should_cache_request(self, request: Request) -> bool:
         """判断是否应该缓存请求"""
@@ -112,77 +281,164 @@ class ResponseCacheMiddleware(BaseHTTPMiddleware):
         if "no-cache" in cache_control or "no-store" in cache_control:
             return False
         
+        # 设置 Cookie 的响应不能在请求间复用
+        if "set-cookie" in response.headers:
+            return False
+        
         return True
     
-    def _generate_cache_key(self, request: Request) -> str:
-        """生成缓存键"""
+    @staticmethod
+    def _access_token(request: Request) -> Optional[str]:
+        authorization = request.headers.get("authorization") or ""
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token.strip():
+            return token.strip()
+        return request.cookies.get("access_token")
+    
+    async def _verified_user_id(self, request: Request) -> Optional[str]:
+        """
+        校验请求身份，返回缓存键中的用户标识：未携带令牌为 "anonymous"，否则为用户ID；
+        令牌无效、用户不存在或已停用、令牌版本已过期时返回 None（不使用缓存）
+        """
+        token = self._access_token(request)
+        if not token:
+            return "anonymous"
+        payload = verify_token(token, token_type="access")
+        if not payload or not str(payload.get("sub", "")).isdigit():
+            return None
+        user_id = int(payload["sub"])
+        try:
+            principal = get_cached_principal(user_id)
+            if principal is None:
+                principal = await run_in_threadpool(load_principal, user_id)
+        except Exception as e:
+            logger.error(f"Failed to verify principal for response cache: {e}")
+            return None
+        if not principal or not principal["is_active"]:
+            return None
+        # 与 get_current_user 一致：不带 ver 的旧令牌不校验版本
+        if payload.get("ver") and payload["ver"] != principal["token_version"]:
+            return None
+        return str(user_id)
+    
+    def _generate_cache_key(self, request: Request, user_id: str) -> str:
+        """
+        生成缓存键：api_response:<路径前缀>:v<版本>:<摘要>
+        路径前缀的版本号和用户版本号由一次 MGET 读取，失效时递增即可，不需要扫描键
+        """
         # 基础信息
         method = request.method
         path = request.url.path
         query_params = str(request.query_params)
         
-        # 用户信息（如果有认证）
-        user_id = getattr(request.state, 'user_id', 'anonymous')
+        cacheable_path = max((p for p in self.cacheable_paths if path.startswith(p)), key=len)
+        namespace = path_namespace(cacheable_path)
+        generations = cache_generations.current_many([namespace, user_namespace(user_id)])
         
         # 生成哈希
-        key_data = f"{method}:{path}:{query_params}:{user_id}"
+        key_data = f"{method}:{path}:{query_params}:{user_id}:{generations[user_namespace(user_id)]}"
         key_hash = hashlib.md5(key_data.encode()).hexdigest()
         
-        return f"{self.cache_key_prefix}:{key_hash}"
+        return f"{versioned_prefix(namespace, generations[namespace])}:{key_hash}"
+    
+    def _get_cached_etag(self, cache_key: str) -> Optional[str]:
+        """读取单独保存的 ETag"""
+        try:
+            etag = cache_service.get_raw(f"{cache_key}:etag")
+            return etag.decode() if isinstance(etag, bytes) else etag
+        except Exception as e:
+            logger.error(f"Failed to get cached etag: {e}")
+            return None
     
     def _get_cached_response(self, cache_key: str) -> Optional[Dict[str, Any]]:
         """从缓存获取响应"""
         try:
-            return cache_service.get(cache_key)
+            return cache_service.get(cache_key, RESPONSE_CACHE_SERIALIZE)
         except Exception as e:
             logger.error(f"Failed to get cached response: {e}")
             return None
     
-    async def _cache_response(self, cache_key: str, response: Response):
-        """缓存响应"""
+    async def _capture_body(self, response: Response) -> Optional[bytes]:
+        """
+        收集响应体，返回拼接后的字节
+        超过 max_body_bytes 时把已收集的块和剩余部分重新接成流式响应体，返回 None
+        """
+        chunks: List[bytes] = []
+        size = 0
+        iterator = response.body_iterator.__aiter__()
+        async for chunk in iterator:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(getattr(response, "charset", "utf-8"))
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                response.body_iterator = self._chain_body(chunks, iterator)
+                return None
+        return b"".join(chunks)
+    
+    @staticmethod
+    async def _chain_body(chunks: List[bytes], iterator: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        for chunk in chunks:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+    
+    @staticmethod
+    def _cacheable_headers(response: Response) -> Dict[str, str]:
+        return {key: value for key, value in response.headers.items() if key.lower() not in _UNCACHED_HEADERS}
+    
+    def _cache_response(self, cache_key: str, status_code: int, headers: Dict[str, str],
+                        body: bytes, etag: str, ttl: int):
+        """缓存响应体和 ETag"""
         try:
-            # 读取响应体
-            response_body = b""
-            async for chunk in response.body_iterator:
-                response_body += chunk
-            
-            # 重新创建响应体迭代器
-            response.body_iterator = self._create_body_iterator(response_body)
-            
-            # 准备缓存数据
             cache_data = {
-                "status_code": response.status_code,
-                "headers": dict(response.headers),
-                "body": response_body.decode('utf-8') if response_body else "",
+                "status_code": status_code,
+                "headers": headers,
+                "body": body,
+                "etag": etag,
                 "cached_at": now_beijing().isoformat()
             }
             
-            # 获取TTL
-            ttl = self._get_cache_ttl(response)
-            
             # 存储到缓存
-            cache_service.set(cache_key, cache_data, ttl)
+            cache_service.set(cache_key, cache_data, ttl, RESPONSE_CACHE_SERIALIZE, RESPONSE_CACHE_COMPRESSION)
+            cache_service.set_raw(f"{cache_key}:etag", etag, ttl)
             
         except Exception as e:
             logger.error(f"Failed to cache response: {e}")
     
-    def _create_body_iterator(self, body: bytes):
-        """创建响应体迭代器"""
-        async def body_iterator():
-            yield body
-        return body_iterator()
+    @staticmethod
+    def _with_validators(headers: Dict[str, str], etag: str, cache_status: str) -> Dict[str, str]:
+        """添加 ETag、Cache-Control、Vary 和缓存标识头"""
+        headers = dict(headers)
+        headers["ETag"] = etag
+        if not any(key.lower() == "cache-control" for key in headers):
+            headers["Cache-Control"] = DEFAULT_CACHE_CONTROL
+        vary_key = next((key for key in headers if key.lower() == "vary"), "Vary")
+        vary = [value.strip() for value in headers.get(vary_key, "").split(",") if value.strip()]
+        headers[vary_key] = ", ".join(vary + [value for value in VARY_HEADERS if value not in vary])
+        headers["X-Cache"] = cache_status
+        return headers
+    
+    def _not_modified(self, etag: str, headers: Dict[str, str], cache_status: str, background=None) -> Response:
+        """304 响应：只带校验和缓存相关的头"""
+        kept = {
+            key: value for key, value in headers.items()
+            if key.lower() in ("cache-control", "vary", "expires", "content-location")
+        }
+        return Response(status_code=304, headers=self._with_validators(kept, etag, cache_status), background=background)
     
     def _create_response_from_cache(self, cached_data: Dict[str, Any]) -> Response:
-        """从缓存数据创建响应"""
+        """从缓存数据创建响应（直接发送缓存的字节）"""
         try:
-            headers = cached_data.get("headers", {})
-            
-            # 添加缓存标识头
-            headers["X-Cache"] = "HIT"
+            body = cached_data.get("body", b"")
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            etag = cached_data.get("etag") or compute_etag(body)
+            headers = self._with_validators(cached_data.get("headers", {}), etag, "HIT")
             headers["X-Cache-Date"] = cached_data.get("cached_at", "")
             
-            return JSONResponse(
-                content=json.loads(cached_data.get("body", "{}")),
+            return Response(
+                content=body,
                 status_code=cached_data.get("status_code", 200),
                 headers=headers
             )
@@ -250,13 +506,16 @@ class CacheControlDecorator:
 
 
 class CacheInvalidationService:
-    """缓存失效服务"""
+    """
+    缓存失效服务
+    按路径、用户或全部失效时递增对应的版本号（O(1)），旧版本的响应由 TTL 和后台清理回收
+    """
     
     def __init__(self):
-        self.cache_key_prefix = "api_response"
+        self.cache_key_prefix = CACHE_KEY_PREFIX
     
     def invalidate_by_pattern(self, pattern: str) -> int:
-        """根据模式失效缓存"""
+        """根据模式失效缓存（SCAN 删除，只用于无法按路径或用户失效的场景）"""
         try:
             full_pattern = f"{self.cache_key_prefix}:*{pattern}*"
             return cache_service.clear_pattern(full_pattern)
@@ -265,20 +524,25 @@ class CacheInvalidationService:
             return 0
     
     def invalidate_by_path(self, path: str) -> int:
-        """根据路径失效缓存"""
+        """根据路径失效缓存：与该路径重叠的可缓存路径前缀全部递增版本号，返回失效的前缀数"""
+        return self.invalidate_by_paths([path])
+    
+    def invalidate_by_paths(self, paths: List[str]) -> int:
+        """多个路径一起失效（一次 pipeline）"""
         try:
-            # 生成路径相关的缓存键模式
-            pattern = f"*{path}*"
-            return self.invalidate_by_pattern(pattern)
+            namespaces = [
+                path_namespace(cacheable_path) for cacheable_path in CACHEABLE_PATHS
+                if any(cacheable_path.startswith(path) or path.startswith(cacheable_path) for path in paths)
+            ]
+            return len(cache_generations.bump(namespaces))
         except Exception as e:
-            logger.error(f"Failed to invalidate cache by path {path}: {e}")
+            logger.error(f"Failed to invalidate cache by paths {paths}: {e}")
             return 0
     
     def invalidate_user_cache(self, user_id: int) -> int:
         """失效用户相关的缓存"""
         try:
-            pattern = f"*:{user_id}"
-            return self.invalidate_by_pattern(pattern)
+            return len(cache_generations.bump([user_namespace(user_id)], collect=False))
         except Exception as e:
             logger.error(f"Failed to invalidate user cache for {user_id}: {e}")
             return 0
@@ -286,8 +550,7 @@ class CacheInvalidationService:
     def invalidate_all_api_cache(self) -> int:
         """失效所有API缓存"""
         try:
-            pattern = f"{self.cache_key_prefix}:*"
-            return cache_service.clear_pattern(pattern)
+            return len(cache_generations.bump([path_namespace(path) for path in CACHEABLE_PATHS]))
         except Exception as e:
             logger.error(f"Failed to invalidate all API cache: {e}")
             return 0
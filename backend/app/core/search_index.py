@@ -0,0 +1,86 @@
+"""
+IP记录全文检索
+基于 MySQL FULLTEXT 索引（ngram 分词，见 alembic 010），代替多字段 LIKE '%term%' 全表扫描。
+索引由 InnoDB 在每次写入时同步维护，应用层只负责把查询词转换为 BOOLEAN MODE 表达式并排序：
+
+- 中文按 ngram 切分，短于 ngram_token_size 的词（如单字姓氏）用前缀通配
+- MAC 片段统一为小写冒号分隔（00-1A-2B、001a.2b3c 均转换为 00:1a:2b...），
+  不带分隔符的十六进制串同时匹配原样和冒号分隔两种写法
+- 结果按相关度排序，字段与查询完全相等时额外加权
+"""
+import os
+import re
+from typing import Optional, Tuple
+
+# 是否使用全文索引（索引未创建的环境可关闭，回退到 LIKE）
+IP_SEARCH_FULLTEXT = os.getenv('IP_SEARCH_FULLTEXT', 'true').lower() == 'true'
+
+# 与 MySQL 的 ngram_token_size 一致
+NGRAM_TOKEN_SIZE = int(os.getenv('MYSQL_NGRAM_TOKEN_SIZE', '2'))
+
+# 全文索引覆盖的列，MATCH() 的列必须与索引定义完全一致
+SEARCH_COLUMNS = ('user_name', 'assigned_to', 'mac_address', 'device_type', 'location', 'description')
+
+# 字段与查询完全相等时的加权
+EXACT_MATCH_BOOSTS = (
+    ('user_name', 100),
+    ('mac_address', 100),
+    ('assigned_to', 60),
+    ('device_type', 20),
+    ('location', 20),
+)
+
+_MAC_SEPARATED = re.compile(r'^[0-9a-fA-F]{1,4}([:\-.][0-9a-fA-F]{1,4})+$')
+_HEX_ONLY = re.compile(r'^[0-9a-fA-F]{6,12}$')
+_WORD_CHARS = re.compile(r'^[\w一-鿿]+$')
+
+
+def _colonize(hex_digits: str) -> str:
+    hex_digits = hex_digits.lower()
+    return ':'.join(hex_digits[i:i + 2] for i in range(0, len(hex_digits), 2))
+
+
+def _term_expression(term: str) -> Optional[str]:
+    """单个查询词转换为 BOOLEAN MODE 子表达式，无法检索时返回 None"""
+    if _MAC_SEPARATED.match(term):
+        digits = re.sub(r'[:\-.]', '', term)
+        if len(digits) % 2 == 0:
+            return f'"{_colonize(digits)}"'
+        return f'"{term.lower()}"'
+    if _HEX_ONLY.match(term) and re.search(r'[a-fA-F]', term) and len(term) % 2 == 0:
+        # 可能是去掉分隔符的MAC片段：原样或冒号分隔任一命中即可
+        return f'("{term}" "{_colonize(term)}")'
+
+    term = term.replace('"', '')
+    if not term:
+        return None
+    if len(term) < NGRAM_TOKEN_SIZE:
+        # 短于分词长度的词无法作为短语检索，改用前缀通配（仅限字母数字和汉字）
+        return f'{term}*' if _WORD_CHARS.match(term) else None
+    return f'"{term}"'
+
+
+def build_boolean_query(query: str, require_all: bool = True) -> Optional[str]:
+    """
+    将用户输入转换为 BOOLEAN MODE 查询
+    require_all 为 True 时每个词都必须命中（任一字段），否则任一词命中即可、命中越多相关度越高；
+    没有可检索的词时返回 None
+    """
+    expressions = [expression for expression in map(_term_expression, query.split()) if expression]
+    if not expressions:
+        return None
+    operator = '+' if require_all else ''
+    return ' '.join(f'{operator}{expression}' for expression in expressions)
+
+
+def match_condition(boolean_query: str, prefix: str = '') -> Tuple[str, list]:
+    """WHERE 条件：MATCH(...) AGAINST (... IN BOOLEAN MODE)"""
+    columns = ', '.join(f'{prefix}{column}' for column in SEARCH_COLUMNS)
+    return f"MATCH({columns}) AGAINST (%s IN BOOLEAN MODE)", [boolean_query]
+
+
+def relevance_expression(boolean_query: str, query: str, prefix: str = '') -> Tuple[str, list]:
+    """排序表达式：全文相关度 + 完全匹配加权（列为 NULL 时 <=> 得 0，不会让整个表达式变成 NULL）"""
+    match_sql, params = match_condition(boolean_query, prefix)
+    boosts = ' + '.join(f'({prefix}{column} <=> %s) * {weight}' for column, weight in EXACT_MATCH_BOOSTS)
+    return f"({match_sql} + {boosts})", params + [query.strip()] * len(EXACT_MATCH_BOOSTS)
@@ -4,16 +4,27 @@
 """
 from datetime import datetime, timedelta
 from app.core.timezone_config import now_beijing
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
 from .config import settings
+from .password_hashing import password_hasher
+import os
 import secrets
 import string
 
+# bcrypt 工作因子；调整后，旧工作因子的哈希在用户下次登录时重新计算
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
 # 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -26,8 +37,44 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     
     Returns:
         bool: 密码匹配返回True，否则返回False
+    
+    Raises:
+        PasswordHasherBusy: 哈希队列已满（429）
+    """
+    return password_hasher.run(pwd_context.verify, plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    验证密码，哈希的工作因子与当前配置不一致时同时生成新哈希（同一次线程池任务中完成）
+    
+    Args:
+        plain_password: 明文密码
+        hashed_password: 哈希密码
+    
+    Returns:
+        tuple: (是否匹配, 需要写回的新哈希；无需更新时为None)
+    
+    Raises:
+        PasswordHasherBusy: 哈希队列已满（429）
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    valid, new_hash = password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
+    if valid and new_hash:
+        password_hasher.record_rehash()
+    return valid, new_hash if valid else None
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    verify_and_update_password 的异步版本，等待哈希结果期间不占用事件循环和数据库线程
+    
+    Raises:
+        PasswordHasherBusy: 哈希队列已满（429）
+    """
+    valid, new_hash = await password_hasher.run_async(pwd_context.verify_and_update, plain_password, hashed_password)
+    if valid and new_hash:
+        password_hasher.record_rehash()
+    return valid, new_hash if valid else None
 
 
 def get_password_hash(password: str) -> str:
@@ -39,8 +86,25 @@ def get_password_hash(password: str) -> str:
     
     Returns:
         str: 哈希密码
+    
+    Raises:
+        PasswordHasherBusy: 哈希队列已满（429）
+    """
+    return password_hasher.run(pwd_context.hash, password)
+
+
+def token_version(credential_version: Optional[int]) -> str:
+    """
+    令牌版本：写入令牌的 ver 字段，取自 users.credential_version
+    修改或重置密码时该列加一，之前签发的令牌随之失效；登录时按新工作因子重新计算哈希不改变版本
+    
+    Args:
+        credential_version: 用户的凭据版本
+    
+    Returns:
+        str: 令牌版本
     """
-    return pwd_context.hash(password)
+    return f"c{int(credential_version or 0)}"
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
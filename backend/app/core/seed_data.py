@@ -283,6 +283,7 @@ def reset_admin_password(new_password: str = "admin123") -> bool:
                 return False
             
             admin_user.password_hash = hash_password(new_password)
+            admin_user.credential_version = (admin_user.credential_version or 0) + 1
             db.commit()
             
             logger.info("Admin password reset successfully")
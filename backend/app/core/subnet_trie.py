@@ -0,0 +1,261 @@
+"""
+网段前缀树（二进制 radix trie）
+所有网段按网络地址的比特位挂在一棵深度不超过 32 的前缀树上，以下查询只沿一条路径走 prefixlen 步
+（加上命中的子树规模），不再对每个网段解析 ip_network 后逐个比较：
+
+- 重叠：路径上的祖先（包含新网段的大网段）+ 目标节点下的子树（被新网段包含的小网段）
+- 包含：supernets / subnets_of
+- 归属：longest_match，给定裸IP返回最具体的网段
+- 空闲空间：free_blocks，大网段中未被任何网段占用的 CIDR 块
+
+前缀树在进程内共享（subnet_index），网段增删改后调用 invalidate()；
+其他进程的写入通过 subnet_index_generation 版本号发现（subnets 的网络地址变化时由触发器递增，
+见迁移 014 / database/init.sql），每次使用前按主键读取一行，版本号变化时重建。
+"""
+import ipaddress
+import os
+import threading
+import logging
+from typing import Any, Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# 每次使用前是否校验网段版本号（多进程部署需开启）
+SUBNET_INDEX_VERIFY = os.getenv('SUBNET_INDEX_VERIFY', 'true').lower() == 'true'
+
+SIGNATURE_SQL = "SELECT generation FROM subnet_index_generation WHERE id = 1"
+LOAD_SQL = "SELECT id, network FROM subnets"
+
+_ADDRESS_BITS = 32
+
+
+class SubnetEntry(NamedTuple):
+    id: int
+    network: ipaddress.IPv4Network
+
+
+class _Node:
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children: List[Optional["_Node"]] = [None, None]
+        # 同一前缀通常只有一个网段，历史数据中可能存在写法不同的重复网段
+        self.entries: List[SubnetEntry] = []
+
+
+def _bit(address: int, index: int) -> int:
+    return (address >> (_ADDRESS_BITS - 1 - index)) & 1
+
+
+def parse_network(network: Any) -> Optional[ipaddress.IPv4Network]:
+    """解析网段（非严格模式），无效或非 IPv4 时返回 None"""
+    if isinstance(network, ipaddress.IPv4Network):
+        return network
+    try:
+        parsed = ipaddress.ip_network(str(network).strip(), strict=False)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, ipaddress.IPv4Network) else None
+
+
+class SubnetTrie:
+    """网段前缀树"""
+
+    def __init__(self, rows: Iterable[Tuple[int, Any]] = ()):
+        self._root = _Node()
+        self.size = 0
+        for subnet_id, network in rows:
+            self.insert(subnet_id, network)
+
+    def insert(self, subnet_id: int, network: Any) -> bool:
+        """插入网段，无法解析的网段忽略并返回 False"""
+        parsed = parse_network(network)
+        if parsed is None:
+            return False
+        address = int(parsed.network_address)
+        node = self._root
+        for index in range(parsed.prefixlen):
+            bit = _bit(address, index)
+            if node.children[bit] is None:
+                node.children[bit] = _Node()
+            node = node.children[bit]
+        node.entries.append(SubnetEntry(subnet_id, parsed))
+        self.size += 1
+        return True
+
+    def _path(self, address: int, prefixlen: int) -> Tuple[List[SubnetEntry], Optional[_Node]]:
+        """沿路径收集前缀长度小于 prefixlen 的网段，返回 (祖先网段, 目标节点)；路径中断时目标节点为 None"""
+        ancestors: List[SubnetEntry] = []
+        node = self._root
+        for index in range(prefixlen):
+            ancestors.extend(node.entries)
+            node = node.children[_bit(address, index)]
+            if node is None:
+                return ancestors, None
+        return ancestors, node
+
+    @staticmethod
+    def _subtree(node: _Node) -> List[SubnetEntry]:
+        entries: List[SubnetEntry] = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            entries.extend(current.entries)
+            stack.extend(child for child in current.children if child is not None)
+        return entries
+
+    def supernets(self, network: Any, include_self: bool = True) -> List[SubnetEntry]:
+        """包含该网段的网段（由大到小）"""
+        parsed = parse_network(network)
+        if parsed is None:
+            return []
+        ancestors, node = self._path(int(parsed.network_address), parsed.prefixlen)
+        if include_self and node is not None:
+            ancestors.extend(node.entries)
+        return ancestors
+
+    def subnets_of(self, network: Any, include_self: bool = True) -> List[SubnetEntry]:
+        """被该网段包含的网段"""
+        parsed = parse_network(network)
+        if parsed is None:
+            return []
+        _, node = self._path(int(parsed.network_address), parsed.prefixlen)
+        if node is None:
+            return []
+        entries = self._subtree(node)
+        if not include_self:
+            entries = [entry for entry in entries if entry.network.prefixlen != parsed.prefixlen]
+        return entries
+
+    def overlapping(self, network: Any, exclude_id: Optional[int] = None) -> List[SubnetEntry]:
+        """与该网段重叠的网段：包含它的、与它相同的和被它包含的"""
+        parsed = parse_network(network)
+        if parsed is None:
+            return []
+        ancestors, node = self._path(int(parsed.network_address), parsed.prefixlen)
+        entries = ancestors + (self._subtree(node) if node is not None else [])
+        return [entry for entry in entries if entry.id != exclude_id]
+
+    def matches(self, ip: Any) -> List[SubnetEntry]:
+        """包含该IP的全部网段，最具体的在前"""
+        try:
+            address = int(ipaddress.IPv4Address(str(ip).strip()))
+        except ValueError:
+            return []
+        ancestors, node = self._path(address, _ADDRESS_BITS)
+        if node is not None:
+            ancestors.extend(node.entries)
+        return ancestors[::-1]
+
+    def longest_match(self, ip: Any) -> Optional[SubnetEntry]:
+        """最长前缀匹配：包含该IP的最具体网段"""
+        matches = self.matches(ip)
+        return matches[0] if matches else None
+
+    def free_blocks(self, network: Any, min_prefixlen: Optional[int] = None,
+                    limit: Optional[int] = None) -> List[ipaddress.IPv4Network]:
+        """
+        网段中未被任何网段占用的最大 CIDR 块（按地址排序）
+        min_prefixlen 过滤掉比它更小的块（如只要 /24 及更大的空闲块）；
+        该网段本身或其祖先已被占用时返回空列表
+        """
+        parsed = parse_network(network)
+        if parsed is None:
+            return []
+        ancestors, node = self._path(int(parsed.network_address), parsed.prefixlen)
+        if ancestors:
+            return []
+        if node is None:
+            return [parsed] if min_prefixlen is None or parsed.prefixlen <= min_prefixlen else []
+
+        blocks: List[ipaddress.IPv4Network] = []
+        # 深度优先、先 0 后 1，保证结果按地址排序
+        stack: List[Tuple[Optional[_Node], int, int]] = [(node, int(parsed.network_address), parsed.prefixlen)]
+        while stack and (limit is None or len(blocks) < limit):
+            current, address, prefixlen = stack.pop()
+            if min_prefixlen is not None and prefixlen > min_prefixlen:
+                continue
+            if current is None:
+                blocks.append(ipaddress.IPv4Network((address, prefixlen)))
+                continue
+            if current.entries or prefixlen == _ADDRESS_BITS:
+                continue
+            half = 1 << (_ADDRESS_BITS - prefixlen - 1)
+            stack.append((current.children[1], address + half, prefixlen + 1))
+            stack.append((current.children[0], address, prefixlen + 1))
+        return blocks
+
+
+class SubnetIndex:
+    """进程内共享的网段前缀树，失效后或网段版本号变化时按需重建"""
+
+    def __init__(self):
+        self._trie: Optional[SubnetTrie] = None
+        self._signature: Optional[Hashable] = None
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "rebuilds": 0}
+
+    def get(self, loader: Callable[[], Iterable[Tuple[int, Any]]],
+            signature_loader: Optional[Callable[[], Hashable]] = None) -> SubnetTrie:
+        """
+        获取前缀树
+        loader 返回全部网段的 (id, network)；signature_loader 返回当前网段版本号，
+        与构建时不一致说明其他进程修改过网段
+        """
+        signature = signature_loader() if signature_loader and SUBNET_INDEX_VERIFY else None
+        with self._lock:
+            if self._trie is not None and (signature is None or signature == self._signature):
+                self._stats["hits"] += 1
+                return self._trie
+            trie = SubnetTrie(loader())
+            self._trie = trie
+            self._signature = signature
+            self._stats["rebuilds"] += 1
+            logger.debug(f"Subnet trie rebuilt with {trie.size} subnets")
+            return trie
+
+    def invalidate(self) -> None:
+        """网段增删改后调用"""
+        with self._lock:
+            self._trie = None
+            self._signature = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": self._trie is not None,
+                "subnets": self._trie.size if self._trie is not None else 0,
+                "verify": SUBNET_INDEX_VERIFY,
+                **self._stats,
+            }
+
+
+subnet_index = SubnetIndex()
+
+
+def _row_values(row) -> tuple:
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+
+def trie_from_cursor(cursor) -> SubnetTrie:
+    """通过 pymysql 游标获取前缀树（DictCursor 与普通游标均可）"""
+    def signature():
+        cursor.execute(SIGNATURE_SQL)
+        row = cursor.fetchone()
+        return _row_values(row) if row else ()
+
+    def load():
+        cursor.execute(LOAD_SQL)
+        return [_row_values(row) for row in cursor.fetchall()]
+
+    return subnet_index.get(load, signature)
+
+
+def trie_from_session(db) -> SubnetTrie:
+    """通过 SQLAlchemy 会话获取前缀树"""
+    return subnet_index.get(
+        lambda: [tuple(row) for row in db.execute(text(LOAD_SQL))],
+        lambda: tuple(db.execute(text(SIGNATURE_SQL)).first() or ()),
+    )
@@ -3,6 +3,8 @@ from .user import User
 from .department import Department
 from .subnet import Subnet
 from .ip_address import IPAddress
+from .subnet_ip_counter import SubnetIPCounter
+from .utilization_history import SubnetUtilizationHistory
 from .custom_field import CustomField, CustomFieldValue
 from .tag import Tag, IPTag, SubnetTag
 from .audit_log import AuditLog
@@ -15,6 +17,8 @@ __all__ = [
     "Department",
     "Subnet", 
     "IPAddress",
+    "SubnetIPCounter",
+    "SubnetUtilizationHistory",
     "CustomField",
     "CustomFieldValue",
     "Tag",
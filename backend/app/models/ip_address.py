@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum, Computed, Index
+from sqlalchemy.dialects.mysql import INTEGER
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -17,6 +18,8 @@ class IPAddress(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     ip_address = Column(String(15), nullable=False, unique=True, index=True)
+    # IP地址的整数形式（MySQL存储生成列），用于排序和范围查询走索引
+    ip_int = Column(INTEGER(unsigned=True), Computed("INET_ATON(ip_address)", persisted=True), index=True)
     subnet_id = Column(Integer, ForeignKey("subnets.id", ondelete="CASCADE"), nullable=False, index=True)
     status = Column(Enum(IPStatus), default=IPStatus.AVAILABLE, index=True)
     mac_address = Column(String(17), index=True)
@@ -30,6 +33,10 @@ class IPAddress(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        Index("ix_ip_addresses_subnet_status_ip_int", "subnet_id", "status", "ip_int"),
+    )
+
     # Relationships
     subnet = relationship("Subnet", back_populates="ip_addresses")
     allocator = relationship("User", back_populates="allocated_ips")
@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
+import enum
+
+
+class SubnetStorageMode(str, enum.Enum):
+    DENSE = "dense"    # 每个主机地址都存一行（默认）
+    SPARSE = "sparse"  # 只存已分配/保留/冲突地址，可用地址由CIDR推算
 
 
 class Subnet(Base):
@@ -14,6 +20,8 @@ class Subnet(Base):
     description = Column(Text)
     vlan_id = Column(Integer, index=True)
     location = Column(String(100))
+    storage_mode = Column(Enum(SubnetStorageMode), nullable=False, default=SubnetStorageMode.DENSE,
+                          server_default=SubnetStorageMode.DENSE.value)
     created_by = Column(Integer, ForeignKey("users.id"), index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, SmallInteger, ForeignKey
+from app.core.database import Base
+
+
+class SubnetIPCounter(Base):
+    """网段IP状态计数（由 ip_addresses 上的触发器维护，只读；每个网段多行，按 subnet_id 求和）"""
+    __tablename__ = "subnet_ip_counters"
+
+    subnet_id = Column(Integer, ForeignKey("subnets.id", ondelete="CASCADE"), primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    total_count = Column(Integer, nullable=False, default=0, server_default="0")
+    available_count = Column(Integer, nullable=False, default=0, server_default="0")
+    allocated_count = Column(Integer, nullable=False, default=0, server_default="0")
+    reserved_count = Column(Integer, nullable=False, default=0, server_default="0")
+    conflict_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"<SubnetIPCounter(subnet_id={self.subnet_id}, slot={self.slot}, total={self.total_count})>"
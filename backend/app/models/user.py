@@ -23,6 +23,8 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False, index=True)
     password_hash = Column(String(255), nullable=False)
+    # 修改/重置密码时加一，作为令牌版本（重新计算哈希不改变）
+    credential_version = Column(Integer, nullable=False, default=0, server_default="0")
     email = Column(String(100))
     role = Column(Enum(UserRole), default=UserRole.USER, index=True)
     theme = Column(Enum(UserTheme), default=UserTheme.LIGHT)
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, DateTime, Enum
+from app.core.database import Base
+
+# subnet_id = ALL_SUBNETS 的序列为全部网段合计
+ALL_SUBNETS = 0
+
+
+class SubnetUtilizationHistory(Base):
+    """网段利用率历史汇总（由 utilization_history 后台任务按分钟/小时/天写入，只读）"""
+    __tablename__ = "subnet_utilization_history"
+
+    subnet_id = Column(Integer, primary_key=True)
+    resolution = Column(Enum('minute', 'hour', 'day', name='historyresolution'), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    allocations = Column(Integer, nullable=False, default=0, server_default="0")
+    releases = Column(Integer, nullable=False, default=0, server_default="0")
+    total_count = Column(Integer)
+    allocated_count = Column(Integer)
+    peak_allocated = Column(Integer)
+
+    def __repr__(self):
+        return (f"<SubnetUtilizationHistory(subnet_id={self.subnet_id}, resolution='{self.resolution}', "
+                f"bucket_start={self.bucket_start})>")
@@ -1,16 +1,180 @@
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Set, Tuple
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_, func, text
+from sqlalchemy import and_, or_, func, text, event
 from app.models.ip_address import IPAddress, IPStatus
-from app.models.subnet import Subnet
+from app.models.subnet import Subnet, SubnetStorageMode
+from app.models.subnet_ip_counter import SubnetIPCounter
 from app.schemas.ip_address import IPAddressCreate, IPAddressUpdate
+from app.core.ip_bitmap import ip_bitmaps, SubnetBitmap, IP_BITMAP_MAX_BITS
+from app.core.live_updates import publish_ip_changes
+from app.core.subnet_trie import trie_from_session
 import ipaddress
 
+# 会话中从位图取出、尚未提交的地址 [(subnet_id, ip_int)]
+BITMAP_CLAIMS_KEY = "ip_bitmap_claims"
+
+
+@event.listens_for(Session, "after_commit")
+def _keep_bitmap_claims(session):
+    """事务已提交：取出的地址保持占用"""
+    session.info.pop(BITMAP_CLAIMS_KEY, None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_bitmap_claims(session, transaction):
+    """最外层事务未提交就结束（回滚、关闭）：取出的地址恢复为空闲"""
+    if transaction.parent is None:
+        ip_bitmaps.rollback(session.info.pop(BITMAP_CLAIMS_KEY, ()))
+
+
+def subnet_host_range(network: str) -> Tuple[int, int]:
+    """网段可用主机地址的整数闭区间，与 hosts() 一致（/31、/32 包含全部地址）"""
+    net = ipaddress.ip_network(network, strict=False)
+    first = int(net.network_address)
+    last = int(net.broadcast_address)
+    if net.prefixlen < 31:
+        first += 1
+        last -= 1
+    return first, last
+
 
 class IPRepository:
     def __init__(self, db: Session):
         self.db = db
 
+    def get_sparse_subnet(self, subnet_id: int) -> Optional[Subnet]:
+        """网段为稀疏存储模式时返回网段对象，否则返回 None"""
+        subnet = self.db.query(Subnet).filter(Subnet.id == subnet_id).first()
+        if subnet and subnet.storage_mode == SubnetStorageMode.SPARSE:
+            return subnet
+        return None
+
+    def count_sparse_virtual(self, subnet_id: Optional[int] = None) -> Dict[int, int]:
+        """
+        统计稀疏网段中未存储（即可用）的地址数: {subnet_id: 虚拟可用数}
+        """
+        query = self.db.query(Subnet.id, Subnet.network).filter(Subnet.storage_mode == SubnetStorageMode.SPARSE)
+        if subnet_id:
+            query = query.filter(Subnet.id == subnet_id)
+
+        ranges = {}
+        for sparse_id, network in query.all():
+            try:
+                ranges[sparse_id] = subnet_host_range(network)
+            except ValueError:
+                continue
+        if not ranges:
+            return {}
+
+        # 已存记录数取自触发器维护的网段计数器，一条分组查询得到全部网段
+        stored = dict(
+            self.db.query(SubnetIPCounter.subnet_id, func.sum(SubnetIPCounter.total_count))
+            .filter(SubnetIPCounter.subnet_id.in_(list(ranges)))
+            .group_by(SubnetIPCounter.subnet_id)
+            .all()
+        )
+        return {
+            sparse_id: max(last - first + 1 - int(stored.get(sparse_id) or 0), 0)
+            for sparse_id, (first, last) in ranges.items()
+        }
+
+    def load_bitmap(self, subnet_id: int) -> Optional[SubnetBitmap]:
+        """从数据库构建网段空闲地址位图，网段不存在或超过位图上限时返回 None"""
+        subnet = self.db.query(Subnet).filter(Subnet.id == subnet_id).first()
+        if not subnet:
+            return None
+        try:
+            first, last = subnet_host_range(subnet.network)
+        except ValueError:
+            return None
+        if last - first + 1 > IP_BITMAP_MAX_BITS:
+            return None
+
+        sparse = subnet.storage_mode == SubnetStorageMode.SPARSE
+        query = self.db.query(IPAddress.ip_int).filter(IPAddress.ip_int >= first, IPAddress.ip_int <= last)
+        if sparse:
+            # 稀疏网段：区间内任何已占用记录（包括属于其他网段的记录）都不可分配
+            query = query.filter(or_(IPAddress.subnet_id != subnet_id, IPAddress.status != IPStatus.AVAILABLE))
+        else:
+            query = query.filter(IPAddress.subnet_id == subnet_id, IPAddress.status == IPStatus.AVAILABLE)
+        return SubnetBitmap.from_rows(subnet_id, first, last, sparse, (row.ip_int for row in query.all()))
+
+    def find_free_ip_int(self, first: int, last: int) -> Optional[int]:
+        """在 [first, last] 中查找最小的未存储地址（只扫描区间内已存记录）"""
+        candidate = self.db.execute(
+            text("""
+                SELECT MIN(candidate) FROM (
+                    SELECT :first AS candidate FROM DUAL
+                    WHERE NOT EXISTS (SELECT 1 FROM ip_addresses WHERE ip_int = :first)
+                    UNION ALL
+                    SELECT a.ip_int + 1 AS candidate
+                    FROM ip_addresses a
+                    WHERE a.ip_int >= :first AND a.ip_int < :last
+                    AND NOT EXISTS (SELECT 1 FROM ip_addresses b WHERE b.ip_int = a.ip_int + 1)
+                ) gaps
+            """),
+            {"first": first, "last": last}
+        ).scalar()
+        return int(candidate) if candidate is not None else None
+
+    def materialize_ip(self, subnet_id: int, ip_int: int) -> Optional[IPAddress]:
+        """为稀疏网段写入一条 available 记录（已存在则保持不变）并返回该地址记录"""
+        self.db.execute(
+            text(
+                "INSERT IGNORE INTO ip_addresses (ip_address, subnet_id, status, created_at) "
+                "VALUES (INET_NTOA(:ip_int), :subnet_id, 'available', NOW())"
+            ),
+            {"ip_int": ip_int, "subnet_id": subnet_id}
+        )
+        self.db.flush()
+        return self.db.query(IPAddress).filter(IPAddress.ip_int == ip_int).first()
+
+    def materialize_unstored(self, ip_addresses: List[str]) -> List[IPAddress]:
+        """
+        为没有存储行的地址按需写入 available 记录：只处理位于稀疏网段主机区间内的地址
+        （稀疏网段中显示为可用的地址没有存储行），返回写入的记录
+        """
+        trie = trie_from_session(self.db)
+        targets = {}
+        for ip_address in ip_addresses:
+            entry = trie.longest_match(ip_address)
+            if entry is not None:
+                targets[ip_address] = entry.id
+        if not targets:
+            return []
+
+        sparse = {
+            subnet.id: subnet
+            for subnet in self.db.query(Subnet).filter(
+                Subnet.id.in_(set(targets.values())),
+                Subnet.storage_mode == SubnetStorageMode.SPARSE
+            )
+        }
+        records = []
+        for ip_address, subnet_id in targets.items():
+            subnet = sparse.get(subnet_id)
+            if subnet is None:
+                continue
+            ip_int = int(ipaddress.IPv4Address(ip_address.strip()))
+            first, last = subnet_host_range(subnet.network)
+            if not first <= ip_int <= last:
+                continue
+            record = self.materialize_ip(subnet_id, ip_int)
+            if record is not None and record.subnet_id == subnet_id:
+                records.append(record)
+        return records
+
+    def sparse_subnet_ids(self, subnet_ids: List[int]) -> Set[int]:
+        """给定网段中使用稀疏存储的网段ID"""
+        if not subnet_ids:
+            return set()
+        return {
+            subnet_id for (subnet_id,) in self.db.query(Subnet.id).filter(
+                Subnet.id.in_(set(subnet_ids)),
+                Subnet.storage_mode == SubnetStorageMode.SPARSE
+            )
+        }
+
     def create(self, ip_data: IPAddressCreate) -> IPAddress:
         """创建新IP地址记录"""
         db_ip = IPAddress(
@@ -27,6 +191,8 @@ class IPRepository:
         self.db.add(db_ip)
         self.db.commit()
         self.db.refresh(db_ip)
+        ip_bitmaps.apply_status(db_ip.subnet_id, db_ip.ip_int, db_ip.status)
+        publish_ip_changes([db_ip.subnet_id], [(db_ip.subnet_id, db_ip.ip_address)])
         return db_ip
 
     def bulk_create(self, ip_data_list: List[IPAddressCreate]) -> List[IPAddress]:
@@ -53,6 +219,9 @@ class IPRepository:
         for db_ip in db_ips:
             self.db.refresh(db_ip)
         
+        for subnet_id in {db_ip.subnet_id for db_ip in db_ips}:
+            ip_bitmaps.invalidate(subnet_id)
+        publish_ip_changes(ip_addresses=[(db_ip.subnet_id, db_ip.ip_address) for db_ip in db_ips])
         return db_ips
 
     def get_by_id(self, ip_id: int) -> Optional[IPAddress]:
@@ -74,17 +243,68 @@ class IPRepository:
         )
 
     def get_by_subnet(self, subnet_id: int, skip: int = 0, limit: int = 100) -> List[IPAddress]:
-        """获取网段下的所有IP地址"""
+        """
+        获取网段下的所有IP地址
+        稀疏网段按CIDR整数区间分页，未存储的地址以未入库的 available 对象（id 为 None）补齐
+        """
+        subnet = self.get_sparse_subnet(subnet_id)
+        if subnet:
+            first, last = subnet_host_range(subnet.network)
+            window_start = first + skip
+            window_end = min(window_start + limit - 1, last)
+            if window_start > window_end:
+                return []
+            stored = {
+                ip.ip_int: ip
+                for ip in self.db.query(IPAddress).filter(
+                    IPAddress.subnet_id == subnet_id,
+                    IPAddress.ip_int >= window_start,
+                    IPAddress.ip_int <= window_end
+                ).all()
+            }
+            return [
+                stored.get(ip_int) or IPAddress(
+                    ip_address=str(ipaddress.IPv4Address(ip_int)),
+                    subnet_id=subnet_id,
+                    status=IPStatus.AVAILABLE
+                )
+                for ip_int in range(window_start, window_end + 1)
+            ]
+
         return (
             self.db.query(IPAddress)
             .filter(IPAddress.subnet_id == subnet_id)
+            .order_by(IPAddress.ip_int)
             .offset(skip)
             .limit(limit)
             .all()
         )
 
     def get_available_ips(self, subnet_id: int, limit: int = 10) -> List[IPAddress]:
-        """获取网段中可用的IP地址"""
+        """
+        获取网段中可用的IP地址
+        位图可用时直接取前 limit 个空闲地址再按 ip_int 取回记录，稀疏网段未存储的地址以未入库对象补齐
+        """
+        free_ints = ip_bitmaps.peek_free(subnet_id, limit, lambda: self.load_bitmap(subnet_id))
+        if free_ints is not None:
+            if not free_ints:
+                return []
+            stored = {
+                ip.ip_int: ip
+                for ip in self.db.query(IPAddress).filter(
+                    IPAddress.subnet_id == subnet_id,
+                    IPAddress.ip_int.in_(free_ints)
+                ).all()
+            }
+            return [
+                stored.get(ip_int) or IPAddress(
+                    ip_address=str(ipaddress.IPv4Address(ip_int)),
+                    subnet_id=subnet_id,
+                    status=IPStatus.AVAILABLE
+                )
+                for ip_int in free_ints
+            ]
+
         return (
             self.db.query(IPAddress)
             .filter(
@@ -93,10 +313,125 @@ class IPRepository:
                     IPAddress.status == IPStatus.AVAILABLE
                 )
             )
+            .order_by(IPAddress.ip_int)
             .limit(limit)
             .all()
         )
 
+    def claim_available_ip(self, subnet_id: int, max_attempts: int = 8) -> Optional[IPAddress]:
+        """
+        锁定网段中最小的可用地址（SELECT ... FOR UPDATE SKIP LOCKED）
+        行锁持有到事务提交，并发请求跳过已锁定的行，各自拿到不同地址；
+        稀疏网段已存储的可用地址用完时按需写入新地址
+        """
+        ip = self._claim_from_bitmap(subnet_id, max_attempts)
+        if ip:
+            return ip
+
+        sparse_subnet = None
+        search_first = None
+        for _ in range(max_attempts):
+            ip = (
+                self.db.query(IPAddress)
+                .filter(
+                    IPAddress.subnet_id == subnet_id,
+                    IPAddress.status == IPStatus.AVAILABLE
+                )
+                .order_by(IPAddress.ip_int)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if ip:
+                return ip
+
+            if sparse_subnet is None:
+                sparse_subnet = self.get_sparse_subnet(subnet_id) or False
+            if not sparse_subnet:
+                return None
+
+            first, last = subnet_host_range(sparse_subnet.network)
+            search_first = first if search_first is None else search_first
+            if search_first > last:
+                return None
+            free_int = self.find_free_ip_int(search_first, last)
+            if free_int is None:
+                return None
+            # 写入后下一轮由 SKIP LOCKED 查询认领；被其他事务抢先写入时从下一个地址继续找
+            self.materialize_ip(subnet_id, free_int)
+            search_first = free_int + 1
+        return None
+
+    def _claim_from_bitmap(self, subnet_id: int, max_attempts: int) -> Optional[IPAddress]:
+        """按位图候选逐个锁定地址，候选已被占用（位图过期）时继续下一个，位图不可用时返回 None"""
+        sparse = None
+        for _ in range(max_attempts):
+            ip_int = ip_bitmaps.acquire(subnet_id, lambda: self.load_bitmap(subnet_id), sparse=sparse)
+            if ip_int is None:
+                return None
+            claims = self.db.info.setdefault(BITMAP_CLAIMS_KEY, [])
+            claims.append((subnet_id, ip_int))
+            if sparse is None:
+                sparse = self.get_sparse_subnet(subnet_id) is not None
+            if sparse and not self.db.query(IPAddress.id).filter(IPAddress.ip_int == ip_int).first():
+                self.materialize_ip(subnet_id, ip_int)
+            ip = (
+                self.db.query(IPAddress)
+                .filter(
+                    IPAddress.ip_int == ip_int,
+                    IPAddress.subnet_id == subnet_id,
+                    IPAddress.status == IPStatus.AVAILABLE
+                )
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if ip:
+                return ip
+            # 数据库中已被占用：保持占用位，回滚时也不恢复
+            claims.remove((subnet_id, ip_int))
+            ip_bitmaps.record_stale_candidate()
+        return None
+
+    def get_by_ip_address_for_update(self, ip_address: str) -> Optional[IPAddress]:
+        """按IP地址查询并加行锁，用于指定地址分配时防止并发重复分配"""
+        return (
+            self.db.query(IPAddress)
+            .filter(IPAddress.ip_address == ip_address)
+            .with_for_update()
+            .first()
+        )
+
+    def get_by_ip_addresses_for_update(self, ip_addresses: List[str]) -> List[IPAddress]:
+        """按IP地址列表一次查询并加行锁，用于批量操作"""
+        if not ip_addresses:
+            return []
+        return (
+            self.db.query(IPAddress)
+            .filter(IPAddress.ip_address.in_(ip_addresses))
+            .with_for_update()
+            .all()
+        )
+
+    def bulk_update_status(self, ip_ids: List[int], allowed_statuses: List[IPStatus],
+                           values: Dict[Any, Any]) -> int:
+        """仅对当前状态在 allowed_statuses 中的记录执行一条批量 UPDATE，不提交，返回受影响行数"""
+        if not ip_ids:
+            return 0
+        return (
+            self.db.query(IPAddress)
+            .filter(IPAddress.id.in_(ip_ids), IPAddress.status.in_(allowed_statuses))
+            .update(values, synchronize_session=False)
+        )
+
+    def bulk_delete(self, ip_ids: List[int], allowed_statuses: List[IPStatus]) -> int:
+        """仅删除当前状态在 allowed_statuses 中的记录，不提交，返回删除行数"""
+        if not ip_ids:
+            return 0
+        return (
+            self.db.query(IPAddress)
+            .filter(IPAddress.id.in_(ip_ids), IPAddress.status.in_(allowed_statuses))
+            .delete(synchronize_session=False)
+        )
+
     def update(self, ip_id: int, ip_data: IPAddressUpdate) -> Optional[IPAddress]:
         """更新IP地址记录"""
         db_ip = self.get_by_id(ip_id)
@@ -109,6 +444,9 @@ class IPRepository:
 
         self.db.commit()
         self.db.refresh(db_ip)
+        if 'status' in update_data:
+            ip_bitmaps.apply_status(db_ip.subnet_id, db_ip.ip_int, db_ip.status)
+        publish_ip_changes([db_ip.subnet_id], [(db_ip.subnet_id, db_ip.ip_address)])
         return db_ip
 
     def delete(self, ip_id: int) -> bool:
@@ -117,8 +455,11 @@ class IPRepository:
         if not db_ip:
             return False
 
+        subnet_id, ip_int, ip_address = db_ip.subnet_id, db_ip.ip_int, db_ip.ip_address
         self.db.delete(db_ip)
         self.db.commit()
+        ip_bitmaps.apply_status(subnet_id, ip_int, None)
+        publish_ip_changes([subnet_id], [(subnet_id, ip_address)])
         return True
 
     def delete_by_subnet(self, subnet_id: int, status_filter: Optional[IPStatus] = None) -> int:
@@ -131,6 +472,8 @@ class IPRepository:
         deleted_count = query.count()
         query.delete()
         self.db.commit()
+        ip_bitmaps.invalidate(subnet_id)
+        publish_ip_changes([subnet_id])
         return deleted_count
 
     def check_ip_conflicts(self, subnet_id: int) -> List[IPAddress]:
@@ -171,6 +514,9 @@ class IPRepository:
             )
         )
         self.db.commit()
+        # 标记的地址可能分布在多个网段
+        ip_bitmaps.invalidate()
+        publish_ip_changes(resync=True)
         return updated_count
 
     def get_ip_statistics(self, subnet_id: Optional[int] = None) -> Dict[str, int]:
@@ -190,6 +536,9 @@ class IPRepository:
         for status, count in query.all():
             stats[status] = count
         
+        # 稀疏网段中未存储的地址计为可用
+        stats[IPStatus.AVAILABLE.value] += sum(self.count_sparse_virtual(subnet_id).values())
+        
         stats['total'] = sum(stats.values())
         return stats
 
@@ -227,8 +576,40 @@ class IPRepository:
         
         return results, total
 
+    def advanced_search_page(self, search_request) -> Dict[str, Any]:
+        """
+        高级搜索IP地址（支持游标分页）
+        按 search_request.count_mode 决定精确统计、估算或跳过总数
+        """
+        from app.services.query_builder import IPQueryBuilder
+        
+        query_builder = IPQueryBuilder(self.db)
+        search_query, count_query = query_builder.build_search_query(search_request, fetch_extra=True)
+        
+        results = search_query.all()
+        has_more = len(results) > search_request.limit
+        results = results[:search_request.limit]
+        
+        if search_request.count_mode == "exact":
+            total = count_query.scalar()
+        elif search_request.count_mode == "estimate":
+            total = query_builder.estimate_count(count_query)
+        else:
+            total = None
+        
+        return {
+            "items": results,
+            "total": total,
+            "has_more": has_more,
+            "next_cursor": query_builder.build_next_cursor(search_request, results[-1]) if has_more else None
+        }
+
     def count_by_subnet(self, subnet_id: int) -> int:
-        """统计网段中的IP地址数量"""
+        """统计网段中的IP地址数量（稀疏网段按CIDR主机数计算）"""
+        subnet = self.get_sparse_subnet(subnet_id)
+        if subnet:
+            first, last = subnet_host_range(subnet.network)
+            return last - first + 1
         return self.db.query(IPAddress).filter(IPAddress.subnet_id == subnet_id).count()
 
     def get_ip_range_status(self, start_ip: str, end_ip: str) -> List[Dict[str, Any]]:
@@ -246,16 +627,29 @@ class IPRepository:
             ip_range.append(str(current))
             current += 1
         
-        # 查询数据库中的IP状态
+        # 查询数据库中的IP状态（整数范围扫描，避免超长IN列表）
         db_ips = (
             self.db.query(IPAddress)
-            .filter(IPAddress.ip_address.in_(ip_range))
+            .filter(
+                IPAddress.ip_int >= int(start_addr),
+                IPAddress.ip_int <= int(end_addr)
+            )
             .all()
         )
         
         # 创建IP状态映射
         ip_status_map = {ip.ip_address: ip for ip in db_ips}
         
+        # 稀疏网段的主机区间：区间内未存储的地址为可用而不是未管理
+        sparse_ranges = []
+        for subnet in self.db.query(Subnet).filter(Subnet.storage_mode == SubnetStorageMode.SPARSE).all():
+            try:
+                first, last = subnet_host_range(subnet.network)
+            except ValueError:
+                continue
+            if first <= int(end_addr) and last >= int(start_addr):
+                sparse_ranges.append((first, last))
+        
         # 构建结果
         result = []
         for ip_str in ip_range:
@@ -269,9 +663,11 @@ class IPRepository:
                     'assigned_to': ip_obj.assigned_to
                 })
             else:
+                ip_int = int(ipaddress.ip_address(ip_str))
+                in_sparse = any(first <= ip_int <= last for first, last in sparse_ranges)
                 result.append({
                     'ip_address': ip_str,
-                    'status': 'not_managed',
+                    'status': IPStatus.AVAILABLE.value if in_sparse else 'not_managed',
                     'hostname': None,
                     'mac_address': None,
                     'assigned_to': None
@@ -287,14 +683,22 @@ class IPRepository:
             raise ValueError(f"无效的网段格式: {network}")
         
         # 获取当前网段中的所有IP地址
-        existing_ips = self.get_by_subnet(subnet_id, skip=0, limit=10000)
-        existing_ip_set = {ip.ip_address for ip in existing_ips}
-        
-        # 生成网段中应该存在的所有IP地址
-        expected_ips = {str(ip) for ip in net.hosts()}
+        existing_ip_set = {
+            row.ip_address
+            for row in self.db.query(IPAddress.ip_address).filter(IPAddress.subnet_id == subnet_id).all()
+        }
         
-        # 找出需要添加和删除的IP地址
-        ips_to_add = expected_ips - existing_ip_set
+        if self.get_sparse_subnet(subnet_id):
+            # 稀疏网段不补齐可用地址，只按整数区间找出越界记录
+            first, last = subnet_host_range(network)
+            expected_ips = {
+                ip for ip in existing_ip_set if first <= int(ipaddress.ip_address(ip)) <= last
+            }
+            ips_to_add = set()
+        else:
+            # 生成网段中应该存在的所有IP地址
+            expected_ips = {str(ip) for ip in net.hosts()}
+            ips_to_add = expected_ips - existing_ip_set
         ips_to_remove = existing_ip_set - expected_ips
         
         stats = {
@@ -333,4 +737,6 @@ class IPRepository:
             stats['added'] = len(new_ips)
         
         self.db.commit()
+        ip_bitmaps.invalidate(subnet_id)
+        publish_ip_changes([subnet_id])
         return stats
\ No newline at end of file
@@ -1,9 +1,12 @@
 from typing import List, Optional
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_, func
-from app.models.subnet import Subnet
+from sqlalchemy import and_, or_, func, case, cast, literal, Integer
+from app.models.subnet import Subnet, SubnetStorageMode
 from app.models.ip_address import IPAddress, IPStatus
+from app.models.subnet_ip_counter import SubnetIPCounter
+from app.models.tag import Tag
 from app.schemas.subnet import SubnetCreate, SubnetUpdate
+from app.core.subnet_trie import SubnetTrie, subnet_index, trie_from_session
 import ipaddress
 
 
@@ -11,7 +14,8 @@ class SubnetRepository:
     def __init__(self, db: Session):
         self.db = db
 
-    def create(self, subnet_data: SubnetCreate, created_by: int) -> Subnet:
+    def create(self, subnet_data: SubnetCreate, created_by: int,
+               storage_mode: SubnetStorageMode = SubnetStorageMode.DENSE) -> Subnet:
         """创建新网段"""
         db_subnet = Subnet(
             network=subnet_data.network,
@@ -20,10 +24,12 @@ class SubnetRepository:
             description=subnet_data.description,
             vlan_id=subnet_data.vlan_id,
             location=subnet_data.location,
+            storage_mode=storage_mode,
             created_by=created_by
         )
         self.db.add(db_subnet)
         self.db.commit()
+        subnet_index.invalidate()
         self.db.refresh(db_subnet)
         return db_subnet
 
@@ -41,16 +47,15 @@ class SubnetRepository:
 
     def get_with_stats(self, skip: int = 0, limit: int = 100) -> List[dict]:
         """获取带统计信息的网段列表"""
-        # 子查询：计算每个网段的IP统计
-        from sqlalchemy import case
+        # 子查询：按网段汇总计数器（触发器维护），不扫描地址表
         ip_stats = (
             self.db.query(
-                IPAddress.subnet_id,
-                func.count(IPAddress.id).label('total_ips'),
-                func.sum(case((IPAddress.status == IPStatus.ALLOCATED, 1), else_=0)).label('allocated_ips'),
-                func.sum(case((IPAddress.status == IPStatus.AVAILABLE, 1), else_=0)).label('available_ips')
+                SubnetIPCounter.subnet_id,
+                func.sum(SubnetIPCounter.total_count).label('total_ips'),
+                func.sum(SubnetIPCounter.allocated_count).label('allocated_ips'),
+                func.sum(SubnetIPCounter.available_count).label('available_ips')
             )
-            .group_by(IPAddress.subnet_id)
+            .group_by(SubnetIPCounter.subnet_id)
             .subquery()
         )
 
@@ -79,6 +84,95 @@ class SubnetRepository:
         
         return results
 
+    def _utilization_filters(self, vlan_id: Optional[int] = None, location: Optional[str] = None,
+                             tag_id: Optional[int] = None) -> list:
+        filters = []
+        if vlan_id is not None:
+            filters.append(Subnet.vlan_id == vlan_id)
+        if location:
+            filters.append(Subnet.location == location)
+        if tag_id is not None:
+            # EXISTS 而不是 JOIN，网段有多个标签时不会重复
+            filters.append(Subnet.tags.any(Tag.id == tag_id))
+        return filters
+
+    def get_utilization(self, vlan_id: Optional[int] = None, location: Optional[str] = None,
+                        tag_id: Optional[int] = None, sort_by: str = "utilization_rate",
+                        descending: bool = True, skip: int = 0, limit: int = 100) -> List[dict]:
+        """
+        网段使用率（一条分组聚合查询）
+        计数来自 subnet_ip_counters，过滤、排序和分页都在数据库中完成，语句数与网段数无关；
+        稀疏网段只存储已占用的地址，总数取 CIDR 主机数（与 hosts() 一致，/31、/32 包含全部地址）
+        """
+        ip_stats = (
+            self.db.query(
+                SubnetIPCounter.subnet_id,
+                func.sum(SubnetIPCounter.total_count).label('total_ips'),
+                func.sum(SubnetIPCounter.allocated_count).label('allocated_ips')
+            )
+            .group_by(SubnetIPCounter.subnet_id)
+            .subquery()
+        )
+        prefix_length = cast(func.substring_index(Subnet.network, '/', -1), Integer)
+        host_count = case(
+            (prefix_length >= 31, literal(1).op('<<')(32 - prefix_length)),
+            else_=literal(1).op('<<')(32 - prefix_length) - 2
+        )
+        total_ips = case(
+            (and_(Subnet.storage_mode == SubnetStorageMode.SPARSE, Subnet.network.contains('/')), host_count),
+            else_=func.coalesce(ip_stats.c.total_ips, 0)
+        )
+        allocated_ips = func.coalesce(ip_stats.c.allocated_ips, 0)
+        utilization_rate = func.coalesce(allocated_ips * 100.0 / func.nullif(total_ips, 0), 0)
+
+        sort_column = {
+            "utilization_rate": utilization_rate,
+            "allocated_ips": allocated_ips,
+            "total_ips": total_ips,
+            "network": Subnet.network,
+        }.get(sort_by, utilization_rate)
+
+        query = (
+            self.db.query(
+                Subnet.id,
+                Subnet.network,
+                Subnet.description,
+                Subnet.vlan_id,
+                Subnet.location,
+                total_ips.label('total_ips'),
+                allocated_ips.label('allocated_ips'),
+                utilization_rate.label('utilization_rate')
+            )
+            .outerjoin(ip_stats, Subnet.id == ip_stats.c.subnet_id)
+            .filter(*self._utilization_filters(vlan_id, location, tag_id))
+            .order_by(sort_column.desc() if descending else sort_column.asc(), Subnet.id)
+            .offset(skip)
+            .limit(limit)
+        )
+
+        return [
+            {
+                'subnet_id': row.id,
+                'network': row.network,
+                'description': row.description,
+                'vlan_id': row.vlan_id,
+                'location': row.location,
+                'total_ips': int(row.total_ips),
+                'allocated_ips': int(row.allocated_ips),
+                'utilization_rate': round(float(row.utilization_rate), 2)
+            }
+            for row in query.all()
+        ]
+
+    def count_utilization(self, vlan_id: Optional[int] = None, location: Optional[str] = None,
+                          tag_id: Optional[int] = None) -> int:
+        """get_utilization 过滤条件下的网段总数"""
+        return (
+            self.db.query(func.count(Subnet.id))
+            .filter(*self._utilization_filters(vlan_id, location, tag_id))
+            .scalar()
+        )
+
     def count(self) -> int:
         """获取网段总数"""
         return self.db.query(Subnet).count()
@@ -94,6 +188,8 @@ class SubnetRepository:
             setattr(db_subnet, field, value)
 
         self.db.commit()
+        if 'network' in update_data:
+            subnet_index.invalidate()
         self.db.refresh(db_subnet)
         return db_subnet
 
@@ -105,32 +201,33 @@ class SubnetRepository:
 
         self.db.delete(db_subnet)
         self.db.commit()
+        subnet_index.invalidate()
         return True
 
-    def check_network_overlap(self, network: str, exclude_id: Optional[int] = None) -> List[Subnet]:
-        """检查网段重叠"""
-        try:
-            new_network = ipaddress.ip_network(network, strict=False)
-        except ValueError:
-            return []
+    def get_trie(self) -> SubnetTrie:
+        """全部网段的前缀树（进程内共享）"""
+        return trie_from_session(self.db)
 
-        query = self.db.query(Subnet)
-        if exclude_id:
-            query = query.filter(Subnet.id != exclude_id)
+    def _get_by_ids(self, subnet_ids: List[int]) -> List[Subnet]:
+        """按给定顺序返回网段"""
+        if not subnet_ids:
+            return []
+        subnets = {s.id: s for s in self.db.query(Subnet).filter(Subnet.id.in_(subnet_ids)).all()}
+        return [subnets[subnet_id] for subnet_id in subnet_ids if subnet_id in subnets]
 
-        existing_subnets = query.all()
-        overlapping_subnets = []
+    def check_network_overlap(self, network: str, exclude_id: Optional[int] = None) -> List[Subnet]:
+        """检查网段重叠（前缀树查询，只加载重叠的网段）"""
+        entries = self.get_trie().overlapping(network, exclude_id)
+        return self._get_by_ids([entry.id for entry in entries])
 
-        for subnet in existing_subnets:
-            try:
-                existing_network = ipaddress.ip_network(subnet.network, strict=False)
-                # 检查是否重叠
-                if new_network.overlaps(existing_network):
-                    overlapping_subnets.append(subnet)
-            except ValueError:
-                continue
+    def find_by_ip(self, ip: str) -> List[Subnet]:
+        """包含该IP的网段，最具体的（最长前缀匹配）在前"""
+        return self._get_by_ids([entry.id for entry in self.get_trie().matches(ip)])
 
-        return overlapping_subnets
+    def get_free_blocks(self, network: str, min_prefixlen: Optional[int] = None,
+                        limit: Optional[int] = None) -> List[ipaddress.IPv4Network]:
+        """网段范围内未被任何网段占用的 CIDR 块"""
+        return self.get_trie().free_blocks(network, min_prefixlen, limit)
 
     def get_allocated_ip_count(self, subnet_id: int) -> int:
         """获取网段中已分配的IP数量"""
@@ -6,7 +6,9 @@ from typing import Optional, List
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from app.models.user import User, UserRole, UserTheme
-from app.core.security import get_password_hash, verify_password
+from app.core.security import get_password_hash, verify_and_update_password
+from app.core.principal_cache import invalidate_principal
+from app.core.password_hashing import PasswordHasherBusy
 import logging
 
 logger = logging.getLogger(__name__)
@@ -115,6 +117,8 @@ class UserRepository:
             logger.info(f"User '{username}' created successfully with ID {user.id}")
             return user
             
+        except PasswordHasherBusy:
+            raise
         except IntegrityError as e:
             self.db.rollback()
             logger.error(f"Failed to create user '{username}': {e}")
@@ -149,6 +153,7 @@ class UserRepository:
             
             self.db.commit()
             self.db.refresh(user)
+            invalidate_principal(user_id)
             
             logger.info(f"User {user_id} updated successfully")
             return user
@@ -176,11 +181,16 @@ class UserRepository:
                 return False
             
             user.password_hash = get_password_hash(new_password)
+            # 令牌版本加一，之前签发的令牌失效
+            user.credential_version = (user.credential_version or 0) + 1
             self.db.commit()
+            invalidate_principal(user_id)
             
             logger.info(f"Password updated for user {user_id}")
             return True
             
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             self.db.rollback()
             logger.error(f"Failed to update password for user {user_id}: {e}")
@@ -207,13 +217,34 @@ class UserRepository:
             logger.warning(f"Authentication failed: user '{username}' is inactive")
             return None
         
-        if not verify_password(password, user.password_hash):
+        password_hash = user.password_hash
+        # 结束只读事务，把连接还给连接池，哈希计算期间不占用连接（user 的属性之后按需重新加载）
+        self.db.rollback()
+        
+        valid, new_hash = verify_and_update_password(password, password_hash)
+        if not valid:
             logger.warning(f"Authentication failed: invalid password for user '{username}'")
             return None
         
+        if new_hash:
+            self._rehash(user, password_hash, new_hash)
+        
         logger.info(f"User '{username}' authenticated successfully")
         return user
     
+    def _rehash(self, user: User, old_hash: str, new_hash: str) -> None:
+        """工作因子配置变化后写回新哈希（期间密码已被修改时不覆盖，不改变令牌版本），失败不影响本次登录"""
+        try:
+            self.db.query(User).filter(User.id == user.id, User.password_hash == old_hash).update(
+                {User.password_hash: new_hash}, synchronize_session=False
+            )
+            self.db.commit()
+            invalidate_principal(user.id)
+            logger.info(f"Password hash upgraded for user {user.id}")
+        except Exception as e:
+            self.db.rollback()
+            logger.warning(f"Failed to upgrade password hash for user {user.id}: {e}")
+    
     def deactivate(self, user_id: int) -> bool:
         """
         停用用户
@@ -256,6 +287,7 @@ class UserRepository:
             
             self.db.delete(user)
             self.db.commit()
+            invalidate_principal(user_id)
             
             logger.info(f"User {user_id} deleted successfully")
             return True
@@ -0,0 +1,106 @@
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from app.models.utilization_history import SubnetUtilizationHistory, ALL_SUBNETS
+from app.core.timezone_config import now_beijing
+
+
+class UtilizationHistoryRepository:
+    """利用率历史查询，只读取预先汇总的行（365 天的按天序列最多 365 行）"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _series(self, subnet_id: int, resolution: str, start: datetime):
+        return (
+            self.db.query(SubnetUtilizationHistory)
+            .filter(
+                SubnetUtilizationHistory.subnet_id == subnet_id,
+                SubnetUtilizationHistory.resolution == resolution,
+                SubnetUtilizationHistory.bucket_start >= start
+            )
+        )
+
+    def _allocated_before(self, subnet_id: int, start: datetime) -> Optional[int]:
+        """start 之前最近一次的已分配数快照"""
+        return (
+            self.db.query(SubnetUtilizationHistory.allocated_count)
+            .filter(
+                SubnetUtilizationHistory.subnet_id == subnet_id,
+                SubnetUtilizationHistory.resolution == 'day',
+                SubnetUtilizationHistory.bucket_start < start,
+                SubnetUtilizationHistory.allocated_count.isnot(None)
+            )
+            .order_by(SubnetUtilizationHistory.bucket_start.desc())
+            .limit(1)
+            .scalar()
+        )
+
+    def daily_series(self, days: int, subnet_id: int = ALL_SUBNETS) -> List[Dict[str, Any]]:
+        """最近 days 天（含今天）每天的分配数、释放数和当天结束时的已分配数（无快照的天沿用前一天）"""
+        start = now_beijing().date() - timedelta(days=days - 1)
+        start_time = datetime.combine(start, datetime.min.time())
+        allocated = self._allocated_before(subnet_id, start_time)
+        rows = {row.bucket_start.date(): row for row in self._series(subnet_id, 'day', start_time).all()}
+
+        series = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            row = rows.get(day)
+            if row and row.allocated_count is not None:
+                allocated = row.allocated_count
+            series.append({
+                'date': day,
+                'allocations': row.allocations if row else 0,
+                'releases': row.releases if row else 0,
+                'allocated_count': allocated,
+            })
+        return series
+
+    def monthly_series(self, months: int = 12, subnet_id: int = ALL_SUBNETS) -> List[Dict[str, Any]]:
+        """最近 months 个自然月（含本月）的分配数、释放数、月末已分配数和环比增长率（%）"""
+        today = now_beijing().date()
+        first_month = date(today.year, today.month, 1)
+        for _ in range(months - 1):
+            first_month = (first_month - timedelta(days=1)).replace(day=1)
+        days = (today - first_month).days + 1
+
+        result: Dict[str, Dict[str, Any]] = {}
+        for entry in self.daily_series(days, subnet_id):
+            month = result.setdefault(entry['date'].strftime('%Y-%m'), {
+                'month': entry['date'].strftime('%Y-%m'), 'allocations': 0, 'releases': 0, 'allocated_count': None
+            })
+            month['allocations'] += entry['allocations']
+            month['releases'] += entry['releases']
+            month['allocated_count'] = entry['allocated_count']
+
+        series = list(result.values())
+        previous = None
+        for month in series:
+            current = month['allocated_count']
+            month['growth'] = round((current - previous) / previous * 100, 2) if previous and current is not None else 0
+            previous = current
+        return series
+
+    def peak_hours(self, days: int = 30, subnet_id: int = ALL_SUBNETS, top: int = 3) -> List[Dict[str, Any]]:
+        """最近 days 天内按小时（0-23）汇总的分配数，分配最多的 top 个小时"""
+        start_time = datetime.combine(now_beijing().date() - timedelta(days=days - 1), datetime.min.time())
+        hour = func.hour(SubnetUtilizationHistory.bucket_start)
+        rows = (
+            self._series(subnet_id, 'hour', start_time)
+            .with_entities(
+                hour.label('hour'),
+                func.sum(SubnetUtilizationHistory.allocations).label('allocations'),
+                func.sum(SubnetUtilizationHistory.releases).label('releases')
+            )
+            .group_by(hour)
+            .order_by(func.sum(SubnetUtilizationHistory.allocations).desc(), hour)
+            .limit(top)
+            .all()
+        )
+        return [
+            {'hour': int(row.hour), 'allocations': int(row.allocations or 0), 'releases': int(row.releases or 0)}
+            for row in rows
+            if row.allocations
+        ]
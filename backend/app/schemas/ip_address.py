@@ -160,10 +160,12 @@ class IPSearchRequest(BaseModel):
     allocated_date_start: Optional[str] = Field(None, description="分配日期起始")
     allocated_date_end: Optional[str] = Field(None, description="分配日期结束")
     tags: Optional[List[str]] = Field(None, description="标签列表")
-    sort_by: Optional[str] = Field("ip_address", description="排序字段")
+    sort_by: Optional[str] = Field("ip_address", description="排序字段，relevance 按全文检索相关度排序")
     sort_order: Optional[str] = Field("asc", description="排序方向: asc, desc")
     skip: int = Field(0, ge=0, description="跳过记录数")
     limit: int = Field(50, ge=1, le=1000, description="返回记录数")
+    cursor: Optional[str] = Field(None, description="游标分页：上一页返回的next_cursor，提供时忽略skip")
+    count_mode: Optional[str] = Field("exact", description="总数统计方式: exact, estimate, none")
 
     @validator('ip_range_start', 'ip_range_end')
     def validate_ip_range(cls, v):
@@ -179,7 +181,7 @@ class IPSearchRequest(BaseModel):
     def validate_sort_by(cls, v):
         allowed_fields = [
             'ip_address', 'status', 'user_name', 'mac_address', 
-            'device_type', 'location', 'assigned_to', 'allocated_at', 'created_at'
+            'device_type', 'location', 'assigned_to', 'allocated_at', 'created_at', 'relevance'
         ]
         if v not in allowed_fields:
             raise ValueError(f'排序字段必须是以下之一: {", ".join(allowed_fields)}')
@@ -191,13 +193,20 @@ class IPSearchRequest(BaseModel):
             raise ValueError('排序方向必须是 asc 或 desc')
         return v
 
+    @validator('count_mode')
+    def validate_count_mode(cls, v):
+        from app.core.pagination import normalize_count_mode
+        return normalize_count_mode(v)
+
 
 class IPSearchResponse(BaseModel):
     items: List[IPAddressResponse] = Field(..., description="搜索结果")
-    total: int = Field(..., description="总记录数")
+    total: Optional[int] = Field(..., description="总记录数（count_mode=none时为空，estimate时为估算值）")
     page: int = Field(..., description="当前页码")
     page_size: int = Field(..., description="每页记录数")
-    total_pages: int = Field(..., description="总页数")
+    total_pages: Optional[int] = Field(..., description="总页数")
+    next_cursor: Optional[str] = Field(None, description="下一页游标")
+    has_more: bool = Field(False, description="是否还有下一页")
 
 
 class SearchHistoryRequest(BaseModel):
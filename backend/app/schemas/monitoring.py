@@ -36,6 +36,8 @@ class SubnetUtilizationStats(BaseModel):
     subnet_id: int
     network: str
     description: Optional[str]
+    vlan_id: Optional[int] = None
+    location: Optional[str] = None
     total_ips: int
     allocated_ips: int
     utilization_rate: float
@@ -44,6 +46,23 @@ class AllocationTrend(BaseModel):
     """分配趋势"""
     date: str
     allocations: int
+    releases: int = 0
+    allocated_ips: Optional[int] = None
+
+class ExhaustionForecast(BaseModel):
+    """网段耗尽预测"""
+    subnet_id: int
+    network: str
+    description: Optional[str]
+    vlan_id: Optional[int]
+    location: Optional[str]
+    capacity: int
+    used_ips: int
+    allocated_ips: int
+    growth_per_day: float
+    days_to_exhaustion: Optional[float]
+    exhaustion_date: Optional[str]
+    confidence: float
 
 class TopSubnet(BaseModel):
     """使用率最高的网段"""
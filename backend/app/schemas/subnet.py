@@ -64,7 +64,14 @@ class SubnetBase(BaseModel):
 
 class SubnetCreate(SubnetBase):
     """创建网段的请求模型"""
-    pass
+    storage_mode: Optional[str] = Field(None, description="IP存储模式: dense/sparse，默认使用系统配置")
+
+    @validator('storage_mode')
+    def validate_storage_mode(cls, v):
+        """验证存储模式"""
+        if v is not None and v not in ('dense', 'sparse'):
+            raise ValueError('存储模式必须是 dense 或 sparse')
+        return v
 
 
 class SubnetUpdate(BaseModel):
@@ -129,6 +136,7 @@ class SubnetResponse(SubnetBase):
     created_by: Optional[int]
     created_at: datetime
     updated_at: datetime
+    storage_mode: Optional[str] = Field("dense", description="IP存储模式")
     ip_count: Optional[int] = Field(None, description="IP地址总数")
     allocated_count: Optional[int] = Field(None, description="已分配IP数量")
     available_count: Optional[int] = Field(None, description="可用IP数量")
@@ -155,4 +163,18 @@ class SubnetValidationResponse(BaseModel):
     """网段验证响应模型"""
     is_valid: bool
     message: str
-    overlapping_subnets: Optional[List[SubnetResponse]] = Field(None, description="重叠的网段列表")
\ No newline at end of file
+    overlapping_subnets: Optional[List[SubnetResponse]] = Field(None, description="重叠的网段列表")
+
+
+class SubnetLookupResponse(BaseModel):
+    """IP归属网段查询响应模型"""
+    ip: str
+    subnet: Optional[SubnetResponse] = Field(None, description="最长前缀匹配的网段，不属于任何网段时为空")
+    matches: List[SubnetResponse] = Field(default_factory=list, description="包含该IP的全部网段，最具体的在前")
+
+
+class SubnetFreeSpaceResponse(BaseModel):
+    """网段空闲空间响应模型"""
+    network: str
+    free_blocks: List[str] = Field(..., description="未被任何网段占用的CIDR块")
+    free_addresses: int = Field(..., description="空闲块的地址总数")
\ No newline at end of file
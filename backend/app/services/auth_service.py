@@ -12,7 +12,13 @@ from app.core.security import (
     create_access_token, 
     create_refresh_token, 
     verify_token,
-    validate_password_strength
+    validate_password_strength,
+    token_version
+)
+from app.core.principal_cache import (
+    get_cached_principal,
+    cache_principal,
+    principal_to_user
 )
 import logging
 
@@ -67,7 +73,8 @@ class AuthService:
         token_data = {
             "sub": str(user.id),
             "username": user.username,
-            "role": user.role.value
+            "role": user.role.value,
+            "ver": token_version(user.credential_version)
         }
         
         # 生成访问令牌和刷新令牌
@@ -121,11 +128,21 @@ class AuthService:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
+        current_version = token_version(user.credential_version)
+        if payload.get("ver") and payload["ver"] != current_version:
+            logger.warning(f"Outdated refresh token for user {user_id}")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="令牌已失效，请重新登录",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        
         # 生成新的访问令牌
         token_data = {
             "sub": str(user.id),
             "username": user.username,
-            "role": user.role.value
+            "role": user.role.value,
+            "ver": current_version
         }
         
         new_access_token = create_access_token(data=token_data)
@@ -156,22 +173,36 @@ class AuthService:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        # 获取用户信息
+        # 获取用户信息：先查认证用户缓存，未命中再查数据库
         user_id = int(payload.get("sub"))
-        user = self.user_repo.get_by_id(user_id)
-        if not user:
-            logger.warning(f"User {user_id} not found during token validation")
+        principal = get_cached_principal(user_id)
+        if principal is None:
+            user = self.user_repo.get_by_id(user_id)
+            if not user:
+                logger.warning(f"User {user_id} not found during token validation")
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="用户不存在",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+            principal = cache_principal(user)
+        else:
+            user = principal_to_user(self.db, principal)
+        
+        if not principal["is_active"]:
+            logger.warning(f"Inactive user {user_id} attempted to access with valid token")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="用户不存在",
+                detail="用户已被停用",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        if not user.is_active:
-            logger.warning(f"Inactive user {user_id} attempted to access with valid token")
+        # 密码修改或重置前签发的令牌（不带 ver 的旧令牌不校验）
+        if payload.get("ver") and payload["ver"] != principal["token_version"]:
+            logger.warning(f"Outdated access token for user {user_id}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="用户已被停用",
+                detail="令牌已失效，请重新登录",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
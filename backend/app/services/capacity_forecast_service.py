@@ -0,0 +1,189 @@
+"""
+网段容量耗尽预测
+从利用率历史的按天汇总（allocations/releases）还原每个网段最近 window_days 天的已分配数曲线，
+用 NumPy 对所有网段一次性做线性回归，得到增长速度、预计耗尽日期和置信度。
+
+- 数据读取只有两条语句（网段+计数器、按天汇总），拟合为矩阵运算，1 万个网段在几十毫秒内完成
+- 已用 = 已分配 + 保留 + 冲突，容量按 CIDR 计算（稀疏存储的网段同样适用）
+- 置信度 = 拟合优度 R² × 数据覆盖度（有变化的天数 / FORECAST_MIN_ACTIVE_DAYS，最大为 1）
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from app.core.timezone_config import now_beijing
+from app.models.utilization_history import ALL_SUBNETS
+
+# 拟合使用的历史天数
+FORECAST_WINDOW_DAYS = int(os.getenv('FORECAST_WINDOW_DAYS', '90'))
+
+# 有分配/释放的天数达到该值时数据覆盖度为 1
+FORECAST_MIN_ACTIVE_DAYS = int(os.getenv('FORECAST_MIN_ACTIVE_DAYS', '7'))
+
+# 超过该天数的预测视为不会耗尽
+FORECAST_MAX_DAYS = int(os.getenv('FORECAST_MAX_DAYS', '3650'))
+
+
+def subnet_capacity(prefixlen: np.ndarray) -> np.ndarray:
+    """按前缀长度计算各网段可分配的主机地址数（/31、/32 不扣除网络和广播地址）"""
+    return np.exp2(32 - prefixlen) - np.where(prefixlen <= 30, 2, 0)
+
+
+def fit_exhaustion(allocated: np.ndarray, used: np.ndarray, capacity: np.ndarray,
+                   net: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    对所有网段一次性拟合
+    Args:
+        allocated: 各网段当前已分配数 (S,)
+        used: 各网段当前已用数（已分配 + 保留 + 冲突）(S,)
+        capacity: 各网段容量 (S,)
+        net: 每天的净分配数（分配 - 释放）(S, D)，最后一列为今天
+    Returns:
+        growth_per_day、days_to_exhaustion（不会耗尽为 NaN）、r_squared、confidence，均为 (S,)
+    """
+    allocated = allocated.astype(np.float64)
+    net = net.astype(np.float64)
+    days = net.shape[1]
+
+    # 第 d 天结束时的已分配数 = 当前值 - d 之后各天的净分配数之和
+    later = np.cumsum(net[:, ::-1], axis=1)[:, ::-1] - net
+    levels = allocated[:, None] - later
+
+    t = np.arange(days, dtype=np.float64)
+    t -= t.mean()
+    centered = levels - levels.mean(axis=1, keepdims=True)
+    slope = centered @ t / (t @ t) if days > 1 else np.zeros(len(allocated))
+
+    ss_total = np.einsum('ij,ij->i', centered, centered)
+    residual = centered - slope[:, None] * t
+    ss_residual = np.einsum('ij,ij->i', residual, residual)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = np.where(ss_total > 0, 1 - ss_residual / ss_total, 0.0)
+        remaining = np.maximum(capacity - used, 0)
+        days_left = np.where(slope > 0, remaining / slope, np.nan)
+    days_left[days_left > FORECAST_MAX_DAYS] = np.nan
+
+    coverage = np.minimum(np.count_nonzero(net, axis=1) / max(FORECAST_MIN_ACTIVE_DAYS, 1), 1.0)
+    confidence = np.clip(r_squared, 0, 1) * coverage
+
+    # 已经用完的网段不需要预测
+    exhausted = (capacity > 0) & (remaining == 0)
+    days_left[exhausted] = 0
+    confidence[exhausted] = 1.0
+
+    return {
+        "growth_per_day": slope,
+        "days_to_exhaustion": days_left,
+        "r_squared": r_squared,
+        "confidence": confidence,
+    }
+
+
+class CapacityForecastService:
+    """网段容量耗尽预测服务"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _load_subnets(self, subnet_ids: Optional[List[int]]) -> List[Any]:
+        sql = """
+            SELECT s.id, s.network, s.description, s.vlan_id, s.location,
+                   COALESCE(c.allocated_count, 0) AS allocated_count,
+                   COALESCE(c.reserved_count, 0) AS reserved_count,
+                   COALESCE(c.conflict_count, 0) AS conflict_count
+            FROM subnets s
+            LEFT JOIN (
+                SELECT subnet_id, SUM(allocated_count) AS allocated_count,
+                       SUM(reserved_count) AS reserved_count, SUM(conflict_count) AS conflict_count
+                FROM subnet_ip_counters GROUP BY subnet_id
+            ) c ON c.subnet_id = s.id
+        """
+        if not subnet_ids:
+            return self.db.execute(text(sql + " ORDER BY s.id")).fetchall()
+        statement = text(sql + " WHERE s.id IN :subnet_ids ORDER BY s.id").bindparams(
+            bindparam("subnet_ids", expanding=True)
+        )
+        return self.db.execute(statement, {"subnet_ids": list(subnet_ids)}).fetchall()
+
+    def _load_daily_net(self, start: datetime) -> List[Any]:
+        return self.db.execute(
+            text("""
+                SELECT subnet_id, bucket_start, allocations - releases AS net
+                FROM subnet_utilization_history
+                WHERE resolution = 'day' AND bucket_start >= :start AND subnet_id <> :all_subnets
+                  AND allocations - releases <> 0
+            """),
+            {"start": start, "all_subnets": ALL_SUBNETS}
+        ).fetchall()
+
+    def forecast(self, window_days: int = FORECAST_WINDOW_DAYS,
+                 subnet_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """所有（或指定）网段的耗尽预测，按网段ID排序"""
+        subnets = self._load_subnets(subnet_ids)
+        if not subnets:
+            return []
+
+        today = now_beijing().date()
+        start = today - timedelta(days=window_days - 1)
+        ids = np.fromiter((row.id for row in subnets), dtype=np.int64, count=len(subnets))
+        allocated = np.fromiter((row.allocated_count for row in subnets), dtype=np.float64, count=len(subnets))
+        used = allocated + np.fromiter(
+            (row.reserved_count + row.conflict_count for row in subnets), dtype=np.float64, count=len(subnets)
+        )
+        capacity = subnet_capacity(np.fromiter(
+            (int(row.network.rsplit('/', 1)[1]) for row in subnets), dtype=np.float64, count=len(subnets)
+        ))
+
+        net = np.zeros((len(subnets), window_days), dtype=np.float64)
+        history = self._load_daily_net(datetime.combine(start, datetime.min.time()))
+        if history:
+            row_ids = np.fromiter((row.subnet_id for row in history), dtype=np.int64, count=len(history))
+            offsets = np.fromiter(((row.bucket_start.date() - start).days for row in history),
+                                  dtype=np.int64, count=len(history))
+            values = np.fromiter((row.net for row in history), dtype=np.float64, count=len(history))
+            positions = np.searchsorted(ids, row_ids)
+            positions[positions >= len(ids)] = 0
+            known = (ids[positions] == row_ids) & (offsets >= 0) & (offsets < window_days)
+            np.add.at(net, (positions[known], offsets[known]), values[known])
+
+        result = fit_exhaustion(allocated, used, capacity, net)
+
+        forecasts = []
+        for index, row in enumerate(subnets):
+            days_left = result["days_to_exhaustion"][index]
+            exhausts = not np.isnan(days_left)
+            forecasts.append({
+                "subnet_id": row.id,
+                "network": row.network,
+                "description": row.description,
+                "vlan_id": row.vlan_id,
+                "location": row.location,
+                "capacity": int(capacity[index]),
+                "used_ips": int(used[index]),
+                "allocated_ips": int(allocated[index]),
+                "growth_per_day": round(float(result["growth_per_day"][index]), 3),
+                "days_to_exhaustion": round(float(days_left), 1) if exhausts else None,
+                "exhaustion_date": (today + timedelta(days=int(np.ceil(days_left)))).isoformat() if exhausts else None,
+                "confidence": round(float(result["confidence"][index]), 2),
+            })
+        return forecasts
+
+    def running_out(self, within_days: Optional[int] = None, min_confidence: float = 0.0,
+                    window_days: int = FORECAST_WINDOW_DAYS, limit: int = 100) -> List[Dict[str, Any]]:
+        """预计最早耗尽的网段（不会耗尽的排在最后）"""
+        forecasts = [
+            forecast for forecast in self.forecast(window_days)
+            if forecast["confidence"] >= min_confidence
+            and (within_days is None
+                 or (forecast["days_to_exhaustion"] is not None and forecast["days_to_exhaustion"] <= within_days))
+        ]
+        forecasts.sort(key=lambda forecast: (
+            forecast["days_to_exhaustion"] is None,
+            forecast["days_to_exhaustion"] or 0,
+            -forecast["confidence"],
+        ))
+        return forecasts[:limit]
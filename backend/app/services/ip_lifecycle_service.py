@@ -1,12 +1,15 @@
 from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from app.repositories.ip_repository import IPRepository
+from app.repositories.utilization_history_repository import UtilizationHistoryRepository
 from app.models.ip_address import IPAddress, IPStatus
 from app.models.subnet import Subnet
+from app.models.utilization_history import ALL_SUBNETS
 from app.schemas.ip_address import IPAddressResponse, IPStatisticsResponse
 from app.core.exceptions import ValidationError, NotFoundError, ConflictError
 from datetime import datetime, timedelta
 from app.core.timezone_config import now_beijing
+from app.core.ip_bitmap import ip_bitmaps
 import ipaddress
 
 
@@ -218,7 +221,7 @@ class IPLifecycleService:
         all_ips = query.all()
         
         patterns = {
-            'peak_usage_hours': [],  # 这需要更详细的日志数据
+            'peak_usage_hours': [],  # 分配最多的小时
             'frequent_allocations': [],  # 频繁分配释放的IP
             'stable_allocations': [],   # 长期稳定分配的IP
             'unused_ranges': [],        # 未使用的IP范围
@@ -229,6 +232,20 @@ class IPLifecycleService:
             }
         }
         
+        # 高峰时段和分配趋势（读取利用率历史汇总）
+        history = UtilizationHistoryRepository(self.db)
+        series_id = subnet_id or ALL_SUBNETS
+        patterns['peak_usage_hours'] = history.peak_hours(days=30, subnet_id=series_id)
+        
+        daily = history.daily_series(30, series_id)
+        weekly_net = sum(day['allocations'] - day['releases'] for day in daily[-7:])
+        monthly = history.monthly_series(2, series_id)
+        patterns['allocation_trends'] = {
+            'daily_average': round(sum(day['allocations'] for day in daily) / len(daily), 2),
+            'weekly_trend': 'increasing' if weekly_net > 0 else 'decreasing' if weekly_net < 0 else 'stable',
+            'monthly_growth': monthly[-1]['growth']
+        }
+        
         # 分析稳定分配的IP（分配超过30天且未变更）
         thirty_days_ago = now_beijing() - timedelta(days=30)
         stable_ips = [
@@ -252,7 +269,7 @@ class IPLifecycleService:
         if subnet_id:
             subnet = self.db.query(Subnet).filter(Subnet.id == subnet_id).first()
             if subnet:
-                patterns['unused_ranges'] = self._find_unused_ip_ranges(subnet.network, all_ips)
+                patterns['unused_ranges'] = self._find_unused_ip_ranges(subnet.network, all_ips, subnet_id)
         
         return patterns
 
@@ -323,8 +340,24 @@ class IPLifecycleService:
         
         return max(0, score)
 
-    def _find_unused_ip_ranges(self, network: str, ip_records: List[IPAddress]) -> List[Dict[str, str]]:
-        """查找未使用的IP地址范围"""
+    def _find_unused_ip_ranges(self, network: str, ip_records: List[IPAddress],
+                               subnet_id: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        查找未使用的IP地址范围
+        网段位图可用时直接按空闲位的连续区间返回，否则遍历主机地址查找未入库的范围
+        """
+        if subnet_id:
+            free_ranges = ip_bitmaps.free_ranges(subnet_id, 5, lambda: self.ip_repo.load_bitmap(subnet_id))
+            if free_ranges is not None:
+                return [
+                    {
+                        'start_ip': str(ipaddress.IPv4Address(start)),
+                        'end_ip': str(ipaddress.IPv4Address(end)),
+                        'count': end - start + 1
+                    }
+                    for start, end in free_ranges
+                ]
+
         try:
             net = ipaddress.ip_network(network, strict=False)
         except ValueError:
@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_, func
 from app.repositories.ip_repository import IPRepository
 from app.models.ip_address import IPAddress, IPStatus
-from app.models.subnet import Subnet
+from app.models.subnet import Subnet, SubnetStorageMode
 from app.schemas.ip_address import (
     IPAddressCreate, IPAddressUpdate, IPAddressResponse,
     IPAllocationRequest, IPReservationRequest, IPReleaseRequest,
@@ -12,12 +12,21 @@ from app.schemas.ip_address import (
     BulkIPOperationRequest, BulkIPOperationResponse, IPDeleteRequest
 )
 from app.core.exceptions import ValidationError, NotFoundError, ConflictError
+from app.core.config import settings
 import ipaddress
 from datetime import datetime
 from app.core.timezone_config import now_beijing
+from app.core.ip_bitmap import ip_bitmaps
+from app.core.live_updates import publish_ip_changes
 
 
 class IPService:
+    # 密集存储模式下单个网段允许自动生成的最大地址数，与原生接口共用 IP_GENERATION_MAX_ADDRESSES 配置
+    MAX_GENERATED_ADDRESSES = settings.IP_GENERATION_MAX_ADDRESSES
+
+    # 批量操作每块处理的地址数
+    BULK_OPERATION_CHUNK_SIZE = 1000
+
     def __init__(self, db: Session):
         self.db = db
         self.ip_repo = IPRepository(db)
@@ -34,8 +43,12 @@ class IPService:
         if not subnet:
             raise ValueError(f"网段不存在: {subnet_id}")
 
+        # 稀疏网段不预生成地址，可用地址由CIDR推算
+        if subnet.storage_mode == SubnetStorageMode.SPARSE:
+            return []
+
         # 检查网段大小，避免生成过多IP地址
-        if net.num_addresses > 65536:  # /16网段
+        if net.num_addresses > self.MAX_GENERATED_ADDRESSES:
             raise ValidationError("网段过大，无法自动生成所有IP地址")
 
         # 批量创建IP地址数据
@@ -92,9 +105,21 @@ class IPService:
         print(f"[DEBUG] 分配时间: {request.allocated_at}")
         print(f"[DEBUG] 分配人ID: {allocated_by}")
         
+        sparse_subnet = self.ip_repo.get_sparse_subnet(request.subnet_id)
+        
         # 如果指定了首选IP，尝试分配
         if request.preferred_ip:
-            preferred_ip = self.ip_repo.get_by_ip_address(request.preferred_ip)
+            # 加行锁读取，并发分配同一地址时后到的请求会看到已分配状态
+            preferred_ip = self.ip_repo.get_by_ip_address_for_update(request.preferred_ip)
+            if not preferred_ip and sparse_subnet:
+                # 稀疏网段：网段范围内未存储的地址即为可用，按需写入
+                try:
+                    preferred_addr = ipaddress.ip_address(request.preferred_ip)
+                except ValueError:
+                    raise ValidationError(f"无效的IP地址: {request.preferred_ip}")
+                if preferred_addr in ipaddress.ip_network(sparse_subnet.network, strict=False):
+                    self.ip_repo.materialize_ip(request.subnet_id, int(preferred_addr))
+                    preferred_ip = self.ip_repo.get_by_ip_address_for_update(request.preferred_ip)
             if preferred_ip:
                 if preferred_ip.subnet_id != request.subnet_id:
                     raise ValidationError("指定的IP地址不属于目标网段")
@@ -124,13 +149,11 @@ class IPService:
                 print(f"[DEBUG] 响应数据: {result}")
                 return result
         
-        # 自动分配可用IP
-        available_ips = self.ip_repo.get_available_ips(request.subnet_id, limit=1)
-        if not available_ips:
+        # 自动分配：行锁认领网段中最小的可用地址（稀疏网段按需写入），锁持有到下面更新提交
+        ip_to_allocate = self.ip_repo.claim_available_ip(request.subnet_id)
+        if not ip_to_allocate:
             raise NotFoundError("网段中没有可用的IP地址")
         
-        ip_to_allocate = available_ips[0]
-        
         # 更新分配信息
         allocated_time = request.allocated_at if request.allocated_at else now_beijing()
         
@@ -150,8 +173,10 @@ class IPService:
         return self._ip_to_response(updated_ip)
 
     def reserve_ip(self, request: IPReservationRequest, reserved_by: int) -> IPAddressResponse:
-        """保留IP地址"""
+        """保留IP地址（稀疏网段中未存储的可用地址按需写入）"""
         ip_record = self.ip_repo.get_by_ip_address(request.ip_address)
+        if not ip_record and self.ip_repo.materialize_unstored([request.ip_address]):
+            ip_record = self.ip_repo.get_by_ip_address(request.ip_address)
         if not ip_record:
             raise NotFoundError(f"IP地址 {request.ip_address} 不存在")
         
@@ -183,6 +208,24 @@ class IPService:
         if ip_record.status not in [IPStatus.ALLOCATED, IPStatus.RESERVED]:
             raise ValidationError(f"IP地址 {request.ip_address} 无法释放，当前状态: {ip_record.status}")
         
+        if self.ip_repo.get_sparse_subnet(ip_record.subnet_id):
+            # 稀疏网段不存储可用地址：释放即删除记录，返回释放后的地址信息
+            released = self._ip_to_response(ip_record).model_copy(update={
+                "status": IPStatus.AVAILABLE,
+                "mac_address": None,
+                "user_name": None,
+                "device_type": None,
+                "location": None,
+                "assigned_to": None,
+                "description": request.reason,
+                "allocated_at": None,
+                "allocated_by": None,
+                "updated_at": now_beijing()
+            })
+            if not self.ip_repo.delete(ip_record.id):
+                raise ConflictError(f"IP地址 {request.ip_address} 已被其他请求修改")
+            return released
+        
         update_data = IPAddressUpdate(
             status=IPStatus.AVAILABLE,
             mac_address=None,
@@ -301,18 +344,20 @@ class IPService:
         from app.schemas.ip_address import IPSearchResponse
         
         # 执行搜索
-        ips, total = self.ip_repo.advanced_search(request)
+        search_result = self.ip_repo.advanced_search_page(request)
+        ips = search_result["items"]
+        total = search_result["total"]
         
-        # 计算分页信息
-        page = (request.skip // request.limit) + 1
-        total_pages = (total + request.limit - 1) // request.limit
+        # 计算分页信息（游标分页或不统计总数时页码信息仅供参考）
+        page = (request.skip // request.limit) + 1 if not request.cursor else 1
+        total_pages = (total + request.limit - 1) // request.limit if total is not None else None
         
         # 保存搜索历史（如果有搜索条件）
         if any([request.query, request.subnet_id, request.status, request.device_type, 
                 request.location, request.assigned_to, request.mac_address, request.user_name,
                 request.ip_range_start, request.tags]):
             search_history_service = SearchHistoryService(self.db)
-            search_params = request.model_dump(exclude_unset=True, exclude={'skip', 'limit'})
+            search_params = request.model_dump(exclude_unset=True, exclude={'skip', 'limit', 'cursor', 'count_mode'})
             search_history_service.save_search(user_id, search_params)
         
         # 构建响应
@@ -323,7 +368,9 @@ class IPService:
             total=total,
             page=page,
             page_size=request.limit,
-            total_pages=total_pages
+            total_pages=total_pages,
+            next_cursor=search_result["next_cursor"],
+            has_more=search_result["has_more"]
         )
 
     def get_ip_range_status(self, request: IPRangeStatusRequest) -> List[IPRangeStatusResponse]:
@@ -342,42 +389,117 @@ class IPService:
         ]
 
     def bulk_ip_operation(self, request: BulkIPOperationRequest, user_id: int) -> BulkIPOperationResponse:
-        """批量IP地址操作"""
+        """
+        批量IP地址操作
+        按块执行：一次加锁查询读取当前状态，筛出可操作的记录后用一条带状态条件的批量语句完成，
+        全部块在同一事务中提交；逐个地址的成功/失败结果按输入顺序返回
+        """
+        operation = request.operation
+        now = now_beijing()
+        allowed = {
+            'allocate': [IPStatus.AVAILABLE],
+            'reserve': [IPStatus.AVAILABLE],
+            'release': [IPStatus.ALLOCATED, IPStatus.RESERVED],
+            'delete': [IPStatus.AVAILABLE, IPStatus.RESERVED, IPStatus.CONFLICT],
+        }[operation]
+        values = {
+            'allocate': {
+                IPAddress.status: IPStatus.ALLOCATED,
+                IPAddress.allocated_at: now,
+                IPAddress.allocated_by: user_id
+            },
+            'reserve': {
+                IPAddress.status: IPStatus.RESERVED,
+                IPAddress.description: request.reason,
+                IPAddress.assigned_to: f"保留 - {request.reason}" if request.reason else "保留",
+                IPAddress.allocated_at: now,
+                IPAddress.allocated_by: user_id
+            },
+            'release': {
+                IPAddress.status: IPStatus.AVAILABLE,
+                IPAddress.mac_address: None,
+                IPAddress.user_name: None,
+                IPAddress.device_type: None,
+                IPAddress.assigned_to: None,
+                IPAddress.description: request.reason,
+                IPAddress.allocated_at: None,
+                IPAddress.allocated_by: None
+            },
+        }.get(operation)
+
+        errors: Dict[str, Optional[str]] = {}
+        bitmap_changes = []
+        changed_ips = []
+        reserve_quota: Dict[int, int] = {}
+        unique_ips = list(dict.fromkeys(request.ip_addresses))
+
+        try:
+            for start in range(0, len(unique_ips), self.BULK_OPERATION_CHUNK_SIZE):
+                chunk = unique_ips[start:start + self.BULK_OPERATION_CHUNK_SIZE]
+                found = {ip.ip_address: ip for ip in self.ip_repo.get_by_ip_addresses_for_update(chunk)}
+                # 稀疏网段中未存储的可用地址按需写入（释放只针对已分配/保留的地址，无需写入）
+                missing = [ip_address for ip_address in chunk if ip_address not in found]
+                if missing and operation != 'release' and self.ip_repo.materialize_unstored(missing):
+                    found.update({ip.ip_address: ip for ip in self.ip_repo.get_by_ip_addresses_for_update(missing)})
+
+                eligible = []
+                for ip_address in chunk:
+                    ip_record = found.get(ip_address)
+                    if not ip_record:
+                        errors[ip_address] = f"IP地址 {ip_address} 不存在"
+                    elif ip_record.status not in allowed:
+                        errors[ip_address] = self._bulk_status_error(operation, ip_address, ip_record.status)
+                    elif operation == 'reserve' and not self._take_reservation_quota(
+                        reserve_quota, ip_record.subnet_id, user_id
+                    ):
+                        errors[ip_address] = "保留IP地址数量已达到限制"
+                    else:
+                        eligible.append(ip_record)
+
+                ids = [ip_record.id for ip_record in eligible]
+                if operation == 'delete':
+                    affected = self.ip_repo.bulk_delete(ids, allowed)
+                elif operation == 'release':
+                    # 稀疏网段不存储可用地址：释放即删除记录
+                    sparse = self.ip_repo.sparse_subnet_ids([ip_record.subnet_id for ip_record in eligible])
+                    affected = self.ip_repo.bulk_delete(
+                        [ip_record.id for ip_record in eligible if ip_record.subnet_id in sparse], allowed
+                    ) + self.ip_repo.bulk_update_status(
+                        [ip_record.id for ip_record in eligible if ip_record.subnet_id not in sparse], allowed, values
+                    )
+                else:
+                    affected = self.ip_repo.bulk_update_status(ids, allowed, values)
+                if affected != len(eligible):
+                    raise ConflictError(f"批量操作影响行数异常：预期 {len(eligible)}，实际 {affected}")
+
+                new_status = None if operation == 'delete' else values[IPAddress.status]
+                for ip_record in eligible:
+                    errors[ip_record.ip_address] = None
+                    bitmap_changes.append((ip_record.subnet_id, ip_record.ip_int, new_status))
+                    changed_ips.append((ip_record.subnet_id, ip_record.ip_address))
+
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        for subnet_id, ip_int, new_status in bitmap_changes:
+            ip_bitmaps.apply_status(subnet_id, ip_int, new_status)
+        publish_ip_changes(ip_addresses=changed_ips)
+
         success_ips = []
         failed_ips = []
-        
+        seen = set()
         for ip_address in request.ip_addresses:
-            try:
-                if request.operation == 'allocate':
-                    # 批量分配需要更复杂的逻辑，这里简化处理
-                    ip_record = self.ip_repo.get_by_ip_address(ip_address)
-                    if ip_record and ip_record.status == IPStatus.AVAILABLE:
-                        update_data = IPAddressUpdate(status=IPStatus.ALLOCATED)
-                        ip_record.allocated_at = now_beijing()
-                        ip_record.allocated_by = user_id
-                        self.ip_repo.update(ip_record.id, update_data)
-                        success_ips.append(ip_address)
-                    else:
-                        failed_ips.append({"ip": ip_address, "error": "IP不可用或不存在"})
-                
-                elif request.operation == 'reserve':
-                    reserve_req = IPReservationRequest(ip_address=ip_address, reason=request.reason)
-                    self.reserve_ip(reserve_req, user_id)
-                    success_ips.append(ip_address)
-                
-                elif request.operation == 'release':
-                    release_req = IPReleaseRequest(ip_address=ip_address, reason=request.reason)
-                    self.release_ip(release_req, user_id)
-                    success_ips.append(ip_address)
-                
-                elif request.operation == 'delete':
-                    delete_req = IPDeleteRequest(ip_address=ip_address, reason=request.reason)
-                    self.delete_ip(delete_req, user_id)
-                    success_ips.append(ip_address)
-                
-            except Exception as e:
-                failed_ips.append({"ip": ip_address, "error": str(e)})
-        
+            if ip_address in seen:
+                failed_ips.append({"ip": ip_address, "error": "重复的IP地址"})
+                continue
+            seen.add(ip_address)
+            if errors[ip_address] is None:
+                success_ips.append(ip_address)
+            else:
+                failed_ips.append({"ip": ip_address, "error": errors[ip_address]})
+
         return BulkIPOperationResponse(
             success_count=len(success_ips),
             failed_count=len(failed_ips),
@@ -386,8 +508,36 @@ class IPService:
             message=f"批量操作完成：成功{len(success_ips)}个，失败{len(failed_ips)}个"
         )
 
+    @staticmethod
+    def _bulk_status_error(operation: str, ip_address: str, status: IPStatus) -> str:
+        """批量操作中当前状态不允许操作时的失败原因，与单个操作的提示一致"""
+        if operation == 'release':
+            return f"IP地址 {ip_address} 无法释放，当前状态: {status}"
+        if operation == 'delete':
+            return f"IP地址 {ip_address} 已分配，无法删除。请先释放该IP地址"
+        return f"IP地址 {ip_address} 不可用，当前状态: {status}"
+
+    def _take_reservation_quota(self, quota: Dict[int, int], subnet_id: int, user_id: int) -> bool:
+        """批量保留时按网段扣减剩余保留额度（每个网段只查询一次），额度不足返回 False"""
+        if subnet_id not in quota:
+            reserved_count, max_allowed = self._reservation_usage(subnet_id, user_id)
+            quota[subnet_id] = max_allowed - reserved_count
+        if quota[subnet_id] <= 0:
+            return False
+        quota[subnet_id] -= 1
+        return True
+
     def _check_reservation_limits(self, subnet_id: int, user_id: int) -> None:
         """检查保留IP地址的分配限制"""
+        reserved_count, max_allowed = self._reservation_usage(subnet_id, user_id)
+        if reserved_count >= max_allowed:
+            raise ValidationError(
+                f"保留IP地址数量已达到限制。当前已保留 {reserved_count} 个，"
+                f"最大允许保留 {max_allowed} 个IP地址"
+            )
+
+    def _reservation_usage(self, subnet_id: int, user_id: int) -> Tuple[int, int]:
+        """用户在网段中已保留的地址数和允许保留的上限"""
         # 获取用户当前保留的IP数量
         reserved_count = (
             self.db.query(IPAddress)
@@ -409,12 +559,7 @@ class IPService:
         max_reserved_absolute = 100
         
         max_allowed = min(int(total_ips * max_reserved_percentage), max_reserved_absolute)
-        
-        if reserved_count >= max_allowed:
-            raise ValidationError(
-                f"保留IP地址数量已达到限制。当前已保留 {reserved_count} 个，"
-                f"最大允许保留 {max_allowed} 个IP地址"
-            )
+        return reserved_count, max_allowed
 
     def get_departments(self) -> List[str]:
         """获取所有分配部门列表"""
@@ -4,7 +4,7 @@
 """
 from typing import List, Optional, Dict, Any, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, text
+from sqlalchemy import and_, func
 from datetime import datetime, timedelta
 from app.core.timezone_config import now_beijing
 import logging
@@ -19,8 +19,10 @@ from app.schemas.ip_address import (
 )
 from app.core.exceptions import ValidationError, NotFoundError, ConflictError
 from app.core.cache_manager import cache_manager, cached, invalidate_cache
+from app.core.ip_bitmap import ip_bitmaps
+from app.core.live_updates import publish_ip_changes
+from app.core.ip_prefix import parse_ip_query, range_filter
 from app.core.query_optimizer import query_optimizer, monitor_query_performance
-from app.core.redis_client import DistributedLock
 
 logger = logging.getLogger(__name__)
 
@@ -104,29 +106,31 @@ class OptimizedIPService:
     @invalidate_cache("ip_updated")
     @monitor_query_performance
     def allocate_ip(self, request: IPAllocationRequest, user_id: int) -> IPAddressResponse:
-        """分配IP地址"""
-        lock_key = f"ip_allocation:{request.ip_address or request.subnet_id}"
-        
-        with DistributedLock(lock_key, timeout=30):
-            try:
-                if request.ip_address:
-                    # 分配指定IP地址
-                    ip = self._allocate_specific_ip(request, user_id)
-                else:
-                    # 自动分配IP地址
-                    ip = self._allocate_auto_ip(request, user_id)
-                
-                self.db.commit()
-                
-                # 清除相关缓存
-                cache_manager.invalidate("ip_updated", ip_id=ip.id)
-                
-                return IPAddressResponse.from_orm(ip)
-                
-            except Exception as e:
-                self.db.rollback()
-                logger.error(f"Failed to allocate IP: {e}")
-                raise
+        """
+        分配IP地址
+        并发控制使用数据库行锁（FOR UPDATE / SKIP LOCKED），不再用按网段串行的分布式锁
+        """
+        try:
+            if request.ip_address:
+                # 分配指定IP地址
+                ip = self._allocate_specific_ip(request, user_id)
+            else:
+                # 自动分配IP地址
+                ip = self._allocate_auto_ip(request, user_id)
+            
+            self.db.commit()
+            ip_bitmaps.apply_status(ip.subnet_id, ip.ip_int, ip.status)
+            publish_ip_changes([ip.subnet_id], [(ip.subnet_id, ip.ip_address)])
+            
+            # 清除相关缓存
+            cache_manager.invalidate("ip_updated", ip_id=ip.id)
+            
+            return IPAddressResponse.from_orm(ip)
+            
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Failed to allocate IP: {e}")
+            raise
     
     @invalidate_cache("ip_updated")
     def reserve_ip(self, request: IPReservationRequest, user_id: int) -> IPAddressResponse:
@@ -146,6 +150,8 @@ class OptimizedIPService:
             ip.allocated_at = now_beijing()
             
             self.db.commit()
+            ip_bitmaps.apply_status(ip.subnet_id, ip.ip_int, ip.status)
+            publish_ip_changes([ip.subnet_id], [(ip.subnet_id, ip.ip_address)])
             
             return IPAddressResponse.from_orm(ip)
             
@@ -176,6 +182,8 @@ class OptimizedIPService:
             ip.allocated_at = None
             
             self.db.commit()
+            ip_bitmaps.apply_status(ip.subnet_id, ip.ip_int, ip.status)
+            publish_ip_changes([ip.subnet_id], [(ip.subnet_id, ip.ip_address)])
             
             return IPAddressResponse.from_orm(ip)
             
@@ -308,8 +316,8 @@ class OptimizedIPService:
             raise
     
     def _allocate_specific_ip(self, request: IPAllocationRequest, user_id: int) -> IPAddress:
-        """分配指定的IP地址"""
-        ip = self.ip_repo.get_by_ip_address(request.ip_address)
+        """分配指定的IP地址（行锁读取，防止并发重复分配）"""
+        ip = self.ip_repo.get_by_ip_address_for_update(request.ip_address)
         if not ip:
             raise NotFoundError(f"IP地址不存在: {request.ip_address}")
         
@@ -330,13 +338,8 @@ class OptimizedIPService:
     
     def _allocate_auto_ip(self, request: IPAllocationRequest, user_id: int) -> IPAddress:
         """自动分配IP地址"""
-        # 查找指定网段中的可用IP
-        available_ip = self.db.query(IPAddress).filter(
-            IPAddress.subnet_id == request.subnet_id,
-            IPAddress.status == IPStatus.AVAILABLE
-        ).order_by(
-            text("INET_ATON(ip_address)")  # 按IP地址数值排序
-        ).first()
+        # 锁定网段中最小的可用IP，并发请求跳过已锁定的行（SKIP LOCKED），锁持有到事务提交
+        available_ip = self.ip_repo.claim_available_ip(request.subnet_id)
         
         if not available_ip:
             raise ConflictError(f"网段中没有可用的IP地址")
@@ -369,7 +372,10 @@ class OptimizedIPService:
                 else:
                     query = query.filter(IPAddress.status == filters["status"])
             
-            if filters.get("search"):
+            ip_ranges = parse_ip_query(filters.get("search"))
+            if ip_ranges:
+                query = query.filter(range_filter(IPAddress.ip_int, ip_ranges))
+            elif filters.get("search"):
                 search_term = f"%{filters['search']}%"
                 query = query.filter(
                     IPAddress.ip_address.like(search_term) |
@@ -1,14 +1,30 @@
 from typing import List, Optional, Dict, Any, Tuple
 from sqlalchemy.orm import Session, Query, joinedload
-from sqlalchemy import and_, or_, func, text, desc, asc
+from sqlalchemy import and_, or_, func, text, desc, asc, case
+from sqlalchemy.dialects.mysql import match
 from app.models.ip_address import IPAddress, IPStatus
 from app.models.subnet import Subnet
 from app.models.tag import Tag
 from app.schemas.ip_address import IPSearchRequest
+from app.core.exceptions import ValidationError
+from app.core.pagination import encode_cursor, decode_cursor
+from app.core.ip_prefix import parse_ip_query, range_filter
+from app.core.search_index import IP_SEARCH_FULLTEXT, SEARCH_COLUMNS, EXACT_MATCH_BOOSTS, build_boolean_query
 import ipaddress
+import re
 from datetime import datetime
 
 
+# 看起来像IP地址片段的查询词（数字和点），不走全文索引
+IP_FRAGMENT_PATTERN = re.compile(r'^[\d.]+$')
+
+# 支持游标分页的排序字段 -> (游标键, 排序列)
+KEYSET_SORT_KEYS = {
+    "ip_address": ("ip_int", IPAddress.ip_int),
+    "created_at": ("created_at", IPAddress.created_at),
+}
+
+
 class IPQueryBuilder:
     """IP地址搜索查询构建器"""
     
@@ -16,8 +32,11 @@ class IPQueryBuilder:
         self.db = db
         self.base_query = db.query(IPAddress).join(Subnet, IPAddress.subnet_id == Subnet.id).options(joinedload(IPAddress.subnet))
     
-    def build_search_query(self, search_request: IPSearchRequest) -> Tuple[Query, Query]:
-        """构建搜索查询和计数查询"""
+    def build_search_query(self, search_request: IPSearchRequest, fetch_extra: bool = False) -> Tuple[Query, Query]:
+        """
+        构建搜索查询和计数查询
+        fetch_extra 为 True 时多取一条记录，用于判断是否存在下一页
+        """
         query = self.base_query
         # 确保count_query也包含必要的联接
         count_query = self.db.query(func.count(IPAddress.id)).join(Subnet, IPAddress.subnet_id == Subnet.id)
@@ -32,7 +51,7 @@ class IPQueryBuilder:
         query = self._apply_sorting(query, search_request)
         
         # 应用分页
-        query = self._apply_pagination(query, search_request)
+        query = self._apply_pagination(query, search_request, fetch_extra)
         
         return query, count_query
     
@@ -101,9 +120,30 @@ class IPQueryBuilder:
         return filters
     
     def _build_text_search_filters(self, query: str) -> List:
-        """构建文本搜索过滤条件"""
-        search_terms = query.strip().split()
+        """
+        构建文本搜索过滤条件（任一词命中即可）
+        IP地址前缀/CIDR/通配符转换为 ip_int 区间，IP记录字段走全文索引（ngram），
+        网段字段先在小表 subnets 中匹配出网段ID；全文检索关闭时使用逐字段模糊匹配
+        """
+        search_terms = []
         filters = []
+        for term in query.strip().split():
+            ip_ranges = parse_ip_query(term)
+            if ip_ranges:
+                filters.append(range_filter(IPAddress.ip_int, ip_ranges))
+            else:
+                search_terms.append(term)
+        
+        fulltext_terms = [
+            term for term in search_terms if IP_SEARCH_FULLTEXT and not IP_FRAGMENT_PATTERN.match(term)
+        ]
+        boolean_query = build_boolean_query(' '.join(fulltext_terms), require_all=False) if fulltext_terms else None
+        if boolean_query:
+            filters.append(self._build_fulltext_match(boolean_query))
+            subnet_ids = self._matching_subnet_ids(fulltext_terms)
+            if subnet_ids:
+                filters.append(IPAddress.subnet_id.in_(subnet_ids))
+            search_terms = [term for term in search_terms if term not in fulltext_terms]
         
         for term in search_terms:
             term_filters = [
@@ -126,16 +166,38 @@ class IPQueryBuilder:
         
         return filters
     
+    @staticmethod
+    def _build_fulltext_match(boolean_query: str):
+        """MATCH(...) AGAINST (... IN BOOLEAN MODE)，列与全文索引定义一致"""
+        return match(*[getattr(IPAddress, column) for column in SEARCH_COLUMNS], against=boolean_query).in_boolean_mode()
+    
+    def _matching_subnet_ids(self, terms: List[str]) -> List[int]:
+        """网段地址或描述包含任一查询词的网段ID（subnets 为小表）"""
+        conditions = []
+        for term in terms:
+            conditions.extend([Subnet.network.ilike(f"%{term}%"), Subnet.description.ilike(f"%{term}%")])
+        return [row.id for row in self.db.query(Subnet.id).filter(or_(*conditions)).all()]
+    
+    def _build_relevance_order(self, query: str):
+        """相关度排序表达式：全文相关度 + 字段完全匹配加权"""
+        boolean_query = build_boolean_query(query, require_all=False)
+        if not boolean_query:
+            return None
+        relevance = self._build_fulltext_match(boolean_query)
+        for column, weight in EXACT_MATCH_BOOSTS:
+            relevance = relevance + case((getattr(IPAddress, column) == query.strip(), weight), else_=0)
+        return relevance
+    
     def _build_ip_range_filter(self, start_ip: str, end_ip: str):
         """构建IP地址范围过滤条件"""
         try:
             start_addr = ipaddress.ip_address(start_ip)
             end_addr = ipaddress.ip_address(end_ip)
             
-            # 使用INET_ATON函数进行IP地址范围比较（MySQL）
+            # 使用整数列 ip_int 进行范围比较，可走索引范围扫描
             return and_(
-                func.inet_aton(IPAddress.ip_address) >= func.inet_aton(start_ip),
-                func.inet_aton(IPAddress.ip_address) <= func.inet_aton(end_ip)
+                IPAddress.ip_int >= int(start_addr),
+                IPAddress.ip_int <= int(end_addr)
             )
         except ValueError:
             return None
@@ -172,26 +234,79 @@ class IPQueryBuilder:
     
     def _apply_sorting(self, query: Query, search_request: IPSearchRequest) -> Query:
         """应用排序"""
+        if search_request.sort_by == "relevance":
+            relevance = (
+                self._build_relevance_order(search_request.query)
+                if search_request.query and IP_SEARCH_FULLTEXT else None
+            )
+            if relevance is not None:
+                return query.order_by(desc(relevance), asc(IPAddress.ip_int), asc(IPAddress.id))
+            return query.order_by(asc(IPAddress.ip_int), asc(IPAddress.id))
+        
         sort_field = getattr(IPAddress, search_request.sort_by, IPAddress.ip_address)
         
         if search_request.sort_by == "ip_address":
             # IP地址特殊排序 - 按数值排序而非字符串排序
-            if search_request.sort_order == "desc":
-                query = query.order_by(desc(func.inet_aton(IPAddress.ip_address)))
-            else:
-                query = query.order_by(func.inet_aton(IPAddress.ip_address))
+            sort_field = IPAddress.ip_int
+        
+        # 以id作为次级排序键，保证顺序稳定（游标分页依赖该顺序）
+        if search_request.sort_order == "desc":
+            query = query.order_by(desc(sort_field), desc(IPAddress.id))
         else:
-            # 其他字段正常排序
-            if search_request.sort_order == "desc":
-                query = query.order_by(desc(sort_field))
-            else:
-                query = query.order_by(asc(sort_field))
+            query = query.order_by(asc(sort_field), asc(IPAddress.id))
         
         return query
     
-    def _apply_pagination(self, query: Query, search_request: IPSearchRequest) -> Query:
-        """应用分页"""
-        return query.offset(search_request.skip).limit(search_request.limit)
+    def _apply_pagination(self, query: Query, search_request: IPSearchRequest, fetch_extra: bool = False) -> Query:
+        """应用分页：提供游标时按排序键定位，否则使用偏移分页"""
+        limit = search_request.limit + 1 if fetch_extra else search_request.limit
+        if search_request.cursor:
+            return query.filter(self._build_keyset_filter(search_request)).limit(limit)
+        return query.offset(search_request.skip).limit(limit)
+    
+    def _build_keyset_filter(self, search_request: IPSearchRequest):
+        """构建游标定位条件 (sort_key, id) > / < (last_value, last_id)"""
+        if search_request.sort_by not in KEYSET_SORT_KEYS:
+            raise ValidationError("游标分页仅支持按 ip_address 或 created_at 排序", field="cursor")
+        
+        key, column = KEYSET_SORT_KEYS[search_request.sort_by]
+        try:
+            position = decode_cursor(search_request.cursor, (key, "id"))
+            value = position[key]
+            if key == "created_at":
+                value = datetime.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise ValidationError("无效的分页游标", field="cursor", value=search_request.cursor)
+        
+        if search_request.sort_order == "desc":
+            return or_(column < value, and_(column == value, IPAddress.id < position["id"]))
+        return or_(column > value, and_(column == value, IPAddress.id > position["id"]))
+    
+    def build_next_cursor(self, search_request: IPSearchRequest, last_item: IPAddress) -> Optional[str]:
+        """根据当前页最后一条记录生成下一页游标"""
+        if search_request.sort_by not in KEYSET_SORT_KEYS:
+            return None
+        key, _ = KEYSET_SORT_KEYS[search_request.sort_by]
+        return encode_cursor({key: getattr(last_item, key), "id": last_item.id})
+    
+    def estimate_count(self, count_query: Query) -> int:
+        """
+        通过 EXPLAIN 估算行数，避免在大表上执行精确 COUNT
+        以 render_postcompile 编译，IN 列表等扩展参数在 SQL 中展开为逐个绑定参数；
+        pymysql 为位置参数风格（%s），参数按 positiontup 的顺序传入。
+        连接查询的执行计划有多行，取 ip_addresses 表的估算行数
+        """
+        statement = count_query.statement
+        compiled = statement.compile(
+            dialect=self.db.get_bind().dialect,
+            compile_kwargs={"render_postcompile": True},
+        )
+        params = tuple(compiled.params[key] for key in (compiled.positiontup or ()))
+        plan = self.db.connection().exec_driver_sql(f"EXPLAIN {compiled}", params).mappings().all()
+        if not plan:
+            return 0
+        row = next((row for row in plan if row.get("table") == IPAddress.__tablename__), plan[0])
+        return int(row.get("rows") or 0)
 
 
 class SearchHistoryService:
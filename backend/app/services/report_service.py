@@ -16,6 +16,7 @@ from app.models.ip_address import IPAddress, IPStatus
 from app.models.subnet import Subnet
 from app.models.user import User
 from app.services.monitoring_service import MonitoringService
+from app.services.capacity_forecast_service import CapacityForecastService
 from app.schemas.monitoring import ReportRequest, ReportResponse, ReportFormat
 import pandas as pd
 from reportlab.lib import colors
@@ -185,8 +186,19 @@ class ReportService:
         if report_request.subnet_ids:
             subnet_stats = [s for s in subnet_stats if s['subnet_id'] in report_request.subnet_ids]
 
-        # 添加规划建议
+        # 耗尽预测（所有网段一次拟合）
+        forecasts = {
+            forecast['subnet_id']: forecast
+            for forecast in CapacityForecastService(self.db).forecast(subnet_ids=report_request.subnet_ids)
+        }
+
+        # 添加预测结果和规划建议
         for subnet in subnet_stats:
+            forecast = forecasts.get(subnet['subnet_id'], {})
+            subnet['growth_per_day'] = forecast.get('growth_per_day')
+            subnet['days_to_exhaustion'] = forecast.get('days_to_exhaustion')
+            subnet['exhaustion_date'] = forecast.get('exhaustion_date')
+            subnet['forecast_confidence'] = forecast.get('confidence')
             subnet['planning_recommendation'] = self._get_subnet_planning_recommendation(subnet)
 
         return {
@@ -197,9 +209,16 @@ class ReportService:
 
     def _get_subnet_planning_recommendation(self, subnet_stats: Dict[str, Any]) -> str:
         """
-        获取网段规划建议
+        获取网段规划建议（预测可信时按预计耗尽时间，否则按当前使用率）
         """
         utilization = subnet_stats['utilization_rate']
+        days_left = subnet_stats.get('days_to_exhaustion')
+        
+        if days_left is not None and (subnet_stats.get('forecast_confidence') or 0) >= 0.5:
+            if days_left <= 30:
+                return f"紧急：预计 {subnet_stats['exhaustion_date']} 前耗尽，建议立即扩容或添加新网段"
+            elif days_left <= 90:
+                return f"警告：预计 {subnet_stats['exhaustion_date']} 前耗尽，建议规划扩容"
         
         if utilization >= 90:
             return "紧急：使用率过高，建议立即扩容或添加新网段"
@@ -351,6 +370,9 @@ class ReportService:
                 ['总IP数', str(subnet['total_ips'])],
                 ['已分配IP', str(subnet['allocated_ips'])],
                 ['可用IP', str(subnet['available_ips'])],
+                ['日均增长', str(subnet.get('growth_per_day'))],
+                ['预计耗尽日期', subnet.get('exhaustion_date') or '-'],
+                ['预测置信度', str(subnet.get('forecast_confidence'))],
                 ['规划建议', subnet['planning_recommendation']]
             ]
             
@@ -2,9 +2,13 @@ from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.repositories.subnet_repository import SubnetRepository
 from app.services.ip_service import IPService
-from app.schemas.subnet import SubnetCreate, SubnetUpdate, SubnetResponse, SubnetValidationResponse
-from app.models.subnet import Subnet
+from app.schemas.subnet import (
+    SubnetCreate, SubnetUpdate, SubnetResponse, SubnetValidationResponse,
+    SubnetLookupResponse, SubnetFreeSpaceResponse
+)
+from app.models.subnet import Subnet, SubnetStorageMode
 from app.core.exceptions import ValidationError, NotFoundError, ConflictError
+from app.core.config import settings
 import ipaddress
 
 
@@ -22,13 +26,18 @@ class SubnetService:
             overlap_networks = [s.network for s in overlapping_subnets]
             raise ConflictError(f"网段与现有网段重叠: {', '.join(overlap_networks)}")
 
+        # 确定存储模式：超过自动生成上限的大网段只能使用稀疏模式
+        storage_mode = SubnetStorageMode(subnet_data.storage_mode or settings.SUBNET_STORAGE_MODE)
+        if ipaddress.ip_network(subnet_data.network, strict=False).num_addresses > IPService.MAX_GENERATED_ADDRESSES:
+            storage_mode = SubnetStorageMode.SPARSE
+
         # 创建网段
-        subnet = self.subnet_repo.create(subnet_data, created_by)
+        subnet = self.subnet_repo.create(subnet_data, created_by, storage_mode)
         
         # 自动生成IP地址列表
         try:
             generated_ips = self.ip_service.generate_ips_for_subnet(subnet.id, subnet.network)
-            if not generated_ips:
+            if not generated_ips and storage_mode == SubnetStorageMode.DENSE:
                 # 记录警告但不失败
                 print(f"警告：网段 {subnet.network} 没有生成任何IP地址")
         except Exception as e:
@@ -51,12 +60,18 @@ class SubnetService:
         subnet_stats = self.subnet_repo.get_with_stats(skip, limit)
         total = self.subnet_repo.count()
         
+        # 稀疏网段未存储的地址计入总数和可用数
+        virtual = self.ip_service.ip_repo.count_sparse_virtual() if any(
+            stats['subnet'].storage_mode == SubnetStorageMode.SPARSE for stats in subnet_stats
+        ) else {}
+        
         subnets = []
         for stats in subnet_stats:
+            virtual_available = virtual.get(stats['subnet'].id, 0)
             subnet_response = self._subnet_to_response(stats['subnet'])
-            subnet_response.ip_count = stats['ip_count']
+            subnet_response.ip_count = stats['ip_count'] + virtual_available
             subnet_response.allocated_count = stats['allocated_count']
-            subnet_response.available_count = stats['available_count']
+            subnet_response.available_count = stats['available_count'] + virtual_available
             subnets.append(subnet_response)
         
         return subnets, total
@@ -132,6 +147,33 @@ class SubnetService:
             message="网段验证通过"
         )
 
+    def lookup_ip(self, ip: str) -> SubnetLookupResponse:
+        """查询IP所属网段（最长前缀匹配）"""
+        try:
+            ipaddress.IPv4Address(ip.strip())
+        except ValueError:
+            raise ValidationError(f"无效的IP地址: {ip}")
+
+        matches = [self._subnet_to_response(s) for s in self.subnet_repo.find_by_ip(ip)]
+        return SubnetLookupResponse(ip=ip.strip(), subnet=matches[0] if matches else None, matches=matches)
+
+    def get_free_space(self, network: str, min_prefixlen: Optional[int] = None,
+                       limit: int = 100) -> SubnetFreeSpaceResponse:
+        """查询网段范围内未被占用的CIDR块（用于规划新网段）"""
+        try:
+            parsed = ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            raise ValidationError("无效的网段格式，请使用CIDR格式如192.168.1.0/24")
+        if parsed.version != 4:
+            raise ValidationError("仅支持IPv4网段")
+
+        blocks = self.subnet_repo.get_free_blocks(str(parsed), min_prefixlen, limit)
+        return SubnetFreeSpaceResponse(
+            network=str(parsed),
+            free_blocks=[str(block) for block in blocks],
+            free_addresses=sum(block.num_addresses for block in blocks)
+        )
+
     def search_subnets(self, query: str, skip: int = 0, limit: int = 100) -> Tuple[List[SubnetResponse], int]:
         """搜索网段"""
         subnets = self.subnet_repo.search(query, skip, limit)
@@ -158,5 +200,6 @@ class SubnetService:
             location=subnet.location,
             created_by=subnet.created_by,
             created_at=subnet.created_at,
-            updated_at=subnet.updated_at
+            updated_at=subnet.updated_at,
+            storage_mode=subnet.storage_mode.value if subnet.storage_mode else SubnetStorageMode.DENSE.value
         )
\ No newline at end of file
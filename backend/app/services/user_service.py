@@ -8,6 +8,7 @@ from fastapi import HTTPException, status
 from app.repositories.user_repository import UserRepository
 from app.models.user import User, UserRole, UserTheme
 from app.core.security import validate_password_strength
+from app.core.principal_cache import invalidate_principal
 import logging
 
 logger = logging.getLogger(__name__)
@@ -283,6 +284,7 @@ class UserService:
                 # 如果更新了用户名，需要手动提交
                 self.db.commit()
                 self.db.refresh(existing_user)
+                invalidate_principal(user_id)
             
             if update_data:
                 updated_user = self.user_repo.update(user_id, **update_data)
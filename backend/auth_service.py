@@ -8,8 +8,13 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import pymysql
+from db_executor import run_db
 from typing import Optional, Dict, Any
-from app.core.security import verify_password, get_password_hash
+from app.core.security import (
+    verify_password, verify_and_update_password, verify_and_update_password_async, get_password_hash, token_version
+)
+from app.core.password_hashing import PasswordHasherBusy
+from app.core.principal_cache import invalidate_principal
 import logging
 
 # 配置日志
@@ -45,36 +50,107 @@ class AuthService:
         Returns:
             用户信息字典，认证失败返回None
         """
+        # 查询后立即归还连接，哈希计算期间不占用数据库连接
+        try:
+            user = self._fetch_login_user(username)
+            if not user:
+                return None
+            
+            # 验证密码
+            valid, new_hash = verify_and_update_password(password, user['password_hash'])
+            if not valid:
+                logger.warning(f"密码验证失败: {username}")
+                return None
+            
+            # 工作因子配置变化后写回新哈希（不改变令牌版本）
+            if new_hash:
+                self._rehash(user['id'], user['password_hash'], new_hash)
+            
+            logger.info(f"用户认证成功: {username}")
+            return self._authenticated(user)
+        except PasswordHasherBusy:
+            raise
+        except Exception as e:
+            logger.error(f"认证过程中发生错误: {e}")
+            return None
+    
+    async def authenticate_user_async(self, username: str, password: str) -> Optional[Dict[str, Any]]:
+        """
+        用户认证（异步处理函数使用）
+        查询和写回哈希在数据库线程池中执行，bcrypt 计算在密码哈希线程池中等待，
+        登录高峰时排队的请求不占用数据库线程，哈希队列满时直接返回 429
+        """
+        try:
+            user = await run_db(self._fetch_login_user, username)
+            if not user:
+                return None
+            
+            valid, new_hash = await verify_and_update_password_async(password, user['password_hash'])
+            if not valid:
+                logger.warning(f"密码验证失败: {username}")
+                return None
+            
+            if new_hash:
+                await run_db(self._rehash, user['id'], user['password_hash'], new_hash)
+            
+            logger.info(f"用户认证成功: {username}")
+            return self._authenticated(user)
+        except PasswordHasherBusy:
+            raise
+        except Exception as e:
+            logger.error(f"认证过程中发生错误: {e}")
+            return None
+    
+    def _fetch_login_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """查询登录用户（含密码哈希），不存在或已禁用时返回 None"""
+        user = self._fetch_user(
+            "SELECT id, username, password_hash, credential_version, email, role, is_active "
+            "FROM users WHERE username = %s AND is_active = TRUE",
+            (username,)
+        )
+        if not user:
+            logger.warning(f"用户不存在或已禁用: {username}")
+        return user
+    
+    @staticmethod
+    def _authenticated(user: Dict[str, Any]) -> Dict[str, Any]:
+        """认证成功后返回的用户信息"""
+        return {
+            'id': user['id'],
+            'username': user['username'],
+            'email': user['email'],
+            'role': user['role'],
+            'is_active': user['is_active'],
+            'token_version': token_version(user['credential_version'])
+        }
+    
+    def _fetch_user(self, sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+        """查询单个用户，返回前关闭连接"""
+        connection = self.get_db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchone()
+        finally:
+            connection.close()
+    
+    def _rehash(self, user_id: int, old_hash: str, new_hash: str) -> bool:
+        """写回新哈希（期间密码已被修改时不覆盖），失败时保留原哈希，不影响本次登录"""
         connection = self.get_db_connection()
         try:
             with connection.cursor() as cursor:
-                # 查询用户
                 cursor.execute(
-                    "SELECT id, username, password_hash, email, role, is_active FROM users WHERE username = %s AND is_active = TRUE",
-                    (username,)
+                    "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                    (new_hash, user_id, old_hash)
                 )
-                user = cursor.fetchone()
-                
-                if not user:
-                    logger.warning(f"用户不存在或已禁用: {username}")
-                    return None
-                
-                # 验证密码
-                if not verify_password(password, user['password_hash']):
-                    logger.warning(f"密码验证失败: {username}")
-                    return None
-                
-                logger.info(f"用户认证成功: {username}")
-                return {
-                    'id': user['id'],
-                    'username': user['username'],
-                    'email': user['email'],
-                    'role': user['role'],
-                    'is_active': user['is_active']
-                }
+            connection.commit()
+            invalidate_principal(user_id)
+            logger.info(f"密码哈希已升级: user_id={user_id}")
+            return True
         except Exception as e:
-            logger.error(f"认证过程中发生错误: {e}")
-            return None
+            connection.rollback()
+            logger.warning(f"密码哈希升级失败: user_id={user_id}, {e}")
+            return False
         finally:
             connection.close()
     
@@ -90,34 +166,35 @@ class AuthService:
         Returns:
             修改成功返回True，否则返回False
         """
+        try:
+            # 获取当前用户信息
+            user = self._fetch_user("SELECT id, username, password_hash FROM users WHERE id = %s", (user_id,))
+            if not user:
+                logger.error(f"用户不存在: {user_id}")
+                return False
+            
+            # 验证旧密码、生成新密码哈希（不占用数据库连接）
+            if not verify_password(old_password, user['password_hash']):
+                logger.warning(f"旧密码验证失败: {user['username']}")
+                return False
+            new_password_hash = get_password_hash(new_password)
+        except PasswordHasherBusy:
+            raise
+        except Exception as e:
+            logger.error(f"修改密码过程中发生错误: {e}")
+            return False
+        
         connection = self.get_db_connection()
         try:
             with connection.cursor() as cursor:
-                # 获取当前用户信息
-                cursor.execute(
-                    "SELECT id, username, password_hash FROM users WHERE id = %s",
-                    (user_id,)
-                )
-                user = cursor.fetchone()
-                
-                if not user:
-                    logger.error(f"用户不存在: {user_id}")
-                    return False
-                
-                # 验证旧密码
-                if not verify_password(old_password, user['password_hash']):
-                    logger.warning(f"旧密码验证失败: {user['username']}")
-                    return False
-                
-                # 生成新密码哈希
-                new_password_hash = get_password_hash(new_password)
-                
-                # 更新密码
+                # 更新密码，令牌版本加一使之前签发的令牌失效；期间密码已被修改时不覆盖
                 cursor.execute(
-                    "UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (new_password_hash, user_id)
+                    "UPDATE users SET password_hash = %s, credential_version = credential_version + 1, "
+                    "updated_at = CURRENT_TIMESTAMP WHERE id = %s AND password_hash = %s",
+                    (new_password_hash, user_id, user['password_hash'])
                 )
                 connection.commit()
+                invalidate_principal(user_id)
                 
                 if cursor.rowcount > 0:
                     logger.info(f"密码修改成功: {user['username']}")
@@ -144,20 +221,25 @@ class AuthService:
         Returns:
             重置成功返回True，否则返回False
         """
+        # 生成新密码哈希（不占用数据库连接）
+        new_password_hash = get_password_hash(new_password)
+        
         connection = self.get_db_connection()
         try:
             with connection.cursor() as cursor:
-                # 生成新密码哈希
-                new_password_hash = get_password_hash(new_password)
-                
-                # 更新密码
+                # 更新密码，令牌版本加一使之前签发的令牌失效
                 cursor.execute(
-                    "UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE username = %s",
+                    "UPDATE users SET password_hash = %s, credential_version = credential_version + 1, "
+                    "updated_at = CURRENT_TIMESTAMP WHERE username = %s",
                     (new_password_hash, username)
                 )
                 connection.commit()
                 
                 if cursor.rowcount > 0:
+                    cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+                    user = cursor.fetchone()
+                    if user:
+                        invalidate_principal(user['id'])
                     logger.info(f"密码重置成功: {username}")
                     return True
                 else:
@@ -184,6 +266,9 @@ class AuthService:
         Returns:
             创建成功返回用户ID，否则返回None
         """
+        # 生成密码哈希（不占用数据库连接）
+        password_hash = get_password_hash(password)
+        
         connection = self.get_db_connection()
         try:
             with connection.cursor() as cursor:
@@ -193,9 +278,6 @@ class AuthService:
                     logger.error(f"用户名已存在: {username}")
                     return None
                 
-                # 生成密码哈希
-                password_hash = get_password_hash(password)
-                
                 # 创建用户
                 cursor.execute(
                     """
@@ -210,6 +292,8 @@ class AuthService:
                 logger.info(f"用户创建成功: {username} (ID: {user_id})")
                 return user_id
                 
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             logger.error(f"创建用户过程中发生错误: {e}")
             connection.rollback()
@@ -228,25 +312,21 @@ class AuthService:
         Returns:
             验证成功返回True，否则返回False
         """
-        connection = self.get_db_connection()
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    "SELECT password_hash FROM users WHERE username = %s AND is_active = TRUE",
-                    (username,)
-                )
-                user = cursor.fetchone()
-                
-                if not user:
-                    return False
-                
-                return verify_password(password, user['password_hash'])
-                
+            user = self._fetch_user(
+                "SELECT password_hash FROM users WHERE username = %s AND is_active = TRUE",
+                (username,)
+            )
+            if not user:
+                return False
+            
+            return verify_password(password, user['password_hash'])
+            
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             logger.error(f"验证密码过程中发生错误: {e}")
             return False
-        finally:
-            connection.close()
     
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """
@@ -305,6 +385,10 @@ def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
     """认证用户的便捷函数"""
     return auth_service.authenticate_user(username, password)
 
+async def authenticate_user_async(username: str, password: str) -> Optional[Dict[str, Any]]:
+    """认证用户的便捷函数（异步）"""
+    return await auth_service.authenticate_user_async(username, password)
+
 def change_user_password(user_id: int, old_password: str, new_password: str) -> bool:
     """修改用户密码的便捷函数"""
     return auth_service.change_password(user_id, old_password, new_password)
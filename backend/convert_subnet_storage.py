@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+网段IP存储模式转换脚本
+
+用法:
+    python convert_subnet_storage.py --to sparse --subnet-id 3 --subnet-id 5
+    python convert_subnet_storage.py --to sparse --all
+    python convert_subnet_storage.py --to dense --subnet-id 3 --dry-run
+
+dense -> sparse: 删除不带任何附加信息的 available 记录，已分配/保留/冲突记录保持不变
+sparse -> dense: 按CIDR补齐全部主机地址（受 IP_GENERATION_MAX_ADDRESSES 限制）
+"""
+import os
+import sys
+import argparse
+import logging
+
+import pymysql
+
+from ip_generation import STORAGE_MODES, convert_subnet_storage
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': os.getenv('DB_USER', 'ipam_user'),
+    'password': os.getenv('DB_PASSWORD', 'ipam_pass123'),
+    'database': os.getenv('DB_NAME', 'ipam'),
+    'port': int(os.getenv('DB_PORT', '3306')),
+    'charset': 'utf8mb4',
+    'cursorclass': pymysql.cursors.DictCursor,
+    'use_unicode': True
+}
+
+
+def list_target_subnets(connection, subnet_ids, target_mode):
+    """列出需要转换的网段及其当前记录数"""
+    sql = """
+        SELECT s.id, s.network, s.storage_mode,
+               COUNT(ip.id) AS stored,
+               COALESCE(SUM(ip.status = 'available'), 0) AS stored_available
+        FROM subnets s
+        LEFT JOIN ip_addresses ip ON ip.subnet_id = s.id
+        WHERE s.storage_mode <> %s
+    """
+    params = [target_mode]
+    if subnet_ids:
+        sql += f" AND s.id IN ({', '.join(['%s'] * len(subnet_ids))})"
+        params.extend(subnet_ids)
+    sql += " GROUP BY s.id, s.network, s.storage_mode ORDER BY s.id"
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转换网段IP存储模式（dense/sparse）")
+    parser.add_argument('--to', dest='target_mode', required=True, choices=STORAGE_MODES,
+                        help="目标存储模式")
+    parser.add_argument('--subnet-id', dest='subnet_ids', type=int, action='append',
+                        help="要转换的网段ID，可重复指定")
+    parser.add_argument('--all', action='store_true', help="转换所有网段")
+    parser.add_argument('--dry-run', action='store_true', help="只列出将要转换的网段，不做修改")
+    args = parser.parse_args()
+
+    if not args.subnet_ids and not args.all:
+        parser.error("必须指定 --subnet-id 或 --all")
+
+    connection = pymysql.connect(**DB_CONFIG)
+    try:
+        subnets = list_target_subnets(connection, args.subnet_ids, args.target_mode)
+        if not subnets:
+            logger.info("没有需要转换的网段")
+            return 0
+
+        failed = 0
+        for subnet in subnets:
+            logger.info(
+                f"网段 {subnet['id']} ({subnet['network']}): {subnet['storage_mode']} -> {args.target_mode}，"
+                f"已存记录 {subnet['stored']}，其中可用 {subnet['stored_available']}"
+            )
+            if args.dry_run:
+                continue
+            try:
+                result = convert_subnet_storage(connection, subnet['id'], args.target_mode)
+                logger.info(f"  转换完成: 删除 {result['removed']} 条，新增 {result['created']} 条")
+            except Exception as e:
+                failed += 1
+                logger.error(f"  转换失败: {e}")
+
+        return 1 if failed else 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
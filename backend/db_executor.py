@@ -0,0 +1,94 @@
+"""
+数据库阻塞调用执行器
+将使用 pymysql 的同步处理函数放到有界线程池中执行，避免阻塞事件循环
+"""
+import os
+import asyncio
+import contextvars
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, partial
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+# 执行模式: threadpool（默认，线程池执行）/ inline（在事件循环中直接执行，旧行为，用于性能对比）
+DB_EXECUTION_MODE = os.getenv('DB_EXECUTION_MODE', 'threadpool').lower()
+
+# 线程数默认与连接池上限一致，避免线程在等待连接上空转
+DB_EXECUTOR_WORKERS = int(os.getenv(
+    'DB_EXECUTOR_WORKERS',
+    str(int(os.getenv('DB_POOL_SIZE', '20')) + int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')))
+))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db-worker')
+_stats_lock = threading.Lock()
+_stats = {
+    "submitted": 0,
+    "active": 0,
+    "completed": 0,
+    "failed": 0,
+}
+
+
+def _run_tracked(func, *args, **kwargs):
+    """在工作线程中执行并统计"""
+    with _stats_lock:
+        _stats["active"] += 1
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        with _stats_lock:
+            _stats["failed"] += 1
+        raise
+    finally:
+        with _stats_lock:
+            _stats["active"] -= 1
+            _stats["completed"] += 1
+
+
+def db_bound(func):
+    """
+    数据库密集型处理函数装饰器
+
+    被装饰的同步函数在 threadpool 模式下提交到数据库线程池执行，
+    inline 模式下直接在事件循环中执行（与改造前行为一致）。
+    FastAPI 通过 __wrapped__ 解析原函数签名，参数注入不受影响。
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+
+    return wrapper
+
+
+async def run_db(func, *args, **kwargs):
+    """在数据库线程池中执行单个同步调用（异步处理函数中只有部分步骤访问数据库时使用）"""
+    if DB_EXECUTION_MODE == 'inline':
+        return func(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    with _stats_lock:
+        _stats["submitted"] += 1
+    return await loop.run_in_executor(
+        _executor, partial(ctx.run, _run_tracked, func, *args, **kwargs)
+    )
+
+
+def get_executor_info() -> Dict[str, Any]:
+    """获取线程池执行器状态"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        "mode": DB_EXECUTION_MODE,
+        "max_workers": DB_EXECUTOR_WORKERS,
+        "pending": max(stats["submitted"] - stats["completed"] - stats["active"], 0),
+    })
+    return stats
+
+
+def shutdown_executor():
+    """关闭线程池（应用关闭时调用）"""
+    _executor.shutdown(wait=False)
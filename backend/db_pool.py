@@ -0,0 +1,269 @@
+"""
+pymysql 连接池
+为 enhanced_main / api_extensions 的原生SQL路径提供有界、线程安全的连接复用
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(Exception):
+    """连接池已耗尽（等待超时）"""
+
+
+class PooledConnection:
+    """
+    池化连接代理
+
+    对外表现与 pymysql.Connection 一致，调用 close() 时归还连接池而不是断开，
+    因此现有的 `connection = get_db_connection() ... finally: connection.close()` 写法无需修改。
+    """
+
+    def __init__(self, pool: "MySQLConnectionPool", raw_connection: pymysql.connections.Connection):
+        self._pool = pool
+        self._raw = raw_connection
+        self._created_at = time.time()
+        self._last_used_at = self._created_at
+        self._checked_out = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        """归还连接池（可重复调用）"""
+        if self._checked_out:
+            self._pool._return(self)
+
+    def invalidate(self):
+        """标记连接失效并从池中移除，用于连接出现异常后不再复用"""
+        if self._checked_out:
+            self._pool._return(self, invalidate=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MySQLConnectionPool:
+    """
+    有界的 pymysql 连接池
+
+    - pool_size: 常驻连接数；max_overflow: 高峰期允许额外创建的连接数
+    - 字符集只在创建物理连接时设置一次
+    - 签出时对空闲超过 ping_interval 的连接做存活检查
+    - 空闲超过 max_idle_time 或存活超过 pool_recycle 的连接被回收重建
+    """
+
+    def __init__(
+        self,
+        db_config: Dict[str, Any],
+        pool_size: int = 20,
+        max_overflow: int = 10,
+        pool_timeout: float = 30.0,
+        max_idle_time: float = 300.0,
+        pool_recycle: float = 3600.0,
+        ping_interval: float = 30.0,
+    ):
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.max_idle_time = max_idle_time
+        self.pool_recycle = pool_recycle
+        self.ping_interval = ping_interval
+
+        self._idle: "queue.LifoQueue[PooledConnection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size + max_overflow)
+        self._total = 0          # 当前存在的物理连接数
+        self._checked_out = 0
+        self._invalid = 0        # 因失效/过期被丢弃的连接累计数
+        self._created = 0        # 累计创建的物理连接数
+
+    def _create_raw_connection(self) -> pymysql.connections.Connection:
+        """创建物理连接并设置字符集（每个物理连接只执行一次）"""
+        connection = pymysql.connect(**self.db_config)
+        with connection.cursor() as cursor:
+            cursor.execute("SET NAMES utf8mb4")
+            cursor.execute("SET CHARACTER SET utf8mb4")
+            cursor.execute("SET character_set_connection=utf8mb4")
+        connection.commit()
+        return connection
+
+    def _discard(self, pooled: PooledConnection, invalid: bool = True):
+        """关闭并丢弃物理连接"""
+        try:
+            pooled._raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._total -= 1
+            if invalid:
+                self._invalid += 1
+
+    def _is_usable(self, pooled: PooledConnection) -> bool:
+        """检查空闲连接是否可继续使用"""
+        now = time.time()
+        if now - pooled._created_at > self.pool_recycle:
+            return False
+        idle_seconds = now - pooled._last_used_at
+        if idle_seconds > self.max_idle_time:
+            return False
+        if idle_seconds > self.ping_interval:
+            try:
+                pooled._raw.ping(reconnect=False)
+            except Exception as e:
+                logger.warning(f"Pooled connection failed liveness check: {e}")
+                return False
+        return True
+
+    def get_connection(self) -> PooledConnection:
+        """签出连接，池中无可用连接时创建新连接，达到上限则等待"""
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise PoolExhaustedError(
+                f"数据库连接池已耗尽（上限 {self.pool_size + self.max_overflow}，等待 {self.pool_timeout}s）"
+            )
+
+        try:
+            pooled = None
+            while pooled is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self._is_usable(candidate):
+                    pooled = candidate
+                else:
+                    self._discard(candidate)
+
+            if pooled is None:
+                raw = self._create_raw_connection()
+                pooled = PooledConnection(self, raw)
+                with self._lock:
+                    self._total += 1
+                    self._created += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        pooled._checked_out = True
+        with self._lock:
+            self._checked_out += 1
+        return pooled
+
+    def _return(self, pooled: PooledConnection, invalidate: bool = False):
+        """归还连接：回滚未提交事务，超出常驻数量或失效的连接直接关闭"""
+        pooled._checked_out = False
+        with self._lock:
+            self._checked_out -= 1
+
+        try:
+            if not invalidate:
+                try:
+                    # 回滚未提交的事务，避免读快照和锁跨请求泄漏
+                    pooled._raw.rollback()
+                except Exception:
+                    invalidate = True
+
+            if invalidate or self._idle.qsize() >= self.pool_size:
+                self._discard(pooled, invalid=invalidate)
+            else:
+                pooled._last_used_at = time.time()
+                self._idle.put(pooled)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """签出/归还上下文管理器，异常时连接作废"""
+        pooled = self.get_connection()
+        try:
+            yield pooled
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            pooled.invalidate()
+            raise
+        finally:
+            pooled.close()
+
+    def dispose(self):
+        """关闭所有空闲连接（应用关闭时调用）"""
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                pooled._raw.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._total -= 1
+
+    def status(self) -> Dict[str, Any]:
+        """连接池统计，字段与 app.core.database.get_database_info 保持一致"""
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "checked_in": self._idle.qsize(),
+                "checked_out": self._checked_out,
+                "overflow": max(self._total - self.pool_size, 0),
+                "invalid": self._invalid,
+                "max_overflow": self.max_overflow,
+                "total_created": self._created,
+            }
+
+
+_pool: Optional[MySQLConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(db_config: Dict[str, Any]) -> MySQLConnectionPool:
+    """初始化全局连接池，参数可通过环境变量调整"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MySQLConnectionPool(
+                db_config,
+                pool_size=int(os.getenv('DB_POOL_SIZE', '20')),
+                max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+                pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                max_idle_time=float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+                pool_recycle=float(os.getenv('DB_POOL_RECYCLE', '3600')),
+                ping_interval=float(os.getenv('DB_POOL_PING_INTERVAL', '30')),
+            )
+        return _pool
+
+
+def get_pool() -> Optional[MySQLConnectionPool]:
+    """获取全局连接池"""
+    return _pool
+
+
+def get_pool_info() -> dict:
+    """
+    获取连接池信息
+    返回数据库状态和连接池信息
+    """
+    if _pool is None:
+        return {"status": "uninitialized"}
+    try:
+        info = {"status": "connected"}
+        with _pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Failed to get pool info: {e}")
+        info = {"status": "disconnected", "error": str(e)}
+    info.update(_pool.status())
+    return info
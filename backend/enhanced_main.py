@@ -1,8 +1,11 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
 import os
+import anyio
+import asyncio
 import pymysql
 import redis
 import ipaddress
@@ -18,6 +21,17 @@ logger = logging.getLogger(__name__)
 
 # 导入API扩展
 from api_extensions import add_missing_endpoints
+from db_pool import init_pool, get_pool_info, PoolExhaustedError
+from db_executor import db_bound, get_executor_info, shutdown_executor, DB_EXECUTOR_WORKERS
+from ip_generation import generate_subnet_ips, choose_storage_mode, sparse_virtual_counts
+from subnet_counters import total_counts, counted_subnet_sql, counter_reconciler
+from utilization_history import daily_trends, utilization_recorder
+from ip_allocation import rebuild_bitmaps
+from app.core.ip_bitmap import ip_bitmaps, IP_BITMAP_ENABLED
+from app.core.subnet_trie import subnet_index, trie_from_cursor
+from app.core.principal_cache import invalidate_principal
+from app.core.password_hashing import password_hasher
+from app.core.live_updates import live_hub, publish_ip_changes
 
 # 尝试启用API v1路由
 try:
@@ -47,6 +61,9 @@ REDIS_CONFIG = {
     'db': int(os.getenv('REDIS_DB', '0'))
 }
 
+# 网段位图：每个 worker 进程在启动时从数据库预加载自己的位图
+IP_BITMAP_PRELOAD = os.getenv('IP_BITMAP_PRELOAD', 'true').lower() == 'true'
+
 # Pydantic模型
 class SubnetCreate(BaseModel):
     network: str
@@ -55,6 +72,7 @@ class SubnetCreate(BaseModel):
     description: Optional[str] = None
     vlan_id: Optional[int] = None
     location: Optional[str] = None
+    storage_mode: Optional[str] = None  # dense / sparse，不传时使用 SUBNET_STORAGE_MODE
 
 class SubnetResponse(BaseModel):
     id: int
@@ -64,6 +82,7 @@ class SubnetResponse(BaseModel):
     description: Optional[str]
     vlan_id: Optional[int]
     location: Optional[str]
+    storage_mode: Optional[str] = 'dense'
     created_at: str
 
 class IPAddressCreate(BaseModel):
@@ -134,17 +153,17 @@ class DeviceTypeOption(BaseModel):
     name: str
     status: str
 
+# 数据库连接池（字符集在创建物理连接时设置一次）
+db_pool = init_pool(DB_CONFIG)
+
 # 数据库连接函数
 def get_db_connection():
-    """获取数据库连接"""
+    """从连接池获取数据库连接，调用 close() 时归还连接池"""
     try:
-        connection = pymysql.connect(**DB_CONFIG)
-        # 确保连接使用UTF-8字符集
-        with connection.cursor() as cursor:
-            cursor.execute("SET NAMES utf8mb4")
-            cursor.execute("SET CHARACTER SET utf8mb4")
-            cursor.execute("SET character_set_connection=utf8mb4")
-        return connection
+        return db_pool.get_connection()
+    except PoolExhaustedError as e:
+        logger.error(f"Database connection pool exhausted: {e}")
+        raise HTTPException(status_code=503, detail="Database connection pool exhausted")
     except Exception as e:
         logger.error(f"Database connection failed: {e}")
         raise HTTPException(status_code=500, detail="Database connection failed")
@@ -160,90 +179,26 @@ def get_redis_connection():
         raise HTTPException(status_code=500, detail="Redis connection failed")
 
 def generate_ips_for_subnet_simple(connection, subnet_id: int, network: str) -> int:
-    """为网段生成IP地址列表（简化版本）"""
+    """为网段生成IP地址列表（批量集合运算版本），返回新建数量"""
     try:
-        # 如果network不包含CIDR前缀，需要从数据库获取子网掩码
-        if '/' not in network:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT netmask FROM subnets WHERE id = %s", (subnet_id,))
-                result = cursor.fetchone()
-                if result and result['netmask']:
-                    netmask = result['netmask']
-                    # 将点分十进制子网掩码转换为CIDR前缀长度
-                    if '.' in netmask:
-                        # 点分十进制格式，如 255.255.255.0
-                        prefix_length = sum([bin(int(x)).count('1') for x in netmask.split('.')])
-                        network = f"{network}/{prefix_length}"
-                    else:
-                        # 已经是前缀长度格式，如 24
-                        network = f"{network}/{netmask}"
-        
-        net = ipaddress.ip_network(network, strict=False)
-        print(f"解析网段 {network}，包含 {net.num_addresses} 个地址")
-    except ValueError as e:
-        print(f"网段格式错误: {network}, 错误: {e}")
-        raise ValueError(f"无效的网段格式: {network}")
-
-    # 检查网段大小，避免生成过多IP地址
-    if net.num_addresses > 65536:  # /16网段
-        print(f"网段过大: {network} 包含 {net.num_addresses} 个地址")
-        raise ValueError("网段过大，无法自动生成所有IP地址。建议使用/17或更小的网段")
-
-    # 批量创建IP地址数据
-    ip_data_list = []
-    host_count = 0
-    existing_count = 0
-    
-    print(f"开始遍历网段 {network} 中的主机地址...")
-    
-    try:
-        with connection.cursor() as cursor:
-            for ip in net.hosts():
-                host_count += 1
-                ip_str = str(ip)
-                
-                # 检查IP是否已存在
-                cursor.execute("SELECT id, subnet_id FROM ip_addresses WHERE ip_address = %s", (ip_str,))
-                existing_ip = cursor.fetchone()
-                
-                if existing_ip and existing_ip['subnet_id'] != subnet_id:
-                    # 如果IP已存在于其他网段，跳过
-                    existing_count += 1
-                    continue
-                
-                if not existing_ip:
-                    ip_data_list.append((ip_str, subnet_id, 'available'))
-
-            print(f"网段分析完成: 总主机数={host_count}, 已存在={existing_count}, 待创建={len(ip_data_list)}")
-
-            # 批量插入IP地址
-            if ip_data_list:
-                print(f"开始批量创建 {len(ip_data_list)} 个IP地址...")
-                
-                # 使用批量插入提高性能
-                sql = """
-                INSERT INTO ip_addresses (ip_address, subnet_id, status, created_at)
-                VALUES (%s, %s, %s, NOW())
-                """
-                cursor.executemany(sql, ip_data_list)
-                connection.commit()
-                
-                print(f"成功创建 {len(ip_data_list)} 个IP地址")
-                return len(ip_data_list)
-            else:
-                print("没有需要创建的IP地址")
-                return 0
-                
+        stats = generate_subnet_ips(connection, subnet_id, network)
     except Exception as e:
         print(f"生成IP地址时发生错误: {str(e)}")
-        connection.rollback()
-        raise e
+        raise
+    
+    print(f"网段分析完成: 总主机数={stats['host_count']}, 其他网段已存在={stats['existing_other_subnet']}, "
+          f"新建={stats['created']}, 耗时={stats['elapsed']}s, 速率={stats['rows_per_second']} 行/秒")
+    return stats['created']
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up Enhanced IPAM backend...")
     
+    # 同步依赖（API v1 的 SQLAlchemy 会话）由 anyio 线程池执行，按数据库容量设置线程数
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_EXECUTOR_WORKERS
+    logger.info(f"DB executor workers: {DB_EXECUTOR_WORKERS}")
+    
     # 测试数据库连接
     try:
         conn = get_db_connection()
@@ -259,12 +214,37 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Redis connection test failed: {e}")
     
+    # 预加载网段空闲地址位图
+    if IP_BITMAP_ENABLED:
+        if IP_BITMAP_PRELOAD:
+            try:
+                conn = get_db_connection()
+                try:
+                    loaded = rebuild_bitmaps(conn)
+                finally:
+                    conn.close()
+                logger.info(f"IP bitmaps loaded for {loaded} subnets")
+            except Exception as e:
+                logger.error(f"IP bitmap preload failed: {e}")
+    
+    # 网段IP状态计数器定期对账
+    counter_reconciler.start(get_db_connection)
+    
+    # 利用率历史汇总
+    utilization_recorder.start(get_db_connection)
+    
+    # 仪表盘/IP列表实时推送
+    live_hub.start(get_db_connection, sparse_virtual_counts)
+    
     logger.info("Enhanced IPAM backend startup completed")
     
     yield
     
     # Shutdown
     logger.info("Shutting down Enhanced IPAM backend...")
+    shutdown_executor()
+    password_hasher.shutdown()
+    db_pool.dispose()
 
 app = FastAPI(
     title="Enhanced IPAM System API",
@@ -282,6 +262,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# API响应缓存（服务端缓存 + ETag/304）；写请求由中间件按路径递增缓存版本号
+from app.core.response_cache_middleware import setup_response_cache_middleware, RESPONSE_CACHE_ENABLED
+setup_response_cache_middleware(app, RESPONSE_CACHE_ENABLED)
+
 # 包含API路由（如果可用）
 if API_V1_AVAILABLE:
     app.include_router(api_router, prefix="/api")
@@ -310,7 +294,8 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check():
+@db_bound
+def health_check():
     """健康检查端点"""
     db_status = "healthy"
     redis_status = "healthy"
@@ -335,27 +320,61 @@ async def health_check():
         "components": {
             "database": db_status,
             "redis": redis_status
-        }
+        },
+        "database_pool": db_pool.status(),
+        "db_executor": get_executor_info(),
+        "password_hasher": password_hasher.status(),
+        "subnet_counter_reconciler": counter_reconciler.status(),
+        "utilization_history": utilization_recorder.status(),
+        "live_updates": live_hub.status(),
+        "ip_bitmaps": ip_bitmaps.status(),
+        "subnet_index": subnet_index.status()
     }
 
+
+@app.get("/health/db-pool")
+@db_bound
+def db_pool_info():
+    """数据库连接池状态"""
+    return get_pool_info()
+
 # 网段管理端点 - 添加 /api 路径映射
 @app.post("/api/subnets", response_model=SubnetResponse)
 @app.post("/api/v1/subnets", response_model=SubnetResponse)
-async def create_subnet(subnet: SubnetCreate):
+@db_bound
+def create_subnet(subnet: SubnetCreate):
     """创建新网段"""
     connection = get_db_connection()
     try:
+        try:
+            network_obj = ipaddress.ip_network(
+                subnet.network if '/' in subnet.network else f"{subnet.network}/{subnet.netmask}",
+                strict=False
+            )
+            storage_mode = choose_storage_mode(network_obj, subnet.storage_mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         with connection.cursor() as cursor:
+            # 重叠检查（网段前缀树）
+            overlapping = trie_from_cursor(cursor).overlapping(network_obj)
+            if overlapping:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"网段与现有网段重叠: {', '.join(str(entry.network) for entry in overlapping)}"
+                )
+            
             # 创建网段
             sql = """
-            INSERT INTO subnets (network, netmask, gateway, description, vlan_id, location, created_by)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO subnets (network, netmask, gateway, description, vlan_id, location, storage_mode, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
             cursor.execute(sql, (
                 subnet.network, subnet.netmask, subnet.gateway, 
-                subnet.description, subnet.vlan_id, subnet.location, 1  # 默认用户ID为1
+                subnet.description, subnet.vlan_id, subnet.location, storage_mode, 1  # 默认用户ID为1
             ))
             connection.commit()
+            subnet_index.invalidate()
             
             # 获取创建的记录
             subnet_id = cursor.lastrowid
@@ -380,8 +399,11 @@ async def create_subnet(subnet: SubnetCreate):
                 description=result['description'],
                 vlan_id=result['vlan_id'],
                 location=result['location'],
+                storage_mode=result.get('storage_mode') or 'dense',
                 created_at=str(result['created_at'])
             )
+    except HTTPException:
+        raise
     except pymysql.IntegrityError as e:
         raise HTTPException(status_code=400, detail=f"Subnet already exists: {str(e)}")
     except Exception as e:
@@ -396,7 +418,8 @@ class SubnetListResponse(BaseModel):
     size: int
 
 @app.get("/api/v1/subnets", response_model=SubnetListResponse)
-async def list_subnets(skip: int = 0, limit: int = 50):
+@db_bound
+def list_subnets(skip: int = 0, limit: int = 50):
     """获取网段列表"""
     connection = get_db_connection()
     try:
@@ -419,6 +442,7 @@ async def list_subnets(skip: int = 0, limit: int = 50):
                     description=row['description'],
                     vlan_id=row['vlan_id'],
                     location=row['location'],
+                    storage_mode=row.get('storage_mode') or 'dense',
                     created_at=str(row['created_at'])
                 ) for row in results
             ]
@@ -435,7 +459,8 @@ async def list_subnets(skip: int = 0, limit: int = 50):
         connection.close()
 
 @app.get("/api/v1/subnets/{subnet_id}", response_model=SubnetResponse)
-async def get_subnet(subnet_id: int):
+@db_bound
+def get_subnet(subnet_id: int):
     """获取特定网段信息"""
     connection = get_db_connection()
     try:
@@ -454,6 +479,7 @@ async def get_subnet(subnet_id: int):
                 description=result['description'],
                 vlan_id=result['vlan_id'],
                 location=result['location'],
+                storage_mode=result.get('storage_mode') or 'dense',
                 created_at=str(result['created_at'])
             )
     except HTTPException:
@@ -465,7 +491,8 @@ async def get_subnet(subnet_id: int):
 
 # IP地址管理端点
 @app.post("/api/v1/ip-addresses", response_model=IPAddressResponse)
-async def create_ip_address(ip: IPAddressCreate):
+@db_bound
+def create_ip_address(ip: IPAddressCreate):
     """创建新IP地址记录"""
     connection = get_db_connection()
     try:
@@ -492,6 +519,8 @@ async def create_ip_address(ip: IPAddressCreate):
             ip_id = cursor.lastrowid
             cursor.execute("SELECT * FROM ip_addresses WHERE id = %s", (ip_id,))
             result = cursor.fetchone()
+            ip_bitmaps.apply_status(result['subnet_id'], result['ip_int'], result['status'])
+            publish_ip_changes([result['subnet_id']], [(result['subnet_id'], result['ip_address'])])
             
             return IPAddressResponse(
                 id=result['id'],
@@ -517,7 +546,8 @@ async def create_ip_address(ip: IPAddressCreate):
         connection.close()
 
 @app.get("/api/v1/ip-addresses", response_model=List[IPAddressResponse])
-async def list_ip_addresses(skip: int = 0, limit: int = 50, subnet_id: Optional[int] = None):
+@db_bound
+def list_ip_addresses(skip: int = 0, limit: int = 50, subnet_id: Optional[int] = None):
     """获取IP地址列表"""
     connection = get_db_connection()
     try:
@@ -569,15 +599,15 @@ class ChangePasswordRequest(BaseModel):
     new_password: str
 
 # 导入统一认证服务
-from auth_service import authenticate_user
+from auth_service import authenticate_user_async
 
 # 认证端点
 @app.post("/api/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
-    """用户登录"""
+    """用户登录（数据库查询在数据库线程池中执行，密码校验在密码哈希线程池中等待）"""
     try:
         # 使用统一认证服务进行用户认证
-        user = authenticate_user(request.username, request.password)
+        user = await authenticate_user_async(request.username, request.password)
         
         if not user:
             raise HTTPException(
@@ -589,10 +619,11 @@ async def login(request: LoginRequest):
         from app.core.security import create_access_token, create_refresh_token
         
         access_token = create_access_token(
-            data={"sub": str(user['id']), "username": user['username'], "role": user['role']}
+            data={"sub": str(user['id']), "username": user['username'], "role": user['role'],
+                  "ver": user['token_version']}
         )
         refresh_token = create_refresh_token(
-            data={"sub": str(user['id']), "username": user['username']}
+            data={"sub": str(user['id']), "username": user['username'], "ver": user['token_version']}
         )
         
         return LoginResponse(
@@ -651,7 +682,8 @@ async def refresh_token(request: dict):
     }
 
 @app.get("/api/auth/profile")
-async def get_profile():
+@db_bound
+def get_profile():
     """获取用户个人信息"""
     connection = get_db_connection()
     try:
@@ -685,7 +717,8 @@ async def get_profile():
         connection.close()
 
 @app.put("/api/auth/profile")
-async def update_profile(request: dict):
+@db_bound
+def update_profile(request: dict):
     """更新用户个人信息"""
     connection = get_db_connection()
     try:
@@ -723,6 +756,7 @@ async def update_profile(request: dict):
             
             if cursor.rowcount == 0:
                 raise HTTPException(status_code=404, detail="用户不存在")
+            invalidate_principal(1)
             
             # 返回更新后的用户信息
             cursor.execute(
@@ -751,7 +785,8 @@ async def update_profile(request: dict):
         connection.close()
 
 @app.put("/api/auth/password")
-async def change_password(request: ChangePasswordRequest, authorization: str = Header(None)):
+@db_bound
+def change_password(request: ChangePasswordRequest, authorization: str = Header(None)):
     """修改用户密码"""
     # 从Authorization header中获取当前用户ID
     if not authorization or not authorization.startswith("Bearer "):
@@ -802,7 +837,8 @@ async def change_password(request: ChangePasswordRequest, authorization: str = H
 
 # 统计端点
 @app.get("/api/v1/stats")
-async def get_statistics():
+@db_bound
+def get_statistics():
     """获取系统统计信息"""
     connection = get_db_connection()
     try:
@@ -811,21 +847,18 @@ async def get_statistics():
             cursor.execute("SELECT COUNT(*) as count FROM subnets")
             subnet_count = cursor.fetchone()['count']
             
-            # IP地址统计
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses")
-            total_ips = cursor.fetchone()['count']
+            # IP地址统计（网段计数器合计）
+            counts = total_counts(cursor)
+            total_ips = counts['total_count']
+            allocated_ips = counts['allocated_count']
+            available_ips = counts['available_count']
+            reserved_ips = counts['reserved_count']
+            conflict_ips = counts['conflict_count']
             
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'allocated'")
-            allocated_ips = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'available'")
-            available_ips = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'reserved'")
-            reserved_ips = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'conflict'")
-            conflict_ips = cursor.fetchone()['count']
+            # 稀疏网段中未存储的地址计为可用
+            virtual_available = sum(sparse_virtual_counts(cursor).values())
+            total_ips += virtual_available
+            available_ips += virtual_available
             
             # 用户统计
             cursor.execute("SELECT COUNT(*) as count FROM users")
@@ -862,9 +895,24 @@ async def get_statistics():
     finally:
         connection.close()
 
+# 实时推送（SSE）：分配/释放/批量操作提交后推送变化网段的计数器和变化的IP行，代替轮询
+@app.get("/api/live/events")
+async def live_events(subnet_id: Optional[int] = None):
+    """仪表盘和IP列表的实时更新事件流，subnet_id 只接收该网段的计数器和地址"""
+    connection = live_hub.connect(asyncio.get_running_loop(), subnet_id)
+    if connection is None:
+        raise HTTPException(status_code=503, detail="实时推送不可用或连接数已达上限")
+    return StreamingResponse(
+        connection.stream(live_hub.disconnect),
+        media_type="text/event-stream",
+        # 关闭 Nginx 对该响应的缓冲
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # 监控相关API端点
 @app.get("/api/monitoring/dashboard")
-async def get_dashboard_summary():
+@db_bound
+def get_dashboard_summary():
     """获取仪表盘汇总数据"""
     connection = get_db_connection()
     try:
@@ -873,21 +921,18 @@ async def get_dashboard_summary():
             cursor.execute("SELECT COUNT(*) as count FROM subnets")
             subnet_count = cursor.fetchone()['count']
             
-            # IP地址统计
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses")
-            total_ips = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'allocated'")
-            allocated_ips = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'available'")
-            available_ips = cursor.fetchone()['count']
+            # IP地址统计（网段计数器合计）
+            counts = total_counts(cursor)
+            total_ips = counts['total_count']
+            allocated_ips = counts['allocated_count']
+            available_ips = counts['available_count']
+            reserved_ips = counts['reserved_count']
+            conflict_ips = counts['conflict_count']
             
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'reserved'")
-            reserved_ips = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM ip_addresses WHERE status = 'conflict'")
-            conflict_ips = cursor.fetchone()['count']
+            # 稀疏网段中未存储的地址计为可用
+            virtual_available = sum(sparse_virtual_counts(cursor).values())
+            total_ips += virtual_available
+            available_ips += virtual_available
             
             # 用户统计
             cursor.execute("SELECT COUNT(*) as count FROM users")
@@ -916,51 +961,13 @@ async def get_dashboard_summary():
         connection.close()
 
 @app.get("/api/monitoring/allocation-trends")
-async def get_allocation_trends(days: int = 30):
-    """获取IP分配趋势数据"""
-    from datetime import datetime, timedelta
-    
+@db_bound
+def get_allocation_trends(days: int = 30):
+    """获取IP分配趋势数据（读取利用率历史的按天汇总，包含已释放地址的分配记录）"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            # 生成最近N天的日期范围
-            sql = """
-            SELECT 
-                DATE(allocated_at) as date,
-                COUNT(*) as allocations
-            FROM ip_addresses 
-            WHERE allocated_at >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
-                AND allocated_at IS NOT NULL
-            GROUP BY DATE(allocated_at)
-            ORDER BY date ASC
-            """
-            cursor.execute(sql, (days,))
-            results = cursor.fetchall()
-            
-            # 创建完整的日期范围
-            trends = []
-            base_date = datetime.now() - timedelta(days=days-1)
-            
-            # 将数据库结果转换为字典，便于查找
-            db_data = {}
-            for row in results:
-                date_str = row['date'].strftime("%Y-%m-%d")
-                db_data[date_str] = row['allocations']
-            
-            # 生成完整的日期序列
-            for i in range(days):
-                current_date = base_date + timedelta(days=i)
-                date_str = current_date.strftime("%Y-%m-%d")
-                
-                # 如果数据库中有该日期的数据，使用实际数据；否则使用0
-                allocations = db_data.get(date_str, 0)
-                
-                trends.append({
-                    "date": date_str,
-                    "allocations": allocations
-                })
-            
-            return trends
+            return daily_trends(cursor, days)
             
     except Exception as e:
         logger.error(f"Failed to fetch allocation trends: {str(e)}")
@@ -969,12 +976,13 @@ async def get_allocation_trends(days: int = 30):
         connection.close()
 
 @app.get("/api/monitoring/top-utilized-subnets")
-async def get_top_utilized_subnets(limit: int = 10):
+@db_bound
+def get_top_utilized_subnets(limit: int = 10):
     """获取使用率最高的网段"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            sql = """
+            sql = f"""
             SELECT 
                 s.id,
                 s.network,
@@ -982,16 +990,12 @@ async def get_top_utilized_subnets(limit: int = 10):
                 s.description,
                 s.vlan_id,
                 s.location,
-                COUNT(ip.id) as total_ips,
-                SUM(CASE WHEN ip.status = 'allocated' THEN 1 ELSE 0 END) as allocated_ips,
-                ROUND(
-                    (SUM(CASE WHEN ip.status = 'allocated' THEN 1 ELSE 0 END) * 100.0 / COUNT(ip.id)), 
-                    2
-                ) as utilization_rate
+                c.total_count as total_ips,
+                c.allocated_count as allocated_ips,
+                ROUND(c.allocated_count * 100.0 / c.total_count, 2) as utilization_rate
             FROM subnets s
-            LEFT JOIN ip_addresses ip ON s.id = ip.subnet_id
-            GROUP BY s.id, s.network, s.netmask, s.description, s.vlan_id, s.location
-            HAVING total_ips > 0
+            JOIN {counted_subnet_sql("c")} ON c.subnet_id = s.id
+            WHERE c.total_count > 0
             ORDER BY utilization_rate DESC
             LIMIT %s
             """
@@ -1022,7 +1026,8 @@ async def get_top_utilized_subnets(limit: int = 10):
 
 # 设备类型管理端点
 @app.get("/api/device-types")
-async def get_device_types(skip: int = 0, limit: int = 100, search: Optional[str] = None):
+@db_bound
+def get_device_types(skip: int = 0, limit: int = 100, search: Optional[str] = None):
     """获取设备类型列表"""
     connection = get_db_connection()
     try:
@@ -1085,7 +1090,8 @@ async def get_device_types(skip: int = 0, limit: int = 100, search: Optional[str
         connection.close()
 
 @app.get("/api/device-types/options")
-async def get_device_type_options():
+@db_bound
+def get_device_type_options():
     """获取设备类型选项（用于下拉选择）"""
     connection = get_db_connection()
     try:
@@ -1111,7 +1117,8 @@ async def get_device_type_options():
         connection.close()
 
 @app.post("/api/device-types", response_model=DeviceTypeResponse)
-async def create_device_type(device_type: DeviceTypeCreate):
+@db_bound
+def create_device_type(device_type: DeviceTypeCreate):
     """创建设备类型"""
     connection = get_db_connection()
     try:
@@ -1169,7 +1176,8 @@ async def create_device_type(device_type: DeviceTypeCreate):
         connection.close()
 
 @app.put("/api/device-types/{device_type_id}", response_model=DeviceTypeResponse)
-async def update_device_type(device_type_id: int, device_type: DeviceTypeUpdate):
+@db_bound
+def update_device_type(device_type_id: int, device_type: DeviceTypeUpdate):
     """更新设备类型"""
     connection = get_db_connection()
     try:
@@ -1254,7 +1262,8 @@ async def update_device_type(device_type_id: int, device_type: DeviceTypeUpdate)
         connection.close()
 
 @app.delete("/api/device-types/{device_type_id}")
-async def delete_device_type(device_type_id: int):
+@db_bound
+def delete_device_type(device_type_id: int):
     """删除设备类型"""
     connection = get_db_connection()
     try:
@@ -1289,7 +1298,8 @@ async def delete_device_type(device_type_id: int):
         connection.close()
 
 @app.patch("/api/device-types/{device_type_id}/status")
-async def toggle_device_type_status(device_type_id: int, request: dict):
+@db_bound
+def toggle_device_type_status(device_type_id: int, request: dict):
     """切换设备类型状态"""
     connection = get_db_connection()
     try:
@@ -1320,7 +1330,8 @@ async def toggle_device_type_status(device_type_id: int, request: dict):
         connection.close()
 
 @app.get("/api/device-types/statistics")
-async def get_device_type_statistics():
+@db_bound
+def get_device_type_statistics():
     """获取设备类型统计信息"""
     connection = get_db_connection()
     try:
@@ -1402,29 +1413,26 @@ async def get_dashboard_summary():
     return await get_statistics()
 
 @app.get("/api/monitoring/ip-utilization")
-async def get_ip_utilization_stats():
+@db_bound
+def get_ip_utilization_stats():
     """获取IP使用率统计"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT 
-                    SUM(CASE WHEN status = 'allocated' THEN 1 ELSE 0 END) as allocated_ips,
-                    SUM(CASE WHEN status = 'available' THEN 1 ELSE 0 END) as available_ips,
-                    SUM(CASE WHEN status = 'reserved' THEN 1 ELSE 0 END) as reserved_ips,
-                    SUM(CASE WHEN status = 'conflict' THEN 1 ELSE 0 END) as conflict_ips,
-                    COUNT(*) as total_ips
-                FROM ip_addresses
-            """)
-            result = cursor.fetchone()
+            counts = total_counts(cursor)
+            
+            # 稀疏网段中未存储的地址计为可用
+            virtual_available = sum(sparse_virtual_counts(cursor).values())
+            allocated_ips = counts['allocated_count']
+            total_ips = counts['total_count'] + virtual_available
             
             return {
-                "allocated_ips": result['allocated_ips'] or 0,
-                "available_ips": result['available_ips'] or 0,
-                "reserved_ips": result['reserved_ips'] or 0,
-                "conflict_ips": result['conflict_ips'] or 0,
-                "total_ips": result['total_ips'] or 0,
-                "utilization_rate": round((result['allocated_ips'] / result['total_ips'] * 100) if result['total_ips'] > 0 else 0, 2)
+                "allocated_ips": allocated_ips,
+                "available_ips": counts['available_count'] + virtual_available,
+                "reserved_ips": counts['reserved_count'],
+                "conflict_ips": counts['conflict_count'],
+                "total_ips": total_ips,
+                "utilization_rate": round((allocated_ips / total_ips * 100) if total_ips > 0 else 0, 2)
             }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch IP utilization stats: {str(e)}")
@@ -1432,43 +1440,47 @@ async def get_ip_utilization_stats():
         connection.close()
 
 @app.get("/api/monitoring/subnet-utilization")
-async def get_subnet_utilization_stats():
+@db_bound
+def get_subnet_utilization_stats():
     """获取网段使用率统计"""
     connection = get_db_connection()
     try:
         with connection.cursor() as cursor:
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT 
                     s.id,
                     s.network,
                     s.description,
                     s.vlan_id,
                     s.location,
-                    COUNT(ip.id) as total_ips,
-                    SUM(CASE WHEN ip.status = 'allocated' THEN 1 ELSE 0 END) as allocated_ips,
-                    ROUND(
-                        (SUM(CASE WHEN ip.status = 'allocated' THEN 1 ELSE 0 END) / COUNT(ip.id)) * 100, 
-                        2
-                    ) as utilization_rate
+                    COALESCE(c.total_count, 0) as total_ips,
+                    COALESCE(c.allocated_count, 0) as allocated_ips,
+                    ROUND(c.allocated_count / NULLIF(c.total_count, 0) * 100, 2) as utilization_rate
                 FROM subnets s
-                LEFT JOIN ip_addresses ip ON s.id = ip.subnet_id
-                GROUP BY s.id, s.network, s.description, s.vlan_id, s.location
+                LEFT JOIN {counted_subnet_sql("c")} ON c.subnet_id = s.id
                 ORDER BY utilization_rate DESC
             """)
             results = cursor.fetchall()
             
-            return [
-                {
+            # 稀疏网段：总数补上未存储的可用地址后重新计算使用率
+            virtual = sparse_virtual_counts(cursor)
+            subnets = []
+            for row in results:
+                total_ips = (row['total_ips'] or 0) + virtual.get(row['id'], 0)
+                allocated_ips = row['allocated_ips'] or 0
+                subnets.append({
                     "id": row['id'],
                     "network": row['network'],
                     "description": row['description'],
                     "vlan_id": row['vlan_id'],
                     "location": row['location'],
-                    "total_ips": row['total_ips'] or 0,
-                    "allocated_ips": row['allocated_ips'] or 0,
-                    "utilization_rate": row['utilization_rate'] or 0
-                } for row in results
-            ]
+                    "total_ips": total_ips,
+                    "allocated_ips": allocated_ips,
+                    "utilization_rate": round(allocated_ips / total_ips * 100, 2) if total_ips > 0 else 0
+                })
+            if virtual:
+                subnets.sort(key=lambda item: item['utilization_rate'], reverse=True)
+            return subnets
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch subnet utilization stats: {str(e)}")
     finally:
@@ -1482,7 +1494,8 @@ async def get_top_utilized_subnets(limit: int = 10):
     return await get_subnet_utilization_stats()
 
 @app.get("/api/monitoring/alerts/statistics")
-async def get_alert_statistics():
+@db_bound
+def get_alert_statistics():
     """获取警报统计"""
     connection = get_db_connection()
     try:
@@ -1507,7 +1520,8 @@ async def get_alert_statistics():
         connection.close()
 
 @app.get("/api/monitoring/alerts/history")
-async def get_alert_history(limit: int = 50):
+@db_bound
+def get_alert_history(limit: int = 50):
     """获取警报历史"""
     connection = get_db_connection()
     try:
@@ -1545,7 +1559,8 @@ async def get_alert_history(limit: int = 50):
         connection.close()
 
 @app.put("/api/monitoring/alerts/history/{alert_id}/resolve")
-async def resolve_alert(alert_id: int):
+@db_bound
+def resolve_alert(alert_id: int):
     """解决警报"""
     connection = get_db_connection()
     try:
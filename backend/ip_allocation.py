@@ -0,0 +1,416 @@
+"""
+IP地址并发安全分配
+用行级原子认领代替"先查询可用地址、再单独更新"：
+
+- skip_locked（默认，MySQL 8.0+）: 候选行用 SELECT ... FOR UPDATE SKIP LOCKED 锁定，
+  并发事务跳过彼此已锁定的行，各自拿到不同地址，互不等待
+- conditional: 不加锁读取一批候选，逐个执行 UPDATE ... WHERE status = 'available'，
+  受影响行数为 0 说明已被其他事务抢先，继续尝试下一个候选
+
+两种策略最终都以条件 UPDATE 的受影响行数为准，因此同一地址不会被重复分配。
+
+启用网段位图（app.core.ip_bitmap）时，候选地址先从位图取得，不再查询 ip_addresses 查找空闲行，
+位图候选失效或位图不可用时回退到上述SQL认领。
+
+批量分配（claim_batch / allocate_batch）在一个事务内认领多个地址，按最佳适配挑选连续地址块；
+幂等键登记在 ip_allocation_requests 表中，与分配结果在同一事务提交，重试时直接返回首次的结果。
+"""
+import os
+import json
+import random
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pymysql
+
+from ip_generation import find_free_ip_int, materialize_ip, subnet_row_range
+from app.core.ip_bitmap import ip_bitmaps, SubnetBitmap, IP_BITMAP_MAX_BITS
+
+logger = logging.getLogger(__name__)
+
+# 分配策略: skip_locked / conditional（用于不支持 SKIP LOCKED 的 MySQL 5.7 / MariaDB 10.5 及以下）
+ALLOCATION_STRATEGY = os.getenv('IP_ALLOCATION_STRATEGY', 'skip_locked').lower()
+
+# 单次分配最多尝试的轮数
+MAX_CLAIM_ATTEMPTS = int(os.getenv('IP_ALLOCATION_MAX_ATTEMPTS', '8'))
+
+# conditional 策略每轮读取的候选数量
+CANDIDATE_WINDOW = int(os.getenv('IP_ALLOCATION_CANDIDATE_WINDOW', '16'))
+
+# 分配时写入的附加字段
+ALLOCATION_FIELDS = ('mac_address', 'user_name', 'device_type', 'location', 'assigned_to', 'description')
+
+
+# 单次批量分配的最大地址数
+BATCH_ALLOCATION_MAX = int(os.getenv('IP_BATCH_ALLOCATION_MAX', '1024'))
+
+# 幂等键保留时长（小时）
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IP_IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+
+
+class AllocationContentionError(Exception):
+    """并发竞争激烈，多轮尝试后仍未认领到地址"""
+
+
+class IdempotencyKeyReuseError(Exception):
+    """同一幂等键被用于内容不同的请求"""
+
+
+def mark_allocated(cursor, ip_id: int, data: Dict[str, Any], allocated_by: int = 1) -> bool:
+    """
+    条件更新为已分配，仅当记录仍为 available 时生效
+    返回 False 表示该地址已被其他事务占用
+    """
+    cursor.execute(f"""
+        UPDATE ip_addresses SET
+            status = 'allocated',
+            {', '.join(f'{field} = %s' for field in ALLOCATION_FIELDS)},
+            allocated_at = NOW(),
+            allocated_by = %s,
+            updated_at = NOW()
+        WHERE id = %s AND status = 'available'
+    """, [data.get(field) for field in ALLOCATION_FIELDS] + [allocated_by, ip_id])
+    return cursor.rowcount == 1
+
+
+def load_subnet_bitmap(cursor, subnet_id: int) -> Optional[SubnetBitmap]:
+    """从数据库构建网段位图，网段不存在或超过位图上限时返回 None"""
+    cursor.execute("SELECT id, network, netmask, storage_mode FROM subnets WHERE id = %s", (subnet_id,))
+    subnet = cursor.fetchone()
+    if not subnet:
+        return None
+    try:
+        first, last = subnet_row_range(subnet)
+    except ValueError:
+        return None
+    if last - first + 1 > IP_BITMAP_MAX_BITS:
+        return None
+
+    sparse = subnet.get('storage_mode') == 'sparse'
+    if sparse:
+        # 稀疏网段：区间内任何已占用记录（包括属于其他网段的记录）都不可分配
+        cursor.execute("""
+            SELECT ip_int FROM ip_addresses
+            WHERE ip_int BETWEEN %s AND %s AND (subnet_id <> %s OR status <> 'available')
+        """, (first, last, subnet_id))
+    else:
+        cursor.execute("""
+            SELECT ip_int FROM ip_addresses
+            WHERE subnet_id = %s AND status = 'available' AND ip_int BETWEEN %s AND %s
+        """, (subnet_id, first, last))
+    return SubnetBitmap.from_rows(subnet_id, first, last, sparse, (row['ip_int'] for row in cursor.fetchall()))
+
+
+def rebuild_bitmaps(connection) -> int:
+    """启动时为所有网段重建位图，返回加载的网段数"""
+    loaded = 0
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM subnets")
+        for row in cursor.fetchall():
+            bitmap = load_subnet_bitmap(cursor, row['id'])
+            if bitmap is not None:
+                ip_bitmaps.put(bitmap)
+                loaded += 1
+    connection.rollback()
+    return loaded
+
+
+def reconcile_bitmaps(connection, subnet_id: Optional[int] = None, fix: bool = True) -> List[Dict[str, Any]]:
+    """将内存位图与数据库逐网段对账，fix 为 True 时以数据库为准修正"""
+    reports = []
+    with connection.cursor() as cursor:
+        if subnet_id:
+            subnet_ids = [subnet_id]
+        else:
+            cursor.execute("SELECT id FROM subnets")
+            subnet_ids = [row['id'] for row in cursor.fetchall()]
+        for sid in subnet_ids:
+            fresh = load_subnet_bitmap(cursor, sid)
+            if fresh is None:
+                ip_bitmaps.invalidate(sid)
+                continue
+            reports.append(ip_bitmaps.reconcile(fresh, fix=fix))
+    connection.rollback()
+    return reports
+
+
+def _claim_ip_int(cursor, subnet_id: int, ip_int: int, data: Dict[str, Any],
+                  allocated_by: int, sparse: bool) -> Optional[int]:
+    """认领位图给出的指定地址，地址已被占用时返回 None"""
+    cursor.execute("SELECT id, subnet_id FROM ip_addresses WHERE ip_int = %s", (ip_int,))
+    record = cursor.fetchone()
+    if not record and sparse:
+        record = materialize_ip(cursor, subnet_id, ip_int)
+    if not record or record['subnet_id'] != subnet_id:
+        return None
+    return record['id'] if mark_allocated(cursor, record['id'], data, allocated_by) else None
+
+
+def _candidate_ids(cursor, subnet_id: int, attempt: int, tried_ids: Set[int]):
+    """
+    读取本轮候选地址ID
+    conditional 策略的候选来自事务的一致性快照，已尝试失败的ID需要排除，否则会反复读到同一批行
+    """
+    if ALLOCATION_STRATEGY == 'skip_locked':
+        cursor.execute("""
+            SELECT id FROM ip_addresses
+            WHERE subnet_id = %s AND status = 'available'
+            ORDER BY ip_int
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """, (subnet_id,))
+        return [row['id'] for row in cursor.fetchall()]
+
+    exclude_sql = f"AND id NOT IN ({', '.join(['%s'] * len(tried_ids))})" if tried_ids else ""
+    cursor.execute(f"""
+        SELECT id FROM ip_addresses
+        WHERE subnet_id = %s AND status = 'available' {exclude_sql}
+        ORDER BY ip_int
+        LIMIT %s
+    """, [subnet_id] + list(tried_ids) + [CANDIDATE_WINDOW])
+    ids = [row['id'] for row in cursor.fetchall()]
+    if attempt > 0:
+        # 发生过冲突后打乱候选顺序，避免并发客户端反复争抢同一行
+        random.shuffle(ids)
+    return ids
+
+
+def claim_next_ip(
+    cursor,
+    subnet_id: int,
+    data: Dict[str, Any],
+    allocated_by: int = 1,
+    sparse_range: Optional[Tuple[int, int]] = None
+) -> Optional[int]:
+    """
+    在当前事务中为网段自动认领一个可用地址并标记为已分配，返回地址ID，调用方负责提交
+
+    Args:
+        sparse_range: 稀疏网段的主机整数区间，已存储的可用地址用完后按需写入新地址
+
+    Returns:
+        地址ID；网段已无可用地址时返回 None
+    """
+    # 稀疏网段下一轮查找未存储地址的起点；一致性读看不到其他事务未提交的写入，
+    # 抢写失败后必须从下一个地址继续找，否则会反复命中同一地址
+    # 位图加速：逐个认领位图候选，候选已被占用（位图过期）时保持占用位并继续
+    sparse = sparse_range is not None
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        ip_int = ip_bitmaps.acquire(subnet_id, lambda: load_subnet_bitmap(cursor, subnet_id), sparse=sparse)
+        if ip_int is None:
+            break
+        ip_id = _claim_ip_int(cursor, subnet_id, ip_int, data, allocated_by, sparse)
+        if ip_id:
+            return ip_id
+        ip_bitmaps.record_stale_candidate(subnet_id, ip_int)
+
+    search_first = sparse_range[0] if sparse_range else None
+    tried_ids: Set[int] = set()
+    for attempt in range(MAX_CLAIM_ATTEMPTS):
+        candidate_ids = _candidate_ids(cursor, subnet_id, attempt, tried_ids)
+        for ip_id in candidate_ids:
+            if mark_allocated(cursor, ip_id, data, allocated_by):
+                return ip_id
+            tried_ids.add(ip_id)
+
+        if candidate_ids:
+            continue
+
+        if not sparse_range:
+            return None
+
+        # 稀疏网段：写入区间内最小的未存储地址，并发写入同一地址时只有一方能认领成功
+        if search_first > sparse_range[1]:
+            return None
+        free_int = find_free_ip_int(cursor, search_first, sparse_range[1])
+        if free_int is None:
+            return None
+        record = materialize_ip(cursor, subnet_id, free_int)
+        if record and record['subnet_id'] == subnet_id and mark_allocated(cursor, record['id'], data, allocated_by):
+            return record['id']
+        search_first = free_int + 1
+
+    logger.warning(f"IP allocation contention on subnet {subnet_id}: gave up after {MAX_CLAIM_ATTEMPTS} attempts")
+    raise AllocationContentionError(f"网段 {subnet_id} 分配竞争激烈，请稍后重试")
+
+
+# ---------------------------------------------------------------------------
+# 批量分配
+# ---------------------------------------------------------------------------
+
+def _best_fit_start(cursor, subnet_id: int, count: int) -> Optional[int]:
+    """
+    dense 网段无位图时用SQL查找最佳适配的连续可用区间起点
+    （ip_int - ROW_NUMBER() 相同的行属于同一连续区间，需要 MySQL 8.0 窗口函数）
+    """
+    cursor.execute("""
+        SELECT MIN(ip_int) AS start_int
+        FROM (
+            SELECT ip_int, ip_int - ROW_NUMBER() OVER (ORDER BY ip_int) AS grp
+            FROM ip_addresses
+            WHERE subnet_id = %s AND status = 'available'
+        ) runs
+        GROUP BY grp
+        HAVING COUNT(*) >= %s
+        ORDER BY COUNT(*), start_int
+        LIMIT 1
+    """, (subnet_id, count))
+    row = cursor.fetchone()
+    return int(row['start_int']) if row else None
+
+
+def _sparse_best_fit_start(cursor, subnet_id: int, sparse_range: Tuple[int, int], count: int) -> Optional[int]:
+    """
+    稀疏网段无位图时用SQL查找最佳适配的连续空闲区间起点
+    未存储的地址和已存储的可用地址都是空闲的，只扫描区间内已占用的记录（走 ip_int 索引），
+    相邻占用地址之间（含区间两端）的间隔即空闲区间（LAG 窗口函数，需要 MySQL 8.0）
+    """
+    first, last = sparse_range
+    cursor.execute("""
+        SELECT prev_int + 1 AS start_int, ip_int - prev_int - 1 AS free_count
+        FROM (
+            SELECT ip_int, LAG(ip_int, 1, %s) OVER (ORDER BY ip_int) AS prev_int
+            FROM (
+                SELECT ip_int FROM ip_addresses
+                WHERE ip_int BETWEEN %s AND %s AND (subnet_id <> %s OR NOT (status <=> 'available'))
+                UNION ALL
+                SELECT %s AS ip_int
+            ) occupied
+        ) gaps
+        WHERE ip_int - prev_int - 1 >= %s
+        ORDER BY free_count, start_int
+        LIMIT 1
+    """, (first - 1, first, last, subnet_id, last + 1, count))
+    row = cursor.fetchone()
+    return int(row['start_int']) if row else None
+
+
+def claim_batch(cursor, subnet: Dict[str, Any], items: List[Dict[str, Any]],
+                allocated_by: int = 1, contiguous: bool = False) -> List[int]:
+    """
+    在当前事务中从单个网段认领 len(items) 个地址，items[i] 为第 i 个地址的附加字段，返回地址ID列表
+    contiguous 为 True 时要么认领到整块连续地址，要么一个都不认领（块内任一地址失败时回滚到保存点换块重试）；
+    否则尽量多认领，返回的地址数可能少于请求数
+    """
+    subnet_id = subnet['id']
+    sparse = subnet.get('storage_mode') == 'sparse'
+    sparse_range = subnet_row_range(subnet) if sparse else None
+    count = len(items)
+    claimed: List[int] = []
+
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        remaining = count - len(claimed)
+        if remaining == 0:
+            return claimed
+        block = ip_bitmaps.acquire_block(
+            subnet_id, remaining, contiguous, lambda: load_subnet_bitmap(cursor, subnet_id), sparse=sparse
+        )
+        if block is None and contiguous:
+            if sparse:
+                start_int = _sparse_best_fit_start(cursor, subnet_id, sparse_range, count)
+            else:
+                start_int = _best_fit_start(cursor, subnet_id, count)
+            block = list(range(start_int, start_int + count)) if start_int is not None else []
+        if not block:
+            break
+
+        if contiguous:
+            cursor.execute("SAVEPOINT batch_block")
+        ids: List[int] = []
+        for ip_int in block:
+            ip_id = _claim_ip_int(cursor, subnet_id, ip_int, items[len(claimed) + len(ids)], allocated_by, sparse)
+            if ip_id is None:
+                ip_bitmaps.record_stale_candidate(subnet_id, ip_int)
+                if contiguous:
+                    break
+                continue
+            ids.append(ip_id)
+
+        if contiguous and len(ids) < count:
+            # 块内有地址已被占用：撤销本块已认领的地址，除失败的地址外其余恢复空闲，换一块重试
+            cursor.execute("ROLLBACK TO SAVEPOINT batch_block")
+            ip_bitmaps.release(subnet_id, block[:len(ids)] + block[len(ids) + 1:])
+            continue
+        claimed.extend(ids)
+        if contiguous:
+            return claimed
+
+    if contiguous:
+        return []
+
+    # 位图不可用或位图已无空闲：逐个走SQL认领补齐剩余数量
+    while len(claimed) < count:
+        try:
+            ip_id = claim_next_ip(cursor, subnet_id, items[len(claimed)], allocated_by, sparse_range)
+        except AllocationContentionError:
+            break
+        if not ip_id:
+            break
+        claimed.append(ip_id)
+    return claimed
+
+
+def allocate_batch(cursor, subnets: List[Dict[str, Any]], items: List[Dict[str, Any]],
+                   allocated_by: int = 1, contiguous: bool = False) -> List[int]:
+    """
+    按候选网段顺序批量认领地址，返回与 items 顺序对应的地址ID列表（可能少于 items）
+    contiguous 时整块地址必须位于同一网段，取第一个能容纳整块的网段；否则前一个网段不足时由后续网段补齐
+    """
+    claimed: List[int] = []
+    for subnet in subnets:
+        if contiguous:
+            claimed = claim_batch(cursor, subnet, items, allocated_by, contiguous=True)
+            if claimed:
+                break
+            continue
+        claimed.extend(claim_batch(cursor, subnet, items[len(claimed):], allocated_by))
+        if len(claimed) == len(items):
+            break
+    return claimed
+
+
+# ---------------------------------------------------------------------------
+# 幂等键
+# ---------------------------------------------------------------------------
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """请求内容摘要，用于识别同一幂等键下内容不同的请求"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def begin_idempotent_request(cursor, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    在当前事务中登记幂等键，首次请求返回 None；键已提交过时返回当时保存的响应
+    并发的相同请求会在唯一索引上等待首个事务结束：首个事务提交则得到其响应，回滚则本次继续执行
+    """
+    cursor.execute(
+        "DELETE FROM ip_allocation_requests WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT 1000",
+        (IDEMPOTENCY_KEY_TTL_HOURS,)
+    )
+    try:
+        cursor.execute(
+            "INSERT INTO ip_allocation_requests (idempotency_key, request_hash) VALUES (%s, %s)",
+            (key, fingerprint)
+        )
+        return None
+    except pymysql.err.IntegrityError:
+        pass
+
+    # 共享锁读取最新提交的版本，不受事务快照影响
+    cursor.execute(
+        "SELECT request_hash, response FROM ip_allocation_requests WHERE idempotency_key = %s LOCK IN SHARE MODE",
+        (key,)
+    )
+    row = cursor.fetchone()
+    if row['request_hash'] != fingerprint:
+        raise IdempotencyKeyReuseError(f"幂等键 {key} 已用于其他请求")
+    return json.loads(row['response']) if row['response'] else None
+
+
+def finish_idempotent_request(cursor, key: str, response: Dict[str, Any]) -> None:
+    """保存幂等键对应的响应，随分配结果一起提交"""
+    cursor.execute(
+        "UPDATE ip_allocation_requests SET response = %s WHERE idempotency_key = %s",
+        (json.dumps(response, ensure_ascii=False, default=str), key)
+    )
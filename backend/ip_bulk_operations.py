@@ -0,0 +1,169 @@
+"""
+IP地址批量保留/释放/删除
+按块执行集合化语句，代替逐个地址的 SELECT + UPDATE/DELETE：
+
+- 每块一次 SELECT ... WHERE ip_address IN (...) FOR UPDATE 读取并锁定当前状态
+- 按状态筛出可操作的记录，一条带状态条件的 UPDATE/DELETE ... WHERE id IN (...) 完成整块
+- 逐个地址的成功/失败结果与原逐条实现一致
+- 稀疏网段中没有存储行的可用地址先按需写入（materialize）再参与操作，释放稀疏网段的地址时删除记录
+
+调用方负责提交事务，提交后按返回的 bitmap_changes 更新网段位图、按 changed_ips 推送实时更新。
+"""
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from ip_generation import materialize_unstored, sparse_subnet_ids
+
+logger = logging.getLogger(__name__)
+
+# 每块处理的地址数（同时是 IN 列表的长度上限）
+BULK_OPERATION_CHUNK_SIZE = int(os.getenv('IP_BULK_OPERATION_CHUNK_SIZE', '1000'))
+
+BULK_OPERATIONS = ('reserve', 'release', 'delete')
+
+# 各操作允许的当前状态
+_ALLOWED_STATUSES = {
+    'reserve': ('available',),
+    'release': ('allocated', 'reserved'),
+    'delete': ('available', 'reserved', 'conflict'),
+}
+
+# 操作完成后的状态，删除为 None
+_NEW_STATUS = {'reserve': 'reserved', 'release': 'available', 'delete': None}
+
+
+def _placeholders(count: int) -> str:
+    return ', '.join(['%s'] * count)
+
+
+def _status_error(operation: str, status: str) -> Optional[str]:
+    """当前状态不允许该操作时返回失败原因"""
+    if status in _ALLOWED_STATUSES[operation]:
+        return None
+    if operation == 'reserve':
+        return f"IP不可用，当前状态: {status}"
+    if operation == 'release':
+        return f"IP无法释放，当前状态: {status}"
+    return "IP已分配，无法删除。请先释放该IP地址"
+
+
+def _apply_chunk(cursor, operation: str, ids: List[int], reason: str, user_id: int, remove: bool = False) -> int:
+    """对一块记录执行带状态条件的批量更新或删除，返回受影响行数；remove 为 True 时删除记录（释放稀疏网段的地址）"""
+    if not ids:
+        return 0
+    allowed = _ALLOWED_STATUSES[operation]
+    condition = f"WHERE id IN ({_placeholders(len(ids))}) AND status IN ({_placeholders(len(allowed))})"
+    if remove:
+        cursor.execute(f"DELETE FROM ip_addresses {condition}", ids + list(allowed))
+    elif operation == 'reserve':
+        cursor.execute(f"""
+            UPDATE ip_addresses SET
+                status = 'reserved',
+                description = %s,
+                assigned_to = %s,
+                allocated_at = NOW(),
+                allocated_by = %s,
+                updated_at = NOW()
+            {condition}
+        """, [reason, f"批量保留 - {reason}", user_id] + ids + list(allowed))
+    elif operation == 'release':
+        cursor.execute(f"""
+            UPDATE ip_addresses SET
+                status = 'available',
+                mac_address = NULL,
+                user_name = NULL,
+                device_type = NULL,
+                location = NULL,
+                assigned_to = NULL,
+                description = %s,
+                allocated_at = NULL,
+                allocated_by = NULL,
+                updated_at = NOW()
+            {condition}
+        """, [reason] + ids + list(allowed))
+    else:
+        cursor.execute(f"DELETE FROM ip_addresses {condition}", ids + list(allowed))
+    return cursor.rowcount
+
+
+def _lock_rows(cursor, ip_addresses: List[str]) -> Dict[str, Dict[str, Any]]:
+    """读取并锁定地址的当前记录: {ip_address: 记录}"""
+    cursor.execute(f"""
+        SELECT id, ip_address, subnet_id, ip_int, status FROM ip_addresses
+        WHERE ip_address IN ({_placeholders(len(ip_addresses))})
+        FOR UPDATE
+    """, ip_addresses)
+    return {row['ip_address']: row for row in cursor.fetchall()}
+
+
+def bulk_ip_operation(cursor, ip_addresses: List[str], operation: str,
+                      reason: str = '', user_id: int = 1) -> Dict[str, Any]:
+    """
+    在当前事务中批量执行 reserve / release / delete
+
+    Returns:
+        success_ips / failed_ips: 按输入顺序排列的逐个结果，重复出现的地址记为失败
+        bitmap_changes: [(subnet_id, ip_int, 新状态)]，删除时新状态为 None
+        changed_ips: [(subnet_id, ip_address)]
+    """
+    if operation not in BULK_OPERATIONS:
+        raise ValueError(f"无效的操作类型: {operation}")
+
+    errors: Dict[str, Optional[str]] = {}
+    bitmap_changes = []
+    changed_ips = []
+    unique_ips = list(dict.fromkeys(ip_addresses))
+
+    for start in range(0, len(unique_ips), BULK_OPERATION_CHUNK_SIZE):
+        chunk = unique_ips[start:start + BULK_OPERATION_CHUNK_SIZE]
+        found = _lock_rows(cursor, chunk)
+        # 释放只针对已分配/保留的地址，未存储的地址无需写入
+        missing = [ip_address for ip_address in chunk if ip_address not in found] if operation != 'release' else []
+        if missing and materialize_unstored(cursor, missing):
+            found.update(_lock_rows(cursor, missing))
+
+        eligible = []
+        for ip_address in chunk:
+            row = found.get(ip_address)
+            if not row:
+                errors[ip_address] = "IP地址不存在"
+                continue
+            error = _status_error(operation, row['status'])
+            if error:
+                errors[ip_address] = error
+                continue
+            eligible.append(row)
+
+        if not eligible:
+            continue
+        sparse = sparse_subnet_ids(cursor, {row['subnet_id'] for row in eligible}) if operation == 'release' else set()
+        affected = _apply_chunk(
+            cursor, operation, [row['id'] for row in eligible if row['subnet_id'] not in sparse], reason, user_id
+        ) + _apply_chunk(
+            cursor, operation, [row['id'] for row in eligible if row['subnet_id'] in sparse], reason, user_id,
+            remove=True
+        )
+        if affected != len(eligible):
+            # 记录已加锁，数量不一致说明有未预期的并发修改，整批回滚
+            raise RuntimeError(f"批量{operation}影响行数异常：预期 {len(eligible)}，实际 {affected}")
+        for row in eligible:
+            errors[row['ip_address']] = None
+            bitmap_changes.append((row['subnet_id'], row['ip_int'], _NEW_STATUS[operation]))
+            changed_ips.append((row['subnet_id'], row['ip_address']))
+
+    success_ips = []
+    failed_ips = []
+    seen = set()
+    for ip_address in ip_addresses:
+        if ip_address in seen:
+            failed_ips.append({"ip": ip_address, "error": "重复的IP地址"})
+            continue
+        seen.add(ip_address)
+        if errors[ip_address] is None:
+            success_ips.append(ip_address)
+        else:
+            failed_ips.append({"ip": ip_address, "error": errors[ip_address]})
+
+    return {"success_ips": success_ips, "failed_ips": failed_ips, "bitmap_changes": bitmap_changes,
+            "changed_ips": changed_ips}
@@ -0,0 +1,511 @@
+"""
+网段IP地址批量生成与同步
+基于 ip_int 整数列做集合运算：一次范围查询统计现有记录，主机地址用整数区间计算，
+分块多行 INSERT IGNORE 写入，越界记录一次性批量删除
+
+网段存储模式（subnets.storage_mode）:
+- dense: 每个主机地址都存一行（原有行为）
+- sparse: 只存已分配/保留/冲突地址，可用地址 = CIDR 主机区间 - 已存记录，
+  分配、保留、更新时按需写入（materialize）对应行，释放时删除记录
+"""
+import os
+import time
+import bisect
+import ipaddress
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.ip_bitmap import ip_bitmaps
+from app.core.live_updates import publish_ip_changes
+from app.core.subnet_trie import trie_from_cursor
+from subnet_counters import subnet_counts
+
+logger = logging.getLogger(__name__)
+
+# 单个网段允许自动生成的最大地址数，与 ORM 服务共用 IP_GENERATION_MAX_ADDRESSES 配置
+MAX_GENERATED_ADDRESSES = settings.IP_GENERATION_MAX_ADDRESSES
+
+# 每条多行INSERT包含的行数
+INSERT_CHUNK_SIZE = int(os.getenv('IP_GENERATION_CHUNK_SIZE', '5000'))
+
+STORAGE_MODES = ('dense', 'sparse')
+
+# 新建网段的默认存储模式（与 ORM 服务共用 SUBNET_STORAGE_MODE 配置）；超过 MAX_GENERATED_ADDRESSES 的网段总是使用 sparse
+DEFAULT_STORAGE_MODE = settings.SUBNET_STORAGE_MODE.lower()
+
+
+def resolve_network(connection, subnet_id: int, network: str) -> ipaddress.IPv4Network:
+    """解析网段，network 不含前缀长度时从数据库读取子网掩码"""
+    if '/' not in network:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT netmask FROM subnets WHERE id = %s", (subnet_id,))
+            result = cursor.fetchone()
+            if result and result['netmask']:
+                netmask = result['netmask']
+                if '.' in netmask:
+                    # 点分十进制格式，如 255.255.255.0
+                    prefix_length = sum([bin(int(x)).count('1') for x in netmask.split('.')])
+                    network = f"{network}/{prefix_length}"
+                else:
+                    # 已经是前缀长度格式，如 24
+                    network = f"{network}/{netmask}"
+    try:
+        return ipaddress.ip_network(network, strict=False)
+    except ValueError:
+        raise ValueError(f"无效的网段格式: {network}")
+
+
+def choose_storage_mode(net: ipaddress.IPv4Network, requested: Optional[str] = None) -> str:
+    """确定新网段的存储模式，无法完整生成的大网段强制使用 sparse"""
+    mode = (requested or DEFAULT_STORAGE_MODE).lower()
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"storage_mode 必须是以下之一: {', '.join(STORAGE_MODES)}")
+    if net.num_addresses > MAX_GENERATED_ADDRESSES:
+        return 'sparse'
+    return mode
+
+
+def get_storage_mode(cursor, subnet_id: int) -> str:
+    """读取网段存储模式"""
+    cursor.execute("SELECT storage_mode FROM subnets WHERE id = %s", (subnet_id,))
+    row = cursor.fetchone()
+    return (row or {}).get('storage_mode') or 'dense'
+
+
+def host_int_range(net: ipaddress.IPv4Network) -> Tuple[int, int]:
+    """
+    返回网段可用主机地址的整数闭区间，与 net.hosts() 一致：
+    /31、/32 包含全部地址，其余排除网络地址和广播地址
+    """
+    first = int(net.network_address)
+    last = int(net.broadcast_address)
+    if net.prefixlen < 31:
+        first += 1
+        last -= 1
+    return first, last
+
+
+def subnet_row_range(subnet: Dict[str, Any]) -> Tuple[int, int]:
+    """由 subnets 表记录（network, netmask）计算主机整数区间"""
+    network = subnet['network']
+    if '/' not in network and subnet.get('netmask'):
+        network = f"{network}/{subnet['netmask']}"
+    return host_int_range(ipaddress.ip_network(network, strict=False))
+
+
+def _insert_missing_hosts(cursor, subnet_id: int, first: int, last: int) -> int:
+    """分块多行 INSERT IGNORE 写入主机地址，已存在（包括其他网段）的地址由唯一索引跳过"""
+    created = 0
+    for chunk_start in range(first, last + 1, INSERT_CHUNK_SIZE):
+        chunk_end = min(chunk_start + INSERT_CHUNK_SIZE - 1, last)
+        row_count = chunk_end - chunk_start + 1
+        values_sql = ", ".join(["(INET_NTOA(%s), %s, 'available', NOW())"] * row_count)
+        params = []
+        for ip_int in range(chunk_start, chunk_end + 1):
+            params.append(ip_int)
+            params.append(subnet_id)
+        cursor.execute(
+            f"INSERT IGNORE INTO ip_addresses (ip_address, subnet_id, status, created_at) VALUES {values_sql}",
+            params
+        )
+        created += cursor.rowcount
+    return created
+
+
+def generate_subnet_ips(connection, subnet_id: int, network: str) -> Dict[str, Any]:
+    """
+    为网段批量生成IP地址
+
+    Returns:
+        统计信息: host_count, created, existing, existing_other_subnet, elapsed, rows_per_second
+    """
+    net = resolve_network(connection, subnet_id, network)
+    first, last = host_int_range(net)
+    host_count = last - first + 1
+
+    with connection.cursor() as cursor:
+        storage_mode = get_storage_mode(cursor, subnet_id)
+    if storage_mode == 'sparse':
+        # 稀疏网段不预生成地址，可用地址由CIDR推算
+        return {
+            "network": str(net),
+            "storage_mode": storage_mode,
+            "host_count": host_count,
+            "created": 0,
+            "existing": 0,
+            "existing_other_subnet": 0,
+            "elapsed": 0.0,
+            "rows_per_second": 0
+        }
+
+    if net.num_addresses > MAX_GENERATED_ADDRESSES:
+        raise ValueError(
+            f"网段过大（{net.num_addresses} 个地址），超过自动生成上限 {MAX_GENERATED_ADDRESSES}"
+        )
+
+    start_time = time.time()
+
+    try:
+        with connection.cursor() as cursor:
+            # 一次范围查询统计已存在的记录（本网段 / 其他网段）
+            cursor.execute("""
+                SELECT
+                    COUNT(*) AS total,
+                    COALESCE(SUM(subnet_id = %s), 0) AS own
+                FROM ip_addresses
+                WHERE ip_int BETWEEN %s AND %s
+            """, (subnet_id, first, last))
+            existing = cursor.fetchone()
+            existing_total = int(existing['total'] or 0)
+            existing_own = int(existing['own'] or 0)
+
+            created = 0
+            if existing_total < host_count:
+                created = _insert_missing_hosts(cursor, subnet_id, first, last)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    ip_bitmaps.invalidate(subnet_id)
+    publish_ip_changes([subnet_id])
+
+    elapsed = time.time() - start_time
+    stats = {
+        "network": str(net),
+        "storage_mode": storage_mode,
+        "host_count": host_count,
+        "created": created,
+        "existing": existing_own,
+        "existing_other_subnet": existing_total - existing_own,
+        "elapsed": round(elapsed, 3),
+        "rows_per_second": round(created / elapsed, 1) if elapsed > 0 else created
+    }
+    logger.info(
+        f"Generated IPs for subnet {subnet_id} ({net}): created={created}, "
+        f"existing={existing_total}, {stats['rows_per_second']} rows/s"
+    )
+    return stats
+
+
+def sync_subnet_ips(connection, subnet_id: int, network: str) -> Dict[str, Any]:
+    """
+    按CIDR同步网段的IP地址：批量删除越界的可用地址，批量补齐缺失的主机地址
+    已分配/保留的越界地址保留不删；稀疏网段只删除越界记录，不补齐
+    """
+    net = resolve_network(connection, subnet_id, network)
+    with connection.cursor() as cursor:
+        sparse = get_storage_mode(cursor, subnet_id) == 'sparse'
+    if not sparse and net.num_addresses > MAX_GENERATED_ADDRESSES:
+        raise ValueError(
+            f"网段过大（{net.num_addresses} 个地址），超过自动生成上限 {MAX_GENERATED_ADDRESSES}"
+        )
+
+    first, last = host_int_range(net)
+    start_time = time.time()
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) AS kept FROM ip_addresses WHERE subnet_id = %s AND ip_int BETWEEN %s AND %s",
+                (subnet_id, first, last)
+            )
+            kept = int(cursor.fetchone()['kept'] or 0)
+
+            cursor.execute("""
+                DELETE FROM ip_addresses
+                WHERE subnet_id = %s AND status = 'available'
+                AND (ip_int < %s OR ip_int > %s)
+            """, (subnet_id, first, last))
+            removed = cursor.rowcount
+
+            added = 0 if sparse else _insert_missing_hosts(cursor, subnet_id, first, last)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    ip_bitmaps.invalidate(subnet_id)
+    publish_ip_changes([subnet_id])
+
+    elapsed = time.time() - start_time
+    return {
+        "added": added,
+        "removed": removed,
+        "kept": kept,
+        "elapsed": round(elapsed, 3),
+        "rows_per_second": round((added + removed) / elapsed, 1) if elapsed > 0 else added + removed
+    }
+
+
+# ---------------------------------------------------------------------------
+# 稀疏模式
+# ---------------------------------------------------------------------------
+
+def find_free_ip_int(cursor, first: int, last: int) -> Optional[int]:
+    """
+    在 [first, last] 中查找最小的未存储地址
+    只扫描区间内已存记录（走 ip_int 索引），代价与已占用地址数成正比，与网段大小无关
+    """
+    cursor.execute("""
+        SELECT MIN(candidate) AS candidate FROM (
+            SELECT %s AS candidate FROM DUAL
+            WHERE NOT EXISTS (SELECT 1 FROM ip_addresses WHERE ip_int = %s)
+            UNION ALL
+            SELECT a.ip_int + 1 AS candidate
+            FROM ip_addresses a
+            WHERE a.ip_int >= %s AND a.ip_int < %s
+            AND NOT EXISTS (SELECT 1 FROM ip_addresses b WHERE b.ip_int = a.ip_int + 1)
+        ) gaps
+    """, (first, first, first, last))
+    row = cursor.fetchone()
+    if not row or row['candidate'] is None:
+        return None
+    return int(row['candidate'])
+
+
+def materialize_ip(cursor, subnet_id: int, ip_int: int) -> Optional[Dict[str, Any]]:
+    """
+    为稀疏网段写入一条 available 记录（已存在则保持不变），返回该地址的记录
+    调用方随后按普通路径更新状态
+    """
+    cursor.execute(
+        "INSERT IGNORE INTO ip_addresses (ip_address, subnet_id, status, created_at) "
+        "VALUES (INET_NTOA(%s), %s, 'available', NOW())",
+        (ip_int, subnet_id)
+    )
+    cursor.execute(
+        "SELECT id, ip_address, subnet_id, ip_int, status FROM ip_addresses WHERE ip_int = %s",
+        (ip_int,)
+    )
+    return cursor.fetchone()
+
+
+def sparse_subnet_ids(cursor, subnet_ids: Iterable[int]) -> Set[int]:
+    """给定网段中使用稀疏存储的网段ID"""
+    subnet_ids = list(subnet_ids)
+    if not subnet_ids:
+        return set()
+    cursor.execute(
+        f"SELECT id FROM subnets WHERE storage_mode = 'sparse' AND id IN ({', '.join(['%s'] * len(subnet_ids))})",
+        subnet_ids
+    )
+    return {row['id'] for row in cursor.fetchall()}
+
+
+def materialize_unstored(cursor, ip_addresses: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    为没有存储行的地址按需写入 available 记录：只处理位于稀疏网段主机区间内的地址
+    （稀疏网段中显示为可用的地址没有存储行），返回 {输入的地址: 记录}，其余地址不返回
+    """
+    trie = trie_from_cursor(cursor)
+    targets = {}
+    for ip_address in ip_addresses:
+        entry = trie.longest_match(ip_address)
+        if entry is not None:
+            targets[ip_address] = entry.id
+    if not targets:
+        return {}
+
+    subnet_ids = sorted(set(targets.values()))
+    cursor.execute(
+        "SELECT id, network, netmask FROM subnets "
+        f"WHERE storage_mode = 'sparse' AND id IN ({', '.join(['%s'] * len(subnet_ids))})",
+        subnet_ids
+    )
+    ranges = {row['id']: subnet_row_range(row) for row in cursor.fetchall()}
+
+    records = {}
+    for ip_address, subnet_id in targets.items():
+        if subnet_id not in ranges:
+            continue
+        ip_int = int(ipaddress.IPv4Address(ip_address.strip()))
+        first, last = ranges[subnet_id]
+        if not first <= ip_int <= last:
+            continue
+        record = materialize_ip(cursor, subnet_id, ip_int)
+        if record and record['subnet_id'] == subnet_id:
+            records[ip_address] = record
+    return records
+
+
+def sparse_virtual_counts(cursor, subnet_ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+    """
+    统计稀疏网段中未存储（即可用）的地址数: {subnet_id: 虚拟可用数}
+    已存储的 available 记录仍按原有方式计数，这里只补未存储的部分
+    """
+    sql = "SELECT id, network, netmask FROM subnets WHERE storage_mode = 'sparse'"
+    params = []
+    if subnet_ids is not None:
+        subnet_ids = list(subnet_ids)
+        if not subnet_ids:
+            return {}
+        sql += f" AND id IN ({', '.join(['%s'] * len(subnet_ids))})"
+        params.extend(subnet_ids)
+    cursor.execute(sql, params)
+    subnets = cursor.fetchall()
+    if not subnets:
+        return {}
+
+    ranges = {}
+    for subnet in subnets:
+        try:
+            ranges[subnet['id']] = subnet_row_range(subnet)
+        except ValueError:
+            logger.warning(f"Skip sparse subnet {subnet['id']} with invalid network {subnet['network']}")
+
+    if not ranges:
+        return {}
+
+    # 已存记录数取自网段计数器，不扫描地址表
+    stored = {subnet_id: counts['total_count'] for subnet_id, counts in subnet_counts(cursor, ranges).items()}
+
+    return {
+        subnet_id: max(last - first + 1 - stored.get(subnet_id, 0), 0)
+        for subnet_id, (first, last) in ranges.items()
+    }
+
+
+def sparse_search_page(connection, cursor, subnet_id: int, ip_ranges: Optional[List[Tuple[int, int]]],
+                       status: Optional[str], skip: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    稀疏网段的搜索结果页（按 ip_int 排序）和总数
+    结果 = 主机区间（与 ip_ranges 求交）内的全部地址，未存储的地址生成 available 虚拟记录（id 为 None）；
+    status 为 'available' 时排除已存储的非 available 记录。
+    稀疏网段只存储占用的地址，被排除的记录一次读出后用二分定位页起点，代价与网段大小无关
+    """
+    cursor.execute("SELECT network FROM subnets WHERE id = %s", (subnet_id,))
+    first, last = host_int_range(resolve_network(connection, subnet_id, cursor.fetchone()['network']))
+    intervals = [
+        (max(first, start), min(last, end))
+        for start, end in (ip_ranges or [(first, last)])
+        if max(first, start) <= min(last, end)
+    ]
+    if not intervals:
+        return [], 0
+
+    excluded: List[int] = []
+    if status == 'available':
+        range_sql = ' OR '.join(['ip_int BETWEEN %s AND %s'] * len(intervals))
+        cursor.execute(
+            f"SELECT ip_int FROM ip_addresses WHERE subnet_id = %s AND status <> 'available' "
+            f"AND ({range_sql}) ORDER BY ip_int",
+            [subnet_id] + [value for interval in intervals for value in interval]
+        )
+        excluded = [row['ip_int'] for row in cursor.fetchall()]
+
+    def excluded_between(low: int, high: int) -> int:
+        return bisect.bisect_right(excluded, high) - bisect.bisect_left(excluded, low)
+
+    total = sum(end - start + 1 - excluded_between(start, end) for start, end in intervals)
+
+    # 逐个区间跳过 skip 个结果，区间内第 skip 个结果 x 满足 x = start + skip + 排除数(<= x)
+    page_ints: List[int] = []
+    remaining = skip
+    for start, end in intervals:
+        if len(page_ints) >= limit:
+            break
+        if not page_ints:
+            matched = end - start + 1 - excluded_between(start, end)
+            if remaining >= matched:
+                remaining -= matched
+                continue
+            position = start + remaining
+            while True:
+                candidate = start + remaining + excluded_between(start, position)
+                if candidate == position:
+                    break
+                position = candidate
+        else:
+            position = start
+        index = bisect.bisect_left(excluded, position)
+        while position <= end and len(page_ints) < limit:
+            if index < len(excluded) and excluded[index] == position:
+                index += 1
+            else:
+                page_ints.append(position)
+            position += 1
+
+    if not page_ints:
+        return [], total
+
+    cursor.execute(
+        "SELECT * FROM ip_addresses WHERE subnet_id = %s AND ip_int BETWEEN %s AND %s",
+        (subnet_id, page_ints[0], page_ints[-1])
+    )
+    stored = {row['ip_int']: row for row in cursor.fetchall()}
+    rows = []
+    for ip_int in page_ints:
+        rows.append(stored.get(ip_int) or {
+            "id": None,
+            "ip_address": str(ipaddress.IPv4Address(ip_int)),
+            "ip_int": ip_int,
+            "subnet_id": subnet_id,
+            "status": "available",
+            "user_name": None,
+            "hostname": None,
+            "mac_address": None,
+            "device_type": None,
+            "location": None,
+            "assigned_to": None,
+            "description": None,
+            "allocated_at": None,
+            "allocated_by": None,
+            "created_at": None,
+            "updated_at": None
+        })
+    return rows, total
+
+
+def convert_subnet_storage(connection, subnet_id: int, target_mode: str) -> Dict[str, Any]:
+    """
+    转换网段存储模式
+    - dense -> sparse: 删除不带任何附加信息的 available 记录
+    - sparse -> dense: 补齐全部主机地址
+    """
+    if target_mode not in STORAGE_MODES:
+        raise ValueError(f"storage_mode 必须是以下之一: {', '.join(STORAGE_MODES)}")
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, network, storage_mode FROM subnets WHERE id = %s", (subnet_id,))
+        subnet = cursor.fetchone()
+    if not subnet:
+        raise ValueError(f"网段 {subnet_id} 不存在")
+
+    current_mode = subnet['storage_mode'] or 'dense'
+    result = {"subnet_id": subnet_id, "network": subnet['network'], "from": current_mode,
+              "to": target_mode, "removed": 0, "created": 0}
+    if current_mode == target_mode:
+        return result
+
+    net = resolve_network(connection, subnet_id, subnet['network'])
+    if target_mode == 'dense' and net.num_addresses > MAX_GENERATED_ADDRESSES:
+        raise ValueError(
+            f"网段过大（{net.num_addresses} 个地址），超过自动生成上限 {MAX_GENERATED_ADDRESSES}，只能使用 sparse"
+        )
+
+    first, last = host_int_range(net)
+    try:
+        with connection.cursor() as cursor:
+            if target_mode == 'sparse':
+                cursor.execute("""
+                    DELETE FROM ip_addresses
+                    WHERE subnet_id = %s AND status = 'available'
+                    AND mac_address IS NULL AND device_type IS NULL AND location IS NULL
+                    AND assigned_to IS NULL AND (description IS NULL OR description = '')
+                """, (subnet_id,))
+                result["removed"] = cursor.rowcount
+            else:
+                result["created"] = _insert_missing_hosts(cursor, subnet_id, first, last)
+            cursor.execute("UPDATE subnets SET storage_mode = %s WHERE id = %s", (target_mode, subnet_id))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    ip_bitmaps.invalidate(subnet_id)
+    publish_ip_changes([subnet_id])
+
+    logger.info(
+        f"Converted subnet {subnet_id} ({net}) {current_mode} -> {target_mode}: "
+        f"removed={result['removed']}, created={result['created']}"
+    )
+    return result
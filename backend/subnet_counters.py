@@ -0,0 +1,213 @@
+"""
+网段IP状态计数器
+subnet_ip_counters 按网段保存各状态的记录数，由 ip_addresses 上的触发器在写入事务中维护
+（迁移 011 / database/init.sql），分配、保留、释放、删除、同步和批量操作无论走 ORM 还是
+原生 SQL 都会同步更新，统计接口读取计数器，代价与网段数成正比，不再扫描地址表。
+
+- 每个网段的计数分散在 COUNTER_SLOTS 行（slot = 连接ID % COUNTER_SLOTS），同一网段的并发分配
+  不会都等待同一行锁；同一事务对一个网段只锁一行，批量/生成事务之间不会因加锁顺序交错而死锁；
+  读取时按网段求和
+- CounterReconciler 定期逐个网段重新统计并修正偏差（手工改表、关闭触发器的导入等）
+"""
+import os
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 与迁移 011 中的 COUNTER_SLOTS 一致
+COUNTER_SLOTS = 8
+
+COUNTER_STATUSES = ('available', 'allocated', 'reserved', 'conflict')
+COUNTER_FIELDS = ('total_count',) + tuple(f"{status}_count" for status in COUNTER_STATUSES)
+
+# 对账间隔（秒），0 表示不启动后台线程
+SUBNET_COUNTER_RECONCILE_INTERVAL = int(os.getenv('SUBNET_COUNTER_RECONCILE_INTERVAL', '3600'))
+
+# 多个 worker 同时运行时只有拿到该 MySQL 命名锁的进程执行对账
+RECONCILE_LOCK_NAME = 'subnet_ip_counters_reconcile'
+
+_SUM_COLUMNS = ", ".join(f"COALESCE(SUM({field}), 0) AS {field}" for field in COUNTER_FIELDS)
+
+
+def _placeholders(count: int) -> str:
+    return ', '.join(['%s'] * count)
+
+
+def _as_counts(row: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    return {field: int((row or {}).get(field) or 0) for field in COUNTER_FIELDS}
+
+
+def subnet_counts(cursor, subnet_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, int]]:
+    """各网段的状态计数: {subnet_id: {total_count, available_count, ...}}，没有记录的网段不返回"""
+    sql = f"SELECT subnet_id, {_SUM_COLUMNS} FROM subnet_ip_counters"
+    params: List[Any] = []
+    if subnet_ids is not None:
+        subnet_ids = list(subnet_ids)
+        if not subnet_ids:
+            return {}
+        sql += f" WHERE subnet_id IN ({_placeholders(len(subnet_ids))})"
+        params.extend(subnet_ids)
+    cursor.execute(sql + " GROUP BY subnet_id", params)
+    return {row['subnet_id']: _as_counts(row) for row in cursor.fetchall()}
+
+
+def total_counts(cursor, subnet_id: Optional[int] = None) -> Dict[str, int]:
+    """全部（或单个网段）的状态计数合计"""
+    if subnet_id is None:
+        cursor.execute(f"SELECT {_SUM_COLUMNS} FROM subnet_ip_counters")
+    else:
+        cursor.execute(f"SELECT {_SUM_COLUMNS} FROM subnet_ip_counters WHERE subnet_id = %s", (subnet_id,))
+    return _as_counts(cursor.fetchone())
+
+
+def counted_subnet_sql(alias: str = "c") -> str:
+    """按网段汇总计数器的子查询，用于 LEFT JOIN 到 subnets"""
+    return f"(SELECT subnet_id, {_SUM_COLUMNS} FROM subnet_ip_counters GROUP BY subnet_id) {alias}"
+
+
+def reconcile_subnet(connection, subnet_id: int) -> Optional[Dict[str, Any]]:
+    """
+    重新统计单个网段并修正计数器，没有偏差时返回 None
+    先 FOR UPDATE 锁定该网段的计数行（含间隙），此后提交的写入已计入统计，
+    仍在进行的写入会在触发器处等待，提交后再累加，不会重复或遗漏
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(COUNTER_FIELDS)} FROM subnet_ip_counters WHERE subnet_id = %s FOR UPDATE",
+            (subnet_id,)
+        )
+        recorded = {field: 0 for field in COUNTER_FIELDS}
+        for row in cursor.fetchall():
+            for field in COUNTER_FIELDS:
+                recorded[field] += int(row[field] or 0)
+
+        status_sums = ", ".join(
+            f"COALESCE(SUM(status <=> '{status}'), 0) AS {status}_count" for status in COUNTER_STATUSES
+        )
+        cursor.execute(
+            f"SELECT COUNT(*) AS total_count, {status_sums} FROM ip_addresses WHERE subnet_id = %s",
+            (subnet_id,)
+        )
+        actual = _as_counts(cursor.fetchone())
+
+        if actual == recorded:
+            connection.commit()
+            return None
+
+        cursor.execute("DELETE FROM subnet_ip_counters WHERE subnet_id = %s", (subnet_id,))
+        if actual['total_count']:
+            cursor.execute(
+                f"INSERT INTO subnet_ip_counters (subnet_id, slot, {', '.join(COUNTER_FIELDS)}) "
+                f"VALUES (%s, 0, {_placeholders(len(COUNTER_FIELDS))})",
+                [subnet_id] + [actual[field] for field in COUNTER_FIELDS]
+            )
+    connection.commit()
+    logger.warning(f"Subnet {subnet_id} IP counters drifted: recorded={recorded}, actual={actual}")
+    return {"subnet_id": subnet_id, "recorded": recorded, "actual": actual}
+
+
+def reconcile_counters(connection, subnet_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+    """
+    逐个网段对账（每个网段一个短事务），返回检查的网段数和修正记录
+    同一时间只有一个进程执行，拿不到命名锁时跳过本次
+    """
+    start_time = time.time()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS locked", (RECONCILE_LOCK_NAME,))
+        if not (cursor.fetchone() or {}).get('locked'):
+            return {"skipped": True, "checked": 0, "corrected": []}
+    try:
+        if subnet_ids is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id FROM subnets ORDER BY id")
+                subnet_ids = [row['id'] for row in cursor.fetchall()]
+            connection.commit()
+        subnet_ids = list(subnet_ids)
+
+        corrected = []
+        for subnet_id in subnet_ids:
+            try:
+                drift = reconcile_subnet(connection, subnet_id)
+            except Exception as e:
+                # 网段可能已被并发删除（外键失败），不影响其他网段
+                connection.rollback()
+                logger.error(f"Failed to reconcile IP counters for subnet {subnet_id}: {e}")
+                continue
+            if drift:
+                corrected.append(drift)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (RECONCILE_LOCK_NAME,))
+
+    elapsed = round(time.time() - start_time, 3)
+    logger.info(f"Subnet IP counters reconciled: {len(subnet_ids)} subnets, {len(corrected)} corrected in {elapsed}s")
+    return {"skipped": False, "checked": len(subnet_ids), "corrected": corrected, "elapsed": elapsed}
+
+
+class CounterReconciler:
+    """计数器后台对账线程"""
+
+    def __init__(self, interval: int = SUBNET_COUNTER_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._get_connection: Optional[Callable] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "skipped": 0, "checked": 0, "corrected": 0, "errors": 0,
+                       "last_run_at": None, "last_run_seconds": 0.0}
+
+    def start(self, get_connection: Callable) -> None:
+        """启动后台线程（幂等），get_connection 返回一个数据库连接"""
+        self._get_connection = get_connection
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="subnet-counter-reconciler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Subnet counter reconcile run failed: {e}")
+
+    def run_once(self, subnet_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        """立即执行一次对账"""
+        if self._get_connection is None:
+            raise RuntimeError("CounterReconciler has not been started")
+        connection = self._get_connection()
+        try:
+            result = reconcile_counters(connection, subnet_ids)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            connection.close()
+        with self._lock:
+            if result["skipped"]:
+                self._stats["skipped"] += 1
+            else:
+                self._stats["runs"] += 1
+                self._stats["checked"] += result["checked"]
+                self._stats["corrected"] += len(result["corrected"])
+                self._stats["last_run_at"] = time.time()
+                self._stats["last_run_seconds"] = result["elapsed"]
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "running": self._thread is not None and self._thread.is_alive(),
+                **self._stats,
+            }
+
+
+counter_reconciler = CounterReconciler()
@@ -0,0 +1,308 @@
+"""
+网段利用率历史
+ip_addresses 上的触发器把每次分配/释放写入 ip_usage_events（迁移 012 / database/init.sql），
+UtilizationRecorder 每分钟消费这些事件并记录计数器快照，按分钟、小时、天三个粒度汇总到
+subnet_utilization_history；趋势、增长和高峰时段查询只读取少量汇总行，不再扫描地址表。
+
+- subnet_id = ALL_SUBNETS (0) 是全部网段合计，每次运行都写入；单个网段只在计数变化或有事件时写入，
+  读取时向前沿用最近一次的快照
+- 每个桶的 allocations/releases 为桶内事件数，allocated_count/total_count 为桶内最后一次快照，
+  peak_allocated 为桶内快照最大值；稀疏网段的 total_count 为 CIDR 主机数（已存记录 + 未存储的可用地址）
+- 分钟、小时数据按保留天数定期删除（降采样：较早的时间只保留小时/天粒度），小时数据默认保留 400 天
+"""
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from subnet_counters import subnet_counts
+from ip_generation import sparse_virtual_counts
+
+logger = logging.getLogger(__name__)
+
+# 与迁移 012 一致：全部网段合计的序列
+ALL_SUBNETS = 0
+
+# 汇总间隔（秒），0 表示不启动后台线程
+UTILIZATION_HISTORY_INTERVAL = int(os.getenv('UTILIZATION_HISTORY_INTERVAL', '60'))
+
+# 各粒度的保留天数（小时数据至少保留一年，按小时统计的高峰时段可查询最近 365 天）
+UTILIZATION_HISTORY_RETENTION = {
+    'minute': int(os.getenv('UTILIZATION_HISTORY_MINUTE_RETENTION_DAYS', '2')),
+    'hour': int(os.getenv('UTILIZATION_HISTORY_HOUR_RETENTION_DAYS', '400')),
+    'day': int(os.getenv('UTILIZATION_HISTORY_DAY_RETENTION_DAYS', '1825')),
+}
+
+# 过期数据每小时清理一次，每批删除的行数
+RETENTION_CHECK_INTERVAL = 3600
+RETENTION_BATCH_SIZE = 10000
+
+# 每次运行最多消费的事件数（积压时分多次消费），按主键删除时每条语句的ID数
+EVENT_BATCH_SIZE = int(os.getenv('UTILIZATION_HISTORY_EVENT_BATCH_SIZE', '50000'))
+EVENT_DELETE_BATCH_SIZE = 1000
+
+# 多个 worker 同时运行时只有拿到该 MySQL 命名锁的进程执行汇总
+HISTORY_LOCK_NAME = 'subnet_utilization_history'
+
+_UPSERT_SQL = """
+    INSERT INTO subnet_utilization_history
+        (subnet_id, resolution, bucket_start, allocations, releases, total_count, allocated_count, peak_allocated)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        allocations = allocations + VALUES(allocations),
+        releases = releases + VALUES(releases),
+        peak_allocated = IF(VALUES(allocated_count) IS NULL, peak_allocated,
+                            GREATEST(COALESCE(peak_allocated, VALUES(allocated_count)), VALUES(allocated_count))),
+        total_count = COALESCE(VALUES(total_count), total_count),
+        allocated_count = COALESCE(VALUES(allocated_count), allocated_count)
+"""
+
+
+def bucket_starts(moment: datetime) -> Dict[str, datetime]:
+    """时间点所在的分钟、小时、天桶的起始时间"""
+    minute = moment.replace(second=0, microsecond=0)
+    hour = minute.replace(minute=0)
+    return {'minute': minute, 'hour': hour, 'day': hour.replace(hour=0)}
+
+
+class _Rollup:
+    """一次运行中待写入的汇总行: (subnet_id, resolution, bucket_start) -> [allocations, releases, total, allocated]"""
+
+    def __init__(self):
+        self.rows: Dict[Tuple[int, str, datetime], List[Optional[int]]] = {}
+
+    def _row(self, subnet_id: int, resolution: str, bucket: datetime) -> List[Optional[int]]:
+        return self.rows.setdefault((subnet_id, resolution, bucket), [0, 0, None, None])
+
+    def add_events(self, subnet_id: int, moment: datetime, allocations: int, releases: int) -> None:
+        for resolution, bucket in bucket_starts(moment).items():
+            for series in (subnet_id, ALL_SUBNETS):
+                row = self._row(series, resolution, bucket)
+                row[0] += allocations
+                row[1] += releases
+
+    def add_snapshot(self, subnet_id: int, moment: datetime, total_count: int, allocated_count: int) -> None:
+        for resolution, bucket in bucket_starts(moment).items():
+            row = self._row(subnet_id, resolution, bucket)
+            row[2] = total_count
+            row[3] = allocated_count
+
+    def params(self) -> List[tuple]:
+        return [
+            (subnet_id, resolution, bucket, allocations, releases, total, allocated, allocated)
+            for (subnet_id, resolution, bucket), (allocations, releases, total, allocated) in self.rows.items()
+        ]
+
+
+def _read_events(cursor) -> List[Dict[str, Any]]:
+    """不加锁地读取一批已提交的事件（按ID顺序）"""
+    cursor.execute("""
+        SELECT id, subnet_id, occurred_at - INTERVAL SECOND(occurred_at) SECOND AS minute, event_type
+        FROM ip_usage_events
+        ORDER BY id
+        LIMIT %s
+    """, (EVENT_BATCH_SIZE,))
+    return list(cursor.fetchall())
+
+
+def record_history(connection, last_snapshot: Dict[int, Tuple[int, int]]) -> Dict[str, Any]:
+    """
+    消费事件并写入快照（一个 READ COMMITTED 事务），last_snapshot 为上次写入的各网段 (total, allocated)，原地更新
+    事件用普通读取，汇总后按读到的主键逐条删除，只加记录锁不加间隙锁，触发器插入新事件不会等待；
+    未提交的事件本次读不到也不会删除，下次运行再计入，同一事件只计入一次（只有持有命名锁的进程消费事件）
+    """
+    rollup = _Rollup()
+    # 结束获取命名锁时开始的事务，使隔离级别对下一个事务生效
+    connection.commit()
+    with connection.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        cursor.execute("SELECT NOW() AS now")
+        now = cursor.fetchone()['now']
+
+        grouped: Dict[Tuple[int, datetime], List[int]] = {}
+        event_ids = []
+        for row in _read_events(cursor):
+            event_ids.append(row['id'])
+            tally = grouped.setdefault((row['subnet_id'], row['minute']), [0, 0])
+            tally[0 if row['event_type'] == 'allocate' else 1] += 1
+        for (subnet_id, minute), (allocations, releases) in grouped.items():
+            rollup.add_events(subnet_id, minute, allocations, releases)
+
+        counts = subnet_counts(cursor)
+        virtual = sparse_virtual_counts(cursor)
+        # 稀疏网段只存非可用记录，未存储的地址也计入容量；没有任何记录的稀疏网段同样要快照
+        snapshot = {}
+        for subnet_id in set(counts) | set(virtual):
+            c = counts.get(subnet_id, {})
+            snapshot[subnet_id] = (c.get('total_count', 0) + virtual.get(subnet_id, 0),
+                                   c.get('allocated_count', 0))
+        changed = {subnet_id: value for subnet_id, value in snapshot.items() if last_snapshot.get(subnet_id) != value}
+        for subnet_id, (total, allocated) in changed.items():
+            rollup.add_snapshot(subnet_id, now, total, allocated)
+        rollup.add_snapshot(
+            ALL_SUBNETS, now,
+            sum(total for total, _ in snapshot.values()),
+            sum(allocated for _, allocated in snapshot.values())
+        )
+
+        params = rollup.params()
+        cursor.executemany(_UPSERT_SQL, params)
+        for i in range(0, len(event_ids), EVENT_DELETE_BATCH_SIZE):
+            batch = event_ids[i:i + EVENT_DELETE_BATCH_SIZE]
+            cursor.execute(
+                f"DELETE FROM ip_usage_events WHERE id IN ({', '.join(['%s'] * len(batch))})", batch
+            )
+    connection.commit()
+
+    last_snapshot.clear()
+    last_snapshot.update(snapshot)
+    return {"events": len(event_ids), "snapshots": len(changed), "rows": len(params)}
+
+
+def purge_history(connection) -> int:
+    """按保留天数分批删除过期的汇总行"""
+    purged = 0
+    with connection.cursor() as cursor:
+        for resolution, days in UTILIZATION_HISTORY_RETENTION.items():
+            if days <= 0:
+                continue
+            while True:
+                cursor.execute(
+                    "DELETE FROM subnet_utilization_history "
+                    "WHERE resolution = %s AND bucket_start < NOW() - INTERVAL %s DAY LIMIT %s",
+                    (resolution, days, RETENTION_BATCH_SIZE)
+                )
+                deleted = cursor.rowcount
+                connection.commit()
+                purged += deleted
+                if deleted < RETENTION_BATCH_SIZE:
+                    break
+    return purged
+
+
+def daily_trends(cursor, days: int, subnet_id: int = ALL_SUBNETS) -> List[Dict[str, Any]]:
+    """最近 days 天（含今天）每天的分配数、释放数和当天结束时的已分配数（无快照的天沿用前一天）"""
+    cursor.execute("SELECT CURDATE() AS today")
+    today = cursor.fetchone()['today']
+    start = today - timedelta(days=days - 1)
+    start_time = datetime.combine(start, datetime.min.time())
+
+    cursor.execute("""
+        SELECT allocated_count FROM subnet_utilization_history
+        WHERE subnet_id = %s AND resolution = 'day' AND bucket_start < %s AND allocated_count IS NOT NULL
+        ORDER BY bucket_start DESC LIMIT 1
+    """, (subnet_id, start_time))
+    previous = cursor.fetchone()
+    allocated = previous['allocated_count'] if previous else None
+
+    cursor.execute("""
+        SELECT bucket_start, allocations, releases, allocated_count FROM subnet_utilization_history
+        WHERE subnet_id = %s AND resolution = 'day' AND bucket_start >= %s
+        ORDER BY bucket_start
+    """, (subnet_id, start_time))
+    rows = {row['bucket_start'].date(): row for row in cursor.fetchall()}
+
+    trends = []
+    for offset in range(days):
+        date = start + timedelta(days=offset)
+        row = rows.get(date)
+        if row and row['allocated_count'] is not None:
+            allocated = row['allocated_count']
+        trends.append({
+            "date": date.strftime("%Y-%m-%d"),
+            "allocations": row['allocations'] if row else 0,
+            "releases": row['releases'] if row else 0,
+            "allocated": allocated,
+        })
+    return trends
+
+
+class UtilizationRecorder:
+    """利用率历史后台汇总线程"""
+
+    def __init__(self, interval: int = UTILIZATION_HISTORY_INTERVAL):
+        self.interval = interval
+        self._get_connection: Optional[Callable] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._last_snapshot: Dict[int, Tuple[int, int]] = {}
+        self._last_purge = 0.0
+        self._stats = {"runs": 0, "skipped": 0, "events": 0, "snapshots": 0, "rows": 0, "purged": 0,
+                       "errors": 0, "last_run_at": None, "last_run_seconds": 0.0}
+
+    def start(self, get_connection: Callable) -> None:
+        """启动后台线程（幂等），get_connection 返回一个数据库连接"""
+        self._get_connection = get_connection
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="utilization-history", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Utilization history run failed: {e}")
+
+    def run_once(self) -> Dict[str, Any]:
+        """立即执行一次汇总（到期时顺带清理过期数据）"""
+        if self._get_connection is None:
+            raise RuntimeError("UtilizationRecorder has not been started")
+        start_time = time.time()
+        connection = self._get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) AS locked", (HISTORY_LOCK_NAME,))
+                if not (cursor.fetchone() or {}).get('locked'):
+                    # 其他进程在写入，本进程记住的快照可能已过时，下次拿到锁时重新写入所有网段
+                    self._last_snapshot.clear()
+                    with self._lock:
+                        self._stats["skipped"] += 1
+                    return {"skipped": True}
+            try:
+                result = record_history(connection, self._last_snapshot)
+                result["purged"] = 0
+                if time.time() - self._last_purge >= RETENTION_CHECK_INTERVAL:
+                    result["purged"] = purge_history(connection)
+                    self._last_purge = time.time()
+            except Exception:
+                connection.rollback()
+                # 下次运行重新写入所有网段的快照
+                self._last_snapshot.clear()
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (HISTORY_LOCK_NAME,))
+        finally:
+            connection.close()
+
+        elapsed = round(time.time() - start_time, 3)
+        with self._lock:
+            self._stats["runs"] += 1
+            for key in ("events", "snapshots", "rows", "purged"):
+                self._stats[key] += result[key]
+            self._stats["last_run_at"] = time.time()
+            self._stats["last_run_seconds"] = elapsed
+        result["skipped"] = False
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "running": self._thread is not None and self._thread.is_alive(),
+                "retention_days": UTILIZATION_HISTORY_RETENTION,
+                **self._stats,
+            }
+
+
+utilization_recorder = UtilizationRecorder()
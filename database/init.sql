@@ -11,11 +11,15 @@ FLUSH PRIVILEGES;
 -- Use the database
 USE ipam;
 
+-- 全文索引不使用停用词（创建索引时生效），否则含 a/i 等单字母的MAC片段无法检索
+SET SESSION innodb_ft_enable_stopword = OFF;
+
 -- 用户表
 CREATE TABLE IF NOT EXISTS users (
     id INT PRIMARY KEY AUTO_INCREMENT,
     username VARCHAR(50) UNIQUE NOT NULL,
     password_hash VARCHAR(255) NOT NULL,
+    credential_version INT NOT NULL DEFAULT 0,  -- 修改/重置密码时加一，作为令牌版本
     email VARCHAR(100),
     role ENUM('admin', 'manager', 'user', 'readonly') DEFAULT 'user',
     theme ENUM('light', 'dark') DEFAULT 'light',
@@ -36,6 +40,7 @@ CREATE TABLE IF NOT EXISTS subnets (
     description TEXT,
     vlan_id INT,
     location VARCHAR(100),
+    storage_mode ENUM('dense', 'sparse') NOT NULL DEFAULT 'dense',  -- sparse: 只存已分配/保留/冲突地址
     created_by INT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
@@ -50,9 +55,11 @@ CREATE TABLE IF NOT EXISTS subnets (
 CREATE TABLE IF NOT EXISTS ip_addresses (
     id INT PRIMARY KEY AUTO_INCREMENT,
     ip_address VARCHAR(15) NOT NULL,
+    ip_int INT UNSIGNED AS (INET_ATON(ip_address)) STORED NOT NULL,
     subnet_id INT NOT NULL,
     status ENUM('available', 'allocated', 'reserved', 'conflict') DEFAULT 'available',
     mac_address VARCHAR(17),
+    user_name VARCHAR(255),
     hostname VARCHAR(255),
     device_type VARCHAR(50),
     location VARCHAR(100),
@@ -66,11 +73,161 @@ CREATE TABLE IF NOT EXISTS ip_addresses (
     FOREIGN KEY (allocated_by) REFERENCES users(id),
     UNIQUE KEY unique_ip (ip_address),
     INDEX idx_subnet_status (subnet_id, status),
+    INDEX ix_ip_addresses_subnet_status_ip_int (subnet_id, status, ip_int),
+    INDEX ix_ip_addresses_ip_int (ip_int),
     INDEX idx_ip_status (ip_address, status),
     INDEX idx_hostname (hostname),
-    INDEX idx_mac_address (mac_address)
+    INDEX idx_mac_address (mac_address),
+    FULLTEXT INDEX ix_ip_addresses_search_ngram (user_name, assigned_to, mac_address, device_type, location, description) WITH PARSER ngram
+);
+
+-- 批量分配幂等键表（响应与分配结果同一事务提交）
+CREATE TABLE IF NOT EXISTS ip_allocation_requests (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    idempotency_key VARCHAR(100) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    response JSON,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY ix_ip_allocation_requests_key (idempotency_key),
+    INDEX ix_ip_allocation_requests_created_at (created_at)
+);
+
+-- 网段IP状态计数器（由 ip_addresses 上的触发器在同一事务中维护，slot = 连接ID % 8，分散行锁，同一事务对每个网段只锁一行）
+CREATE TABLE IF NOT EXISTS subnet_ip_counters (
+    subnet_id INT NOT NULL,
+    slot SMALLINT NOT NULL,
+    total_count INT NOT NULL DEFAULT 0,
+    available_count INT NOT NULL DEFAULT 0,
+    allocated_count INT NOT NULL DEFAULT 0,
+    reserved_count INT NOT NULL DEFAULT 0,
+    conflict_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (subnet_id, slot),
+    FOREIGN KEY (subnet_id) REFERENCES subnets(id) ON DELETE CASCADE
+);
+
+DELIMITER $$
+
+CREATE TRIGGER trg_ip_addresses_counters_insert AFTER INSERT ON ip_addresses FOR EACH ROW
+INSERT INTO subnet_ip_counters (subnet_id, slot, total_count, available_count, allocated_count, reserved_count, conflict_count)
+VALUES (NEW.subnet_id, CONNECTION_ID() MOD 8, 1, NEW.status <=> 'available', NEW.status <=> 'allocated', NEW.status <=> 'reserved', NEW.status <=> 'conflict')
+ON DUPLICATE KEY UPDATE
+    total_count = total_count + VALUES(total_count),
+    available_count = available_count + VALUES(available_count),
+    allocated_count = allocated_count + VALUES(allocated_count),
+    reserved_count = reserved_count + VALUES(reserved_count),
+    conflict_count = conflict_count + VALUES(conflict_count)$$
+
+CREATE TRIGGER trg_ip_addresses_counters_delete AFTER DELETE ON ip_addresses FOR EACH ROW
+INSERT INTO subnet_ip_counters (subnet_id, slot, total_count, available_count, allocated_count, reserved_count, conflict_count)
+VALUES (OLD.subnet_id, CONNECTION_ID() MOD 8, -1, -(OLD.status <=> 'available'), -(OLD.status <=> 'allocated'), -(OLD.status <=> 'reserved'), -(OLD.status <=> 'conflict'))
+ON DUPLICATE KEY UPDATE
+    total_count = total_count + VALUES(total_count),
+    available_count = available_count + VALUES(available_count),
+    allocated_count = allocated_count + VALUES(allocated_count),
+    reserved_count = reserved_count + VALUES(reserved_count),
+    conflict_count = conflict_count + VALUES(conflict_count)$$
+
+CREATE TRIGGER trg_ip_addresses_counters_update AFTER UPDATE ON ip_addresses FOR EACH ROW
+BEGIN
+    IF NOT (OLD.status <=> NEW.status) OR OLD.subnet_id <> NEW.subnet_id THEN
+        INSERT INTO subnet_ip_counters (subnet_id, slot, total_count, available_count, allocated_count, reserved_count, conflict_count)
+        VALUES
+            (OLD.subnet_id, CONNECTION_ID() MOD 8, -1, -(OLD.status <=> 'available'), -(OLD.status <=> 'allocated'), -(OLD.status <=> 'reserved'), -(OLD.status <=> 'conflict')),
+            (NEW.subnet_id, CONNECTION_ID() MOD 8, 1, NEW.status <=> 'available', NEW.status <=> 'allocated', NEW.status <=> 'reserved', NEW.status <=> 'conflict')
+        ON DUPLICATE KEY UPDATE
+            total_count = total_count + VALUES(total_count),
+            available_count = available_count + VALUES(available_count),
+            allocated_count = allocated_count + VALUES(allocated_count),
+            reserved_count = reserved_count + VALUES(reserved_count),
+            conflict_count = conflict_count + VALUES(conflict_count);
+    END IF;
+END$$
+
+DELIMITER ;
+
+-- IP分配/释放事件（触发器写入，利用率历史任务汇总后删除）
+CREATE TABLE IF NOT EXISTS ip_usage_events (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    subnet_id INT NOT NULL,
+    ip_address_id INT NOT NULL,
+    event_type ENUM('allocate', 'release') NOT NULL,
+    occurred_at DATETIME NOT NULL
 );
 
+-- 网段利用率历史（分钟/小时/天汇总，subnet_id = 0 为全部网段合计；不设外键，网段删除后保留历史）
+CREATE TABLE IF NOT EXISTS subnet_utilization_history (
+    subnet_id INT NOT NULL,
+    resolution ENUM('minute', 'hour', 'day') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    allocations INT NOT NULL DEFAULT 0,
+    releases INT NOT NULL DEFAULT 0,
+    total_count INT NULL,
+    allocated_count INT NULL,
+    peak_allocated INT NULL,
+    PRIMARY KEY (subnet_id, resolution, bucket_start),
+    INDEX idx_utilization_history_retention (resolution, bucket_start)
+);
+
+DELIMITER $$
+
+CREATE TRIGGER trg_ip_addresses_usage_insert AFTER INSERT ON ip_addresses FOR EACH ROW
+BEGIN
+    IF NEW.status <=> 'allocated' THEN
+        INSERT INTO ip_usage_events (subnet_id, ip_address_id, event_type, occurred_at)
+        VALUES (NEW.subnet_id, NEW.id, 'allocate', NOW());
+    END IF;
+END$$
+
+CREATE TRIGGER trg_ip_addresses_usage_delete AFTER DELETE ON ip_addresses FOR EACH ROW
+BEGIN
+    IF OLD.status <=> 'allocated' THEN
+        INSERT INTO ip_usage_events (subnet_id, ip_address_id, event_type, occurred_at)
+        VALUES (OLD.subnet_id, OLD.id, 'release', NOW());
+    END IF;
+END$$
+
+CREATE TRIGGER trg_ip_addresses_usage_update AFTER UPDATE ON ip_addresses FOR EACH ROW
+BEGIN
+    IF NEW.status <=> 'allocated' AND NOT (OLD.status <=> 'allocated') THEN
+        INSERT INTO ip_usage_events (subnet_id, ip_address_id, event_type, occurred_at)
+        VALUES (NEW.subnet_id, NEW.id, 'allocate', NOW());
+    ELSEIF OLD.status <=> 'allocated' AND NOT (NEW.status <=> 'allocated') THEN
+        INSERT INTO ip_usage_events (subnet_id, ip_address_id, event_type, occurred_at)
+        VALUES (OLD.subnet_id, OLD.id, 'release', NOW());
+    END IF;
+END$$
+
+DELIMITER ;
+
+-- 网段前缀树版本号（subnets 的网络地址变化时由触发器递增，各进程据此发现其他进程的网段修改）
+CREATE TABLE IF NOT EXISTS subnet_index_generation (
+    id INT PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO subnet_index_generation (id, generation) VALUES (1, 0)
+ON DUPLICATE KEY UPDATE generation = generation;
+
+DELIMITER $$
+
+CREATE TRIGGER trg_subnets_index_insert AFTER INSERT ON subnets FOR EACH ROW
+INSERT INTO subnet_index_generation (id, generation) VALUES (1, 1)
+ON DUPLICATE KEY UPDATE generation = generation + 1$$
+
+CREATE TRIGGER trg_subnets_index_delete AFTER DELETE ON subnets FOR EACH ROW
+INSERT INTO subnet_index_generation (id, generation) VALUES (1, 1)
+ON DUPLICATE KEY UPDATE generation = generation + 1$$
+
+CREATE TRIGGER trg_subnets_index_update AFTER UPDATE ON subnets FOR EACH ROW
+BEGIN
+    IF NOT (OLD.network <=> NEW.network) THEN
+        INSERT INTO subnet_index_generation (id, generation) VALUES (1, 1)
+        ON DUPLICATE KEY UPDATE generation = generation + 1;
+    END IF;
+END$$
+
+DELIMITER ;
+
 -- 自定义字段表
 CREATE TABLE IF NOT EXISTS custom_fields (
     id INT PRIMARY KEY AUTO_INCREMENT,
@@ -307,7 +307,7 @@ BEGIN
     FROM ip_addresses 
     WHERE subnet_id = subnet_id_param 
     AND status = 'available'
-    ORDER BY INET_ATON(ip_address)
+    ORDER BY ip_int
     LIMIT limit_param;
 END //
 DELIMITER ;
@@ -32,3 +32,47 @@ export const getTopUtilizedSubnets = (limit = 10) => {
   })
 }
 
+// 获取网段耗尽预测（预计最早耗尽的在前）
+export const getExhaustionForecast = (params = {}) => {
+  return request.get('/monitoring/exhaustion-forecast', {
+    params
+  })
+}
+
+// 订阅实时更新（SSE），代替轮询；返回取消订阅函数
+// onUpdate 收到合并后的变化 { counters, totals, ips, resync }；onResync 在需要重新加载时调用（含断线重连）
+export const subscribeLiveUpdates = ({ subnetId, onUpdate, onResync } = {}) => {
+  const query = subnetId ? `?subnet_id=${encodeURIComponent(subnetId)}` : ''
+  const source = new EventSource(`/api/live/events${query}`)
+  let connected = false
+
+  source.addEventListener('ready', () => {
+    // 重连期间的变化已丢失
+    if (connected && onResync) onResync()
+    connected = true
+  })
+  source.addEventListener('update', (event) => {
+    const data = JSON.parse(event.data)
+    if (data.resync) {
+      if (onResync) onResync()
+      return
+    }
+    if (onUpdate) onUpdate(data)
+  })
+
+  return () => source.close()
+}
+
+// 推送的计数器/合计转换为统计接口的格式（稀疏网段未存储的地址计为可用，与 /ips/statistics 口径一致）
+export const liveCountsToStatistics = (counts) => {
+  const virtual = counts.virtual_available || 0
+  const total = counts.total_count + virtual
+  return {
+    total_ips: total,
+    allocated_ips: counts.allocated_count,
+    available_ips: counts.available_count + virtual,
+    reserved_ips: counts.reserved_count,
+    conflict_ips: counts.conflict_count,
+    utilization_rate: total > 0 ? Math.round(counts.allocated_count / total * 10000) / 100 : 0
+  }
+}
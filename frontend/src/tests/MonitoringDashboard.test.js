@@ -35,7 +35,9 @@ vi.mock('@/api/monitoring', () => ({
   getTopUtilizedSubnets: vi.fn(),
   getAllocationTrends: vi.fn(),
   getAlertHistory: vi.fn(),
-  resolveAlert: vi.fn()
+  resolveAlert: vi.fn(),
+  subscribeLiveUpdates: vi.fn(() => () => {}),
+  liveCountsToStatistics: vi.fn()
 }))
 
 describe('MonitoringDashboard', () => {